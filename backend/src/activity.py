@@ -0,0 +1,182 @@
+"""
+最近の更新（アクティビティフィード）
+
+GET /activity で、すべてのユーザーの発注書・出荷を更新日時の新しい順に返します（管理者のみ）。
+
+created-at-index は作成日時そのものがパーティションキーなので「全体の最新 N 件」には使えず、
+1つのパーティションにまとめると書き込みがそこに集中します。そのため activity-index は次のキーで書き込みを分散します。
+- パーティションキー activity_bucket: <更新日>#<シャード番号>（ID のハッシュで ACTIVITY_SHARDS 個に分ける）
+- ソートキー updated_at
+
+読み込みでは、1日分のすべてのシャード（tables の場合は発注書・出荷の2テーブル分）を並列に新しい順で Query し、
+マージして limit 件を返します。足りない場合は前日にさかのぼります（1回のリクエストで最大 LOOKBACK_DAYS 日）。
+インデックスには一覧の表示に使う属性だけを射影しています。
+"""
+import heapq
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from botocore.exceptions import ClientError
+from utils import (
+    create_response,
+    create_error_response,
+    require_auth,
+    require_admin,
+    get_dynamodb_resource,
+    get_query_parameter,
+    handle_dynamodb_error,
+    encode_cursor,
+    decode_cursor,
+    prime_dynamodb
+)
+from instrumentation import TracedThreadPoolExecutor, traced_handler
+from warmup import register_primer
+from models import ACTIVITY_SHARDS
+from repository import PURCHASE_ORDER, SHIPMENT, get_repository
+
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+# 1回のリクエストでさかのぼる日数（更新のない日が続いても Query の回数が増えすぎないようにする）
+LOOKBACK_DAYS = 7
+
+
+def _entry(item: Dict[str, Any]) -> Dict[str, Any]:
+    """インデックスの行をフィードの1件に変換"""
+    if 'shipment_id' in item:
+        return {
+            'type': SHIPMENT,
+            'id': item['shipment_id'],
+            'po_id': item.get('po_id'),
+            'tracking_number': item.get('tracking_number'),
+            'carrier': item.get('carrier'),
+            'status': item.get('status'),
+            'created_by': item.get('created_by'),
+            'created_at': item.get('created_at'),
+            'updated_at': item['updated_at']
+        }
+    return {
+        'type': PURCHASE_ORDER,
+        'id': item['po_id'],
+        'supplier': item.get('supplier'),
+        'total_amount': item.get('total_amount'),
+        'status': item.get('status'),
+        'created_by': item.get('created_by'),
+        'created_at': item.get('created_at'),
+        'updated_at': item['updated_at']
+    }
+
+
+def _position(entry: Dict[str, Any]) -> Tuple[str, str]:
+    # 更新日時が同じ場合は ID で順序を決める（カーソルで続きを読むときに重複・欠落しないようにする）
+    return entry['updated_at'], entry['id']
+
+
+def _query_bucket(table_name: str, bucket: str, before: Optional[Tuple[str, str]], limit: int) -> List[Dict[str, Any]]:
+    """1つのシャードから新しい順に最大 limit 件を読み込む"""
+    params: Dict[str, Any] = {
+        'IndexName': 'activity-index',
+        'KeyConditionExpression': 'activity_bucket = :bucket',
+        'ExpressionAttributeValues': {':bucket': bucket},
+        'ScanIndexForward': False,
+        'Limit': limit
+    }
+    if before:
+        params['KeyConditionExpression'] += ' AND updated_at <= :before'
+        params['ExpressionAttributeValues'][':before'] = before[0]
+    items = get_dynamodb_resource().Table(table_name).query(**params)['Items']
+    entries = [_entry(item) for item in items]
+    return [entry for entry in entries if before is None or _position(entry) < before]
+
+
+def load_activity(limit: int, cursor: Optional[Dict[str, Any]] = None,
+                  today: Optional[date] = None) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """更新を新しい順に最大 limit 件読み込み、(フィード, 続きのカーソル) を返す
+
+    カーソルは最後に返した更新の位置（updated_at と id）か、次に読む日（day）です。
+    """
+    repository = get_repository()
+    # single_table では発注書と出荷が同じテーブルにある
+    table_names = sorted({repository.table_name(PURCHASE_ORDER), repository.table_name(SHIPMENT)})
+    before = None
+    if cursor and 'day' in cursor:
+        day = date.fromisoformat(cursor['day'])
+    elif cursor:
+        before = (cursor['updated_at'], cursor['id'])
+        day = date.fromisoformat(before[0][:10])
+    else:
+        day = today or datetime.utcnow().date()
+
+    entries: List[Dict[str, Any]] = []
+    with TracedThreadPoolExecutor(max_workers=len(table_names) * ACTIVITY_SHARDS) as executor:
+        for _ in range(LOOKBACK_DAYS):
+            remaining = limit - len(entries)
+            futures = [
+                executor.submit(_query_bucket, table_name, f'{day.isoformat()}#{shard}', before, remaining)
+                for table_name in table_names
+                for shard in range(ACTIVITY_SHARDS)
+            ]
+            shards = [future.result() for future in futures]
+            # 各シャードの結果を合わせて新しい順に remaining 件を取り出す
+            entries.extend(heapq.nlargest(remaining, (entry for page in shards for entry in page), key=_position))
+            if len(entries) >= limit:
+                updated_at, item_id = _position(entries[-1])
+                return entries, {'updated_at': updated_at, 'id': item_id}
+            # 前日以前のバケットの行はすべて before より前なので、位置の条件は不要
+            before = None
+            day -= timedelta(days=1)
+    # さかのぼる日数の上限に達した場合は見つかった分を返し、続きは次の日から読む
+    # （LOOKBACK_DAYS 日続けて更新がなければ終わりとする）
+    return entries, ({'day': day.isoformat()} if entries else None)
+
+
+def _validate_cursor(cursor: Optional[Dict[str, Any]]) -> None:
+    """カーソルの形式を確認する（不正な場合は ValueError）"""
+    if cursor is None:
+        return
+    if set(cursor) == {'day'} and isinstance(cursor['day'], str):
+        date.fromisoformat(cursor['day'])
+    elif set(cursor) == {'updated_at', 'id'} and all(isinstance(value, str) for value in cursor.values()):
+        date.fromisoformat(cursor['updated_at'][:10])
+    else:
+        raise ValueError('Invalid cursor')
+
+
+register_primer('dynamodb', lambda: prime_dynamodb(get_repository().table_name(PURCHASE_ORDER)), 'activity')
+
+
+@traced_handler('activity')
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """アクティビティフィードのメインハンドラー"""
+    http_method = event['httpMethod']
+    path = event['path']
+
+    try:
+        if path == '/activity' and http_method == 'GET':
+            return get_activity(event, context)
+        else:
+            return create_error_response(404, 'Endpoint not found')
+
+    except Exception as e:
+        print(f"Error in activity handler: {str(e)}")
+        return create_error_response(500, 'Internal server error')
+
+
+@require_auth
+@require_admin
+def get_activity(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """発注書・出荷の最近の更新を新しい順に取得（管理者のみ、limit はデフォルト50、最大200）"""
+    try:
+        limit = int(get_query_parameter(event, 'limit', DEFAULT_LIMIT))
+        cursor = decode_cursor(get_query_parameter(event, 'cursor'))
+        _validate_cursor(cursor)
+    except ValueError:
+        return create_error_response(400, 'Invalid limit or cursor')
+    if limit < 1 or limit > MAX_LIMIT:
+        return create_error_response(400, f'limit must be between 1 and {MAX_LIMIT}')
+
+    try:
+        entries, next_cursor = load_activity(limit, cursor)
+    except ClientError as e:
+        return handle_dynamodb_error(e)
+
+    return create_response(200, {'activity': entries, 'next_cursor': encode_cursor(next_cursor)})
@@ -0,0 +1,296 @@
+"""
+完了済みデータのアーカイブ
+
+キャンセル済みの発注書と、配達完了・キャンセル済みの出荷のうち、最終更新から
+ARCHIVE_AFTER_DAYS 日（デフォルト365日）以上経過したものをオブジェクトストレージに移し、
+DynamoDB のテーブルから削除します。一覧のスキャン対象が稼働中のデータだけになるため、
+テーブルが年々大きくなってもスキャンのコストは増えません。
+
+- アーカイブは gzip 圧縮した NDJSON で、作成月ごとに
+  archive/{resource}/year=YYYY/month=MM/{job_id}-{chunk}.ndjson.gz に保存します（Athena 等でそのまま検索可能）
+- ファイルは ARCHIVE_BLOCK_BYTES ごとに独立した gzip メンバーとして書き込みます。
+  連結した gzip は通常の gzip として読めるうえ、ブロック単位で Range 読み込みできます
+- ArchiveIndex テーブルにレコードごとの保存先（キー・ブロックの位置と長さ）を記録し、
+  詳細取得ではテーブルにない場合に該当ブロックだけを読み込んで返します（読み取り専用）
+
+ジョブは毎日のスケジュール、または POST /archives（管理者のみ）で登録されます。
+"""
+import gzip
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from itertools import islice
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from utils import (
+    create_response,
+    create_error_response,
+    require_auth,
+    require_admin,
+    get_dynamodb_resource,
+    json_default,
+    scan_all,
+    int_env,
+    prime_dynamodb
+)
+from instrumentation import traced_handler
+from warmup import register_primer
+from jobs import (
+    JOB_TIME_BUDGET_SECONDS,
+    ContinueJob,
+    enqueue_job,
+    get_job_queue,
+    job_to_response,
+    register_job,
+    update_job_progress
+)
+from object_storage import get_object_storage
+from po_lines import delete_lines, with_items
+from change_log import record_deletions
+from repository import PURCHASE_ORDER, SHIPMENT, get_repository
+from models import decompress_attributes
+
+
+ARCHIVE_RESOURCES = {
+    'purchase_orders': {
+        'entity': PURCHASE_ORDER,
+        'key': 'po_id',
+        'statuses': ['cancelled'],
+        # 明細は PurchaseOrderLines から読み込んでアーカイブに含め、ヘッダーと一緒に削除する
+        'line_items': True
+    },
+    'shipments': {
+        'entity': SHIPMENT,
+        'key': 'shipment_id',
+        'statuses': ['delivered', 'cancelled'],
+        # アーカイブした出荷の追跡番号の予約は解除する（運送会社が番号を再利用するため）
+        'reservations': ('TRACKING_NUMBERS_TABLE', 'tracking_key')
+    }
+}
+DEFAULT_ARCHIVE_AFTER_DAYS = 365
+DEFAULT_CHUNK_ROWS = 10000
+DEFAULT_BLOCK_BYTES = 64 * 1024
+DEFAULT_SCAN_SEGMENTS = 4
+
+
+def _index_table():
+    return get_dynamodb_resource().Table(os.environ['ARCHIVE_INDEX_TABLE'])
+
+
+def _record_key(resource: str, record_id: str) -> str:
+    return f'{resource}#{record_id}'
+
+
+register_primer('dynamodb', lambda: prime_dynamodb(os.environ.get('JOBS_TABLE')), 'archival')
+register_primer('job_queue', get_job_queue, 'archival')
+register_primer('object_storage', get_object_storage, 'archival')
+
+
+@traced_handler('archival')
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """アーカイブのメインハンドラー（API Gateway とスケジュール実行の両方から呼ばれる）"""
+    if 'httpMethod' not in event:
+        # EventBridge のスケジュールから呼ばれた場合はジョブを登録するだけ
+        job = enqueue_job('archive', {})
+        return {'statusCode': 202, 'job_id': job['job_id']}
+
+    http_method = event['httpMethod']
+    path = event['path']
+
+    try:
+        if path == '/archives' and http_method == 'POST':
+            return create_archive(event, context)
+        else:
+            return create_error_response(404, 'Endpoint not found')
+
+    except Exception as e:
+        print(f"Error in archival handler: {str(e)}")
+        return create_error_response(500, 'Internal server error')
+
+
+@require_auth
+@require_admin
+def create_archive(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """アーカイブジョブを登録（管理者のみ）。進捗は GET /jobs/{job_id} で確認する"""
+    try:
+        body = json.loads(event['body'] or '{}')
+    except json.JSONDecodeError:
+        return create_error_response(400, 'Invalid JSON in request body')
+
+    resources = body.get('resources', list(ARCHIVE_RESOURCES))
+    if not isinstance(resources, list) or not resources or any(r not in ARCHIVE_RESOURCES for r in resources):
+        return create_error_response(400, f"resources must be a list of: {', '.join(ARCHIVE_RESOURCES)}")
+    payload: Dict[str, Any] = {'resources': resources}
+    if 'older_than_days' in body:
+        days = body['older_than_days']
+        if not isinstance(days, int) or isinstance(days, bool) or days < 1:
+            return create_error_response(400, 'older_than_days must be a positive integer')
+        payload['older_than_days'] = days
+
+    job = enqueue_job('archive', payload, created_by=event['user'].get('sub'))
+    return create_response(202, {'message': 'Archive started', 'job': job_to_response(job)})
+
+
+def _partition(record: Dict[str, Any]) -> str:
+    created_at = str(record.get('created_at') or '')
+    if len(created_at) >= 7 and created_at[:4].isdigit() and created_at[5:7].isdigit():
+        return f'year={created_at[:4]}/month={created_at[5:7]}'
+    return 'year=unknown/month=unknown'
+
+
+def _write_archive_file(storage: Any, key: str, records: List[Dict[str, Any]],
+                        key_name: str) -> List[Tuple[str, int, int]]:
+    """レコードをブロックごとの gzip メンバーとして書き込み、(ID, オフセット, 長さ) を返す"""
+    block_bytes = int_env('ARCHIVE_BLOCK_BYTES', DEFAULT_BLOCK_BYTES)
+    locations: List[Tuple[str, int, int]] = []
+    with storage.open_writer(key, 'application/x-ndjson') as writer:
+        lines: List[str] = []
+        ids: List[str] = []
+        size = 0
+
+        def flush() -> None:
+            data = gzip.compress(''.join(lines).encode('utf-8'), compresslevel=6, mtime=0)
+            offset = writer.size
+            writer.write(data)
+            locations.extend((record_id, offset, len(data)) for record_id in ids)
+            lines.clear()
+            ids.clear()
+
+        for record in records:
+            line = json.dumps(record, ensure_ascii=False, default=json_default) + '\n'
+            lines.append(line)
+            ids.append(record[key_name])
+            size += len(line)
+            if size >= block_bytes:
+                flush()
+                size = 0
+        if lines:
+            flush()
+    return locations
+
+
+def _archive_chunk(storage: Any, table: Any, resource: str, records: List[Dict[str, Any]],
+                   job_id: str, chunk_number: int, archived_at: str) -> None:
+    """1チャンク分を月別のファイルに書き込み、インデックスを登録してからテーブルから削除"""
+    key_name = ARCHIVE_RESOURCES[resource]['key']
+    partitions: Dict[str, List[Dict[str, Any]]] = {}
+    for record in records:
+        partitions.setdefault(_partition(record), []).append(record)
+
+    # ファイルの書き込みとインデックスの登録が終わってから削除するため、
+    # 途中で失敗してもデータは失われない（再実行時に再度アーカイブされる）
+    with _index_table().batch_writer(overwrite_by_pkeys=['record_key']) as index_batch:
+        for partition, partition_records in sorted(partitions.items()):
+            key = f'archive/{resource}/{partition}/{job_id}-{chunk_number:05d}.ndjson.gz'
+            for record_id, offset, length in _write_archive_file(storage, key, partition_records, key_name):
+                index_batch.put_item(Item={
+                    'record_key': _record_key(resource, record_id),
+                    'archive_key': key,
+                    'offset': offset,
+                    'length': length,
+                    'archived_at': archived_at
+                })
+
+    repository = get_repository()
+    entity = ARCHIVE_RESOURCES[resource]['entity']
+    with table.batch_writer(overwrite_by_pkeys=list(repository.key(entity, records[0]))) as batch:
+        for record in records:
+            batch.delete_item(Key=repository.key(entity, record))
+    # 差分同期しているクライアントの一覧からも取り除く
+    record_deletions(entity, records)
+
+    if ARCHIVE_RESOURCES[resource].get('line_items'):
+        # 明細の分割前の行（line_count を持たない行）には削除する明細がない
+        delete_lines((record[key_name], int(record['line_count'])) for record in records if 'line_count' in record)
+
+    reservations = ARCHIVE_RESOURCES[resource].get('reservations')
+    if reservations and os.environ.get(reservations[0]):
+        table_env, attribute = reservations
+        reserved_table = get_dynamodb_resource().Table(os.environ[table_env])
+        with reserved_table.batch_writer(overwrite_by_pkeys=[attribute]) as batch:
+            for record in records:
+                if record.get(attribute):
+                    batch.delete_item(Key={attribute: record[attribute]})
+
+
+def _iter_closed_records(table: Any, resource: str, cutoff: str) -> Iterator[Dict[str, Any]]:
+    statuses = ARCHIVE_RESOURCES[resource]['statuses']
+    placeholders = [f':status{i}' for i in range(len(statuses))]
+    values: Dict[str, Any] = {name: status for name, status in zip(placeholders, statuses)}
+    values[':cutoff'] = cutoff
+    return scan_all(
+        table,
+        segments=int_env('ARCHIVE_SCAN_SEGMENTS', DEFAULT_SCAN_SEGMENTS),
+        **get_repository().scan_params(ARCHIVE_RESOURCES[resource]['entity'], {
+            'FilterExpression': f"#status IN ({', '.join(placeholders)}) AND updated_at < :cutoff",
+            'ExpressionAttributeNames': {'#status': 'status'},
+            'ExpressionAttributeValues': values
+        })
+    )
+
+
+@register_job('archive')
+def run_archive(payload: Dict[str, Any], job: Dict[str, Any]) -> Dict[str, Any]:
+    """古い完了済みデータをアーカイブするジョブ（時間切れの場合は続きを再登録）"""
+    job_id = job['job_id']
+    progress = job.get('progress') or {}
+    archived = dict(progress.get('archived', {}))
+    chunk_number = int(progress.get('chunks', 0))
+
+    days = int(payload.get('older_than_days') or int_env('ARCHIVE_AFTER_DAYS', DEFAULT_ARCHIVE_AFTER_DAYS))
+    # 再開時も最初の実行と同じ基準日時を使う
+    cutoff = progress.get('cutoff') or (datetime.utcnow() - timedelta(days=days)).isoformat()
+    archived_at = datetime.utcnow().isoformat()
+    chunk_rows = int_env('ARCHIVE_CHUNK_ROWS', DEFAULT_CHUNK_ROWS)
+    deadline = time.monotonic() + int_env('ARCHIVE_TIME_BUDGET_SECONDS', JOB_TIME_BUDGET_SECONDS)
+
+    storage = get_object_storage()
+    repository = get_repository()
+    for resource in payload.get('resources') or list(ARCHIVE_RESOURCES):
+        table = repository.table(ARCHIVE_RESOURCES[resource]['entity'])
+        # アーカイブ済みの行は削除されるので、再開時は最初からスキャンし直せばよい
+        records = _iter_closed_records(table, resource, cutoff)
+        try:
+            while True:
+                chunk = list(islice(records, chunk_rows))
+                if not chunk:
+                    break
+                # アーカイブには圧縮した属性を展開し、single_table のキー属性を除いて書き込む
+                chunk = [decompress_attributes(repository.from_storage(record)) for record in chunk]
+                if ARCHIVE_RESOURCES[resource].get('line_items'):
+                    chunk = list(with_items(chunk))
+                chunk_number += 1
+                _archive_chunk(storage, table, resource, chunk, job_id, chunk_number, archived_at)
+                archived[resource] = archived.get(resource, 0) + len(chunk)
+                update_job_progress(job_id, {'cutoff': cutoff, 'archived': archived, 'chunks': chunk_number})
+                if time.monotonic() > deadline:
+                    raise ContinueJob()
+        finally:
+            records.close()
+
+    return {'cutoff': cutoff, 'archived': archived, 'chunks': chunk_number}
+
+
+def load_archived(resource: str, record_id: str) -> Optional[Dict[str, Any]]:
+    """アーカイブ済みのレコードを取得（アーカイブされていなければ None）
+
+    返すレコードには archived_at が付きます。
+    """
+    if not os.environ.get('ARCHIVE_INDEX_TABLE'):
+        # アーカイブを使わない環境
+        return None
+    index = _index_table().get_item(Key={'record_key': _record_key(resource, record_id)}).get('Item')
+    if not index:
+        return None
+    block = get_object_storage().read_range(index['archive_key'], int(index['offset']), int(index['length']))
+    if not block:
+        return None
+
+    key_name = ARCHIVE_RESOURCES[resource]['key']
+    for line in gzip.decompress(block).decode('utf-8').splitlines():
+        record = json.loads(line, parse_float=Decimal)
+        if record.get(key_name) == record_id:
+            record['archived_at'] = index['archived_at']
+            return record
+    return None
@@ -5,20 +5,30 @@
 """
 import json
 import os
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import boto3
+import jwt
 from botocore.exceptions import ClientError
 from utils import (
     create_response, 
     create_error_response, 
-    get_cognito_client, 
+    handle_cognito_error,
     get_dynamodb_resource,
     validate_email,
-    validate_required_fields
+    validate_required_fields,
+    prime_dynamodb
 )
+from instrumentation import traced_handler
+from warmup import register_primer
+from cognito_gateway import get_cognito_gateway, CognitoThrottledError
 from models import User, UserRole, generate_id
 
 
+register_primer('dynamodb', lambda: prime_dynamodb(os.environ.get('USERS_TABLE')), 'auth')
+register_primer('cognito', get_cognito_gateway, 'auth')
+
+
+@traced_handler('auth')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """認証関連のメインハンドラー"""
     http_method = event['httpMethod']
@@ -27,6 +37,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     try:
         if path == '/auth/login' and http_method == 'POST':
             return login(event)
+        elif path == '/auth/refresh' and http_method == 'POST':
+            return refresh(event)
         elif path == '/auth/logout' and http_method == 'POST':
             return logout(event)
         elif path == '/auth/register' and http_method == 'POST':
@@ -34,6 +46,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         else:
             return create_error_response(404, 'Endpoint not found')
     
+    except CognitoThrottledError as e:
+        return e.to_response()
     except Exception as e:
         print(f"Error in auth handler: {str(e)}")
         return create_error_response(500, 'Internal server error')
@@ -57,7 +71,7 @@ def login(event: Dict[str, Any]) -> Dict[str, Any]:
             return create_error_response(400, 'Invalid email format')
         
         # Cognito認証
-        cognito_client = get_cognito_client()
+        cognito_client = get_cognito_gateway()
         user_pool_id = os.environ['COGNITO_USER_POOL_ID']
         client_id = os.environ['COGNITO_USER_POOL_CLIENT_ID']
         
@@ -78,9 +92,10 @@ def login(event: Dict[str, Any]) -> Dict[str, Any]:
             id_token = auth_result['IdToken']
             refresh_token = auth_result['RefreshToken']
             
-            # ユーザー情報を取得
-            user_info = cognito_client.get_user(AccessToken=access_token)
-            user_attributes = {attr['Name']: attr['Value'] for attr in user_info['UserAttributes']}
+            # ユーザー情報はIDトークンのクレームから取得（get_user の呼び出しを省略）
+            claims = _get_id_token_claims(id_token, user_pool_id, client_id)
+            if not claims:
+                return create_error_response(500, 'Authentication failed')
             
             return create_response(200, {
                 'message': 'Login successful',
@@ -89,11 +104,7 @@ def login(event: Dict[str, Any]) -> Dict[str, Any]:
                     'id_token': id_token,
                     'refresh_token': refresh_token
                 },
-                'user': {
-                    'email': user_attributes.get('email'),
-                    'role': user_attributes.get('custom:role', 'user'),
-                    'user_id': user_attributes.get('sub')
-                }
+                'user': _user_from_claims(claims)
             })
             
         except ClientError as e:
@@ -103,12 +114,97 @@ def login(event: Dict[str, Any]) -> Dict[str, Any]:
             elif error_code == 'UserNotConfirmedException':
                 return create_error_response(401, 'User not confirmed')
             else:
-                return create_error_response(500, 'Authentication failed')
+                return handle_cognito_error(e, 'Authentication failed')
                 
     except json.JSONDecodeError:
         return create_error_response(400, 'Invalid JSON in request body')
 
 
+def refresh(event: Dict[str, Any]) -> Dict[str, Any]:
+    """リフレッシュトークンによるトークン更新処理"""
+    try:
+        body = json.loads(event['body'])
+        
+        # 必須フィールドの検証
+        is_valid, error_msg = validate_required_fields(body, ['refresh_token'])
+        if not is_valid:
+            return create_error_response(400, error_msg)
+        
+        cognito_client = get_cognito_gateway()
+        user_pool_id = os.environ['COGNITO_USER_POOL_ID']
+        client_id = os.environ['COGNITO_USER_POOL_CLIENT_ID']
+        
+        try:
+            response = cognito_client.admin_initiate_auth(
+                UserPoolId=user_pool_id,
+                ClientId=client_id,
+                AuthFlow='REFRESH_TOKEN_AUTH',
+                AuthParameters={
+                    'REFRESH_TOKEN': body['refresh_token']
+                }
+            )
+            
+            # REFRESH_TOKEN_AUTH ではリフレッシュトークン自体は再発行されない
+            auth_result = response['AuthenticationResult']
+            id_token = auth_result['IdToken']
+            
+            claims = _get_id_token_claims(id_token, user_pool_id, client_id)
+            if not claims:
+                return create_error_response(500, 'Token refresh failed')
+            
+            return create_response(200, {
+                'message': 'Token refreshed',
+                'tokens': {
+                    'access_token': auth_result['AccessToken'],
+                    'id_token': id_token,
+                    'refresh_token': auth_result.get('RefreshToken', body['refresh_token'])
+                },
+                'user': _user_from_claims(claims)
+            })
+            
+        except ClientError as e:
+            error_code = e.response['Error']['Code']
+            if error_code == 'NotAuthorizedException':
+                return create_error_response(401, 'Invalid or expired refresh token')
+            elif error_code == 'UserNotFoundException':
+                return create_error_response(401, 'User not found')
+            else:
+                return handle_cognito_error(e, 'Token refresh failed')
+                
+    except json.JSONDecodeError:
+        return create_error_response(400, 'Invalid JSON in request body')
+
+
+def _get_id_token_claims(id_token: str, user_pool_id: str, client_id: str) -> Optional[Dict[str, Any]]:
+    """Cognitoから受け取ったIDトークンのクレームを検証して取得"""
+    # トークンは admin_initiate_auth の応答としてTLS経由でCognitoから直接受け取ったものなので、
+    # 署名の検証（JWKSの取得）は省略し、発行元・対象・用途のクレームを検証する
+    try:
+        claims = jwt.decode(
+            id_token,
+            options={'verify_signature': False, 'verify_aud': False}
+        )
+    except jwt.InvalidTokenError:
+        return None
+    
+    if claims.get('token_use') != 'id':
+        return None
+    if claims.get('aud') != client_id:
+        return None
+    if not str(claims.get('iss', '')).endswith('/' + user_pool_id):
+        return None
+    return claims
+
+
+def _user_from_claims(claims: Dict[str, Any]) -> Dict[str, Any]:
+    """IDトークンのクレームからレスポンス用のユーザー情報を生成"""
+    return {
+        'email': claims.get('email'),
+        'role': claims.get('custom:role', 'user'),
+        'user_id': claims.get('sub')
+    }
+
+
 def logout(event: Dict[str, Any]) -> Dict[str, Any]:
     """ユーザーログアウト処理"""
     try:
@@ -122,7 +218,7 @@ def logout(event: Dict[str, Any]) -> Dict[str, Any]:
         access_token = auth_header.replace('Bearer ', '')
         
         # Cognitoからログアウト
-        cognito_client = get_cognito_client()
+        cognito_client = get_cognito_gateway()
         
         try:
             cognito_client.global_sign_out(AccessToken=access_token)
@@ -133,8 +229,10 @@ def logout(event: Dict[str, Any]) -> Dict[str, Any]:
             if error_code == 'NotAuthorizedException':
                 return create_error_response(401, 'Invalid token')
             else:
-                return create_error_response(500, 'Logout failed')
+                return handle_cognito_error(e, 'Logout failed')
                 
+    except CognitoThrottledError as e:
+        return e.to_response()
     except Exception:
         return create_error_response(500, 'Logout failed')
 
@@ -165,7 +263,7 @@ def register(event: Dict[str, Any]) -> Dict[str, Any]:
             return create_error_response(400, 'Invalid role')
         
         # Cognitoでユーザーを作成
-        cognito_client = get_cognito_client()
+        cognito_client = get_cognito_gateway()
         user_pool_id = os.environ['COGNITO_USER_POOL_ID']
         
         try:
@@ -219,7 +317,7 @@ def register(event: Dict[str, Any]) -> Dict[str, Any]:
             if error_code == 'UsernameExistsException':
                 return create_error_response(409, 'User already exists')
             else:
-                return create_error_response(500, 'User creation failed')
+                return handle_cognito_error(e, 'User creation failed')
                 
     except json.JSONDecodeError:
         return create_error_response(400, 'Invalid JSON in request body')
\ No newline at end of file
@@ -0,0 +1,347 @@
+"""
+運送会社ごとの配送実績（リードタイム・定時配送率）の集計
+
+出荷が配送完了になるたびに、運送会社 × 配送月ごとのスケッチ（CarrierAnalytics テーブルの1行）に加算し、
+GET /analytics/carriers で期間内のスケッチを合算して p50/p90/p99 のリードタイムと定時配送率を返します。
+
+- リードタイム（出荷の作成から配送完了まで、分単位）は対数バケットのヒストグラム（DDSketch 方式）で保持します。
+  バケット i は (γ^(i-1), γ^i] 分の範囲で、γ = (1 + α) / (1 - α) のため分位点の相対誤差は α（2%）以内です
+- バケットごとの件数は b<i> という属性に ADD で加算するので、複数のコンテナから同時に書き込んでも
+  読み込み・書き戻しは不要です。スケッチ同士はバケットごとの件数を足すだけで合算できます
+- 1回の加算は件数とバケットをまとめた1回の UpdateItem です。バケットが多い場合は出荷単位で別の UpdateItem に分けるので、
+  失敗しても出荷が一部だけ数えられることはありません（数えられなかった出荷はバックフィルで作り直します）
+- 定時配送は estimated_delivery が設定された出荷について、actual_delivery の日付が予定日以前かどうかで判定します
+"""
+import math
+import os
+import unicodedata
+from collections import Counter
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from botocore.exceptions import ClientError
+from utils import (
+    create_response,
+    create_error_response,
+    require_auth,
+    require_admin,
+    get_dynamodb_resource,
+    get_query_parameter,
+    handle_dynamodb_error,
+    scan_all,
+    prime_dynamodb
+)
+from instrumentation import traced_handler
+from warmup import register_primer
+
+
+RELATIVE_ACCURACY = 0.02
+_GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+BUCKET_PREFIX = 'b'
+# 1回の UpdateItem に含めるバケット数（式の長さの上限 4KB に収める）
+MAX_BUCKETS_PER_UPDATE = 100
+DEFAULT_MONTHS = 12
+QUANTILES = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99))
+
+
+def bucket_index(minutes: float) -> int:
+    """リードタイム（分）のバケット番号（1分以下は 0）"""
+    if minutes <= 1:
+        return 0
+    return int(math.ceil(math.log(minutes) / _LOG_GAMMA))
+
+
+def bucket_value(index: int) -> float:
+    """バケットの代表値（分）。範囲内のどの値に対しても相対誤差が α 以内になる値"""
+    if index <= 0:
+        return 0.0
+    return 2 * _GAMMA ** index / (_GAMMA + 1)
+
+
+def carrier_key(carrier: str) -> str:
+    """運送会社名の表記ゆれ（全角・大文字小文字・前後の空白）を吸収したキー"""
+    return unicodedata.normalize('NFKC', str(carrier)).strip().casefold()
+
+
+def _parse_datetime(value: Any) -> Optional[datetime]:
+    """ISO 形式の日時を UTC（タイムゾーンなし）として読む"""
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+class CarrierSketch:
+    """運送会社 × 配送月のリードタイムのヒストグラムと定時配送の件数"""
+
+    def __init__(self, carrier: str, month: str):
+        self.carrier = carrier
+        self.month = month
+        self.buckets: Counter = Counter()
+        self.delivered = 0
+        self.with_estimate = 0
+        self.on_time = 0
+        self.lead_minutes_sum = 0.0
+
+    @property
+    def sketch_key(self) -> str:
+        return f'{carrier_key(self.carrier)}#{self.month}'
+
+    def add(self, lead_minutes: float, on_time: Optional[bool]) -> None:
+        self.buckets[bucket_index(lead_minutes)] += 1
+        self.delivered += 1
+        self.lead_minutes_sum += lead_minutes
+        if on_time is not None:
+            self.with_estimate += 1
+            self.on_time += int(on_time)
+
+    def merge(self, other: 'CarrierSketch') -> None:
+        self.buckets.update(other.buckets)
+        self.delivered += other.delivered
+        self.with_estimate += other.with_estimate
+        self.on_time += other.on_time
+        self.lead_minutes_sum += other.lead_minutes_sum
+
+    def quantile(self, q: float) -> Optional[float]:
+        """分位点（分）。件数が 0 のときは None"""
+        total = sum(self.buckets.values())
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                return bucket_value(index)
+        return bucket_value(max(self.buckets))
+
+    def summary(self) -> Dict[str, Any]:
+        lead_time_hours = {
+            name: round(minutes / 60, 2) if minutes is not None else None
+            for name, minutes in ((name, self.quantile(q)) for name, q in QUANTILES)
+        }
+        lead_time_hours['mean'] = round(self.lead_minutes_sum / self.delivered / 60, 2) if self.delivered else None
+        return {
+            'carrier': self.carrier,
+            'delivered': self.delivered,
+            'with_estimate': self.with_estimate,
+            'on_time_rate': round(self.on_time / self.with_estimate, 4) if self.with_estimate else None,
+            'lead_time_hours': lead_time_hours
+        }
+
+    def to_item(self) -> Dict[str, Any]:
+        item = {
+            'sketch_key': self.sketch_key,
+            'carrier': self.carrier,
+            'delivery_month': self.month,
+            'delivered_count': self.delivered,
+            'with_estimate_count': self.with_estimate,
+            'on_time_count': self.on_time,
+            'lead_minutes_sum': Decimal(str(round(self.lead_minutes_sum, 3)))
+        }
+        item.update({f'{BUCKET_PREFIX}{index}': count for index, count in self.buckets.items()})
+        return item
+
+    @classmethod
+    def from_item(cls, item: Dict[str, Any]) -> 'CarrierSketch':
+        sketch = cls(item['carrier'], item['delivery_month'])
+        sketch.delivered = int(item.get('delivered_count', 0))
+        sketch.with_estimate = int(item.get('with_estimate_count', 0))
+        sketch.on_time = int(item.get('on_time_count', 0))
+        sketch.lead_minutes_sum = float(item.get('lead_minutes_sum', 0))
+        for name, count in item.items():
+            if name.startswith(BUCKET_PREFIX) and name[len(BUCKET_PREFIX):].isdigit():
+                sketch.buckets[int(name[len(BUCKET_PREFIX):])] = int(count)
+        return sketch
+
+    def update_request(self) -> Dict[str, Any]:
+        """このスケッチをテーブルの行に加算する UpdateItem の引数
+
+        件数とバケットを1回の UpdateItem でまとめて加算するため、途中で失敗しても行の件数とバケットの合計はずれません。
+        バケットは MAX_BUCKETS_PER_UPDATE 以下にしてください（update_sketches で分けたスケッチ）。
+        """
+        if len(self.buckets) > MAX_BUCKETS_PER_UPDATE:
+            raise ValueError(f'A sketch update can add at most {MAX_BUCKETS_PER_UPDATE} buckets')
+        indexes = sorted(self.buckets)
+        names = {f'#b{i}': f'{BUCKET_PREFIX}{index}' for i, index in enumerate(indexes)}
+        values: Dict[str, Any] = {f':b{i}': self.buckets[index] for i, index in enumerate(indexes)}
+        adds = [
+            'delivered_count :delivered', 'with_estimate_count :with_estimate',
+            'on_time_count :on_time', 'lead_minutes_sum :lead_minutes'
+        ] + [f'#b{i} :b{i}' for i in range(len(indexes))]
+        values.update({
+            ':carrier': self.carrier,
+            ':month': self.month,
+            ':delivered': self.delivered,
+            ':with_estimate': self.with_estimate,
+            ':on_time': self.on_time,
+            ':lead_minutes': Decimal(str(round(self.lead_minutes_sum, 3)))
+        })
+        request: Dict[str, Any] = {
+            'Key': {'sketch_key': self.sketch_key},
+            'UpdateExpression': 'SET carrier = :carrier, delivery_month = :month ADD ' + ', '.join(adds),
+            'ExpressionAttributeValues': values
+        }
+        if names:
+            request['ExpressionAttributeNames'] = names
+        return request
+
+
+def delivery_sample(shipment: Dict[str, Any]) -> Optional[Tuple[str, float, Optional[bool]]]:
+    """配送完了した出荷から (配送月, リードタイム（分）, 定時配送か) を求める。求められない場合は None"""
+    created_at = _parse_datetime(shipment.get('created_at'))
+    delivered_at = _parse_datetime(shipment.get('actual_delivery'))
+    if not shipment.get('carrier') or created_at is None or delivered_at is None or delivered_at < created_at:
+        return None
+    estimated = _parse_datetime(shipment.get('estimated_delivery'))
+    on_time = delivered_at.date() <= estimated.date() if estimated is not None else None
+    return delivered_at.strftime('%Y-%m'), (delivered_at - created_at).total_seconds() / 60, on_time
+
+
+def build_sketches(shipments: Iterable[Dict[str, Any]]) -> Dict[str, CarrierSketch]:
+    """配送完了した出荷をスケッチのキーごとに集計"""
+    sketches: Dict[str, CarrierSketch] = {}
+    for shipment in shipments:
+        sample = delivery_sample(shipment)
+        if sample is None:
+            continue
+        month, lead_minutes, on_time = sample
+        sketch = CarrierSketch(shipment['carrier'], month)
+        sketch = sketches.setdefault(sketch.sketch_key, sketch)
+        sketch.add(lead_minutes, on_time)
+    return sketches
+
+
+def update_sketches(shipments: Iterable[Dict[str, Any]]) -> List[CarrierSketch]:
+    """配送完了した出荷を、1回の UpdateItem で加算できるスケッチに集計
+
+    同じキーでもバケットが MAX_BUCKETS_PER_UPDATE を超える場合は出荷ごとに別のスケッチに分けるので、
+    加算の途中で失敗しても1件の出荷が一部だけ数えられることはありません。
+    """
+    full: List[CarrierSketch] = []
+    open_sketches: Dict[str, CarrierSketch] = {}
+    for shipment in shipments:
+        sample = delivery_sample(shipment)
+        if sample is None:
+            continue
+        month, lead_minutes, on_time = sample
+        sketch = CarrierSketch(shipment['carrier'], month)
+        sketch = open_sketches.setdefault(sketch.sketch_key, sketch)
+        if bucket_index(lead_minutes) not in sketch.buckets and len(sketch.buckets) >= MAX_BUCKETS_PER_UPDATE:
+            full.append(sketch)
+            sketch = open_sketches[sketch.sketch_key] = CarrierSketch(shipment['carrier'], month)
+        sketch.add(lead_minutes, on_time)
+    return full + list(open_sketches.values())
+
+
+def _analytics_table():
+    return get_dynamodb_resource().Table(os.environ['CARRIER_ANALYTICS_TABLE'])
+
+
+def record_deliveries(shipments: Iterable[Dict[str, Any]]) -> None:
+    """配送完了になった出荷をスケッチに加算"""
+    if not os.environ.get('CARRIER_ANALYTICS_TABLE'):
+        # 配送実績の集計を使わない環境
+        return
+    sketches = update_sketches(shipments)
+    if not sketches:
+        return
+    table = _analytics_table()
+    for sketch in sketches:
+        try:
+            table.update_item(**sketch.update_request())
+        except ClientError as e:
+            # 出荷の更新は成功させ、加算できなかったスケッチは tools/backfill_carrier_analytics.py で作り直す
+            print(f"Failed to update carrier analytics: {str(e)}")
+
+
+def _month_range(event: Dict[str, Any]) -> Tuple[str, str]:
+    """from / to（YYYY-MM）を検証して返す。省略時は今月までの12か月"""
+    now = datetime.utcnow()
+    start_index = now.year * 12 + now.month - DEFAULT_MONTHS
+    default_from = f'{start_index // 12:04d}-{start_index % 12 + 1:02d}'
+    month_from = get_query_parameter(event, 'from') or default_from
+    month_to = get_query_parameter(event, 'to') or now.strftime('%Y-%m')
+    for value in (month_from, month_to):
+        try:
+            datetime.strptime(value, '%Y-%m')
+        except ValueError:
+            raise ValueError('from and to must be in YYYY-MM format')
+    if month_from > month_to:
+        raise ValueError('from must not be after to')
+    return month_from, month_to
+
+
+register_primer('dynamodb', lambda: prime_dynamodb(os.environ.get('CARRIER_ANALYTICS_TABLE')), 'analytics')
+
+
+@traced_handler('analytics')
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """配送実績のメインハンドラー"""
+    http_method = event['httpMethod']
+    path = event['path']
+
+    try:
+        if path == '/analytics/carriers' and http_method == 'GET':
+            return get_carrier_analytics(event, context)
+        else:
+            return create_error_response(404, 'Endpoint not found')
+
+    except Exception as e:
+        print(f"Error in analytics handler: {str(e)}")
+        return create_error_response(500, 'Internal server error')
+
+
+@require_auth
+@require_admin
+def get_carrier_analytics(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """運送会社ごとのリードタイムの分位点と定時配送率（管理者のみ）
+
+    クエリパラメータ:
+    - from / to: 配送月の範囲（YYYY-MM、デフォルトは今月までの12か月）
+    - carrier: 運送会社で絞り込む
+    - group_by: month を指定すると月ごとの内訳も返す
+    """
+    try:
+        month_from, month_to = _month_range(event)
+    except ValueError as e:
+        return create_error_response(400, str(e))
+    carrier = get_query_parameter(event, 'carrier')
+    by_month = get_query_parameter(event, 'group_by') == 'month'
+
+    try:
+        # 運送会社数 × 月数の小さなテーブルなのでスキャンで読む
+        monthly = [CarrierSketch.from_item(item) for item in scan_all(
+            _analytics_table(), 1,
+            FilterExpression='delivery_month BETWEEN :from AND :to',
+            ExpressionAttributeValues={':from': month_from, ':to': month_to}
+        )]
+    except ClientError as e:
+        return handle_dynamodb_error(e)
+
+    if carrier:
+        monthly = [sketch for sketch in monthly if carrier_key(sketch.carrier) == carrier_key(carrier)]
+
+    merged: Dict[str, CarrierSketch] = {}
+    months: Dict[str, List[CarrierSketch]] = {}
+    for sketch in sorted(monthly, key=lambda s: s.month):
+        key = carrier_key(sketch.carrier)
+        if key not in merged:
+            merged[key] = CarrierSketch(sketch.carrier, month_from)
+        merged[key].merge(sketch)
+        months.setdefault(key, []).append(sketch)
+
+    carriers = []
+    for key, sketch in sorted(merged.items(), key=lambda entry: -entry[1].delivered):
+        summary = sketch.summary()
+        if by_month:
+            summary['months'] = [dict(s.summary(), month=s.month) for s in months[key]]
+        carriers.append(summary)
+
+    return create_response(200, {'from': month_from, 'to': month_to, 'carriers': carriers})
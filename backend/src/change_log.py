@@ -0,0 +1,266 @@
+"""
+発注書・出荷の変更履歴（クライアントの差分同期）
+
+GET /changes?since=<cursor> で、カーソル以降に作成・更新・削除された発注書と出荷を返します。
+クライアントは一覧を一度読み込んだ後、差分だけを取得して手元の一覧に反映できます。
+
+- 発注書・出荷の書き込み（API、ステータスイベント、インポート、アーカイブ）のたびに、ChangeLog テーブルの
+  アイテムごとの1行（change_key = <種類>#<ID>）を上書きします。行は一覧と同じ形式の内容を持ち、削除は deleted の行（tombstone）です
+- 同じアイテムの変更は1行にまとまるので、しばらく同期しなかったクライアントも最新の状態だけを受け取ります
+- changed-index（パーティションキー change_bucket = <日付>#<シャード>、ソートキー changed_at）から日ごとに読みます。
+  書き込みが1つのパーティションに集中しないよう、ID のハッシュで CHANGE_LOG_SHARDS 個に分けています
+- 書き込みや GSI への反映の遅れで取りこぼさないよう、SETTLE_SECONDS 秒より前の変更だけを返します
+- 行は RETENTION_DAYS 日後に TTL で削除されます。それより古いカーソルには 410 を返すので、一覧を読み込み直してください
+
+最初の同期では since を付けずに呼び出してカーソルを受け取ってから一覧を読み込みます（その間の変更は次の差分に含まれます）。
+
+書き込んだ変更は ChangeLog テーブルの DynamoDB Streams（stream_handler）から WebSocket の接続に配信されます（realtime）。
+"""
+import heapq
+import os
+import time
+import zlib
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+from utils import (
+    create_response,
+    create_error_response,
+    require_auth,
+    get_dynamodb_resource,
+    get_query_parameter,
+    handle_dynamodb_error,
+    encode_cursor,
+    decode_cursor,
+    prime_dynamodb
+)
+from instrumentation import TracedThreadPoolExecutor, traced_handler
+from warmup import register_primer
+from realtime import prime_connections, publish_changes, publishes_inline
+from repository import ID_NAMES, PURCHASE_ORDER, SHIPMENT
+from models import PurchaseOrder, Shipment, UserRole, decode_attribute, encode_attribute
+
+
+CHANGE_LOG_SHARDS = 8
+RETENTION_DAYS = 7
+SETTLE_SECONDS = 5
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 1000
+
+_MODELS = {PURCHASE_ORDER: PurchaseOrder, SHIPMENT: Shipment}
+
+
+def _table() -> Any:
+    return get_dynamodb_resource().Table(os.environ['CHANGE_LOG_TABLE'])
+
+
+def _write(rows: List[Dict[str, Any]]) -> None:
+    if not rows or not os.environ.get('CHANGE_LOG_TABLE'):
+        # 差分同期を使わない環境
+        return
+    now = datetime.utcnow().isoformat()
+    expires_at = int(time.time()) + RETENTION_DAYS * 86400
+    stored = []
+    with _table().batch_writer(overwrite_by_pkeys=['change_key']) as batch:
+        for row in rows:
+            shard = zlib.crc32(row['change_key'].encode('utf-8')) % CHANGE_LOG_SHARDS
+            stored.append(dict(row, changed_at=now, change_bucket=f'{now[:10]}#{shard}', expires_at=expires_at))
+            batch.put_item(Item=stored[-1])
+    if publishes_inline():
+        # DynamoDB Streams のない local ではここで配信する
+        publish_changes((row['created_by'], _change(row)) for row in stored)
+
+
+def record_changes(entity: str, items: Iterable[Dict[str, Any]]) -> None:
+    """作成・更新されたアイテム（DynamoDB に書き込んだ形式）を記録"""
+    rows = []
+    for item in items:
+        summary = _MODELS[entity].from_dict(item).summary()
+        rows.append({
+            'change_key': f'{entity}#{item[ID_NAMES[entity]]}',
+            'entity': entity,
+            'item_id': item[ID_NAMES[entity]],
+            'created_by': item['created_by'],
+            'deleted': False,
+            # 備考が長い場合は一覧の内容ごと圧縮する
+            'record': encode_attribute(summary)
+        })
+    _write(rows)
+
+
+def record_deletions(entity: str, items: Iterable[Dict[str, Any]]) -> None:
+    """削除（アーカイブを含む）されたアイテムの tombstone を記録"""
+    _write([{
+        'change_key': f'{entity}#{item[ID_NAMES[entity]]}',
+        'entity': entity,
+        'item_id': item[ID_NAMES[entity]],
+        'created_by': item['created_by'],
+        'deleted': True
+    } for item in items])
+
+
+def _after(row: Dict[str, Any], since: Tuple[str, Optional[str]]) -> bool:
+    """since（変更日時, change_key）より後の行か（change_key がない場合はその日時より後）"""
+    if row['changed_at'] != since[0]:
+        return row['changed_at'] > since[0]
+    return since[1] is not None and row['change_key'] > since[1]
+
+
+def _position(row: Dict[str, Any]) -> Tuple[str, str]:
+    return row['changed_at'], row['change_key']
+
+
+def _query_bucket(bucket: str, since: Tuple[str, Optional[str]], until: str, limit: int,
+                  created_by: Optional[str]) -> List[Dict[str, Any]]:
+    """1つのシャードから since より後の行を古い順に最大 limit 件読み込む"""
+    params: Dict[str, Any] = {
+        'IndexName': 'changed-index',
+        'KeyConditionExpression': 'change_bucket = :bucket AND changed_at BETWEEN :since AND :until',
+        'ExpressionAttributeValues': {':bucket': bucket, ':since': since[0], ':until': until},
+        'Limit': limit
+    }
+    if created_by:
+        params['FilterExpression'] = 'created_by = :created_by'
+        params['ExpressionAttributeValues'][':created_by'] = created_by
+    table = _table()
+    rows: List[Dict[str, Any]] = []
+    while len(rows) < limit:
+        response = table.query(**params)
+        rows.extend(row for row in response['Items'] if _after(row, since))
+        if 'LastEvaluatedKey' not in response:
+            break
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return rows[:limit]
+
+
+def load_changes(since: Tuple[str, Optional[str]], limit: int, created_by: Optional[str] = None,
+                 now: Optional[datetime] = None) -> Tuple[List[Dict[str, Any]], Tuple[str, Optional[str]], bool]:
+    """since より後の変更を古い順に最大 limit 件読み込み、(変更, 続きの位置, まだ残りがあるか) を返す"""
+    until = ((now or datetime.utcnow()) - timedelta(seconds=SETTLE_SECONDS)).isoformat()
+    if since[0] >= until:
+        return [], since, False
+    day = date.fromisoformat(since[0][:10])
+    last_day = date.fromisoformat(until[:10])
+
+    rows: List[Dict[str, Any]] = []
+    with TracedThreadPoolExecutor(max_workers=CHANGE_LOG_SHARDS) as executor:
+        while day <= last_day:
+            remaining = limit - len(rows)
+            futures = [
+                executor.submit(_query_bucket, f'{day.isoformat()}#{shard}', since, until, remaining, created_by)
+                for shard in range(CHANGE_LOG_SHARDS)
+            ]
+            # 各シャードの古いほうから remaining 件ずつを合わせ、全体の古い順に remaining 件を取り出す
+            rows.extend(heapq.nsmallest(remaining, (row for f in futures for row in f.result()), key=_position))
+            if len(rows) >= limit:
+                return rows, _position(rows[-1]), True
+            day += timedelta(days=1)
+    return rows, (until, None), False
+
+
+def _change(row: Dict[str, Any]) -> Dict[str, Any]:
+    """変更履歴の行をレスポンスの1件に変換"""
+    change = {
+        'type': row['entity'],
+        'id': row['item_id'],
+        'changed_at': row['changed_at'],
+        'deleted': bool(row['deleted'])
+    }
+    if not row['deleted']:
+        change[row['entity']] = decode_attribute(row['record'])
+    return change
+
+
+def _parse_since(cursor: Optional[Dict[str, Any]]) -> Tuple[str, Optional[str]]:
+    """カーソルを (変更日時, change_key) に戻す（不正な場合は ValueError）"""
+    if not cursor or not isinstance(cursor.get('changed_at'), str):
+        raise ValueError('Invalid cursor')
+    key = cursor.get('key')
+    if key is not None and not isinstance(key, str):
+        raise ValueError('Invalid cursor')
+    datetime.fromisoformat(cursor['changed_at'])
+    return cursor['changed_at'], key
+
+
+def _encode_since(position: Tuple[str, Optional[str]]) -> str:
+    cursor = {'changed_at': position[0]}
+    if position[1] is not None:
+        cursor['key'] = position[1]
+    return encode_cursor(cursor)
+
+
+register_primer('dynamodb', lambda: prime_dynamodb(os.environ.get('CONNECTIONS_TABLE')), 'change_stream')
+register_primer('connections', prime_connections, 'change_stream')
+
+
+@traced_handler('change_stream')
+def stream_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """ChangeLog テーブルの DynamoDB Streams から、バッチ内の変更をまとめて WebSocket の接続に配信"""
+    deserializer = TypeDeserializer()
+    rows = [
+        {name: deserializer.deserialize(value) for name, value in record['dynamodb']['NewImage'].items()}
+        for record in event.get('Records', [])
+        # TTL による削除（REMOVE）は配信しない
+        if record.get('eventName') in ('INSERT', 'MODIFY')
+    ]
+    return publish_changes((row['created_by'], _change(row)) for row in rows)
+
+
+register_primer('dynamodb', lambda: prime_dynamodb(os.environ.get('CHANGE_LOG_TABLE')), 'changes')
+
+
+@traced_handler('changes')
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """変更履歴のメインハンドラー"""
+    http_method = event['httpMethod']
+    path = event['path']
+
+    try:
+        if path == '/changes' and http_method == 'GET':
+            return get_changes(event, context)
+        else:
+            return create_error_response(404, 'Endpoint not found')
+
+    except Exception as e:
+        print(f"Error in changes handler: {str(e)}")
+        return create_error_response(500, 'Internal server error')
+
+
+@require_auth
+def get_changes(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """since 以降に作成・更新・削除された発注書と出荷を古い順に取得
+
+    管理者はすべての変更、一般ユーザーは自分が作成したものの変更だけを受け取ります（一覧と同じ範囲）。
+    since を省略すると現在の位置のカーソルだけを返します。limit はデフォルト500、最大1000です。
+    """
+    now = datetime.utcnow()
+    since_param = get_query_parameter(event, 'since')
+    if not since_param:
+        position = ((now - timedelta(seconds=SETTLE_SECONDS)).isoformat(), None)
+        return create_response(200, {'changes': [], 'cursor': _encode_since(position), 'has_more': False})
+
+    try:
+        limit = int(get_query_parameter(event, 'limit', DEFAULT_LIMIT))
+        since = _parse_since(decode_cursor(since_param))
+    except ValueError:
+        return create_error_response(400, 'Invalid limit or cursor')
+    if limit < 1 or limit > MAX_LIMIT:
+        return create_error_response(400, f'limit must be between 1 and {MAX_LIMIT}')
+    if since[0] < (now - timedelta(days=RETENTION_DAYS)).isoformat():
+        # 変更履歴が残っていない期間を含むので、一覧を読み込み直してもらう
+        return create_error_response(410, 'Cursor expired, reload the full list')
+
+    user = event.get('user', {})
+    created_by = None if user.get('custom:role', 'user') == UserRole.ADMIN.value else user.get('sub')
+
+    try:
+        rows, position, has_more = load_changes(since, limit, created_by, now)
+    except ClientError as e:
+        return handle_dynamodb_error(e)
+
+    return create_response(200, {
+        'changes': [_change(row) for row in rows],
+        'cursor': _encode_since(position),
+        'has_more': has_more
+    })
@@ -0,0 +1,270 @@
+"""
+Cognito API 呼び出しの共通ゲートウェイ
+
+Cognito のユーザープールは API カテゴリごとに秒間リクエスト数のクォータがあり、
+朝のログイン集中時にスロットリングがタイムアウトの連鎖を引き起こしていました。
+このゲートウェイは全ての Cognito 呼び出しに次の制御を加えます。
+
+- トークンバケットによるクライアント側のレート制限（カテゴリ別、クォータ × COGNITO_QUOTA_SHARE）
+- TooManyRequestsException 等と、タイムアウト・接続エラーに対するジッター付き指数バックオフでの再試行と、レートの適応的な引き下げ
+- 失敗が続いた場合に即座に失敗させるサーキットブレーカー
+
+制限を超えた場合は CognitoThrottledError を送出し、ハンドラーは 429 と Retry-After を返します。
+"""
+import math
+import os
+import random
+import threading
+import time
+from typing import Dict, Any, Optional, Callable, Tuple
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+from utils import create_error_response, get_cognito_client
+
+
+# ユーザープール全体のカテゴリ別クォータ（秒間リクエスト数、Cognito のデフォルト値）
+CATEGORY_QUOTAS = {
+    'UserAuthentication': 120.0,
+    'UserCreation': 50.0,
+    'UserAccountRead': 120.0,
+    'UserAccountUpdate': 25.0,
+    'UserList': 30.0,
+    'UserResourceRead': 120.0
+}
+OPERATION_CATEGORIES = {
+    'admin_initiate_auth': 'UserAuthentication',
+    'initiate_auth': 'UserAuthentication',
+    'admin_create_user': 'UserCreation',
+    'get_user': 'UserAccountRead',
+    'admin_get_user': 'UserAccountRead',
+    'admin_set_user_password': 'UserAccountUpdate',
+    'admin_update_user_attributes': 'UserAccountUpdate',
+    'admin_delete_user': 'UserAccountUpdate',
+    'global_sign_out': 'UserAccountUpdate',
+    'list_users': 'UserList'
+}
+DEFAULT_CATEGORY = 'UserResourceRead'
+
+# 再試行の対象となるエラーコード（サーバー側の一時的な失敗）
+RETRYABLE_ERRORS = {
+    'TooManyRequestsException',
+    'LimitExceededException',
+    'ThrottlingException',
+    'InternalErrorException',
+    'ServiceUnavailable'
+}
+THROTTLE_ERRORS = {'TooManyRequestsException', 'LimitExceededException', 'ThrottlingException'}
+# 再試行の対象となる通信エラー（ReadTimeoutError / ConnectTimeoutError / EndpointConnectionError 等）
+TRANSPORT_ERRORS = (BotoConnectionError, HTTPClientError)
+
+DEFAULT_QUOTA_SHARE = 0.2
+MAX_ATTEMPTS = 4
+BASE_BACKOFF_SECONDS = 0.05
+MAX_BACKOFF_SECONDS = 1.0
+# バケットのトークン待ちの上限（これを超える場合は待たずに 429 を返す）
+MAX_WAIT_SECONDS = 2.0
+FAILURE_THRESHOLD = 5
+OPEN_SECONDS = 10.0
+
+
+class CognitoThrottledError(Exception):
+    """Cognito の呼び出しを制限したことを表す例外（429 として返す）"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    def to_response(self) -> Dict[str, Any]:
+        return create_error_response(
+            429, str(self),
+            headers={'Retry-After': str(max(1, math.ceil(self.retry_after)))}
+        )
+
+
+class TokenBucket:
+    """トークンバケット（レートは適応的に引き下げ・回復する）"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self._clock = clock
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, max_wait: float) -> Optional[float]:
+        """トークンを1つ予約し、必要な待ち時間を返す（max_wait を超える場合は None）"""
+        with self._lock:
+            self._refill()
+            wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+            if wait > max_wait:
+                return None
+            self.tokens -= 1
+            return wait
+
+    def throttled(self) -> None:
+        """スロットリングを受けたらレートを半分にする（下限は最大レートの 10%）"""
+        with self._lock:
+            self.rate = max(self.max_rate * 0.1, self.rate * 0.5)
+
+    def succeeded(self) -> None:
+        """成功したらレートを少しずつ回復する"""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+
+class CircuitBreaker:
+    """連続した失敗で開き、一定時間後に1件だけ試行を許可するサーキットブレーカー"""
+
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD, open_seconds: float = OPEN_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def acquire(self) -> Tuple[Optional[float], bool]:
+        """(拒否する場合は再試行までの秒数・許可する場合は None, 半開状態の試行として許可したか) を返す
+
+        試行として許可された呼び出しは、結果にかかわらず最後に release_trial を呼ぶこと。
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return None, False
+            remaining = self.opened_at + self.open_seconds - self._clock()
+            if remaining > 0:
+                return remaining, False
+            if self.trial_in_flight:
+                return self.open_seconds, False
+            self.trial_in_flight = True
+            return None, True
+
+    def allow(self) -> Optional[float]:
+        """呼び出しを許可する場合は None、拒否する場合は再試行までの秒数を返す"""
+        return self.acquire()[0]
+
+    def release_trial(self) -> None:
+        """試行の終了（成功・失敗を記録せずに終わった場合も次の試行を許可する）"""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = self._clock()
+
+
+def _quota_share() -> float:
+    try:
+        return float(os.environ.get('COGNITO_QUOTA_SHARE', DEFAULT_QUOTA_SHARE))
+    except ValueError:
+        return DEFAULT_QUOTA_SHARE
+
+
+class CognitoGateway:
+    """Cognito クライアントと同じメソッド名で呼び出せる、レート制限付きのラッパー"""
+
+    def __init__(self, client: Any, quota_share: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.client = client
+        share = quota_share if quota_share is not None else _quota_share()
+        self.buckets = {
+            category: TokenBucket(quota * share, clock=clock)
+            for category, quota in CATEGORY_QUOTAS.items()
+        }
+        self.breakers = {category: CircuitBreaker(clock=clock) for category in CATEGORY_QUOTAS}
+        self._sleep = sleep
+
+    def __getattr__(self, name: str) -> Callable:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        operation = getattr(self.client, name)
+        category = OPERATION_CATEGORIES.get(name, DEFAULT_CATEGORY)
+
+        def call(**kwargs):
+            return self._call(category, operation, kwargs)
+        return call
+
+    def rate(self, *operations: str) -> float:
+        """operations を1回ずつ呼ぶ処理を秒間何件実行できるか（最も遅いカテゴリの現在のレート）"""
+        return min(self.buckets[OPERATION_CATEGORIES.get(name, DEFAULT_CATEGORY)].rate for name in operations)
+
+    def _call(self, category: str, operation: Callable, kwargs: Dict[str, Any]) -> Any:
+        bucket = self.buckets[category]
+        breaker = self.breakers[category]
+
+        retry_after, trial = breaker.acquire()
+        if retry_after is not None:
+            raise CognitoThrottledError('Authentication service is temporarily unavailable', retry_after)
+        try:
+            return self._attempt(bucket, breaker, operation, kwargs)
+        finally:
+            # 試行が想定外の例外やバケットの拒否で終わっても、ブレーカーが試行中のまま残らないようにする
+            if trial:
+                breaker.release_trial()
+
+    def _attempt(self, bucket: TokenBucket, breaker: CircuitBreaker, operation: Callable,
+                 kwargs: Dict[str, Any]) -> Any:
+        for attempt in range(MAX_ATTEMPTS):
+            wait = bucket.reserve(MAX_WAIT_SECONDS)
+            if wait is None:
+                raise CognitoThrottledError('Too many requests, please retry later', 1 / bucket.rate)
+            if wait > 0:
+                self._sleep(wait)
+            try:
+                result = operation(**kwargs)
+            except ClientError as e:
+                error_code = e.response['Error']['Code']
+                if error_code not in RETRYABLE_ERRORS:
+                    # 入力エラー等はサービスの状態とは無関係なのでブレーカーには数えない
+                    breaker.record_success()
+                    raise
+                if error_code in THROTTLE_ERRORS:
+                    bucket.throttled()
+                message = 'Too many requests, please retry later'
+            except TRANSPORT_ERRORS:
+                message = 'Authentication service is temporarily unavailable'
+            else:
+                bucket.succeeded()
+                breaker.record_success()
+                return result
+            if attempt == MAX_ATTEMPTS - 1:
+                breaker.record_failure()
+                raise CognitoThrottledError(message, MAX_BACKOFF_SECONDS)
+            # フルジッター付きの指数バックオフ
+            self._sleep(random.uniform(0, min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2 ** attempt)))
+
+
+_gateway: Optional[CognitoGateway] = None
+
+
+def get_cognito_gateway() -> CognitoGateway:
+    """コンテナ内で共有する Cognito ゲートウェイを取得（バケットとブレーカーの状態を保持）"""
+    global _gateway
+    if _gateway is None:
+        _gateway = CognitoGateway(get_cognito_client())
+    return _gateway
+
+
+def reset_cognito_gateway() -> None:
+    """ゲートウェイの状態を破棄（テスト用）"""
+    global _gateway
+    _gateway = None
@@ -0,0 +1,168 @@
+"""
+発注書・出荷データのエクスポート
+
+POST /exports でエクスポートジョブを登録し、ワーカーがテーブルを並列スキャンしながら
+gzip 圧縮した NDJSON / CSV をオブジェクトストレージにマルチパートで書き込みます。
+スキャン結果はジェネレーターで1行ずつ流すため、メモリ使用量はテーブルの大きさに依存しません。
+完了後は GET /exports/{job_id} で署名付きのダウンロード URL を取得できます。
+"""
+import json
+import os
+from typing import Dict, Any, Iterator, Optional
+from utils import (
+    create_response,
+    create_error_response,
+    require_auth,
+    get_path_parameter,
+    validate_required_fields,
+    scan_all,
+    int_env,
+    prime_dynamodb
+)
+from instrumentation import traced_handler
+from warmup import register_primer
+from idempotency import idempotent
+from jobs import (
+    enqueue_job, get_job, get_job_queue, register_job, update_job_progress, job_to_response, STATUS_SUCCEEDED
+)
+from object_storage import get_object_storage
+from record_io import FORMAT_CSV, FORMAT_NDJSON, encode_records, gzip_chunks
+from po_lines import with_items
+from repository import PURCHASE_ORDER, SHIPMENT, get_repository
+from models import UserRole, decompress_attributes
+
+
+EXPORT_RESOURCES = {
+    'purchase_orders': {
+        'entity': PURCHASE_ORDER,
+        'fields': ['po_id', 'supplier', 'status', 'total_amount', 'items',
+                   'created_by', 'created_at', 'updated_at', 'notes'],
+        # 明細は PurchaseOrderLines から発注書ごとに読み込む
+        'line_items': True
+    },
+    'shipments': {
+        'entity': SHIPMENT,
+        'fields': ['shipment_id', 'po_id', 'tracking_number', 'carrier', 'status',
+                   'estimated_delivery', 'actual_delivery', 'created_by', 'created_at', 'updated_at', 'notes']
+    }
+}
+CONTENT_TYPES = {
+    FORMAT_NDJSON: 'application/x-ndjson',
+    FORMAT_CSV: 'text/csv'
+}
+DEFAULT_SCAN_SEGMENTS = 4
+PROGRESS_INTERVAL_ROWS = 10000
+
+
+register_primer('dynamodb', lambda: prime_dynamodb(os.environ.get('JOBS_TABLE')), 'exports')
+register_primer('job_queue', get_job_queue, 'exports')
+register_primer('object_storage', get_object_storage, 'exports')
+
+
+@traced_handler('exports')
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """エクスポートのメインハンドラー"""
+    http_method = event['httpMethod']
+    path = event['path']
+
+    try:
+        if path == '/exports' and http_method == 'POST':
+            return create_export(event, context)
+        elif path.startswith('/exports/') and http_method == 'GET':
+            return get_export(event, context)
+        else:
+            return create_error_response(404, 'Endpoint not found')
+
+    except Exception as e:
+        print(f"Error in exports handler: {str(e)}")
+        return create_error_response(500, 'Internal server error')
+
+
+@require_auth
+@idempotent
+def create_export(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """エクスポートジョブを登録（一般ユーザーは自分が作成したデータのみ）"""
+    try:
+        body = json.loads(event['body'] or '{}')
+    except json.JSONDecodeError:
+        return create_error_response(400, 'Invalid JSON in request body')
+
+    is_valid, error_msg = validate_required_fields(body, ['resource'])
+    if not is_valid:
+        return create_error_response(400, error_msg)
+    if body['resource'] not in EXPORT_RESOURCES:
+        return create_error_response(400, f"resource must be one of: {', '.join(EXPORT_RESOURCES)}")
+    fmt = body.get('format', FORMAT_NDJSON)
+    if fmt not in CONTENT_TYPES:
+        return create_error_response(400, 'format must be ndjson or csv')
+
+    user = event.get('user', {})
+    owner = None if user.get('custom:role') == UserRole.ADMIN.value else user.get('sub')
+    job = enqueue_job(
+        'export',
+        {'resource': body['resource'], 'format': fmt, 'owner': owner},
+        created_by=user.get('sub')
+    )
+    return create_response(202, {'message': 'Export started', 'job': job_to_response(job)})
+
+
+@require_auth
+def get_export(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """エクスポートの状態を取得し、完了していればダウンロード URL を発行"""
+    job_id = get_path_parameter(event, 'job_id')
+    if not job_id:
+        return create_error_response(400, 'Job ID is required')
+
+    job = get_job(job_id)
+    user = event.get('user', {})
+    if (not job or job['job_type'] != 'export'
+            or (job.get('created_by') != user.get('sub') and user.get('custom:role') != UserRole.ADMIN.value)):
+        return create_error_response(404, 'Export not found')
+
+    response = {'job': job_to_response(job)}
+    if job['status'] == STATUS_SUCCEEDED:
+        expires_in = int_env('EXPORT_URL_EXPIRES_SECONDS', 3600)
+        response['download_url'] = get_object_storage().presigned_url(job['result']['key'], expires_in)
+        response['expires_in'] = expires_in
+    return create_response(200, response)
+
+
+def _iter_rows(resource: str, owner: Optional[str]) -> Iterator[Dict[str, Any]]:
+    repository = get_repository()
+    entity = EXPORT_RESOURCES[resource]['entity']
+    params: Dict[str, Any] = {}
+    if owner:
+        params['FilterExpression'] = 'created_by = :user_id'
+        params['ExpressionAttributeValues'] = {':user_id': owner}
+    rows = scan_all(
+        repository.table(entity),
+        segments=int_env('EXPORT_SCAN_SEGMENTS', DEFAULT_SCAN_SEGMENTS),
+        **repository.scan_params(entity, params)
+    )
+    rows = map(decompress_attributes, rows)
+    return with_items(rows) if EXPORT_RESOURCES[resource].get('line_items') else rows
+
+
+@register_job('export')
+def run_export(payload: Dict[str, Any], job: Dict[str, Any]) -> Dict[str, Any]:
+    """テーブルをスキャンして gzip 圧縮したファイルを書き出すジョブ"""
+    resource = payload['resource']
+    fmt = payload['format']
+    fields = EXPORT_RESOURCES[resource]['fields']
+    key = f"exports/{job['job_id']}/{resource}.{fmt}.gz"
+    counter = {'rows': 0}
+
+    def counted(rows: Iterator[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        for row in rows:
+            counter['rows'] += 1
+            if counter['rows'] % PROGRESS_INTERVAL_ROWS == 0:
+                update_job_progress(job['job_id'], {'rows': counter['rows']})
+            # NDJSON も CSV と同じ列だけを出力する（内部用の属性は含めない）
+            yield {name: row.get(name) for name in fields}
+
+    storage = get_object_storage()
+    with storage.open_writer(key, CONTENT_TYPES[fmt]) as writer:
+        for chunk in gzip_chunks(encode_records(counted(_iter_rows(resource, payload.get('owner'))), fmt, fields)):
+            writer.write(chunk)
+
+    return {'key': key, 'rows': counter['rows'], 'bytes': writer.size, 'format': fmt, 'compression': 'gzip'}
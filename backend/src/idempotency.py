@@ -0,0 +1,130 @@
+"""
+作成系エンドポイントの冪等性制御
+
+Idempotency-Key ヘッダー付きのリクエストについて、最初のレスポンスを冪等性テーブルに保存し、
+同じキーで再送されたリクエストには業務テーブルに触れずに保存済みのレスポンスを返します。
+
+- キーはユーザー（sub）とエンドポイントごとに区別されます
+- 処理中の重複リクエストは条件付き書き込みで検出し、409 を返します
+- 同じキーで異なるリクエスト本文が送られた場合は 422 を返します
+- レコードは DynamoDB の TTL（expires_at）で自動的に削除されます
+"""
+import hashlib
+import json
+import os
+import time
+from functools import wraps
+from typing import Dict, Any, Optional
+from botocore.exceptions import ClientError
+from utils import create_response, create_error_response, get_dynamodb_resource
+
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+# Lambda のタイムアウト（30秒）より長くし、異常終了したリクエストのロックが残り続けないようにする
+IN_PROGRESS_TTL_SECONDS = 60
+
+STATUS_IN_PROGRESS = 'IN_PROGRESS'
+STATUS_COMPLETED = 'COMPLETED'
+
+
+def _get_header(event: Dict[str, Any], name: str) -> Optional[str]:
+    headers = event.get('headers') or {}
+    lowered = name.lower()
+    for key, value in headers.items():
+        if key.lower() == lowered:
+            return value
+    return None
+
+
+def _record_key(event: Dict[str, Any], idempotency_key: str) -> str:
+    user_id = (event.get('user') or {}).get('sub', 'anonymous')
+    return f"{user_id}#{event.get('httpMethod')} {event.get('path')}#{idempotency_key}"
+
+
+def _request_hash(event: Dict[str, Any]) -> str:
+    return hashlib.sha256((event.get('body') or '').encode('utf-8')).hexdigest()
+
+
+def _ttl_seconds() -> int:
+    try:
+        return int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', DEFAULT_TTL_SECONDS))
+    except ValueError:
+        return DEFAULT_TTL_SECONDS
+
+
+def _replay(record: Dict[str, Any]) -> Dict[str, Any]:
+    """保存済みのレスポンスを再生"""
+    return create_response(
+        int(record['status_code']),
+        json.loads(record['response_body']),
+        headers={REPLAYED_HEADER: 'true'}
+    )
+
+
+def idempotent(func):
+    """Idempotency-Key ヘッダーによる冪等性を提供するデコレータ（require_auth の内側で使用）"""
+    @wraps(func)
+    def wrapper(event, context):
+        idempotency_key = _get_header(event, IDEMPOTENCY_HEADER)
+        if not idempotency_key:
+            return func(event, context)
+        if len(idempotency_key) > MAX_KEY_LENGTH:
+            return create_error_response(400, f'{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters')
+
+        dynamodb = get_dynamodb_resource()
+        table = dynamodb.Table(os.environ['IDEMPOTENCY_TABLE'])
+        record_key = _record_key(event, idempotency_key)
+        request_hash = _request_hash(event)
+        now = int(time.time())
+
+        # 再送の場合はこの1回の読み込みだけで応答する
+        response = table.get_item(Key={'idempotency_key': record_key}, ConsistentRead=True)
+        record = response.get('Item')
+        if record and int(record['expires_at']) > now:
+            if record['request_hash'] != request_hash:
+                return create_error_response(422, f'{IDEMPOTENCY_HEADER} was already used with a different request')
+            if record['status'] == STATUS_COMPLETED:
+                return _replay(record)
+            return create_error_response(409, 'A request with this Idempotency-Key is already in progress')
+
+        # 処理中ロックを取得（期限切れのロックは上書き可能）
+        try:
+            table.put_item(
+                Item={
+                    'idempotency_key': record_key,
+                    'status': STATUS_IN_PROGRESS,
+                    'request_hash': request_hash,
+                    'expires_at': now + IN_PROGRESS_TTL_SECONDS
+                },
+                ConditionExpression='attribute_not_exists(idempotency_key) OR expires_at <= :now',
+                ExpressionAttributeValues={':now': now}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return create_error_response(409, 'A request with this Idempotency-Key is already in progress')
+            raise
+
+        try:
+            result = func(event, context)
+        except Exception:
+            table.delete_item(Key={'idempotency_key': record_key})
+            raise
+
+        if 200 <= result.get('statusCode', 500) < 300:
+            table.put_item(Item={
+                'idempotency_key': record_key,
+                'status': STATUS_COMPLETED,
+                'request_hash': request_hash,
+                'status_code': result['statusCode'],
+                'response_body': result['body'],
+                'expires_at': int(time.time()) + _ttl_seconds()
+            })
+        else:
+            # 失敗したリクエストは同じキーで再試行できるようにロックを解放する
+            table.delete_item(Key={'idempotency_key': record_key})
+        return result
+
+    return wrapper
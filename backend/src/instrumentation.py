@@ -0,0 +1,400 @@
+"""
+リクエスト単位のトレースとメトリクス
+
+ハンドラーごとに処理時間のスパン（認証・AWS呼び出し・シリアライズ）を記録し、
+リクエスト終了時に CloudWatch Embedded Metric Format (EMF) の1行を標準出力に書き出します。
+
+- 集計値（呼び出し回数・合計時間）は全リクエストで記録（perf_counter のみで低コスト）
+- スパンの詳細（呼び出しごとの時間とレスポンスサイズ）は TRACE_SAMPLE_RATE の割合でのみ記録
+- 5xx を返したリクエストはサンプリングに関係なく詳細を出力
+- DynamoDB 呼び出しには ReturnConsumedCapacity=TOTAL を付与し、RCU / WCU をテーブル別に集計
+  （CAPACITY_DEBUG_HEADER=true の場合はレスポンスヘッダー X-Consumed-Capacity にも出力）
+- 現在のトレースは ContextVar で保持する。ハンドラーから起動したスレッドでの呼び出しも同じリクエストに計上するため、
+  並列処理には TracedThreadPoolExecutor を使う（utils.scan_all のスレッドも同様にトレースを引き継ぐ）
+- ウォームアップのイベントでは本来の処理を行わず初期化のみ実行し、所要時間を PrimingLatency に出力（warmup を参照）
+  Provisioned Concurrency で初期化されるコンテナでは、ハンドラーの読み込み時に同じ初期化を行う
+"""
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, Any, List, Optional, Callable
+from warmup import is_warmup_event, prime
+
+
+DEFAULT_NAMESPACE = 'POShipmentManagement'
+DEFAULT_SAMPLE_RATE = 0.05
+
+# カテゴリ名 → EMF のメトリクス名
+CATEGORY_METRICS = {
+    'dynamodb': 'DynamoDBLatency',
+    'cognito-idp': 'CognitoLatency',
+    'sqs': 'SQSLatency',
+    's3': 'S3Latency',
+    'auth': 'AuthLatency',
+    'serialize': 'SerializationLatency'
+}
+AWS_CATEGORIES = ('dynamodb', 'cognito-idp', 'sqs', 's3')
+
+# ConsumedCapacity を返す DynamoDB 操作と、その消費キャパシティの種別
+CAPACITY_OPERATIONS = {
+    'get_item': 'read',
+    'query': 'read',
+    'scan': 'read',
+    'batch_get_item': 'read',
+    'transact_get_items': 'read',
+    'put_item': 'write',
+    'update_item': 'write',
+    'delete_item': 'write',
+    'batch_write_item': 'write',
+    'transact_write_items': 'write'
+}
+CAPACITY_HEADER = 'X-Consumed-Capacity'
+
+# コンテナ内で最初のリクエストかどうか（コールドスタート判定）
+_cold_start = True
+# 処理中のリクエストのトレース（スレッドには TracedThreadPoolExecutor で引き継ぐ）
+_current: contextvars.ContextVar[Optional['RequestTrace']] = contextvars.ContextVar('current_trace', default=None)
+
+
+class RequestTrace:
+    """1リクエスト分のスパンとメトリクス"""
+
+    def __init__(self, service: str, endpoint: str, request_id: Optional[str],
+                 cold_start: bool, sampled: bool):
+        self.service = service
+        self.endpoint = endpoint
+        self.request_id = request_id
+        self.cold_start = cold_start
+        self.sampled = sampled
+        self.started = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self.totals: Dict[str, Dict[str, float]] = {}
+        self.metrics: Dict[str, Dict[str, Any]] = {}
+        self.properties: Dict[str, Any] = {}
+        self.capacity: Dict[str, Dict[str, float]] = {}
+        # 並列処理のスレッドからも記録されるため、加算はロックを持って行う
+        self._lock = threading.Lock()
+
+    def record(self, name: str, category: str, duration_ms: float, **attributes) -> None:
+        """スパンを記録"""
+        with self._lock:
+            total = self.totals.setdefault(category, {'count': 0, 'duration_ms': 0.0})
+            total['count'] += 1
+            total['duration_ms'] += duration_ms
+            if self.sampled:
+                span_data = {'name': name, 'category': category, 'duration_ms': round(duration_ms, 3)}
+                span_data.update(attributes)
+                self.spans.append(span_data)
+
+    def add_metric(self, name: str, value: float, unit: str = 'Count') -> None:
+        """任意のメトリクスを加算"""
+        with self._lock:
+            metric = self.metrics.setdefault(name, {'value': 0, 'unit': unit})
+            metric['value'] += value
+
+    def add_capacity(self, table_name: str, read: float = 0.0, write: float = 0.0) -> None:
+        """テーブル別の消費キャパシティを加算"""
+        with self._lock:
+            capacity = self.capacity.setdefault(table_name, {'read': 0.0, 'write': 0.0})
+            capacity['read'] += read
+            capacity['write'] += write
+
+    def total_capacity(self) -> Dict[str, float]:
+        return {
+            'read': sum(c['read'] for c in self.capacity.values()),
+            'write': sum(c['write'] for c in self.capacity.values())
+        }
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+
+def current_trace() -> Optional[RequestTrace]:
+    """処理中のリクエストのトレースを取得（ハンドラー外では None）"""
+    return _current.get()
+
+
+class TracedThreadPoolExecutor(ThreadPoolExecutor):
+    """投入した時点のトレースを引き継いでタスクを実行する ThreadPoolExecutor"""
+
+    def submit(self, fn: Callable, /, *args: Any, **kwargs: Any) -> Future:
+        # コンテキストは同時に複数のスレッドで実行できないので、タスクごとにコピーする
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+@contextmanager
+def span(name: str, category: str = 'app', **attributes):
+    """処理時間をスパンとして記録するコンテキストマネージャー"""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.record(name, category, (time.perf_counter() - started) * 1000, **attributes)
+
+
+def _record_capacity(trace: RequestTrace, operation: str, consumed: Any,
+                     default_table: Optional[str]) -> None:
+    """レスポンスの ConsumedCapacity（単体またはリスト）をトレースに加算"""
+    if not consumed:
+        return
+    kind = CAPACITY_OPERATIONS[operation]
+    for entry in consumed if isinstance(consumed, list) else [consumed]:
+        table_name = entry.get('TableName') or default_table or 'unknown'
+        read = entry.get('ReadCapacityUnits')
+        write = entry.get('WriteCapacityUnits')
+        if not read and not write:
+            # TOTAL モードでは CapacityUnits のみが返るため、操作の種別で読み書きを判定する
+            units = float(entry.get('CapacityUnits', 0))
+            read, write = (units, 0.0) if kind == 'read' else (0.0, units)
+        trace.add_capacity(table_name, float(read or 0), float(write or 0))
+
+
+def format_capacity_header(trace: RequestTrace) -> str:
+    """X-Consumed-Capacity ヘッダーの値（例: rcu=1.5; wcu=2; PurchaseOrders=1.5/0,Users=0/2）"""
+    total = trace.total_capacity()
+    tables = ','.join(
+        f"{name}={capacity['read']:g}/{capacity['write']:g}"
+        for name, capacity in sorted(trace.capacity.items())
+    )
+    return f"rcu={total['read']:g}; wcu={total['write']:g}; {tables}".rstrip('; ')
+
+
+def _payload_size(payload: Any) -> int:
+    try:
+        return len(json.dumps(payload, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+class InstrumentedClient:
+    """boto3 クライアント / Table リソースの呼び出しを計測するプロキシ"""
+
+    def __init__(self, target: Any, service: str, resource_name: Optional[str] = None):
+        self._target = target
+        self._service = service
+        self._resource_name = resource_name
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._target, name)
+        if name == 'batch_writer':
+            return self._batch_writer(attribute)
+        if name.startswith('_') or not callable(attribute) or name in ('get_paginator', 'get_waiter'):
+            return attribute
+
+        @wraps(attribute)
+        def call(*args, **kwargs):
+            trace = _current.get()
+            if trace is None:
+                return attribute(*args, **kwargs)
+            track_capacity = self._service == 'dynamodb' and name in CAPACITY_OPERATIONS
+            if track_capacity:
+                kwargs.setdefault('ReturnConsumedCapacity', 'TOTAL')
+            started = time.perf_counter()
+            error_code = None
+            response = None
+            try:
+                response = attribute(*args, **kwargs)
+                if track_capacity and isinstance(response, dict):
+                    _record_capacity(trace, name, response.get('ConsumedCapacity'), self._resource_name)
+                return response
+            except Exception as e:
+                error_code = getattr(e, 'response', {}).get('Error', {}).get('Code', type(e).__name__)
+                raise
+            finally:
+                attributes: Dict[str, Any] = {}
+                if trace.sampled:
+                    if self._resource_name:
+                        attributes['resource'] = self._resource_name
+                    if error_code:
+                        attributes['error'] = error_code
+                    if isinstance(response, dict):
+                        attributes['response_bytes'] = _payload_size(response)
+                        if track_capacity and response.get('ConsumedCapacity'):
+                            attributes['consumed_capacity'] = response['ConsumedCapacity']
+                trace.record(f'{self._service}.{name}', self._service,
+                             (time.perf_counter() - started) * 1000, **attributes)
+        return call
+
+
+    def _batch_writer(self, batch_writer: Callable) -> Callable:
+        """フラッシュ時の batch_write_item も計測する batch_writer を返す"""
+        @wraps(batch_writer)
+        def create(*args, **kwargs):
+            writer = batch_writer(*args, **kwargs)
+            # boto3 の BatchWriter もインメモリエンジンの互換実装も、送信に使うクライアントを _client に持つ
+            writer._client = InstrumentedClient(writer._client, self._service)
+            return writer
+        return create
+
+
+class _InstrumentedMeta:
+    def __init__(self, meta: Any, service: str):
+        self._meta = meta
+        self.client = InstrumentedClient(meta.client, service)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._meta, name)
+
+
+class InstrumentedResource:
+    """boto3 の DynamoDB リソースを計測するプロキシ（Table も計測対象にする）"""
+
+    def __init__(self, resource: Any, service: str = 'dynamodb'):
+        self._resource = resource
+        self._service = service
+        self.meta = _InstrumentedMeta(resource.meta, service)
+
+    def Table(self, name: str) -> InstrumentedClient:
+        return InstrumentedClient(self._resource.Table(name), self._service, name)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(InstrumentedClient(self._resource, self._service), name)
+
+
+def _endpoint_name(event: Dict[str, Any]) -> str:
+    """メトリクスのディメンションに使うエンドポイント名（パスパラメータはテンプレートのまま）"""
+    if is_warmup_event(event):
+        return 'warmup'
+    method = event.get('httpMethod', '')
+    resource = event.get('resource') or event.get('path', '')
+    if not method and not resource and event.get('Records'):
+        # SQS 等のイベントソースから呼ばれた場合
+        return event['Records'][0].get('eventSource', 'unknown')
+    if not method and not resource and event.get('requestContext', {}).get('routeKey'):
+        # API Gateway の WebSocket API から呼ばれた場合
+        return event['requestContext']['routeKey']
+    if not method and not resource and event.get('source'):
+        # EventBridge のスケジュール等から呼ばれた場合
+        return event['source']
+    return f'{method} {resource}'.strip()
+
+
+def _sample_rate() -> float:
+    try:
+        return float(os.environ.get('TRACE_SAMPLE_RATE', DEFAULT_SAMPLE_RATE))
+    except ValueError:
+        return DEFAULT_SAMPLE_RATE
+
+
+def build_emf_record(trace: RequestTrace, status_code: int, response_bytes: int) -> Dict[str, Any]:
+    """EMF 形式のログレコードを生成"""
+    metrics: Dict[str, Any] = {
+        'Latency': (round(trace.elapsed_ms(), 3), 'Milliseconds'),
+        'ColdStart': (1 if trace.cold_start else 0, 'Count'),
+        'ResponseBytes': (response_bytes, 'Bytes'),
+        'AwsCallCount': (sum(int(trace.totals[c]['count']) for c in AWS_CATEGORIES if c in trace.totals), 'Count'),
+        'AwsCallLatency': (round(sum(trace.totals[c]['duration_ms'] for c in AWS_CATEGORIES if c in trace.totals), 3),
+                           'Milliseconds'),
+        'Error': (1 if status_code >= 500 else 0, 'Count')
+    }
+    for category, metric_name in CATEGORY_METRICS.items():
+        if category in trace.totals:
+            metrics[metric_name] = (round(trace.totals[category]['duration_ms'], 3), 'Milliseconds')
+    if trace.capacity:
+        total = trace.total_capacity()
+        metrics['ReadCapacityUnits'] = (total['read'], 'Count')
+        metrics['WriteCapacityUnits'] = (total['write'], 'Count')
+    for name, metric in trace.metrics.items():
+        metrics[name] = (metric['value'], metric['unit'])
+
+    record: Dict[str, Any] = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': os.environ.get('METRICS_NAMESPACE', DEFAULT_NAMESPACE),
+                'Dimensions': [['Service', 'Endpoint']],
+                'Metrics': [{'Name': name, 'Unit': unit} for name, (_, unit) in metrics.items()]
+            }]
+        },
+        'Service': trace.service,
+        'Endpoint': trace.endpoint,
+        'StatusCode': status_code,
+        'RequestId': trace.request_id
+    }
+    record.update({name: value for name, (value, _) in metrics.items()})
+    if trace.capacity:
+        record['ConsumedCapacity'] = trace.capacity
+    record.update(trace.properties)
+    if trace.sampled or status_code >= 500:
+        record['Spans'] = trace.spans
+        record['Sampled'] = trace.sampled
+    return record
+
+
+def _warm_up(trace: RequestTrace) -> Dict[str, Any]:
+    """ウォームアップのイベントに対し、サービスの初期化のみ行って所要時間を返す"""
+    result = prime(trace.service)
+    trace.add_metric('PrimingLatency', result['priming_ms'], 'Milliseconds')
+    trace.properties['PrimingSteps'] = result['steps']
+    if result.get('errors'):
+        trace.properties['PrimingErrors'] = result['errors']
+    body = dict(result, warmup=True, service=trace.service, cold_start=trace.cold_start)
+    return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps(body)}
+
+
+def _primes_at_init(func: Callable) -> bool:
+    """Provisioned Concurrency で初期化中のコンテナの、設定されたハンドラーか"""
+    return (
+        os.environ.get('AWS_LAMBDA_INITIALIZATION_TYPE') == 'provisioned-concurrency'
+        and os.environ.get('_HANDLER') == f'{func.__module__}.{func.__name__}'
+    )
+
+
+def _prime_at_init(service: str) -> None:
+    """スケールアウトで追加されたコンテナが、最初のリクエストの前に初期化を済ませる"""
+    trace = RequestTrace(service=service, endpoint='warmup', request_id=None, cold_start=True, sampled=False)
+    token = _current.set(trace)
+    try:
+        response = _warm_up(trace)
+    finally:
+        _current.reset(token)
+    print(json.dumps(build_emf_record(trace, 200, len(response['body'].encode('utf-8'))), default=str))
+
+
+def traced_handler(service: str) -> Callable:
+    """Lambda ハンドラー用のデコレータ：トレースを開始し、終了時に EMF を出力"""
+    def decorator(func: Callable) -> Callable:
+        if _primes_at_init(func):
+            _prime_at_init(service)
+
+        @wraps(func)
+        def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            global _cold_start
+            trace = RequestTrace(
+                service=service,
+                endpoint=_endpoint_name(event),
+                request_id=getattr(context, 'aws_request_id', None),
+                cold_start=_cold_start,
+                sampled=random.random() < _sample_rate()
+            )
+            _cold_start = False
+            token = _current.set(trace)
+            status_code = 500
+            response_bytes = 0
+            try:
+                if is_warmup_event(event):
+                    response = _warm_up(trace)
+                else:
+                    response = func(event, context)
+                if trace.capacity and os.environ.get('CAPACITY_DEBUG_HEADER', '').lower() == 'true':
+                    headers = response.setdefault('headers', {})
+                    headers[CAPACITY_HEADER] = format_capacity_header(trace)
+                    headers['Access-Control-Expose-Headers'] = CAPACITY_HEADER
+                status_code = response.get('statusCode', 200)
+                response_bytes = len((response.get('body') or '').encode('utf-8'))
+                return response
+            finally:
+                _current.reset(token)
+                print(json.dumps(build_emf_record(trace, status_code, response_bytes), default=str))
+        return wrapper
+    return decorator
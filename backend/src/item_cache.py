@@ -0,0 +1,237 @@
+"""
+リードスルーのアイテムキャッシュ
+
+ウォームコンテナで繰り返し参照される詳細データ（発注書・出荷）をキャッシュし、
+DynamoDB の読み込みを削減します。バックエンドは ITEM_CACHE_BACKEND で切り替えます。
+
+- lru（デフォルト）: コンテナ内の LRU キャッシュ（TTL とエントリ数の上限付き）
+- shared: DAX / Redis 形式の共有キャッシュ。REDIS_URL があれば redis クライアント、
+  なければプロセス内のスタンドイン（LocalSharedStore）を使用
+- none: キャッシュ無効
+
+更新・削除ハンドラーはライトスルーでエントリを更新・無効化します。
+lru の場合は他のコンテナのエントリは TTL が切れるまで残るため、TTL は短め（デフォルト30秒）にしています。
+"""
+import copy
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Dict, Any, Optional, Callable
+from instrumentation import current_trace
+from utils import int_env
+
+
+DEFAULT_TTL_SECONDS = 30
+DEFAULT_MAX_ENTRIES = 1000
+
+
+class CacheBackend:
+    """キャッシュバックエンドのインターフェース"""
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Dict[str, Any], ttl: int) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+
+class NullCacheBackend(CacheBackend):
+    """何もキャッシュしないバックエンド"""
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return None
+
+    def set(self, key: str, value: Dict[str, Any], ttl: int) -> None:
+        pass
+
+    def delete(self, key: str) -> None:
+        pass
+
+    def clear(self) -> None:
+        pass
+
+
+class LRUCacheBackend(CacheBackend):
+    """コンテナ内の LRU キャッシュ（TTL とエントリ数の上限付き）"""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return copy.deepcopy(value)
+
+    def set(self, key: str, value: Dict[str, Any], ttl: int) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class LocalSharedStore:
+    """Redis クライアント互換（get / set(ex=) / delete / flushdb）のプロセス内スタンドイン"""
+
+    def __init__(self):
+        self._values: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._values[key]
+                return None
+            return value
+
+    def set(self, key: str, value: bytes, ex: Optional[int] = None) -> bool:
+        with self._lock:
+            self._values[key] = (time.monotonic() + ex if ex else None, value)
+        return True
+
+    def delete(self, *keys: str) -> int:
+        with self._lock:
+            return sum(1 for key in keys if self._values.pop(key, None) is not None)
+
+    def flushdb(self) -> bool:
+        with self._lock:
+            self._values.clear()
+        return True
+
+
+def _encode(value: Dict[str, Any]) -> bytes:
+    # DynamoDB の数値（Decimal）を精度を落とさずに保存する
+    return json.dumps(value, default=lambda v: {'__decimal__': str(v)} if isinstance(v, Decimal) else str(v)).encode('utf-8')
+
+
+def _decode(data: bytes) -> Dict[str, Any]:
+    return json.loads(data, object_hook=lambda d: Decimal(d['__decimal__']) if set(d) == {'__decimal__'} else d)
+
+
+class SharedCacheBackend(CacheBackend):
+    """DAX / Redis 形式の共有キャッシュ（コンテナ間で共有）"""
+
+    def __init__(self, client: Any, prefix: str = 'item-cache:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        data = self.client.get(self.prefix + key)
+        return _decode(data) if data is not None else None
+
+    def set(self, key: str, value: Dict[str, Any], ttl: int) -> None:
+        self.client.set(self.prefix + key, _encode(value), ex=ttl)
+
+    def delete(self, key: str) -> None:
+        self.client.delete(self.prefix + key)
+
+    def clear(self) -> None:
+        self.client.flushdb()
+
+
+_local_shared_store = LocalSharedStore()
+
+
+def _create_shared_client() -> Any:
+    redis_url = os.environ.get('REDIS_URL')
+    if not redis_url:
+        return _local_shared_store
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError('ITEM_CACHE_BACKEND=shared with REDIS_URL requires the redis package')
+    return redis.Redis.from_url(redis_url)
+
+
+class ItemCache:
+    """名前空間付きのリードスルー / ライトスルーキャッシュ"""
+
+    def __init__(self, namespace: str, backend: CacheBackend, ttl: int = DEFAULT_TTL_SECONDS):
+        self.namespace = namespace
+        self.backend = backend
+        self.ttl = ttl
+
+    def _key(self, key: str) -> str:
+        return f'{self.namespace}:{key}'
+
+    def get_or_load(self, key: str, loader: Callable[[], Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        """キャッシュから取得し、なければ loader で読み込んでキャッシュする（存在しない場合はキャッシュしない）"""
+        trace = current_trace()
+        item = self.backend.get(self._key(key))
+        if item is not None:
+            if trace:
+                trace.add_metric('ItemCacheHit', 1)
+            return item
+        if trace:
+            trace.add_metric('ItemCacheMiss', 1)
+        item = loader()
+        if item is not None:
+            self.backend.set(self._key(key), item, self.ttl)
+        return item
+
+    def put(self, key: str, item: Dict[str, Any]) -> None:
+        """書き込み後の最新アイテムでエントリを更新"""
+        self.backend.set(self._key(key), item, self.ttl)
+
+    def invalidate(self, key: str) -> None:
+        self.backend.delete(self._key(key))
+
+
+_caches: Dict[str, ItemCache] = {}
+
+
+def _create_backend() -> CacheBackend:
+    backend = os.environ.get('ITEM_CACHE_BACKEND', 'lru')
+    if backend == 'none':
+        return NullCacheBackend()
+    if backend == 'shared':
+        return SharedCacheBackend(_create_shared_client())
+    return LRUCacheBackend(int_env('ITEM_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES))
+
+
+def get_item_cache(namespace: str) -> ItemCache:
+    """名前空間ごとのキャッシュを取得（コンテナ内で再利用）"""
+    cache = _caches.get(namespace)
+    if cache is None:
+        cache = ItemCache(namespace, _create_backend(), int_env('ITEM_CACHE_TTL_SECONDS', DEFAULT_TTL_SECONDS))
+        _caches[namespace] = cache
+    return cache
+
+
+def reset_item_caches() -> None:
+    """全てのキャッシュを破棄（テスト用）"""
+    _caches.clear()
+    _local_shared_store.flushdb()
@@ -0,0 +1,369 @@
+"""
+バックグラウンドジョブ
+
+時間のかかる処理（Cognito の削除、エクスポート等）をリクエストの処理から切り離して実行します。
+ハンドラーは enqueue_job でジョブを登録して 202 を返し、ワーカーがキューから取り出して実行します。
+ジョブの状態は Jobs テーブルに保存され、GET /jobs/{job_id} で確認できます。
+
+キューのバックエンドは JOB_QUEUE_BACKEND で切り替えます（未指定の場合は JOB_QUEUE_URL の有無で判定）。
+
+- sqs: SQS にジョブ ID を送信し、worker_handler（SQS イベントソース）が実行
+- local: プロセス内のキュー。drain() で溜まったジョブを実行する（テスト・ローカル開発用）。
+  JOB_LOCAL_AUTORUN=true の場合は登録と同時にバックグラウンドのスレッドで実行
+
+失敗したジョブは JOB_MAX_ATTEMPTS 回まで再試行し、それでも失敗した場合は
+デッドレターキュー（sqs: JOB_DLQ_URL、local: dead_letters）に送って failed にします。
+再試行しても成功しないエラーは PermanentJobError を送出すると即座に failed になります。
+ワーカーの実行時間に収まらないジョブは、進捗を保存して ContinueJob を送出すると続きが再度キューに入ります。
+"""
+import importlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, Any, Optional, Callable, List
+from botocore.exceptions import ClientError
+from utils import (
+    create_response,
+    create_error_response,
+    require_auth,
+    get_dynamodb_resource,
+    get_sqs_client,
+    get_path_parameter,
+    to_dynamodb_item,
+    int_env,
+    prime_dynamodb
+)
+from instrumentation import traced_handler, span
+from warmup import register_primer
+from models import generate_id
+
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_SUCCEEDED = 'succeeded'
+STATUS_FAILED = 'failed'
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+# 実行中のジョブを他のワーカーが引き継げるようになるまでの秒数（ワーカーの最大実行時間）
+LEASE_SECONDS = 15 * 60
+# ContinueJob で区切るジョブの1回の実行時間（ワーカーの最大実行時間に対して余裕を持たせる）
+JOB_TIME_BUDGET_SECONDS = LEASE_SECONDS - 2 * 60
+
+# ワーカーが起動時にインポートする、ジョブを登録しているモジュール
+JOB_MODULES = ('user_management', 'exports', 'po_import', 'archival', 'search_index')
+
+_job_handlers: Dict[str, Callable[[Dict[str, Any], Dict[str, Any]], Optional[Dict[str, Any]]]] = {}
+
+
+class PermanentJobError(Exception):
+    """再試行しても成功しないジョブのエラー"""
+
+
+class ContinueJob(Exception):
+    """長いジョブを区切るための例外（進捗を保存した上で送出すると、試行回数を消費せずに再度キューに入る）"""
+
+
+def register_job(job_type: str) -> Callable:
+    """ジョブの処理関数を登録するデコレータ（関数は payload と job レコードを受け取り、結果の辞書を返す）"""
+    def decorator(func: Callable) -> Callable:
+        _job_handlers[job_type] = func
+        return func
+    return decorator
+
+
+def _load_job_modules() -> None:
+    for module in JOB_MODULES:
+        importlib.import_module(module)
+
+
+def _jobs_table():
+    return get_dynamodb_resource().Table(os.environ['JOBS_TABLE'])
+
+
+def _now_iso() -> str:
+    return datetime.utcnow().isoformat()
+
+
+class SQSJobQueue:
+    """SQS のジョブキュー（メッセージにはジョブ ID のみを入れる）"""
+
+    def __init__(self, queue_url: str, dead_letter_url: Optional[str] = None):
+        self.queue_url = queue_url
+        self.dead_letter_url = dead_letter_url
+        self.client = get_sqs_client()
+
+    def send(self, job_id: str) -> None:
+        self.client.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps({'job_id': job_id}))
+
+    def dead_letter(self, job_id: str) -> None:
+        if self.dead_letter_url:
+            self.client.send_message(QueueUrl=self.dead_letter_url, MessageBody=json.dumps({'job_id': job_id}))
+
+
+class LocalJobQueue:
+    """プロセス内のジョブキュー（SQS のスタンドイン）"""
+
+    def __init__(self, autorun: bool = False):
+        self.pending: deque = deque()
+        self.dead_letters: List[str] = []
+        self.autorun = autorun
+        self._lock = threading.Lock()
+        self._worker_running = False
+
+    def send(self, job_id: str) -> None:
+        with self._lock:
+            self.pending.append(job_id)
+            start_worker = self.autorun and not self._worker_running
+            if start_worker:
+                self._worker_running = True
+        if start_worker:
+            # ローカル開発用：バックグラウンドのスレッドで順に実行する
+            threading.Thread(target=self._run_worker, daemon=True).start()
+
+    def dead_letter(self, job_id: str) -> None:
+        with self._lock:
+            self.dead_letters.append(job_id)
+
+    def _next(self, stop_worker: bool = False) -> Optional[str]:
+        with self._lock:
+            if self.pending:
+                return self.pending.popleft()
+            if stop_worker:
+                self._worker_running = False
+            return None
+
+    def _run_worker(self) -> None:
+        while True:
+            job_id = self._next(stop_worker=True)
+            if job_id is None:
+                return
+            if run_job(job_id):
+                self.send(job_id)
+
+    def drain(self, max_jobs: Optional[int] = None) -> int:
+        """キューが空になるまでジョブを実行し、実行した回数を返す（再試行は末尾に積み直す）"""
+        executed = 0
+        while max_jobs is None or executed < max_jobs:
+            job_id = self._next()
+            if job_id is None:
+                break
+            if run_job(job_id):
+                self.send(job_id)
+            executed += 1
+        return executed
+
+
+_queue: Optional[Any] = None
+
+
+def get_job_queue():
+    """コンテナ内で共有するジョブキューを取得"""
+    global _queue
+    if _queue is None:
+        backend = os.environ.get('JOB_QUEUE_BACKEND') or ('sqs' if os.environ.get('JOB_QUEUE_URL') else 'local')
+        if backend == 'sqs':
+            _queue = SQSJobQueue(os.environ['JOB_QUEUE_URL'], os.environ.get('JOB_DLQ_URL'))
+        else:
+            _queue = LocalJobQueue(autorun=os.environ.get('JOB_LOCAL_AUTORUN', '').lower() == 'true')
+    return _queue
+
+
+def reset_job_queue() -> None:
+    """キューを破棄（テスト用）"""
+    global _queue
+    _queue = None
+
+
+def enqueue_job(job_type: str, payload: Dict[str, Any], created_by: Optional[str] = None,
+                max_attempts: Optional[int] = None) -> Dict[str, Any]:
+    """ジョブを登録してキューに送信し、ジョブのレコードを返す"""
+    if job_type not in _job_handlers:
+        _load_job_modules()
+        if job_type not in _job_handlers:
+            raise ValueError(f'Unknown job type: {job_type}')
+    now = _now_iso()
+    job = to_dynamodb_item({
+        'job_id': generate_id(),
+        'job_type': job_type,
+        'status': STATUS_QUEUED,
+        'payload': payload,
+        'attempts': 0,
+        'max_attempts': max_attempts or int_env('JOB_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS),
+        'created_by': created_by,
+        'created_at': now,
+        'updated_at': now,
+        'expires_at': int(time.time()) + int_env('JOB_TTL_SECONDS', DEFAULT_TTL_SECONDS)
+    })
+    _jobs_table().put_item(Item=job)
+    get_job_queue().send(job['job_id'])
+    return job
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    return _jobs_table().get_item(Key={'job_id': job_id}, ConsistentRead=True).get('Item')
+
+
+def update_job_progress(job_id: str, progress: Dict[str, Any]) -> None:
+    """実行中のジョブの進捗（再開用のチェックポイントを含む）を保存"""
+    _jobs_table().update_item(
+        Key={'job_id': job_id},
+        UpdateExpression='SET #progress = :progress, updated_at = :now',
+        ExpressionAttributeNames={'#progress': 'progress'},
+        ExpressionAttributeValues={':progress': to_dynamodb_item(progress), ':now': _now_iso()}
+    )
+
+
+def _claim(job_id: str) -> Optional[Dict[str, Any]]:
+    """ジョブを実行中にする（他のワーカーが実行中、または終了済みの場合は None）"""
+    now = int(time.time())
+    try:
+        response = _jobs_table().update_item(
+            Key={'job_id': job_id},
+            UpdateExpression='SET #status = :running, attempts = attempts + :one, '
+                             'lease_expires_at = :lease, updated_at = :updated',
+            ConditionExpression='#status = :queued OR (#status = :running AND lease_expires_at < :now)',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={
+                ':running': STATUS_RUNNING,
+                ':queued': STATUS_QUEUED,
+                ':one': 1,
+                ':lease': now + LEASE_SECONDS,
+                ':now': now,
+                ':updated': _now_iso()
+            },
+            ReturnValues='ALL_NEW'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return None
+        raise
+    return response['Attributes']
+
+
+def _finish(job_id: str, status: str, **fields: Any) -> None:
+    """ジョブの状態を更新してリースを解放（値が None のフィールドは削除）"""
+    # result / error 等が予約語と衝突しないよう、属性名は全てプレースホルダーで指定する
+    names = {'#status': 'status'}
+    values = {':status': status, ':updated': _now_iso()}
+    assignments = ['#status = :status', 'updated_at = :updated']
+    removals = ['lease_expires_at']
+    for name, value in fields.items():
+        names[f'#{name}'] = name
+        if value is None:
+            removals.append(f'#{name}')
+        else:
+            assignments.append(f'#{name} = :{name}')
+            values[f':{name}'] = value
+    _jobs_table().update_item(
+        Key={'job_id': job_id},
+        UpdateExpression='SET ' + ', '.join(assignments) + ' REMOVE ' + ', '.join(removals),
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=to_dynamodb_item(values)
+    )
+
+
+def run_job(job_id: str) -> bool:
+    """ジョブを1回実行する。再試行が必要な場合は True を返す"""
+    job = _claim(job_id)
+    if job is None:
+        return False
+    handler = _job_handlers.get(job['job_type'])
+    if handler is None:
+        _load_job_modules()
+        handler = _job_handlers.get(job['job_type'])
+
+    try:
+        if handler is None:
+            raise PermanentJobError(f"Unknown job type: {job['job_type']}")
+        with span(f"Job.{job['job_type']}", 'job'):
+            result = handler(job.get('payload') or {}, job)
+    except ContinueJob:
+        _finish(job_id, STATUS_QUEUED, attempts=0)
+        get_job_queue().send(job_id)
+        return False
+    except Exception as e:
+        print(f"Job {job_id} ({job['job_type']}) attempt {job['attempts']} failed: {str(e)}")
+        if not isinstance(e, PermanentJobError) and job['attempts'] < job['max_attempts']:
+            _finish(job_id, STATUS_QUEUED, error=str(e))
+            return True
+        _finish(job_id, STATUS_FAILED, error=str(e))
+        get_job_queue().dead_letter(job_id)
+        return False
+
+    _finish(job_id, STATUS_SUCCEEDED, result=result or {}, error=None)
+    return False
+
+
+def job_to_response(job: Dict[str, Any]) -> Dict[str, Any]:
+    """API で返すジョブの情報（payload は含めない）"""
+    return {
+        'job_id': job['job_id'],
+        'job_type': job['job_type'],
+        'status': job['status'],
+        'attempts': job.get('attempts', 0),
+        'progress': job.get('progress'),
+        'result': job.get('result'),
+        'error': job.get('error'),
+        'created_at': job.get('created_at'),
+        'updated_at': job.get('updated_at')
+    }
+
+
+register_primer('dynamodb', lambda: prime_dynamodb(os.environ.get('JOBS_TABLE')), 'job_worker')
+register_primer('job_queue', get_job_queue, 'job_worker')
+# ジョブを実装するモジュールの import（最初のジョブの実行時に行われる）
+register_primer('job_modules', _load_job_modules, 'job_worker')
+
+
+@traced_handler('job_worker')
+def worker_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """SQS イベントソースのワーカー（再試行が必要なメッセージは batchItemFailures で返す）"""
+    failures = []
+    for record in event.get('Records', []):
+        try:
+            job_id = json.loads(record['body'])['job_id']
+            if run_job(job_id):
+                failures.append({'itemIdentifier': record['messageId']})
+        except Exception as e:
+            print(f"Error in job worker: {str(e)}")
+            failures.append({'itemIdentifier': record['messageId']})
+    return {'batchItemFailures': failures}
+
+
+register_primer('dynamodb', lambda: prime_dynamodb(os.environ.get('JOBS_TABLE')), 'jobs')
+
+
+@traced_handler('jobs')
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """ジョブ状態確認のメインハンドラー"""
+    http_method = event['httpMethod']
+    path = event['path']
+
+    try:
+        if path.startswith('/jobs/') and http_method == 'GET':
+            return get_job_status(event, context)
+        else:
+            return create_error_response(404, 'Endpoint not found')
+
+    except Exception as e:
+        print(f"Error in jobs handler: {str(e)}")
+        return create_error_response(500, 'Internal server error')
+
+
+@require_auth
+def get_job_status(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """ジョブの状態を取得（登録したユーザーまたは管理者のみ）"""
+    job_id = get_path_parameter(event, 'job_id')
+    if not job_id:
+        return create_error_response(400, 'Job ID is required')
+
+    job = get_job(job_id)
+    user = event.get('user', {})
+    if not job or (job.get('created_by') != user.get('sub') and user.get('custom:role') != 'admin'):
+        return create_error_response(404, 'Job not found')
+
+    return create_response(200, {'job': job_to_response(job)})
@@ -0,0 +1,1710 @@
+"""
+インメモリDynamoDBエンジン
+
+DYNAMODB_BACKEND=memory を設定すると utils.get_dynamodb_resource /
+utils.get_dynamodb_client がこのエンジンを返します。
+Docker や LocalStack なしでハンドラーの結合テストやベンチマークを実行するためのもので、
+boto3 の Table リソース / 低レベルクライアントと同じ呼び出し形式をサポートします。
+
+- get_item / put_item / update_item / delete_item
+- query（GSI を含む）/ scan（Segment / TotalSegments 対応）
+- Limit / ExclusiveStartKey / LastEvaluatedKey（1MB のページ上限を含む）
+- batch_get_item / batch_write_item / transact_get_items / transact_write_items
+- ReturnConsumedCapacity による消費キャパシティの概算
+"""
+import copy
+import math
+import os
+import re
+import threading
+import zlib
+from decimal import Decimal
+from typing import Dict, Any, List, Optional, Tuple, Callable
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from boto3.dynamodb.types import TypeSerializer, TypeDeserializer, Binary
+from botocore.exceptions import ClientError
+
+
+# template.yaml のテーブル定義と同期させること（キーは環境変数名）
+TABLE_DEFINITIONS: Dict[str, Dict[str, Any]] = {
+    'USERS_TABLE': {
+        'TableName': 'Users',
+        'KeySchema': [
+            {'AttributeName': 'user_id', 'KeyType': 'HASH'}
+        ],
+        'GlobalSecondaryIndexes': [
+            {
+                'IndexName': 'email-index',
+                'KeySchema': [
+                    {'AttributeName': 'email_initial', 'KeyType': 'HASH'},
+                    {'AttributeName': 'email_key', 'KeyType': 'RANGE'}
+                ],
+                'Projection': {'ProjectionType': 'ALL'}
+            }
+        ]
+    },
+    'PURCHASE_ORDERS_TABLE': {
+        'TableName': 'PurchaseOrders',
+        'KeySchema': [
+            {'AttributeName': 'po_id', 'KeyType': 'HASH'}
+        ],
+        'GlobalSecondaryIndexes': [
+            {
+                'IndexName': 'created-at-index',
+                'KeySchema': [{'AttributeName': 'created_at', 'KeyType': 'HASH'}],
+                'Projection': {'ProjectionType': 'ALL'}
+            },
+            {
+                'IndexName': 'activity-index',
+                'KeySchema': [
+                    {'AttributeName': 'activity_bucket', 'KeyType': 'HASH'},
+                    {'AttributeName': 'updated_at', 'KeyType': 'RANGE'}
+                ],
+                'Projection': {
+                    'ProjectionType': 'INCLUDE',
+                    'NonKeyAttributes': ['supplier', 'total_amount', 'status', 'created_by', 'created_at']
+                }
+            }
+        ]
+    },
+    'PURCHASE_ORDER_LINES_TABLE': {
+        'TableName': 'PurchaseOrderLines',
+        'KeySchema': [
+            {'AttributeName': 'po_id', 'KeyType': 'HASH'},
+            {'AttributeName': 'line_no', 'KeyType': 'RANGE'}
+        ],
+        'GlobalSecondaryIndexes': []
+    },
+    'IDEMPOTENCY_TABLE': {
+        'TableName': 'IdempotencyKeys',
+        'KeySchema': [
+            {'AttributeName': 'idempotency_key', 'KeyType': 'HASH'}
+        ],
+        'GlobalSecondaryIndexes': []
+    },
+    'ARCHIVE_INDEX_TABLE': {
+        'TableName': 'ArchiveIndex',
+        'KeySchema': [
+            {'AttributeName': 'record_key', 'KeyType': 'HASH'}
+        ],
+        'GlobalSecondaryIndexes': []
+    },
+    'SEARCH_INDEX_TABLE': {
+        'TableName': 'SearchIndex',
+        'KeySchema': [
+            {'AttributeName': 'doc_key', 'KeyType': 'HASH'}
+        ],
+        'GlobalSecondaryIndexes': [
+            {
+                'IndexName': 'indexed-day-index',
+                'KeySchema': [
+                    {'AttributeName': 'indexed_day', 'KeyType': 'HASH'},
+                    {'AttributeName': 'indexed_at', 'KeyType': 'RANGE'}
+                ],
+                'Projection': {'ProjectionType': 'ALL'}
+            }
+        ]
+    },
+    'CHANGE_LOG_TABLE': {
+        'TableName': 'ChangeLog',
+        'KeySchema': [
+            {'AttributeName': 'change_key', 'KeyType': 'HASH'}
+        ],
+        'GlobalSecondaryIndexes': [
+            {
+                'IndexName': 'changed-index',
+                'KeySchema': [
+                    {'AttributeName': 'change_bucket', 'KeyType': 'HASH'},
+                    {'AttributeName': 'changed_at', 'KeyType': 'RANGE'}
+                ],
+                'Projection': {'ProjectionType': 'ALL'}
+            }
+        ]
+    },
+    'CONNECTIONS_TABLE': {
+        'TableName': 'WebSocketConnections',
+        'KeySchema': [
+            {'AttributeName': 'connection_id', 'KeyType': 'HASH'}
+        ],
+        'GlobalSecondaryIndexes': [
+            {
+                'IndexName': 'audience-index',
+                'KeySchema': [{'AttributeName': 'audience', 'KeyType': 'HASH'}],
+                'Projection': {'ProjectionType': 'INCLUDE', 'NonKeyAttributes': ['types']}
+            }
+        ]
+    },
+    'JOBS_TABLE': {
+        'TableName': 'Jobs',
+        'KeySchema': [
+            {'AttributeName': 'job_id', 'KeyType': 'HASH'}
+        ],
+        'GlobalSecondaryIndexes': []
+    },
+    'SHIPMENTS_TABLE': {
+        'TableName': 'Shipments',
+        'KeySchema': [
+            {'AttributeName': 'shipment_id', 'KeyType': 'HASH'}
+        ],
+        'GlobalSecondaryIndexes': [
+            {
+                'IndexName': 'po-id-index',
+                'KeySchema': [{'AttributeName': 'po_id', 'KeyType': 'HASH'}],
+                'Projection': {'ProjectionType': 'ALL'}
+            },
+            {
+                'IndexName': 'created-at-index',
+                'KeySchema': [{'AttributeName': 'created_at', 'KeyType': 'HASH'}],
+                'Projection': {'ProjectionType': 'ALL'}
+            },
+            {
+                'IndexName': 'tracking-number-index',
+                'KeySchema': [
+                    {'AttributeName': 'tracking_prefix', 'KeyType': 'HASH'},
+                    {'AttributeName': 'tracking_key', 'KeyType': 'RANGE'}
+                ],
+                'Projection': {'ProjectionType': 'ALL'}
+            },
+            {
+                'IndexName': 'activity-index',
+                'KeySchema': [
+                    {'AttributeName': 'activity_bucket', 'KeyType': 'HASH'},
+                    {'AttributeName': 'updated_at', 'KeyType': 'RANGE'}
+                ],
+                'Projection': {
+                    'ProjectionType': 'INCLUDE',
+                    'NonKeyAttributes': ['po_id', 'tracking_number', 'carrier', 'status', 'created_by', 'created_at']
+                }
+            }
+        ]
+    },
+    'PROCUREMENT_TABLE': {
+        'TableName': 'Procurement',
+        'KeySchema': [
+            {'AttributeName': 'pk', 'KeyType': 'HASH'},
+            {'AttributeName': 'sk', 'KeyType': 'RANGE'}
+        ],
+        'GlobalSecondaryIndexes': [
+            {
+                'IndexName': 'shipment-id-index',
+                'KeySchema': [{'AttributeName': 'shipment_id', 'KeyType': 'HASH'}],
+                'Projection': {'ProjectionType': 'KEYS_ONLY'}
+            },
+            {
+                'IndexName': 'tracking-number-index',
+                'KeySchema': [
+                    {'AttributeName': 'tracking_prefix', 'KeyType': 'HASH'},
+                    {'AttributeName': 'tracking_key', 'KeyType': 'RANGE'}
+                ],
+                'Projection': {'ProjectionType': 'ALL'}
+            },
+            {
+                'IndexName': 'activity-index',
+                'KeySchema': [
+                    {'AttributeName': 'activity_bucket', 'KeyType': 'HASH'},
+                    {'AttributeName': 'updated_at', 'KeyType': 'RANGE'}
+                ],
+                'Projection': {
+                    'ProjectionType': 'INCLUDE',
+                    'NonKeyAttributes': ['po_id', 'shipment_id', 'supplier', 'total_amount', 'tracking_number', 'carrier', 'status', 'created_by', 'created_at']
+                }
+            }
+        ]
+    },
+    'TRACKING_NUMBERS_TABLE': {
+        'TableName': 'ShipmentTrackingNumbers',
+        'KeySchema': [
+            {'AttributeName': 'tracking_key', 'KeyType': 'HASH'}
+        ],
+        'GlobalSecondaryIndexes': []
+    },
+    'CARRIER_ANALYTICS_TABLE': {
+        'TableName': 'CarrierAnalytics',
+        'KeySchema': [
+            {'AttributeName': 'sketch_key', 'KeyType': 'HASH'}
+        ],
+        'GlobalSecondaryIndexes': []
+    }
+}
+
+# DynamoDB の制限値
+MAX_PAGE_BYTES = 1024 * 1024
+MAX_BATCH_GET_KEYS = 100
+MAX_BATCH_WRITE_ITEMS = 25
+MAX_TRANSACT_ITEMS = 100
+MAX_ITEM_BYTES = 400 * 1024
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+_MISSING = object()
+
+
+def _client_error(code: str, message: str, operation: str, **extra) -> ClientError:
+    """botocore と同じ形式の ClientError を生成"""
+    response = {'Error': {'Code': code, 'Message': message}}
+    response.update(extra)
+    return ClientError(response, operation)
+
+
+# =============================================================================
+# サイズとキャパシティの概算
+# =============================================================================
+
+def _typed_size(typed: Dict[str, Any]) -> int:
+    """型付きの属性値のサイズ（バイト）を概算"""
+    (type_code, value), = typed.items()
+    if type_code == 'S':
+        return len(value.encode('utf-8'))
+    if type_code == 'N':
+        digits = value.lstrip('-').replace('.', '').lstrip('0') or '0'
+        return (len(digits) + 1) // 2 + 1
+    if type_code == 'B':
+        return len(value)
+    if type_code in ('BOOL', 'NULL'):
+        return 1
+    if type_code == 'SS':
+        return sum(len(v.encode('utf-8')) for v in value)
+    if type_code == 'NS':
+        return sum(_typed_size({'N': v}) for v in value)
+    if type_code == 'BS':
+        return sum(len(v) for v in value)
+    if type_code == 'L':
+        return 3 + sum(1 + _typed_size(v) for v in value)
+    if type_code == 'M':
+        return 3 + sum(1 + len(k.encode('utf-8')) + _typed_size(v) for k, v in value.items())
+    return 0
+
+
+def item_size(item: Optional[Dict[str, Any]]) -> int:
+    """アイテムのサイズ（属性名 + 値のバイト数）を概算"""
+    if not item:
+        return 0
+    return sum(
+        len(name.encode('utf-8')) + _typed_size(_serializer.serialize(value))
+        for name, value in item.items()
+    )
+
+
+def read_units(size: int, consistent: bool = False) -> float:
+    """読み込みキャパシティユニットを計算（4KB 単位、結果整合性は半分）"""
+    units = max(1, math.ceil(size / 4096))
+    return units if consistent else units / 2
+
+
+def write_units(size: int) -> float:
+    """書き込みキャパシティユニットを計算（1KB 単位）"""
+    return float(max(1, math.ceil(size / 1024)))
+
+
+class _CapacityMeter:
+    """1回の操作で消費したキャパシティを集計"""
+
+    def __init__(self, mode: Optional[str]):
+        self.mode = mode if mode in ('TOTAL', 'INDEXES') else None
+        self.tables: Dict[str, Dict[str, Any]] = {}
+
+    def add(self, table_name: str, read: float = 0.0, write: float = 0.0,
+            index_name: Optional[str] = None) -> None:
+        if not self.mode:
+            return
+        entry = self.tables.setdefault(table_name, {
+            'TableName': table_name,
+            'CapacityUnits': 0.0,
+            'ReadCapacityUnits': 0.0,
+            'WriteCapacityUnits': 0.0,
+            'Table': {'CapacityUnits': 0.0},
+            'GlobalSecondaryIndexes': {}
+        })
+        units = read + write
+        entry['CapacityUnits'] += units
+        entry['ReadCapacityUnits'] += read
+        entry['WriteCapacityUnits'] += write
+        if index_name:
+            index_entry = entry['GlobalSecondaryIndexes'].setdefault(index_name, {'CapacityUnits': 0.0})
+            index_entry['CapacityUnits'] += units
+        else:
+            entry['Table']['CapacityUnits'] += units
+
+    def entries(self) -> List[Dict[str, Any]]:
+        result = []
+        for entry in self.tables.values():
+            entry = dict(entry)
+            if self.mode == 'TOTAL':
+                entry.pop('Table')
+                entry.pop('GlobalSecondaryIndexes')
+            elif not entry['GlobalSecondaryIndexes']:
+                entry.pop('GlobalSecondaryIndexes')
+            result.append(entry)
+        return result
+
+    def attach(self, response: Dict[str, Any], single: bool = True) -> Dict[str, Any]:
+        if self.mode:
+            entries = self.entries()
+            if single:
+                if entries:
+                    response['ConsumedCapacity'] = entries[0]
+            else:
+                response['ConsumedCapacity'] = entries
+        return response
+
+
+# =============================================================================
+# 式の解析
+# =============================================================================
+
+_TOKEN_PATTERN = re.compile(
+    r'\s*(?:'
+    r'(?P<op><>|<=|>=|[=<>(),.\[\]+\-])'
+    r'|(?P<name>#[A-Za-z0-9_]+)'
+    r'|(?P<value>:[A-Za-z0-9_]+)'
+    r'|(?P<number>\d+)'
+    r'|(?P<ident>[A-Za-z_][A-Za-z0-9_\-]*)'
+    r')'
+)
+_KEYWORDS = {'AND', 'OR', 'NOT', 'BETWEEN', 'IN', 'SET', 'REMOVE', 'ADD', 'DELETE'}
+
+
+class _Parser:
+    """条件式・更新式・射影式の再帰下降パーサー"""
+
+    def __init__(self, expression: str, names: Optional[Dict[str, str]],
+                 values: Optional[Dict[str, Any]], operation: str):
+        self.operation = operation
+        self.names = names or {}
+        self.values = values or {}
+        self.tokens: List[Tuple[str, str]] = []
+        position = 0
+        expression = expression.strip()
+        while position < len(expression):
+            match = _TOKEN_PATTERN.match(expression, position)
+            if not match or match.end() == position:
+                raise self.error(f'Invalid token in expression: {expression[position:]}')
+            position = match.end()
+            kind = match.lastgroup
+            text = match.group(kind)
+            if kind == 'ident' and text.upper() in _KEYWORDS:
+                kind, text = 'keyword', text.upper()
+            self.tokens.append((kind, text))
+        self.index = 0
+
+    def error(self, message: str) -> ClientError:
+        return _client_error('ValidationException', message, self.operation)
+
+    def peek(self, offset: int = 0) -> Tuple[Optional[str], Optional[str]]:
+        position = self.index + offset
+        if position < len(self.tokens):
+            return self.tokens[position]
+        return None, None
+
+    def take(self, kind: Optional[str] = None, text: Optional[str] = None) -> str:
+        token_kind, token_text = self.peek()
+        if token_kind is None or (kind and token_kind != kind) or (text and token_text != text):
+            raise self.error(f'Syntax error in expression near: {token_text}')
+        self.index += 1
+        return token_text
+
+    def accept(self, kind: str, text: Optional[str] = None) -> bool:
+        token_kind, token_text = self.peek()
+        if token_kind == kind and (text is None or token_text == text):
+            self.index += 1
+            return True
+        return False
+
+    def done(self) -> bool:
+        return self.index >= len(self.tokens)
+
+    def expect_end(self) -> None:
+        if not self.done():
+            raise self.error(f'Syntax error in expression near: {self.peek()[1]}')
+
+    # --- パスと値 ---
+
+    def path(self) -> List[Any]:
+        kind, text = self.peek()
+        if kind == 'name':
+            self.index += 1
+            if text not in self.names:
+                raise self.error(f'An expression attribute name used in the document path is not defined; attribute name: {text}')
+            parts: List[Any] = [self.names[text]]
+        elif kind == 'ident':
+            self.index += 1
+            parts = [text]
+        else:
+            raise self.error(f'Syntax error in expression near: {text}')
+        while True:
+            if self.accept('op', '.'):
+                kind, text = self.peek()
+                if kind == 'name':
+                    self.index += 1
+                    if text not in self.names:
+                        raise self.error(f'An expression attribute name used in the document path is not defined; attribute name: {text}')
+                    parts.append(self.names[text])
+                else:
+                    parts.append(self.take('ident'))
+            elif self.accept('op', '['):
+                parts.append(int(self.take('number')))
+                self.take('op', ']')
+            else:
+                return parts
+
+    def value_ref(self) -> Any:
+        text = self.take('value')
+        if text not in self.values:
+            raise self.error(f'An expression attribute value used in expression is not defined; attribute value: {text}')
+        return self.values[text]
+
+    def operand(self) -> Tuple:
+        kind, text = self.peek()
+        if kind == 'value':
+            return ('const', self.value_ref())
+        if kind == 'ident' and text == 'size' and self.peek(1) == ('op', '('):
+            self.index += 2
+            target = self.path()
+            self.take('op', ')')
+            return ('size', target)
+        if kind == 'ident' and text in ('if_not_exists', 'list_append') and self.peek(1) == ('op', '('):
+            self.index += 2
+            first = self.operand() if text == 'list_append' else ('path', self.path())
+            self.take('op', ',')
+            second = self.operand()
+            self.take('op', ')')
+            return (text, first, second)
+        return ('path', self.path())
+
+    # --- 条件式 ---
+
+    def condition(self) -> Tuple:
+        node = self.conjunction()
+        while self.accept('keyword', 'OR'):
+            node = ('or', node, self.conjunction())
+        return node
+
+    def conjunction(self) -> Tuple:
+        node = self.negation()
+        while self.accept('keyword', 'AND'):
+            node = ('and', node, self.negation())
+        return node
+
+    def negation(self) -> Tuple:
+        if self.accept('keyword', 'NOT'):
+            return ('not', self.negation())
+        return self.predicate()
+
+    def predicate(self) -> Tuple:
+        if self.accept('op', '('):
+            node = self.condition()
+            self.take('op', ')')
+            return node
+        kind, text = self.peek()
+        functions = ('attribute_exists', 'attribute_not_exists', 'attribute_type', 'begins_with', 'contains')
+        if kind == 'ident' and text in functions and self.peek(1) == ('op', '('):
+            self.index += 2
+            target = self.path()
+            argument = None
+            if text not in ('attribute_exists', 'attribute_not_exists'):
+                self.take('op', ',')
+                argument = self.operand()
+            self.take('op', ')')
+            return ('func', text, target, argument)
+        left = self.operand()
+        if self.accept('keyword', 'BETWEEN'):
+            low = self.operand()
+            self.take('keyword', 'AND')
+            high = self.operand()
+            return ('between', left, low, high)
+        if self.accept('keyword', 'IN'):
+            self.take('op', '(')
+            options = [self.operand()]
+            while self.accept('op', ','):
+                options.append(self.operand())
+            self.take('op', ')')
+            return ('in', left, options)
+        kind, text = self.peek()
+        if kind == 'op' and text in ('=', '<>', '<', '<=', '>', '>='):
+            self.index += 1
+            return ('compare', text, left, self.operand())
+        raise self.error(f'Syntax error in expression near: {text}')
+
+    # --- 更新式 ---
+
+    def update_actions(self) -> List[Tuple]:
+        actions = []
+        while not self.done():
+            clause = self.take('keyword')
+            while True:
+                target = self.path()
+                if clause == 'SET':
+                    self.take('op', '=')
+                    value = self.operand()
+                    if self.accept('op', '+'):
+                        value = ('plus', value, self.operand())
+                    elif self.accept('op', '-'):
+                        value = ('minus', value, self.operand())
+                    actions.append(('SET', target, value))
+                elif clause == 'REMOVE':
+                    actions.append(('REMOVE', target, None))
+                elif clause in ('ADD', 'DELETE'):
+                    actions.append((clause, target, ('const', self.value_ref())))
+                else:
+                    raise self.error(f'Invalid UpdateExpression clause: {clause}')
+                if not self.accept('op', ','):
+                    break
+        if not actions:
+            raise self.error('Invalid UpdateExpression: The expression can not be empty')
+        return actions
+
+    def projection(self) -> List[List[Any]]:
+        paths = [self.path()]
+        while self.accept('op', ','):
+            paths.append(self.path())
+        self.expect_end()
+        return paths
+
+
+def _resolve(item: Dict[str, Any], path: List[Any]) -> Any:
+    """ドキュメントパスの値を取得（存在しない場合は _MISSING）"""
+    current: Any = item
+    for part in path:
+        if isinstance(part, int):
+            if not isinstance(current, list) or part >= len(current):
+                return _MISSING
+        elif not isinstance(current, dict) or part not in current:
+            return _MISSING
+        current = current[part]
+    return current
+
+
+def _comparable(left: Any, right: Any) -> bool:
+    """大小比較が可能な同じ型の値かどうか"""
+    for kind in (str, Decimal, (bytes, Binary)):
+        if isinstance(left, kind) and isinstance(right, kind):
+            return True
+    return False
+
+
+def _raw(value: Any) -> Any:
+    return value.value if isinstance(value, Binary) else value
+
+
+def _type_of(value: Any) -> str:
+    return next(iter(_serializer.serialize(value)))
+
+
+class _Evaluator:
+    """解析済みの式をアイテムに対して評価"""
+
+    def __init__(self, item: Dict[str, Any]):
+        self.item = item
+
+    def operand(self, node: Tuple) -> Any:
+        kind = node[0]
+        if kind == 'const':
+            return node[1]
+        if kind == 'path':
+            return _resolve(self.item, node[1])
+        if kind == 'size':
+            value = _resolve(self.item, node[1])
+            if value is _MISSING:
+                return _MISSING
+            if isinstance(value, str):
+                return Decimal(len(value.encode('utf-8')))
+            if isinstance(value, (bytes, Binary)):
+                return Decimal(len(_raw(value)))
+            if isinstance(value, (list, dict, set)):
+                return Decimal(len(value))
+            return _MISSING
+        if kind == 'if_not_exists':
+            value = self.operand(node[1])
+            return self.operand(node[2]) if value is _MISSING else value
+        if kind == 'list_append':
+            first, second = self.operand(node[1]), self.operand(node[2])
+            if not isinstance(first, list) or not isinstance(second, list):
+                raise _client_error('ValidationException',
+                                    'An operand in the update expression has an incorrect data type', 'UpdateItem')
+            return first + second
+        if kind in ('plus', 'minus'):
+            first, second = self.operand(node[1]), self.operand(node[2])
+            if not isinstance(first, Decimal) or not isinstance(second, Decimal):
+                raise _client_error('ValidationException',
+                                    'An operand in the update expression has an incorrect data type', 'UpdateItem')
+            return first + second if kind == 'plus' else first - second
+        raise ValueError(f'Unknown operand: {kind}')
+
+    def condition(self, node: Tuple) -> bool:
+        kind = node[0]
+        if kind == 'and':
+            return self.condition(node[1]) and self.condition(node[2])
+        if kind == 'or':
+            return self.condition(node[1]) or self.condition(node[2])
+        if kind == 'not':
+            return not self.condition(node[1])
+        if kind == 'compare':
+            _, operator, left_node, right_node = node
+            left, right = self.operand(left_node), self.operand(right_node)
+            if left is _MISSING or right is _MISSING:
+                return operator == '<>' and (left is _MISSING) != (right is _MISSING)
+            if operator == '=':
+                return type(_raw(left)) is type(_raw(right)) and _raw(left) == _raw(right)
+            if operator == '<>':
+                return not (type(_raw(left)) is type(_raw(right)) and _raw(left) == _raw(right))
+            if not _comparable(left, right):
+                return False
+            left, right = _raw(left), _raw(right)
+            return {
+                '<': left < right, '<=': left <= right,
+                '>': left > right, '>=': left >= right
+            }[operator]
+        if kind == 'between':
+            value, low, high = (self.operand(n) for n in node[1:])
+            if not (_comparable(value, low) and _comparable(value, high)):
+                return False
+            return _raw(low) <= _raw(value) <= _raw(high)
+        if kind == 'in':
+            value = self.operand(node[1])
+            return value is not _MISSING and any(
+                _raw(value) == _raw(self.operand(option)) for option in node[2]
+            )
+        if kind == 'func':
+            _, name, path, argument_node = node
+            value = _resolve(self.item, path)
+            if name == 'attribute_exists':
+                return value is not _MISSING
+            if name == 'attribute_not_exists':
+                return value is _MISSING
+            if value is _MISSING:
+                return False
+            argument = self.operand(argument_node)
+            if name == 'attribute_type':
+                return _type_of(value) == argument
+            if name == 'begins_with':
+                if isinstance(value, str) and isinstance(argument, str):
+                    return value.startswith(argument)
+                if isinstance(value, (bytes, Binary)) and isinstance(argument, (bytes, Binary)):
+                    return _raw(value).startswith(_raw(argument))
+                return False
+            if name == 'contains':
+                if isinstance(value, str) and isinstance(argument, str):
+                    return argument in value
+                if isinstance(value, (set, list)):
+                    return argument in value
+                return False
+        raise ValueError(f'Unknown condition: {kind}')
+
+
+def _normalize_expression(expression: Any, names: Dict[str, str], values: Dict[str, Any],
+                          builder: ConditionExpressionBuilder, is_key_condition: bool = False) -> str:
+    """boto3 の条件オブジェクトを文字列式に変換し、プレースホルダーをマージ"""
+    if isinstance(expression, ConditionBase):
+        built = builder.build_expression(expression, is_key_condition=is_key_condition)
+        names.update(built.attribute_name_placeholders)
+        values.update(built.attribute_value_placeholders)
+        return built.condition_expression
+    return expression
+
+
+def _set_path(item: Dict[str, Any], path: List[Any], value: Any, operation: str) -> None:
+    parent = _resolve(item, path[:-1]) if len(path) > 1 else item
+    last = path[-1]
+    if isinstance(last, int) and isinstance(parent, list):
+        if last >= len(parent):
+            parent.append(value)
+        else:
+            parent[last] = value
+    elif isinstance(last, str) and isinstance(parent, dict):
+        parent[last] = value
+    else:
+        raise _client_error('ValidationException',
+                            'The document path provided in the update expression is invalid for update', operation)
+
+
+def _remove_path(item: Dict[str, Any], path: List[Any]) -> None:
+    parent = _resolve(item, path[:-1]) if len(path) > 1 else item
+    last = path[-1]
+    if isinstance(last, int) and isinstance(parent, list) and last < len(parent):
+        parent.pop(last)
+    elif isinstance(last, str) and isinstance(parent, dict):
+        parent.pop(last, None)
+
+
+# =============================================================================
+# テーブル
+# =============================================================================
+
+def _key_value(value: Any) -> Any:
+    """キー値をハッシュ・比較可能な形に変換"""
+    return _raw(value)
+
+
+class _Index:
+    """GSI の定義と、パーティションキー値からプライマリキーへの対応表"""
+
+    def __init__(self, definition: Dict[str, Any]):
+        self.name = definition['IndexName']
+        schema = {k['KeyType']: k['AttributeName'] for k in definition['KeySchema']}
+        self.hash_key = schema['HASH']
+        self.range_key = schema.get('RANGE')
+        projection = definition.get('Projection', {'ProjectionType': 'ALL'})
+        self.projection_type = projection.get('ProjectionType', 'ALL')
+        self.non_key_attributes = set(projection.get('NonKeyAttributes', []))
+        self.partitions: Dict[Any, set] = {}
+
+    def key_of(self, item: Dict[str, Any]) -> Optional[Any]:
+        if self.hash_key not in item:
+            return None
+        if self.range_key and self.range_key not in item:
+            return None
+        return _key_value(item[self.hash_key])
+
+
+class MemoryTable:
+    """インメモリのテーブル本体"""
+
+    def __init__(self, name: str, key_schema: List[Dict[str, str]],
+                 global_secondary_indexes: Optional[List[Dict[str, Any]]] = None):
+        self.name = name
+        self.key_schema = key_schema
+        schema = {k['KeyType']: k['AttributeName'] for k in key_schema}
+        self.hash_key = schema['HASH']
+        self.range_key = schema.get('RANGE')
+        self.items: Dict[Tuple, Dict[str, Any]] = {}
+        self.partitions: Dict[Any, set] = {}
+        self.indexes: Dict[str, _Index] = {
+            d['IndexName']: _Index(d) for d in (global_secondary_indexes or [])
+        }
+        self._scan_order: Optional[List[Tuple]] = None
+
+    # --- キー ---
+
+    def key_attributes(self) -> List[str]:
+        return [self.hash_key] + ([self.range_key] if self.range_key else [])
+
+    def primary_key(self, key: Dict[str, Any], operation: str) -> Tuple:
+        names = self.key_attributes()
+        if set(key) != set(names):
+            raise _client_error('ValidationException',
+                                'The provided key element does not match the schema', operation)
+        for name in names:
+            if isinstance(key[name], (dict, list, set, bool)) or key[name] is None:
+                raise _client_error('ValidationException',
+                                    'The provided key element does not match the schema', operation)
+        return tuple(_key_value(key[name]) for name in names)
+
+    def key_of_item(self, item: Dict[str, Any], operation: str) -> Tuple:
+        missing = [name for name in self.key_attributes() if name not in item]
+        if missing:
+            raise _client_error('ValidationException',
+                                f'One or more parameter values were invalid: Missing the key {missing[0]} in the item',
+                                operation)
+        return self.primary_key({name: item[name] for name in self.key_attributes()}, operation)
+
+    def extract_key(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        return {name: item[name] for name in self.key_attributes()}
+
+    @staticmethod
+    def _scan_hash(primary_key: Tuple) -> int:
+        return zlib.crc32(repr(primary_key[0]).encode('utf-8'))
+
+    def scan_key(self, primary_key: Tuple) -> Tuple:
+        return (self._scan_hash(primary_key), repr(primary_key))
+
+    def scan_order(self) -> List[Tuple]:
+        if self._scan_order is None:
+            self._scan_order = sorted(self.items, key=self.scan_key)
+        return self._scan_order
+
+    # --- 書き込み ---
+
+    def store(self, primary_key: Tuple, item: Optional[Dict[str, Any]]) -> None:
+        """アイテムを保存（None の場合は削除）し、インデックスを更新"""
+        old = self.items.get(primary_key)
+        if old is not None:
+            self.partitions.get(primary_key[0], set()).discard(primary_key)
+            for index in self.indexes.values():
+                index_key = index.key_of(old)
+                if index_key is not None:
+                    index.partitions.get(index_key, set()).discard(primary_key)
+        if item is None:
+            if old is not None:
+                del self.items[primary_key]
+                self._scan_order = None
+            return
+        if old is None:
+            self._scan_order = None
+        self.items[primary_key] = item
+        self.partitions.setdefault(primary_key[0], set()).add(primary_key)
+        for index in self.indexes.values():
+            index_key = index.key_of(item)
+            if index_key is not None:
+                index.partitions.setdefault(index_key, set()).add(primary_key)
+
+    def index_write_units(self, old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]]) -> Dict[str, float]:
+        """書き込みで影響を受ける GSI ごとの書き込みユニットを計算"""
+        units = {}
+        for index in self.indexes.values():
+            old_in = old is not None and index.key_of(old) is not None
+            new_in = new is not None and index.key_of(new) is not None
+            if not old_in and not new_in:
+                continue
+            count = 2 if (old_in and new_in and index.key_of(old) != index.key_of(new)) else 1
+            size = max(item_size(self.project(old, index)) if old_in else 0,
+                       item_size(self.project(new, index)) if new_in else 0)
+            units[index.name] = write_units(size) * count
+        return units
+
+    def project(self, item: Dict[str, Any], index: Optional[_Index]) -> Dict[str, Any]:
+        if index is None or index.projection_type == 'ALL':
+            return item
+        keep = set(self.key_attributes()) | {index.hash_key}
+        if index.range_key:
+            keep.add(index.range_key)
+        if index.projection_type == 'INCLUDE':
+            keep |= index.non_key_attributes
+        return {k: v for k, v in item.items() if k in keep}
+
+    def describe(self) -> Dict[str, Any]:
+        description = {
+            'TableName': self.name,
+            'TableStatus': 'ACTIVE',
+            'KeySchema': copy.deepcopy(self.key_schema),
+            'ItemCount': len(self.items),
+            'TableSizeBytes': sum(item_size(item) for item in self.items.values()),
+            'BillingModeSummary': {'BillingMode': 'PAY_PER_REQUEST'}
+        }
+        if self.indexes:
+            description['GlobalSecondaryIndexes'] = [
+                {
+                    'IndexName': index.name,
+                    'KeySchema': [{'AttributeName': index.hash_key, 'KeyType': 'HASH'}] + (
+                        [{'AttributeName': index.range_key, 'KeyType': 'RANGE'}] if index.range_key else []
+                    ),
+                    'Projection': {'ProjectionType': index.projection_type},
+                    'IndexStatus': 'ACTIVE'
+                }
+                for index in self.indexes.values()
+            ]
+        return description
+
+
+def _sort_value(value: Any) -> Tuple:
+    """範囲キーのソート用の値（型が混在しても比較可能にする）"""
+    value = _raw(value)
+    if isinstance(value, Decimal):
+        return (0, value)
+    if isinstance(value, bytes):
+        return (2, value)
+    return (1, value)
+
+
+class _Reversed:
+    """降順ソート用に比較を反転するラッパー"""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value: Tuple):
+        self.value = value
+
+    def __lt__(self, other: '_Reversed') -> bool:
+        return other.value < self.value
+
+    def __le__(self, other: '_Reversed') -> bool:
+        return other.value <= self.value
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, _Reversed) and other.value == self.value
+
+
+class MemoryDynamoDB:
+    """プロセス内で共有されるテーブル群と操作の実装"""
+
+    def __init__(self):
+        self.tables: Dict[str, MemoryTable] = {}
+        self.lock = threading.RLock()
+
+    # --- テーブル管理 ---
+
+    def create_table(self, TableName: str, KeySchema: List[Dict[str, str]],
+                     GlobalSecondaryIndexes: Optional[List[Dict[str, Any]]] = None,
+                     **kwargs) -> Dict[str, Any]:
+        with self.lock:
+            if TableName in self.tables:
+                raise _client_error('ResourceInUseException', f'Table already exists: {TableName}', 'CreateTable')
+            table = MemoryTable(TableName, KeySchema, GlobalSecondaryIndexes)
+            self.tables[TableName] = table
+            return {'TableDescription': table.describe()}
+
+    def delete_table(self, TableName: str, **kwargs) -> Dict[str, Any]:
+        with self.lock:
+            table = self.table(TableName, 'DeleteTable')
+            del self.tables[TableName]
+            return {'TableDescription': table.describe()}
+
+    def describe_table(self, TableName: str, **kwargs) -> Dict[str, Any]:
+        with self.lock:
+            return {'Table': self.table(TableName, 'DescribeTable').describe()}
+
+    def list_tables(self, **kwargs) -> Dict[str, Any]:
+        with self.lock:
+            self.bootstrap()
+            return {'TableNames': sorted(self.tables)}
+
+    def bootstrap(self) -> None:
+        """TABLE_DEFINITIONS のテーブルを環境変数のテーブル名で作成"""
+        for env_var in TABLE_DEFINITIONS:
+            self._ensure_defined(os.environ.get(env_var, TABLE_DEFINITIONS[env_var]['TableName']))
+
+    def _ensure_defined(self, name: str) -> Optional[MemoryTable]:
+        if name in self.tables:
+            return self.tables[name]
+        for env_var, definition in TABLE_DEFINITIONS.items():
+            if os.environ.get(env_var, definition['TableName']) == name:
+                table = MemoryTable(name, definition['KeySchema'], definition.get('GlobalSecondaryIndexes'))
+                self.tables[name] = table
+                return table
+        return None
+
+    def table(self, name: str, operation: str) -> MemoryTable:
+        table = self._ensure_defined(name)
+        if table is None:
+            raise _client_error('ResourceNotFoundException',
+                                'Requested resource not found', operation)
+        return table
+
+    # --- 内部ヘルパー ---
+
+    @staticmethod
+    def _prepare(item: Dict[str, Any], operation: str) -> Dict[str, Any]:
+        """boto3 と同じ型検証を行い、保存用のコピーを作成"""
+        # boto3 と同様、float などの非対応型は TypeError になる
+        serialized = {name: _serializer.serialize(value) for name, value in item.items()}
+        stored = {name: _deserializer.deserialize(value) for name, value in serialized.items()}
+        if item_size(stored) > MAX_ITEM_BYTES:
+            raise _client_error('ValidationException',
+                                'Item size has exceeded the maximum allowed size', operation)
+        return stored
+
+    @staticmethod
+    def _copy(item: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        return copy.deepcopy(item) if item is not None else None
+
+    def _check_condition(self, item: Optional[Dict[str, Any]], expression: Optional[str],
+                         names: Dict[str, str], values: Dict[str, Any], operation: str,
+                         return_on_failure: Optional[str] = None) -> None:
+        if not expression:
+            return
+        node = _Parser(expression, names, values, operation)
+        tree = node.condition()
+        node.expect_end()
+        if not _Evaluator(item or {}).condition(tree):
+            extra = {}
+            if return_on_failure == 'ALL_OLD' and item is not None:
+                extra['Item'] = self._copy(item)
+            raise _client_error('ConditionalCheckFailedException',
+                                'The conditional request failed', operation, **extra)
+
+    @staticmethod
+    def _apply_projection(item: Dict[str, Any], expression: Optional[str],
+                          names: Dict[str, str], operation: str) -> Dict[str, Any]:
+        if not expression:
+            return item
+        parser = _Parser(expression, names, {}, operation)
+        projected: Dict[str, Any] = {}
+        for path in parser.projection():
+            value = _resolve(item, path)
+            if value is _MISSING:
+                continue
+            if len(path) == 1:
+                projected[path[0]] = value
+            else:
+                # ネストしたパスはトップレベル属性ごと返す（簡略化）
+                projected[path[0]] = item[path[0]]
+        return projected
+
+    def _apply_update(self, table: MemoryTable, item: Dict[str, Any], expression: str,
+                      names: Dict[str, str], values: Dict[str, Any], operation: str) -> set:
+        parser = _Parser(expression, names, values, operation)
+        actions = parser.update_actions()
+        evaluator = _Evaluator(copy.deepcopy(item))
+        key_names = set(table.key_attributes())
+        updated = set()
+        # 全ての値は更新前のアイテムを基準に評価する
+        computed = [(action, path, evaluator.operand(value) if value else None)
+                    for action, path, value in actions]
+        for action, path, value in computed:
+            if path[0] in key_names:
+                raise _client_error('ValidationException',
+                                    f'One or more parameter values were invalid: Cannot update attribute {path[0]}. '
+                                    'This attribute is part of the key', operation)
+            updated.add(path[0])
+            if action == 'SET':
+                if value is _MISSING:
+                    raise _client_error('ValidationException',
+                                        'The provided expression refers to an attribute that does not exist in the item',
+                                        operation)
+                _set_path(item, path, copy.deepcopy(value), operation)
+            elif action == 'REMOVE':
+                _remove_path(item, path)
+            elif action == 'ADD':
+                current = _resolve(item, path)
+                if current is _MISSING:
+                    _set_path(item, path, copy.deepcopy(value), operation)
+                elif isinstance(current, Decimal) and isinstance(value, Decimal):
+                    _set_path(item, path, current + value, operation)
+                elif isinstance(current, set) and isinstance(value, set):
+                    _set_path(item, path, current | value, operation)
+                else:
+                    raise _client_error('ValidationException',
+                                        'An operand in the update expression has an incorrect data type', operation)
+            elif action == 'DELETE':
+                current = _resolve(item, path)
+                if isinstance(current, set) and isinstance(value, set):
+                    remaining = current - value
+                    if remaining:
+                        _set_path(item, path, remaining, operation)
+                    else:
+                        _remove_path(item, path)
+                elif current is not _MISSING:
+                    raise _client_error('ValidationException',
+                                        'An operand in the update expression has an incorrect data type', operation)
+        return updated
+
+    # --- アイテム操作 ---
+
+    def get_item(self, TableName: str, Key: Dict[str, Any], ConsistentRead: bool = False,
+                 ProjectionExpression: Optional[str] = None,
+                 ExpressionAttributeNames: Optional[Dict[str, str]] = None,
+                 ReturnConsumedCapacity: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        with self.lock:
+            table = self.table(TableName, 'GetItem')
+            item = table.items.get(table.primary_key(Key, 'GetItem'))
+            meter = _CapacityMeter(ReturnConsumedCapacity)
+            meter.add(TableName, read=read_units(item_size(item), ConsistentRead))
+            response: Dict[str, Any] = {}
+            if item is not None:
+                response['Item'] = self._apply_projection(
+                    self._copy(item), ProjectionExpression, ExpressionAttributeNames or {}, 'GetItem'
+                )
+            return meter.attach(response)
+
+    def put_item(self, TableName: str, Item: Dict[str, Any],
+                 ConditionExpression: Optional[str] = None,
+                 ExpressionAttributeNames: Optional[Dict[str, str]] = None,
+                 ExpressionAttributeValues: Optional[Dict[str, Any]] = None,
+                 ReturnValues: str = 'NONE',
+                 ReturnValuesOnConditionCheckFailure: Optional[str] = None,
+                 ReturnConsumedCapacity: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        with self.lock:
+            table = self.table(TableName, 'PutItem')
+            stored = self._prepare(Item, 'PutItem')
+            primary_key = table.key_of_item(stored, 'PutItem')
+            old = table.items.get(primary_key)
+            self._check_condition(old, ConditionExpression, ExpressionAttributeNames or {},
+                                  ExpressionAttributeValues or {}, 'PutItem',
+                                  ReturnValuesOnConditionCheckFailure)
+            meter = _CapacityMeter(ReturnConsumedCapacity)
+            meter.add(TableName, write=write_units(max(item_size(old), item_size(stored))))
+            for index_name, units in table.index_write_units(old, stored).items():
+                meter.add(TableName, write=units, index_name=index_name)
+            table.store(primary_key, stored)
+            response: Dict[str, Any] = {}
+            if ReturnValues == 'ALL_OLD' and old is not None:
+                response['Attributes'] = self._copy(old)
+            return meter.attach(response)
+
+    def update_item(self, TableName: str, Key: Dict[str, Any],
+                    UpdateExpression: Optional[str] = None,
+                    ConditionExpression: Optional[str] = None,
+                    ExpressionAttributeNames: Optional[Dict[str, str]] = None,
+                    ExpressionAttributeValues: Optional[Dict[str, Any]] = None,
+                    ReturnValues: str = 'NONE',
+                    ReturnValuesOnConditionCheckFailure: Optional[str] = None,
+                    ReturnConsumedCapacity: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        with self.lock:
+            table = self.table(TableName, 'UpdateItem')
+            primary_key = table.primary_key(Key, 'UpdateItem')
+            old = table.items.get(primary_key)
+            names = ExpressionAttributeNames or {}
+            values = self._prepare(ExpressionAttributeValues or {}, 'UpdateItem')
+            self._check_condition(old, ConditionExpression, names, values, 'UpdateItem',
+                                  ReturnValuesOnConditionCheckFailure)
+            new = self._copy(old) if old is not None else self._copy(dict(Key))
+            updated = set()
+            if UpdateExpression:
+                updated = self._apply_update(table, new, UpdateExpression, names, values, 'UpdateItem')
+            new = self._prepare(new, 'UpdateItem')
+            meter = _CapacityMeter(ReturnConsumedCapacity)
+            meter.add(TableName, write=write_units(max(item_size(old), item_size(new))))
+            for index_name, units in table.index_write_units(old, new).items():
+                meter.add(TableName, write=units, index_name=index_name)
+            table.store(primary_key, new)
+            response: Dict[str, Any] = {}
+            if ReturnValues == 'ALL_NEW':
+                response['Attributes'] = self._copy(new)
+            elif ReturnValues == 'ALL_OLD' and old is not None:
+                response['Attributes'] = self._copy(old)
+            elif ReturnValues == 'UPDATED_NEW':
+                response['Attributes'] = {k: copy.deepcopy(new[k]) for k in updated if k in new}
+            elif ReturnValues == 'UPDATED_OLD' and old is not None:
+                response['Attributes'] = {k: copy.deepcopy(old[k]) for k in updated if k in old}
+            return meter.attach(response)
+
+    def delete_item(self, TableName: str, Key: Dict[str, Any],
+                    ConditionExpression: Optional[str] = None,
+                    ExpressionAttributeNames: Optional[Dict[str, str]] = None,
+                    ExpressionAttributeValues: Optional[Dict[str, Any]] = None,
+                    ReturnValues: str = 'NONE',
+                    ReturnValuesOnConditionCheckFailure: Optional[str] = None,
+                    ReturnConsumedCapacity: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        with self.lock:
+            table = self.table(TableName, 'DeleteItem')
+            primary_key = table.primary_key(Key, 'DeleteItem')
+            old = table.items.get(primary_key)
+            self._check_condition(old, ConditionExpression, ExpressionAttributeNames or {},
+                                  ExpressionAttributeValues or {}, 'DeleteItem',
+                                  ReturnValuesOnConditionCheckFailure)
+            meter = _CapacityMeter(ReturnConsumedCapacity)
+            meter.add(TableName, write=write_units(item_size(old)))
+            for index_name, units in table.index_write_units(old, None).items():
+                meter.add(TableName, write=units, index_name=index_name)
+            table.store(primary_key, None)
+            response: Dict[str, Any] = {}
+            if ReturnValues == 'ALL_OLD' and old is not None:
+                response['Attributes'] = self._copy(old)
+            return meter.attach(response)
+
+    # --- 読み込み（複数件） ---
+
+    def _paginate(self, table: MemoryTable, candidates: List[Tuple], order_key: Callable,
+                  index: Optional[_Index], operation: str, key_filter: Optional[Tuple], filter_tree: Optional[Tuple],
+                  limit: Optional[int], exclusive_start_key: Optional[Dict[str, Any]],
+                  select: Optional[str], projection: Optional[str], names: Dict[str, str],
+                  consistent: bool, meter: _CapacityMeter) -> Dict[str, Any]:
+        """候補キーを順にたどり、Limit / 1MB 上限 / フィルターを適用"""
+        start = 0
+        if exclusive_start_key:
+            start_key = table.key_of_item(exclusive_start_key, operation)
+            # 開始キーのアイテムが削除されていてもソート位置から再開できるよう二分探索する
+            target = order_key(start_key, exclusive_start_key)
+            low, high = 0, len(candidates)
+            while low < high:
+                middle = (low + high) // 2
+                if order_key(candidates[middle], table.items[candidates[middle]]) <= target:
+                    low = middle + 1
+                else:
+                    high = middle
+            start = low
+        items = []
+        scanned = 0
+        read_bytes = 0
+        last_key = None
+        for position in range(start, len(candidates)):
+            primary_key = candidates[position]
+            item = table.project(table.items[primary_key], index)
+            if key_filter is not None and not _Evaluator(item).condition(key_filter):
+                continue
+            scanned += 1
+            read_bytes += item_size(item)
+            if filter_tree is None or _Evaluator(item).condition(filter_tree):
+                items.append(self._apply_projection(self._copy(item), projection, names, operation))
+            reached_limit = limit is not None and scanned >= limit
+            if (reached_limit or read_bytes >= MAX_PAGE_BYTES) and position < len(candidates) - 1:
+                last_key = table.extract_key(item)
+                if index is not None:
+                    last_key[index.hash_key] = item[index.hash_key]
+                    if index.range_key:
+                        last_key[index.range_key] = item[index.range_key]
+                break
+        meter.add(table.name, read=read_units(read_bytes, consistent),
+                  index_name=index.name if index else None)
+        response: Dict[str, Any] = {'Count': len(items), 'ScannedCount': scanned}
+        if select != 'COUNT':
+            response['Items'] = items
+        if last_key is not None:
+            response['LastEvaluatedKey'] = self._copy(last_key)
+        return meter.attach(response)
+
+    def query(self, TableName: str, KeyConditionExpression: Any, IndexName: Optional[str] = None,
+              FilterExpression: Optional[str] = None, ProjectionExpression: Optional[str] = None,
+              ExpressionAttributeNames: Optional[Dict[str, str]] = None,
+              ExpressionAttributeValues: Optional[Dict[str, Any]] = None,
+              ScanIndexForward: bool = True, Limit: Optional[int] = None,
+              ExclusiveStartKey: Optional[Dict[str, Any]] = None, Select: Optional[str] = None,
+              ConsistentRead: bool = False, ReturnConsumedCapacity: Optional[str] = None,
+              **kwargs) -> Dict[str, Any]:
+        with self.lock:
+            table = self.table(TableName, 'Query')
+            names = dict(ExpressionAttributeNames or {})
+            values = self._prepare(ExpressionAttributeValues or {}, 'Query')
+            index = None
+            if IndexName:
+                if IndexName not in table.indexes:
+                    raise _client_error('ValidationException',
+                                        'The table does not have the specified index: ' + IndexName, 'Query')
+                if ConsistentRead:
+                    raise _client_error('ValidationException',
+                                        'Consistent reads are not supported on global secondary indexes', 'Query')
+                index = table.indexes[IndexName]
+            hash_key = index.hash_key if index else table.hash_key
+            range_key = index.range_key if index else table.range_key
+
+            parser = _Parser(KeyConditionExpression, names, values, 'Query')
+            key_tree = parser.condition()
+            parser.expect_end()
+            hash_value = self._find_hash_value(key_tree, hash_key)
+            if hash_value is _MISSING:
+                raise _client_error('ValidationException',
+                                    'Query condition missed key schema element: ' + hash_key, 'Query')
+            partition = index.partitions if index else table.partitions
+            candidates = list(partition.get(_key_value(hash_value), ()))
+
+            # 範囲キー順（同値の場合はプライマリキー順）に並べる。降順の場合は符号を反転した順序を使う
+            def order_key(primary_key: Tuple, item: Dict[str, Any]) -> Tuple:
+                value = _sort_value(item[range_key]) if range_key and range_key in item else (0, 0)
+                return (value, repr(primary_key))
+            if ScanIndexForward:
+                forward_key = order_key
+            else:
+                def forward_key(primary_key: Tuple, item: Dict[str, Any]) -> Tuple:
+                    return _Reversed(order_key(primary_key, item))
+            candidates.sort(key=lambda pk: forward_key(pk, table.items[pk]))
+
+            filter_tree = None
+            if FilterExpression:
+                filter_parser = _Parser(FilterExpression, names, values, 'Query')
+                filter_tree = filter_parser.condition()
+                filter_parser.expect_end()
+            meter = _CapacityMeter(ReturnConsumedCapacity)
+            return self._paginate(table, candidates, forward_key, index, 'Query', key_tree, filter_tree, Limit,
+                                  ExclusiveStartKey, Select, ProjectionExpression, names,
+                                  ConsistentRead, meter)
+
+    @staticmethod
+    def _find_hash_value(tree: Tuple, hash_key: str) -> Any:
+        if tree[0] == 'compare' and tree[1] == '=':
+            left, right = tree[2], tree[3]
+            if left[0] == 'path' and left[1] == [hash_key] and right[0] == 'const':
+                return right[1]
+            if right[0] == 'path' and right[1] == [hash_key] and left[0] == 'const':
+                return left[1]
+        if tree[0] == 'and':
+            value = MemoryDynamoDB._find_hash_value(tree[1], hash_key)
+            if value is _MISSING:
+                value = MemoryDynamoDB._find_hash_value(tree[2], hash_key)
+            return value
+        return _MISSING
+
+    def scan(self, TableName: str, IndexName: Optional[str] = None,
+             FilterExpression: Optional[str] = None, ProjectionExpression: Optional[str] = None,
+             ExpressionAttributeNames: Optional[Dict[str, str]] = None,
+             ExpressionAttributeValues: Optional[Dict[str, Any]] = None,
+             Limit: Optional[int] = None, ExclusiveStartKey: Optional[Dict[str, Any]] = None,
+             Segment: Optional[int] = None, TotalSegments: Optional[int] = None,
+             Select: Optional[str] = None, ConsistentRead: bool = False,
+             ReturnConsumedCapacity: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        with self.lock:
+            table = self.table(TableName, 'Scan')
+            names = dict(ExpressionAttributeNames or {})
+            values = self._prepare(ExpressionAttributeValues or {}, 'Scan')
+            if (Segment is None) != (TotalSegments is None):
+                raise _client_error('ValidationException',
+                                    'Segment and TotalSegments must be specified together', 'Scan')
+            if TotalSegments is not None and not 0 <= Segment < TotalSegments:
+                raise _client_error('ValidationException',
+                                    'Segment must be less than TotalSegments', 'Scan')
+            index = None
+            if IndexName:
+                if IndexName not in table.indexes:
+                    raise _client_error('ValidationException',
+                                        'The table does not have the specified index: ' + IndexName, 'Scan')
+                index = table.indexes[IndexName]
+            candidates = table.scan_order()
+            if index is not None:
+                candidates = [pk for pk in candidates if index.key_of(table.items[pk]) is not None]
+            if TotalSegments:
+                candidates = [pk for pk in candidates
+                              if MemoryTable._scan_hash(pk) % TotalSegments == Segment]
+            filter_tree = None
+            if FilterExpression:
+                filter_parser = _Parser(FilterExpression, names, values, 'Scan')
+                filter_tree = filter_parser.condition()
+                filter_parser.expect_end()
+            meter = _CapacityMeter(ReturnConsumedCapacity)
+            return self._paginate(table, candidates, lambda pk, item: table.scan_key(pk), index, 'Scan', None, filter_tree, Limit,
+                                  ExclusiveStartKey, Select, ProjectionExpression, names,
+                                  ConsistentRead, meter)
+
+    # --- バッチ操作 ---
+
+    def batch_get_item(self, RequestItems: Dict[str, Dict[str, Any]],
+                       ReturnConsumedCapacity: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        with self.lock:
+            total = sum(len(request['Keys']) for request in RequestItems.values())
+            if total > MAX_BATCH_GET_KEYS:
+                raise _client_error('ValidationException',
+                                    'Too many items requested for the BatchGetItem call', 'BatchGetItem')
+            meter = _CapacityMeter(ReturnConsumedCapacity)
+            responses: Dict[str, List[Dict[str, Any]]] = {}
+            for table_name, request in RequestItems.items():
+                table = self.table(table_name, 'BatchGetItem')
+                names = request.get('ExpressionAttributeNames') or {}
+                consistent = request.get('ConsistentRead', False)
+                found = responses.setdefault(table_name, [])
+                for key in request['Keys']:
+                    item = table.items.get(table.primary_key(key, 'BatchGetItem'))
+                    meter.add(table_name, read=read_units(item_size(item), consistent))
+                    if item is not None:
+                        found.append(self._apply_projection(
+                            self._copy(item), request.get('ProjectionExpression'), names, 'BatchGetItem'
+                        ))
+            return meter.attach({'Responses': responses, 'UnprocessedKeys': {}}, single=False)
+
+    def batch_write_item(self, RequestItems: Dict[str, List[Dict[str, Any]]],
+                         ReturnConsumedCapacity: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        with self.lock:
+            total = sum(len(requests) for requests in RequestItems.values())
+            if total > MAX_BATCH_WRITE_ITEMS:
+                raise _client_error('ValidationException',
+                                    'Too many items requested for the BatchWriteItem call', 'BatchWriteItem')
+            # 検証を先に行い、不正なリクエストが含まれる場合は何も書き込まない
+            prepared = []
+            seen = set()
+            for table_name, requests in RequestItems.items():
+                table = self.table(table_name, 'BatchWriteItem')
+                for request in requests:
+                    if 'PutRequest' in request:
+                        item = self._prepare(request['PutRequest']['Item'], 'BatchWriteItem')
+                        primary_key = table.key_of_item(item, 'BatchWriteItem')
+                    else:
+                        item = None
+                        primary_key = table.primary_key(request['DeleteRequest']['Key'], 'BatchWriteItem')
+                    if (table_name, primary_key) in seen:
+                        raise _client_error('ValidationException',
+                                            'Provided list of item keys contains duplicates', 'BatchWriteItem')
+                    seen.add((table_name, primary_key))
+                    prepared.append((table, primary_key, item))
+            meter = _CapacityMeter(ReturnConsumedCapacity)
+            for table, primary_key, item in prepared:
+                old = table.items.get(primary_key)
+                meter.add(table.name, write=write_units(max(item_size(old), item_size(item))))
+                for index_name, units in table.index_write_units(old, item).items():
+                    meter.add(table.name, write=units, index_name=index_name)
+                table.store(primary_key, item)
+            return meter.attach({'UnprocessedItems': {}}, single=False)
+
+    def transact_get_items(self, TransactItems: List[Dict[str, Any]],
+                           ReturnConsumedCapacity: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        with self.lock:
+            if len(TransactItems) > MAX_TRANSACT_ITEMS:
+                raise _client_error('ValidationException',
+                                    'Member must have length less than or equal to 100', 'TransactGetItems')
+            meter = _CapacityMeter(ReturnConsumedCapacity)
+            responses = []
+            for entry in TransactItems:
+                request = entry['Get']
+                table = self.table(request['TableName'], 'TransactGetItems')
+                item = table.items.get(table.primary_key(request['Key'], 'TransactGetItems'))
+                meter.add(table.name, read=read_units(item_size(item), True) * 2)
+                if item is None:
+                    responses.append({})
+                else:
+                    responses.append({'Item': self._apply_projection(
+                        self._copy(item), request.get('ProjectionExpression'),
+                        request.get('ExpressionAttributeNames') or {}, 'TransactGetItems'
+                    )})
+            return meter.attach({'Responses': responses}, single=False)
+
+    def transact_write_items(self, TransactItems: List[Dict[str, Any]],
+                             ReturnConsumedCapacity: Optional[str] = None,
+                             ClientRequestToken: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        with self.lock:
+            if len(TransactItems) > MAX_TRANSACT_ITEMS:
+                raise _client_error('ValidationException',
+                                    'Member must have length less than or equal to 100', 'TransactWriteItems')
+            # 1. 全ての条件を評価し、新しいアイテムを計算（まだ書き込まない）
+            planned = []
+            reasons = []
+            failed = False
+            seen = set()
+            for entry in TransactItems:
+                (action, request), = entry.items()
+                table = self.table(request['TableName'], 'TransactWriteItems')
+                names = request.get('ExpressionAttributeNames') or {}
+                values = self._prepare(request.get('ExpressionAttributeValues') or {}, 'TransactWriteItems')
+                if action == 'Put':
+                    new = self._prepare(request['Item'], 'TransactWriteItems')
+                    primary_key = table.key_of_item(new, 'TransactWriteItems')
+                else:
+                    primary_key = table.primary_key(request['Key'], 'TransactWriteItems')
+                if (table.name, primary_key) in seen:
+                    raise _client_error('ValidationException',
+                                        'Transaction request cannot include multiple operations on one item',
+                                        'TransactWriteItems')
+                seen.add((table.name, primary_key))
+                old = table.items.get(primary_key)
+                try:
+                    self._check_condition(old, request.get('ConditionExpression'), names, values,
+                                          'TransactWriteItems')
+                except ClientError:
+                    failed = True
+                    reason = {'Code': 'ConditionalCheckFailed', 'Message': 'The conditional request failed'}
+                    if request.get('ReturnValuesOnConditionCheckFailure') == 'ALL_OLD' and old is not None:
+                        reason['Item'] = self._copy(old)
+                    reasons.append(reason)
+                    continue
+                reasons.append({'Code': 'None'})
+                if action == 'Put':
+                    planned.append((table, primary_key, old, new))
+                elif action == 'Delete':
+                    planned.append((table, primary_key, old, None))
+                elif action == 'Update':
+                    new = self._copy(old) if old is not None else self._copy(dict(request['Key']))
+                    self._apply_update(table, new, request['UpdateExpression'], names, values,
+                                       'TransactWriteItems')
+                    planned.append((table, primary_key, old, self._prepare(new, 'TransactWriteItems')))
+            if failed:
+                codes = ', '.join(reason['Code'] for reason in reasons)
+                raise _client_error('TransactionCanceledException',
+                                    f'Transaction cancelled, please refer cancellation reasons for specific '
+                                    f'reasons [{codes}]', 'TransactWriteItems', CancellationReasons=reasons)
+            # 2. 全て成功した場合のみ書き込む
+            meter = _CapacityMeter(ReturnConsumedCapacity)
+            for table, primary_key, old, new in planned:
+                meter.add(table.name, write=write_units(max(item_size(old), item_size(new))) * 2)
+                for index_name, units in table.index_write_units(old, new).items():
+                    meter.add(table.name, write=units, index_name=index_name)
+                table.store(primary_key, new)
+            for entry in TransactItems:
+                if 'ConditionCheck' in entry:
+                    meter.add(entry['ConditionCheck']['TableName'], read=read_units(0, True) * 2)
+            return meter.attach({}, single=False)
+
+
+# =============================================================================
+# boto3 互換のクライアント / リソース
+# =============================================================================
+
+_EXPRESSION_KEYS = ('ConditionExpression', 'FilterExpression', 'KeyConditionExpression')
+_VALUE_KEYS = ('Item', 'Key', 'ExclusiveStartKey', 'LastEvaluatedKey', 'Attributes')
+
+
+class MemoryDynamoDBClient:
+    """boto3.client('dynamodb') 互換のクライアント
+
+    typed=True の場合は低レベル API と同じく {'S': ...} 形式の値を受け渡しし、
+    typed=False の場合は boto3 リソースの meta.client と同じく Python の値を受け渡しします。
+    """
+
+    _OPERATIONS = (
+        'get_item', 'put_item', 'update_item', 'delete_item', 'query', 'scan',
+        'batch_get_item', 'batch_write_item', 'transact_get_items', 'transact_write_items',
+        'create_table', 'delete_table', 'describe_table', 'list_tables'
+    )
+
+    def __init__(self, engine: MemoryDynamoDB, typed: bool = True):
+        self._engine = engine
+        self._typed = typed
+
+    def __getattr__(self, name: str):
+        if name not in self._OPERATIONS:
+            raise AttributeError(name)
+        operation = getattr(self._engine, name)
+
+        def call(**kwargs):
+            return self._decode(operation(**self._encode(kwargs)))
+        return call
+
+    # --- 値の変換 ---
+
+    def _from_wire(self, value: Dict[str, Any]) -> Dict[str, Any]:
+        if not self._typed:
+            return value
+        return {k: _deserializer.deserialize(v) for k, v in value.items()}
+
+    def _to_wire(self, value: Dict[str, Any]) -> Dict[str, Any]:
+        if not self._typed:
+            return value
+        return {k: _serializer.serialize(v) for k, v in value.items()}
+
+    def _encode_request(self, request: Dict[str, Any], builder: ConditionExpressionBuilder) -> Dict[str, Any]:
+        request = dict(request)
+        names = dict(request.get('ExpressionAttributeNames') or {})
+        values = self._from_wire(request.get('ExpressionAttributeValues') or {})
+        for key in _EXPRESSION_KEYS:
+            if key in request:
+                request[key] = _normalize_expression(request[key], names, values, builder,
+                                                     key == 'KeyConditionExpression')
+        if names:
+            request['ExpressionAttributeNames'] = names
+        if values:
+            request['ExpressionAttributeValues'] = values
+        for key in _VALUE_KEYS:
+            if key in request:
+                request[key] = self._from_wire(request[key])
+        if 'Keys' in request:
+            request['Keys'] = [self._from_wire(key) for key in request['Keys']]
+        return request
+
+    def _encode(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        builder = ConditionExpressionBuilder()
+        kwargs = self._encode_request(kwargs, builder)
+        if 'RequestItems' in kwargs:
+            encoded = {}
+            for table_name, request in kwargs['RequestItems'].items():
+                if isinstance(request, list):
+                    encoded[table_name] = [
+                        {'PutRequest': {'Item': self._from_wire(r['PutRequest']['Item'])}} if 'PutRequest' in r
+                        else {'DeleteRequest': {'Key': self._from_wire(r['DeleteRequest']['Key'])}}
+                        for r in request
+                    ]
+                else:
+                    encoded[table_name] = self._encode_request(request, builder)
+            kwargs['RequestItems'] = encoded
+        if 'TransactItems' in kwargs:
+            kwargs['TransactItems'] = [
+                {action: self._encode_request(request, builder) for action, request in entry.items()}
+                for entry in kwargs['TransactItems']
+            ]
+        return kwargs
+
+    def _decode(self, response: Dict[str, Any]) -> Dict[str, Any]:
+        if not self._typed:
+            return response
+        for key in _VALUE_KEYS:
+            if key in response:
+                response[key] = self._to_wire(response[key])
+        if 'Items' in response:
+            response['Items'] = [self._to_wire(item) for item in response['Items']]
+        if isinstance(response.get('Responses'), dict):
+            response['Responses'] = {
+                table: [self._to_wire(item) for item in items]
+                for table, items in response['Responses'].items()
+            }
+        elif isinstance(response.get('Responses'), list):
+            response['Responses'] = [
+                {'Item': self._to_wire(entry['Item'])} if 'Item' in entry else {}
+                for entry in response['Responses']
+            ]
+        return response
+
+
+class MemoryTableResource:
+    """boto3 の Table リソース互換オブジェクト"""
+
+    def __init__(self, resource: 'MemoryDynamoDBResource', name: str):
+        self._client = resource.meta.client
+        self.name = name
+        self.table_name = name
+
+    def get_item(self, **kwargs):
+        return self._client.get_item(TableName=self.name, **kwargs)
+
+    def put_item(self, **kwargs):
+        return self._client.put_item(TableName=self.name, **kwargs)
+
+    def update_item(self, **kwargs):
+        return self._client.update_item(TableName=self.name, **kwargs)
+
+    def delete_item(self, **kwargs):
+        return self._client.delete_item(TableName=self.name, **kwargs)
+
+    def query(self, **kwargs):
+        return self._client.query(TableName=self.name, **kwargs)
+
+    def scan(self, **kwargs):
+        return self._client.scan(TableName=self.name, **kwargs)
+
+    def batch_writer(self, overwrite_by_pkeys: Optional[List[str]] = None) -> '_BatchWriter':
+        return _BatchWriter(self._client, self.name, overwrite_by_pkeys)
+
+    @property
+    def key_schema(self) -> List[Dict[str, str]]:
+        return self._client.describe_table(TableName=self.name)['Table']['KeySchema']
+
+    @property
+    def item_count(self) -> int:
+        return self._client.describe_table(TableName=self.name)['Table']['ItemCount']
+
+
+class _BatchWriter:
+    """Table.batch_writer() 互換のコンテキストマネージャー（25件ごとにフラッシュ）"""
+
+    def __init__(self, client: MemoryDynamoDBClient, table_name: str,
+                 overwrite_by_pkeys: Optional[List[str]] = None):
+        self._client = client
+        self._table_name = table_name
+        self._overwrite_by_pkeys = overwrite_by_pkeys
+        self._buffer: List[Dict[str, Any]] = []
+
+    def put_item(self, Item: Dict[str, Any]) -> None:
+        self._add({'PutRequest': {'Item': Item}})
+
+    def delete_item(self, Key: Dict[str, Any]) -> None:
+        self._add({'DeleteRequest': {'Key': Key}})
+
+    def _add(self, request: Dict[str, Any]) -> None:
+        if self._overwrite_by_pkeys:
+            body = request.get('PutRequest', {}).get('Item') or request['DeleteRequest']['Key']
+            key = [body.get(name) for name in self._overwrite_by_pkeys]
+            self._buffer = [
+                r for r in self._buffer
+                if [(r.get('PutRequest', {}).get('Item') or r['DeleteRequest']['Key']).get(name)
+                    for name in self._overwrite_by_pkeys] != key
+            ]
+        self._buffer.append(request)
+        if len(self._buffer) >= MAX_BATCH_WRITE_ITEMS:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._buffer:
+            self._client.batch_write_item(RequestItems={self._table_name: self._buffer[:MAX_BATCH_WRITE_ITEMS]})
+            self._buffer = self._buffer[MAX_BATCH_WRITE_ITEMS:]
+
+    def __enter__(self) -> '_BatchWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        while self._buffer:
+            self._flush()
+
+
+class _Meta:
+    def __init__(self, client: MemoryDynamoDBClient):
+        self.client = client
+
+
+class MemoryDynamoDBResource:
+    """boto3.resource('dynamodb') 互換のリソース"""
+
+    def __init__(self, engine: MemoryDynamoDB):
+        self.meta = _Meta(MemoryDynamoDBClient(engine, typed=False))
+
+    def Table(self, name: str) -> MemoryTableResource:
+        return MemoryTableResource(self, name)
+
+    def create_table(self, **kwargs) -> MemoryTableResource:
+        self.meta.client.create_table(**kwargs)
+        return self.Table(kwargs['TableName'])
+
+    def batch_get_item(self, **kwargs) -> Dict[str, Any]:
+        return self.meta.client.batch_get_item(**kwargs)
+
+    def batch_write_item(self, **kwargs) -> Dict[str, Any]:
+        return self.meta.client.batch_write_item(**kwargs)
+
+
+_engine = MemoryDynamoDB()
+
+
+def get_memory_client() -> MemoryDynamoDBClient:
+    """プロセス共有エンジンの低レベルクライアントを取得"""
+    return MemoryDynamoDBClient(_engine, typed=True)
+
+
+def get_memory_resource() -> MemoryDynamoDBResource:
+    """プロセス共有エンジンのリソースを取得"""
+    return MemoryDynamoDBResource(_engine)
+
+
+def reset_memory_backend() -> None:
+    """全てのテーブルとデータを破棄（テスト用）"""
+    global _engine
+    _engine = MemoryDynamoDB()
@@ -2,11 +2,32 @@
 データモデル定義
 
 DynamoDB用のデータ構造を定義します。
+items / notes のような大きくなりやすい属性は、書き込み時に compress_attributes で圧縮し、
+読み込み時は CompressedAttribute が最初に参照されたときに展開します（圧縮前の行もそのまま読めます）。
 """
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterable, List, Optional, Any
 from datetime import datetime
+from decimal import Decimal
 from enum import Enum
+import json
+import re
+import unicodedata
 import uuid
+import zlib
+
+
+# tracking-number-index のパーティションキーに使う追跡番号の先頭文字数
+TRACKING_PREFIX_LENGTH = 3
+
+# activity-index のパーティションを1日あたりいくつに分けるか（変更すると既存の行は読み込まれなくなる）
+ACTIVITY_SHARDS = 8
+
+# JSON にしたときにこのバイト数以上になる属性は圧縮して Binary で保存する
+COMPRESSION_THRESHOLD_BYTES = 1024
+# 圧縮の対象にする属性（長いテキストやリストになりやすいもの）
+COMPRESSED_ATTRIBUTES = ('items', 'notes')
+# 圧縮した値の先頭1バイトに付ける形式のバージョン（1 = JSON を zlib で圧縮）
+CODEC_ZLIB_JSON = 1
 
 
 class UserRole(Enum):
@@ -31,6 +52,79 @@ class ShipmentStatus(Enum):
     CANCELLED = "cancelled"
 
 
+# 出荷ステータスの有効な遷移（配達完了・キャンセルは終端）
+SHIPMENT_STATUS_TRANSITIONS = {
+    ShipmentStatus.PENDING: {ShipmentStatus.IN_TRANSIT, ShipmentStatus.DELIVERED, ShipmentStatus.CANCELLED},
+    ShipmentStatus.IN_TRANSIT: {ShipmentStatus.DELIVERED, ShipmentStatus.CANCELLED},
+    ShipmentStatus.DELIVERED: set(),
+    ShipmentStatus.CANCELLED: set()
+}
+
+
+def _json_number(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def encode_attribute(value: Any) -> Any:
+    """しきい値以上の文字列・リスト・マップを圧縮した bytes にする（それ以外や圧縮しても小さくならない場合はそのまま返す）"""
+    if not isinstance(value, (str, list, dict)):
+        return value
+    data = json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=_json_number).encode('utf-8')
+    if len(data) < COMPRESSION_THRESHOLD_BYTES:
+        return value
+    encoded = bytes([CODEC_ZLIB_JSON]) + zlib.compress(data, 6)
+    return encoded if len(encoded) < len(data) else value
+
+
+def decode_attribute(value: Any) -> Any:
+    """encode_attribute で圧縮した値を元に戻す（圧縮されていない値はそのまま返す）"""
+    # DynamoDB から読み込んだ Binary 型は value に bytes を持つ
+    data = getattr(value, 'value', value)
+    if not isinstance(data, (bytes, bytearray)):
+        return value
+    if not data or data[0] != CODEC_ZLIB_JSON:
+        raise ValueError('Unsupported attribute encoding')
+    # DynamoDB から読み込んだ値と同じく数値は Decimal にする
+    return json.loads(zlib.decompress(data[1:]).decode('utf-8'), parse_float=Decimal, parse_int=Decimal)
+
+
+def compress_attributes(item: Dict[str, Any], names: Iterable[str] = COMPRESSED_ATTRIBUTES) -> Dict[str, Any]:
+    """DynamoDB に書き込むアイテムの大きな属性を圧縮したコピーを返す"""
+    compressed = dict(item)
+    for name in names:
+        if name in compressed:
+            compressed[name] = encode_attribute(compressed[name])
+    return compressed
+
+
+def decompress_attributes(item: Dict[str, Any], names: Iterable[str] = COMPRESSED_ATTRIBUTES) -> Dict[str, Any]:
+    """DynamoDB から読み込んだアイテムの圧縮された属性を元に戻したコピーを返す"""
+    decompressed = dict(item)
+    for name in names:
+        if name in decompressed:
+            decompressed[name] = decode_attribute(decompressed[name])
+    return decompressed
+
+
+class CompressedAttribute:
+    """圧縮されたまま保持し、最初に参照したときに展開するモデルの属性"""
+    
+    def __set_name__(self, owner: type, name: str) -> None:
+        self.name = '_' + name
+    
+    def __get__(self, instance: Any, owner: type) -> Any:
+        if instance is None:
+            return self
+        value = decode_attribute(instance.__dict__.get(self.name))
+        instance.__dict__[self.name] = value
+        return value
+    
+    def __set__(self, instance: Any, value: Any) -> None:
+        instance.__dict__[self.name] = value
+
+
 class User:
     """ユーザーモデル"""
     
@@ -52,9 +146,13 @@ class User:
     
     def to_dict(self) -> Dict[str, Any]:
         """辞書形式に変換"""
+        email_key = self.email.lower()
         return {
             'user_id': self.user_id,
             'email': self.email,
+            # email-index 用のキー（先頭文字でパーティションを分散し、小文字化したメールで前方一致検索する）
+            'email_initial': email_key[:1],
+            'email_key': email_key,
             'role': self.role.value,
             'permissions': self.permissions,
             'created_at': self.created_at,
@@ -77,21 +175,27 @@ class User:
 class PurchaseOrder:
     """購買発注書モデル"""
     
+    items = CompressedAttribute()
+    notes = CompressedAttribute()
+    
     def __init__(
         self,
         po_id: str,
         supplier: str,
-        items: List[Dict[str, Any]],
+        items: Optional[List[Dict[str, Any]]],
         total_amount: float,
         status: PurchaseOrderStatus,
         created_by: str,
         created_at: Optional[str] = None,
         updated_at: Optional[str] = None,
-        notes: Optional[str] = None
+        notes: Optional[str] = None,
+        line_count: Optional[int] = None
     ):
         self.po_id = po_id
         self.supplier = supplier
+        # 明細は PurchaseOrderLines に別に保存するため、ヘッダーだけを読み込んだ場合は None
         self.items = items
+        self.line_count = int(line_count) if line_count is not None else len(self.items or [])
         self.total_amount = total_amount
         self.status = status
         self.created_by = created_by
@@ -105,6 +209,23 @@ class PurchaseOrder:
             'po_id': self.po_id,
             'supplier': self.supplier,
             'items': self.items,
+            'line_count': len(self.items) if self.items is not None else self.line_count,
+            'total_amount': self.total_amount,
+            'status': self.status.value,
+            'created_by': self.created_by,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+            # activity-index 用のキー（更新日とシャード番号）
+            'activity_bucket': activity_bucket(self.po_id, self.updated_at),
+            'notes': self.notes
+        }
+    
+    def summary(self) -> Dict[str, Any]:
+        """一覧・変更フィードで返す形式（明細を含まない）"""
+        return {
+            'po_id': self.po_id,
+            'supplier': self.supplier,
+            'line_count': len(self.items) if self.items is not None else self.line_count,
             'total_amount': self.total_amount,
             'status': self.status.value,
             'created_by': self.created_by,
@@ -119,19 +240,22 @@ class PurchaseOrder:
         return cls(
             po_id=data['po_id'],
             supplier=data['supplier'],
-            items=data['items'],
+            items=data.get('items'),
             total_amount=data['total_amount'],
             status=PurchaseOrderStatus(data['status']),
             created_by=data['created_by'],
             created_at=data.get('created_at'),
             updated_at=data.get('updated_at'),
-            notes=data.get('notes')
+            notes=data.get('notes'),
+            line_count=data.get('line_count')
         )
 
 
 class Shipment:
     """出荷モデル"""
     
+    notes = CompressedAttribute()
+    
     def __init__(
         self,
         shipment_id: str,
@@ -144,7 +268,8 @@ class Shipment:
         actual_delivery: Optional[str] = None,
         created_at: Optional[str] = None,
         updated_at: Optional[str] = None,
-        notes: Optional[str] = None
+        notes: Optional[str] = None,
+        status_updated_at: Optional[str] = None
     ):
         self.shipment_id = shipment_id
         self.po_id = po_id
@@ -157,9 +282,33 @@ class Shipment:
         self.created_at = created_at or datetime.utcnow().isoformat()
         self.updated_at = updated_at or datetime.utcnow().isoformat()
         self.notes = notes
+        # 最後にステータスが変わった日時（運送会社のイベントでは発生日時）
+        self.status_updated_at = status_updated_at
     
     def to_dict(self) -> Dict[str, Any]:
         """辞書形式に変換"""
+        tracking_number = normalize_tracking_number(self.tracking_number)
+        return {
+            'shipment_id': self.shipment_id,
+            'po_id': self.po_id,
+            'tracking_number': self.tracking_number,
+            # tracking-number-index 用のキー（追跡番号の先頭でパーティションを分散し、運送会社ごとに一意にする）
+            'tracking_prefix': tracking_number[:TRACKING_PREFIX_LENGTH],
+            'tracking_key': tracking_key(self.tracking_number, self.carrier),
+            'carrier': self.carrier,
+            'status': self.status.value,
+            'created_by': self.created_by,
+            'estimated_delivery': self.estimated_delivery,
+            'actual_delivery': self.actual_delivery,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+            'activity_bucket': activity_bucket(self.shipment_id, self.updated_at),
+            'notes': self.notes,
+            'status_updated_at': self.status_updated_at
+        }
+    
+    def summary(self) -> Dict[str, Any]:
+        """一覧・変更フィードで返す形式"""
         return {
             'shipment_id': self.shipment_id,
             'po_id': self.po_id,
@@ -188,10 +337,31 @@ class Shipment:
             actual_delivery=data.get('actual_delivery'),
             created_at=data.get('created_at'),
             updated_at=data.get('updated_at'),
-            notes=data.get('notes')
+            notes=data.get('notes'),
+            status_updated_at=data.get('status_updated_at')
         )
 
 
+def normalize_tracking_number(tracking_number: str) -> str:
+    """追跡番号を比較用に正規化（全角・小文字・空白・ハイフンの違いを無視）"""
+    return re.sub(r'[\s\-]', '', unicodedata.normalize('NFKC', str(tracking_number))).upper()
+
+
+def tracking_key(tracking_number: str, carrier: str) -> str:
+    """追跡番号と運送会社の組み合わせのキー（この組み合わせで出荷を一意にする）"""
+    carrier_key = unicodedata.normalize('NFKC', str(carrier)).strip().casefold()
+    return f'{normalize_tracking_number(tracking_number)}#{carrier_key}'
+
+
+def activity_bucket(item_id: str, updated_at: str) -> str:
+    """activity-index のパーティションキー（<更新日>#<シャード番号>）
+
+    全件の新しい順を1つのパーティションで持つと書き込みが集中するため、日付ごとに ID のハッシュで
+    ACTIVITY_SHARDS 個に分けます。同じアイテムは常に同じシャードに入ります。
+    """
+    return f'{updated_at[:10]}#{zlib.crc32(item_id.encode("utf-8")) % ACTIVITY_SHARDS}'
+
+
 def generate_id() -> str:
     """ユニークIDを生成"""
     return str(uuid.uuid4())
\ No newline at end of file
@@ -0,0 +1,306 @@
+"""
+オブジェクトストレージ
+
+エクスポート・インポート等の大きなファイルを扱うため、書き込みはマルチパートアップロード、
+読み込みはストリームで行います。バックエンドは OBJECT_STORAGE_BACKEND で切り替えます
+（未指定の場合は OBJECT_STORAGE_BUCKET の有無で判定）。
+
+- s3: OBJECT_STORAGE_BUCKET の S3 バケット。ダウンロードには署名付き URL を発行
+- local: LOCAL_STORAGE_DIR 配下のファイル（テスト・ローカル開発用）。URL は file:// 形式
+"""
+import io
+import os
+import shutil
+import tempfile
+from typing import Any, BinaryIO, Iterator, List, Optional
+from botocore.exceptions import ClientError
+from utils import get_s3_client
+
+
+# S3 のマルチパートアップロードのパートサイズ（最後のパート以外は 5MB 以上が必要）
+PART_SIZE = 8 * 1024 * 1024
+DEFAULT_URL_EXPIRES_SECONDS = 3600
+# ローカルストレージで書き込み中のファイル名の接頭辞（一覧には含めない）
+TEMP_PREFIX = '.tmp-'
+
+
+class ObjectWriter:
+    """ストリーム書き込みのインターフェース（close で確定、abort で破棄）"""
+
+    def write(self, data: bytes) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        raise NotImplementedError
+
+    def abort(self) -> None:
+        raise NotImplementedError
+
+    @property
+    def size(self) -> int:
+        raise NotImplementedError
+
+    def __enter__(self) -> 'ObjectWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class S3MultipartWriter(ObjectWriter):
+    """PART_SIZE ごとにパートをアップロードするライター（バッファは1パート分のみ）"""
+
+    def __init__(self, client: Any, bucket: str, key: str, content_type: str):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.upload_id: Optional[str] = None
+        self.parts: List[dict] = []
+        self.buffer = bytearray()
+        self._size = 0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def write(self, data: bytes) -> None:
+        self.buffer.extend(data)
+        self._size += len(data)
+        if len(self.buffer) >= PART_SIZE:
+            self._upload_part()
+
+    def _upload_part(self) -> None:
+        if self.upload_id is None:
+            self.upload_id = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType=self.content_type
+            )['UploadId']
+        part_number = len(self.parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            PartNumber=part_number, Body=bytes(self.buffer)
+        )
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+        self.buffer.clear()
+
+    def close(self) -> None:
+        if self.upload_id is None:
+            # 1パートに満たない小さなファイルは通常の PutObject で保存する
+            self.client.put_object(
+                Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer), ContentType=self.content_type
+            )
+            self.buffer.clear()
+            return
+        if self.buffer:
+            self._upload_part()
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={'Parts': self.parts}
+        )
+
+    def abort(self) -> None:
+        if self.upload_id is not None:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        self.buffer.clear()
+
+
+class LocalFileWriter(ObjectWriter):
+    """一時ファイルに書き込み、close で正式なパスに移動するライター"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix=TEMP_PREFIX, delete=False)
+        self._size = 0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def write(self, data: bytes) -> None:
+        self._file.write(data)
+        self._size += len(data)
+
+    def close(self) -> None:
+        self._file.close()
+        os.replace(self._file.name, self.path)
+
+    def abort(self) -> None:
+        self._file.close()
+        os.unlink(self._file.name)
+
+
+class S3Storage:
+    """S3 バケットのストレージ"""
+
+    def __init__(self, bucket: str):
+        self.bucket = bucket
+        self.client = get_s3_client()
+
+    def open_writer(self, key: str, content_type: str = 'application/octet-stream') -> ObjectWriter:
+        return S3MultipartWriter(self.client, self.bucket, key, content_type)
+
+    def open_reader(self, key: str, offset: int = 0) -> BinaryIO:
+        """オブジェクトを offset バイト目からストリームで読むファイルオブジェクト（read / close）を返す"""
+        if not offset:
+            return self.client.get_object(Bucket=self.bucket, Key=key)['Body']
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=key, Range=f'bytes={offset}-')['Body']
+        except ClientError as e:
+            # offset がオブジェクトの末尾の場合
+            if e.response['Error']['Code'] == 'InvalidRange':
+                return io.BytesIO(b'')
+            raise
+
+    def put_bytes(self, key: str, data: bytes, content_type: str = 'application/octet-stream') -> None:
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data, ContentType=content_type)
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+
+    def read_range(self, key: str, offset: int, length: int) -> Optional[bytes]:
+        """オブジェクトの一部（offset から length バイト）を Range 指定で取得"""
+        try:
+            return self.client.get_object(
+                Bucket=self.bucket, Key=key, Range=f'bytes={offset}-{offset + length - 1}'
+            )['Body'].read()
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+
+    def list_keys(self, prefix: str) -> Iterator[str]:
+        params = {'Bucket': self.bucket, 'Prefix': prefix}
+        while True:
+            response = self.client.list_objects_v2(**params)
+            for obj in response.get('Contents', []):
+                yield obj['Key']
+            if not response.get('IsTruncated'):
+                return
+            params['ContinuationToken'] = response['NextContinuationToken']
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def presigned_url(self, key: str, expires_in: int = DEFAULT_URL_EXPIRES_SECONDS) -> str:
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': key}, ExpiresIn=expires_in
+        )
+
+    def presigned_upload_url(self, key: str, expires_in: int = DEFAULT_URL_EXPIRES_SECONDS) -> str:
+        """クライアントが直接アップロードするための PUT 用署名付き URL"""
+        return self.client.generate_presigned_url(
+            'put_object', Params={'Bucket': self.bucket, 'Key': key}, ExpiresIn=expires_in
+        )
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return False
+            raise
+
+
+class LocalStorage:
+    """ローカルファイルシステムのストレージ（S3 のスタンドイン）"""
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+
+    def _path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f'Invalid object key: {key}')
+        return path
+
+    def open_writer(self, key: str, content_type: str = 'application/octet-stream') -> ObjectWriter:
+        return LocalFileWriter(self._path(key))
+
+    def open_reader(self, key: str, offset: int = 0) -> BinaryIO:
+        f = open(self._path(key), 'rb')
+        f.seek(offset)
+        return f
+
+    def put_bytes(self, key: str, data: bytes, content_type: str = 'application/octet-stream') -> None:
+        with self.open_writer(key) as writer:
+            writer.write(data)
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def read_range(self, key: str, offset: int, length: int) -> Optional[bytes]:
+        try:
+            with open(self._path(key), 'rb') as f:
+                f.seek(offset)
+                return f.read(length)
+        except FileNotFoundError:
+            return None
+
+    def list_keys(self, prefix: str) -> Iterator[str]:
+        keys = []
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if name.startswith(TEMP_PREFIX):
+                    continue
+                key = os.path.relpath(os.path.join(directory, name), self.root).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    keys.append(key)
+        # S3 と同じくキーの昇順で返す
+        yield from sorted(keys)
+
+    def delete(self, key: str) -> None:
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def presigned_url(self, key: str, expires_in: int = DEFAULT_URL_EXPIRES_SECONDS) -> str:
+        return 'file://' + self._path(key)
+
+    def presigned_upload_url(self, key: str, expires_in: int = DEFAULT_URL_EXPIRES_SECONDS) -> str:
+        os.makedirs(os.path.dirname(self._path(key)), exist_ok=True)
+        return 'file://' + self._path(key)
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self._path(key))
+
+    def clear(self) -> None:
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+_storage: Optional[Any] = None
+
+
+def get_object_storage():
+    """コンテナ内で共有するストレージを取得"""
+    global _storage
+    if _storage is None:
+        bucket = os.environ.get('OBJECT_STORAGE_BUCKET')
+        backend = os.environ.get('OBJECT_STORAGE_BACKEND') or ('s3' if bucket else 'local')
+        if backend == 's3':
+            _storage = S3Storage(bucket)
+        else:
+            _storage = LocalStorage(os.environ.get(
+                'LOCAL_STORAGE_DIR', os.path.join(tempfile.gettempdir(), 'po-shipment-storage')
+            ))
+    return _storage
+
+
+def reset_object_storage() -> None:
+    """ストレージの選択を破棄（テスト用）"""
+    global _storage
+    _storage = None
@@ -0,0 +1,405 @@
+"""
+発注書の一括インポート
+
+ERP から出力した NDJSON / CSV（gzip 圧縮も可）をオブジェクトストレージにアップロードし、
+バックグラウンドジョブで取り込みます。
+
+1. POST /imports/purchase-orders/uploads でアップロード用の署名付き URL を取得してファイルを PUT
+2. POST /imports/purchase-orders でインポートジョブを登録
+3. GET /imports/{job_id} で進捗と、不正な行をまとめたファイル（rejects）の URL を取得
+
+ファイルは先頭から少しずつ読み、IMPORT_WINDOW_ROWS 行ごとに検証して
+BatchWriteItem（25件単位）を IMPORT_WRITE_WORKERS 個のスレッドで並列に書き込みます。
+明細は PurchaseOrderLines に先に書き込み、その後でヘッダーを書き込みます。
+ウィンドウごとにジョブの進捗（処理済みの行番号とファイル上のバイト位置）を保存するので、
+失敗した場合も再試行時にその位置からファイルを読み直して再開します（gzip は途中から展開できないため、先頭から読んで読み飛ばします）。
+行番号から決まる po_id を使うため、再開時に同じ行を書き直しても重複は発生しません。
+po_id を指定した行は、その発注書がすでにある場合（同じジョブで書き込んだものを除く）は取り込まずに rejects に入れます。
+"""
+import codecs
+import itertools
+import json
+import os
+import random
+import time
+import uuid
+from concurrent.futures import Future
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Any, BinaryIO, Iterator, List, Optional, Set, Tuple
+from utils import (
+    create_response,
+    create_error_response,
+    require_auth,
+    require_admin,
+    get_dynamodb_resource,
+    get_path_parameter,
+    validate_required_fields,
+    to_dynamodb_item,
+    int_env,
+    prime_dynamodb
+)
+from instrumentation import TracedThreadPoolExecutor, traced_handler
+from warmup import register_primer
+from jobs import (
+    JOB_TIME_BUDGET_SECONDS,
+    ContinueJob,
+    PermanentJobError,
+    enqueue_job,
+    get_job,
+    get_job_queue,
+    job_to_response,
+    register_job,
+    update_job_progress
+)
+from object_storage import get_object_storage
+from record_io import FORMAT_CSV, FORMAT_NDJSON, iter_records, iter_text_lines, encode_records
+from search_index import DOC_PURCHASE_ORDER, index_documents
+from change_log import record_changes
+from po_lines import header_item, line_rows
+from repository import PURCHASE_ORDER, get_repository
+from models import PurchaseOrder, PurchaseOrderStatus, compress_attributes, generate_id
+
+
+BATCH_SIZE = 25
+BATCH_GET_SIZE = 100
+# 検索インデックス・変更履歴を1つのスレッドで書き込む行数
+SIDE_WRITE_ROWS = 500
+DEFAULT_WINDOW_ROWS = 5000
+DEFAULT_WRITE_WORKERS = 8
+MAX_BATCH_RETRIES = 8
+
+
+register_primer('dynamodb', lambda: prime_dynamodb(os.environ.get('JOBS_TABLE')), 'imports')
+register_primer('job_queue', get_job_queue, 'imports')
+register_primer('object_storage', get_object_storage, 'imports')
+
+
+@traced_handler('imports')
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """インポートのメインハンドラー"""
+    http_method = event['httpMethod']
+    path = event['path']
+
+    try:
+        if path == '/imports/purchase-orders/uploads' and http_method == 'POST':
+            return create_upload(event, context)
+        elif path == '/imports/purchase-orders' and http_method == 'POST':
+            return create_import(event, context)
+        elif path.startswith('/imports/') and http_method == 'GET':
+            return get_import(event, context)
+        else:
+            return create_error_response(404, 'Endpoint not found')
+
+    except Exception as e:
+        print(f"Error in imports handler: {str(e)}")
+        return create_error_response(500, 'Internal server error')
+
+
+@require_auth
+@require_admin
+def create_upload(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """インポートするファイルのアップロード先を発行（管理者のみ）"""
+    key = f'imports/uploads/{generate_id()}'
+    return create_response(201, {
+        'key': key,
+        'upload_url': get_object_storage().presigned_upload_url(key, int_env('IMPORT_UPLOAD_URL_EXPIRES_SECONDS', 3600))
+    })
+
+
+@require_auth
+@require_admin
+def create_import(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """アップロード済みファイルのインポートジョブを登録（管理者のみ）"""
+    try:
+        body = json.loads(event['body'] or '{}')
+    except json.JSONDecodeError:
+        return create_error_response(400, 'Invalid JSON in request body')
+
+    is_valid, error_msg = validate_required_fields(body, ['key'])
+    if not is_valid:
+        return create_error_response(400, error_msg)
+    key = body['key']
+    if not key.startswith('imports/uploads/'):
+        return create_error_response(400, 'key must be an upload key issued by /imports/purchase-orders/uploads')
+    fmt = body.get('format', FORMAT_NDJSON)
+    if fmt not in (FORMAT_NDJSON, FORMAT_CSV):
+        return create_error_response(400, 'format must be ndjson or csv')
+    if not get_object_storage().exists(key):
+        return create_error_response(400, 'Uploaded file not found')
+
+    job = enqueue_job(
+        'po_import',
+        {'key': key, 'format': fmt, 'compressed': bool(body.get('compressed', False))},
+        created_by=event['user'].get('sub')
+    )
+    return create_response(202, {'message': 'Import started', 'job': job_to_response(job)})
+
+
+@require_auth
+@require_admin
+def get_import(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """インポートの進捗を取得（完了後は rejects ファイルの URL を含む）"""
+    job_id = get_path_parameter(event, 'job_id')
+    job = get_job(job_id) if job_id else None
+    if not job or job['job_type'] != 'po_import':
+        return create_error_response(404, 'Import not found')
+
+    response = {'job': job_to_response(job)}
+    rejects_key = (job.get('result') or {}).get('rejects_key')
+    if rejects_key:
+        response['rejects_url'] = get_object_storage().presigned_url(rejects_key)
+    return create_response(200, response)
+
+
+def _parse_decimal(value: Any) -> Optional[Decimal]:
+    if isinstance(value, bool):
+        return None
+    try:
+        number = Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        return None
+    return number if number.is_finite() else None
+
+
+def _validate_row(record: Dict[str, Any], created_by: str, job_id: str,
+                  row_number: int) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """1行を検証し、(保存するアイテム, エラー) を返す（create_purchase_order と同じ規則）"""
+    is_valid, error_msg = validate_required_fields(record, ['supplier', 'items', 'total_amount'])
+    if not is_valid:
+        return None, error_msg
+
+    items = record['items']
+    if isinstance(items, str):
+        # CSV では明細を JSON 文字列で受け取る
+        try:
+            items = json.loads(items, parse_float=Decimal)
+        except json.JSONDecodeError:
+            return None, 'items must be a JSON list'
+    if not isinstance(items, list) or len(items) == 0:
+        return None, 'Items must be a non-empty list'
+    for item in items:
+        if not isinstance(item, dict) or 'name' not in item or 'quantity' not in item or 'unit_price' not in item:
+            return None, 'Each item must have name, quantity, and unit_price'
+
+    total_amount = _parse_decimal(record['total_amount'])
+    if total_amount is None or total_amount <= 0:
+        return None, 'Total amount must be a positive number'
+
+    try:
+        status = PurchaseOrderStatus(record.get('status') or PurchaseOrderStatus.DRAFT.value)
+    except ValueError:
+        return None, 'Invalid status'
+
+    purchase_order = PurchaseOrder(
+        # 再開時に同じ行から同じ ID が得られるよう、ID がない行はジョブ ID と行番号から決める
+        po_id=str(record.get('po_id') or uuid.uuid5(uuid.NAMESPACE_URL, f'po-import:{job_id}:{row_number}')),
+        supplier=str(record['supplier']),
+        items=items,
+        total_amount=total_amount,
+        status=status,
+        created_by=created_by,
+        created_at=record.get('created_at') or None,
+        notes=record.get('notes') or None
+    )
+    item = to_dynamodb_item(purchase_order.to_dict())
+    # 再開時に、前回の試行で書き込んだ発注書と既存の発注書を区別するため
+    item['import_job_id'] = job_id
+    return item, None
+
+
+def _existing_po_ids(dynamodb: Any, repository: Any, po_ids: Set[str], job_id: str) -> Set[str]:
+    """すでにある（このジョブ以外で作成された）発注書の po_id を BatchGetItem で調べる"""
+    table_name = repository.table_name(PURCHASE_ORDER)
+    keys = [repository.key(PURCHASE_ORDER, {'po_id': po_id}) for po_id in sorted(po_ids)]
+    existing: Set[str] = set()
+    for i in range(0, len(keys), BATCH_GET_SIZE):
+        request = {table_name: {
+            'Keys': keys[i:i + BATCH_GET_SIZE],
+            'ProjectionExpression': 'po_id, import_job_id',
+            'ConsistentRead': True
+        }}
+        while request:
+            response = dynamodb.batch_get_item(RequestItems=request)
+            for item in response['Responses'].get(table_name, []):
+                if item.get('import_job_id') != job_id:
+                    existing.add(item['po_id'])
+            request = response.get('UnprocessedKeys')
+    return existing
+
+
+def _validate_window(rows: List[Tuple[int, Optional[Dict[str, Any]], Optional[str]]], created_by: str,
+                     job_id: str, existing: Set[str]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """ウィンドウ内の行をまとめて検証（同じ po_id が複数ある場合は最初の行のみ取り込む）"""
+    items: List[Dict[str, Any]] = []
+    rejects: List[Dict[str, Any]] = []
+    seen = set()
+    for row_number, record, error in rows:
+        item = None
+        if not error:
+            item, error = _validate_row(record, created_by, job_id, row_number)
+        if not error and item['po_id'] in seen:
+            error = 'Duplicate po_id in file'
+        if not error and item['po_id'] in existing:
+            # 既存の発注書を上書きすると明細やキャッシュと食い違うため取り込まない
+            error = 'Purchase order already exists'
+        if error:
+            rejects.append({'row': row_number, 'error': error, 'record': record})
+            continue
+        seen.add(item['po_id'])
+        items.append(item)
+    return items, rejects
+
+
+def _write_batch(dynamodb: Any, table_name: str, items: List[Dict[str, Any]]) -> None:
+    """BatchWriteItem で書き込み、未処理のアイテムはジッター付きの指数バックオフで再送"""
+    request = {table_name: [{'PutRequest': {'Item': item}} for item in items]}
+    for attempt in range(MAX_BATCH_RETRIES):
+        response = dynamodb.batch_write_item(RequestItems=request)
+        request = response.get('UnprocessedItems') or {}
+        if not request:
+            return
+        time.sleep(random.uniform(0, min(2.0, 0.05 * 2 ** attempt)))
+    raise RuntimeError(f'BatchWriteItem left {len(request.get(table_name, []))} unprocessed items')
+
+
+def _chunks(records: List[Dict[str, Any]], size: int) -> List[List[Dict[str, Any]]]:
+    return [records[i:i + size] for i in range(0, len(records), size)]
+
+
+def _submit_batches(executor: Any, dynamodb: Any, table_name: str, records: List[Dict[str, Any]]) -> List[Future]:
+    return [executor.submit(_write_batch, dynamodb, table_name, batch) for batch in _chunks(records, BATCH_SIZE)]
+
+
+def _wait(futures: List[Future]) -> None:
+    """すべての書き込みの完了（または最初の例外）を待つ。チェックポイントはその後で進める"""
+    for future in futures:
+        future.result()
+
+
+def _windows(rows: Iterator[Tuple[int, Optional[Dict[str, Any]], Optional[str]]], size: int,
+             after_row: int) -> Iterator[List[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]]:
+    window = []
+    for row in rows:
+        if row[0] <= after_row:
+            continue
+        window.append(row)
+        if len(window) >= size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+
+class _CountingLines:
+    """テキスト行を返しながら、読み終えた位置（ファイル先頭からのバイト数）を数える"""
+
+    def __init__(self, lines: Iterator[str], offset: int):
+        self._lines = lines
+        self.offset = offset
+
+    def __iter__(self) -> Iterator[str]:
+        for line in self._lines:
+            self.offset += len(line.encode('utf-8'))
+            yield line
+
+
+def _open_rows(storage: Any, payload: Dict[str, Any], progress: Dict[str, Any]) -> Tuple[
+        BinaryIO, _CountingLines, Optional[str], Iterator[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]]:
+    """ファイルを開き、(reader, 読み終えた位置, CSV のヘッダー行, 行) を返す
+
+    非圧縮のファイルは前回のチェックポイントのバイト位置から読み始め、行番号はその続きから振ります。
+    """
+    compressed = payload.get('compressed', False)
+    offset = 0 if compressed else int(progress.get('offset', 0))
+    start = offset
+    if not offset and not compressed and storage.read_range(payload['key'], 0, 3) == codecs.BOM_UTF8:
+        # BOM は行のテキストに含まれないため、その分を位置に足しておく
+        start = len(codecs.BOM_UTF8)
+    reader = storage.open_reader(payload['key'], offset)
+    counter = _CountingLines(iter_text_lines(reader.read, compressed), start)
+    lines: Iterator[str] = iter(counter)
+    header = None
+    if payload['format'] == FORMAT_CSV:
+        # 途中から読む場合は保存しておいたヘッダー行（1行）を前に付ける
+        header = progress['csv_header'] if offset else next(lines, '')
+        lines = itertools.chain([header], lines)
+    rows = iter_records(lines, payload['format'])
+    if offset:
+        rows = ((row_number + int(progress['row']), record, error) for row_number, record, error in rows)
+    return reader, counter, header, rows
+
+
+def _merge_rejects(storage: Any, job_id: str, keys: List[str]) -> Optional[str]:
+    """ウィンドウごとの rejects を1つのファイルにまとめる"""
+    if not keys:
+        return None
+    rejects_key = f'imports/{job_id}/rejects.ndjson'
+    with storage.open_writer(rejects_key, 'application/x-ndjson') as writer:
+        for key in keys:
+            writer.write(storage.get_bytes(key) or b'')
+    for key in keys:
+        storage.delete(key)
+    return rejects_key
+
+
+@register_job('po_import')
+def run_po_import(payload: Dict[str, Any], job: Dict[str, Any]) -> Dict[str, Any]:
+    """アップロードされたファイルを取り込むジョブ（進捗から再開可能）"""
+    job_id = job['job_id']
+    progress = job.get('progress') or {}
+    last_row = int(progress.get('row', 0))
+    imported = int(progress.get('imported', 0))
+    rejected = int(progress.get('rejected', 0))
+    reject_parts = list(progress.get('reject_parts', []))
+
+    storage = get_object_storage()
+    if not storage.exists(payload['key']):
+        raise PermanentJobError('Uploaded file not found')
+    dynamodb = get_dynamodb_resource()
+    repository = get_repository()
+    table_name = repository.table_name(PURCHASE_ORDER)
+    lines_table_name = os.environ['PURCHASE_ORDER_LINES_TABLE']
+    deadline = time.monotonic() + int_env('IMPORT_TIME_BUDGET_SECONDS', JOB_TIME_BUDGET_SECONDS)
+
+    reader, counter, csv_header, rows = _open_rows(storage, payload, progress)
+    try:
+        with TracedThreadPoolExecutor(max_workers=int_env('IMPORT_WRITE_WORKERS', DEFAULT_WRITE_WORKERS)) as executor:
+            for window in _windows(rows, int_env('IMPORT_WINDOW_ROWS', DEFAULT_WINDOW_ROWS), last_row):
+                explicit_ids = {str(record['po_id']) for _, record, _ in window if record and record.get('po_id')}
+                existing = _existing_po_ids(dynamodb, repository, explicit_ids, job_id) if explicit_ids else set()
+                items, rejects = _validate_window(window, job.get('created_by'), job_id, existing)
+                # 明細をすべて書き込んでからヘッダーを書き込む（ヘッダーがない明細は読まれない）
+                lines = [row for item in items for row in line_rows(item['po_id'], item['items'])]
+                headers = [repository.to_storage(PURCHASE_ORDER, compress_attributes(header_item(item))) for item in items]
+                _wait(_submit_batches(executor, dynamodb, lines_table_name, lines))
+                # 検索インデックスと変更履歴の書き込みも同じスレッドでヘッダーと並行して行う
+                futures = _submit_batches(executor, dynamodb, table_name, headers)
+                for chunk in _chunks(items, SIDE_WRITE_ROWS):
+                    futures.append(executor.submit(index_documents, DOC_PURCHASE_ORDER, chunk))
+                    futures.append(executor.submit(record_changes, PURCHASE_ORDER, chunk))
+                _wait(futures)
+                if rejects:
+                    part_key = f'imports/{job_id}/rejects/{window[0][0]:010d}.ndjson'
+                    storage.put_bytes(part_key, ''.join(encode_records(rejects, FORMAT_NDJSON)).encode('utf-8'))
+                    reject_parts.append(part_key)
+
+                last_row = window[-1][0]
+                imported += len(items)
+                rejected += len(rejects)
+                checkpoint = {'row': last_row, 'imported': imported, 'rejected': rejected, 'reject_parts': reject_parts}
+                if not payload.get('compressed', False):
+                    checkpoint['offset'] = counter.offset
+                if csv_header is not None:
+                    checkpoint['csv_header'] = csv_header
+                update_job_progress(job_id, checkpoint)
+                if time.monotonic() > deadline:
+                    raise ContinueJob()
+    finally:
+        reader.close()
+
+    return {
+        'rows': last_row,
+        'imported': imported,
+        'rejected': rejected,
+        'rejects_key': _merge_rejects(storage, job_id, reject_parts)
+    }
@@ -0,0 +1,142 @@
+"""
+発注書の明細（PurchaseOrderLines テーブル）
+
+明細は発注書の行（ヘッダー）とは別に (po_id, line_no) をキーとするアイテムとして保存し、
+ヘッダーには明細数（line_count）だけを持たせます。一覧のスキャンや明細を必要としない読み込みは
+ヘッダーの分の RCU だけで済み、明細の多い発注書でも 400KB のアイテム上限に近づきません。
+
+- line_no は 1 から連番です。書き込みは明細 → ヘッダーの順に行い、読み込みは
+  line_no <= line_count の範囲だけを Query するので、明細を減らす更新の途中や失敗で残った古い明細は読まれません
+- 分割前に作成された発注書（ヘッダーに items を持つ行）やアーカイブ済みの発注書は items をそのまま使います。
+  tools/split_purchase_order_lines.py で既存の行を分割できます
+- 明細全体が必要な処理（エクスポート・アーカイブ・検索インデックスの再構築・一覧の include_items）は
+  with_items で LINE_LOAD_WORKERS 個のスレッドで並行して Query します
+"""
+import os
+from collections import deque
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from utils import get_dynamodb_resource, int_env
+from instrumentation import TracedThreadPoolExecutor
+from models import decode_attribute
+
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+DEFAULT_LOAD_WORKERS = 8
+# 読み込み中の発注書の上限（ワーカー数あたり）。スキャンの結果を全件メモリに載せないようにする
+LOAD_AHEAD_PER_WORKER = 4
+
+
+def _lines_table():
+    return get_dynamodb_resource().Table(os.environ['PURCHASE_ORDER_LINES_TABLE'])
+
+
+def _inline_items(item: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+    """ヘッダーに持っている明細（圧縮されていれば展開する）。PurchaseOrderLines に分割済みの行は None"""
+    items = decode_attribute(item.get('items'))
+    return items if isinstance(items, list) else None
+
+
+def line_count(item: Dict[str, Any]) -> int:
+    """発注書の明細数（items を持つ行はその件数）"""
+    items = _inline_items(item)
+    if items is not None:
+        return len(items)
+    return int(item.get('line_count') or 0)
+
+
+def line_rows(po_id: str, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """明細を PurchaseOrderLines のアイテムに変換（line_no は振り直す）"""
+    rows = []
+    for line_no, line in enumerate(items, 1):
+        row = {k: v for k, v in line.items() if k not in ('po_id', 'line_no')}
+        row.update({'po_id': po_id, 'line_no': line_no})
+        rows.append(row)
+    return rows
+
+
+def header_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    """発注書のアイテムから items を除き、line_count を設定したヘッダーを返す"""
+    header = {k: v for k, v in item.items() if k != 'items'}
+    header['line_count'] = line_count(item)
+    return header
+
+
+def write_lines(po_id: str, items: List[Dict[str, Any]], previous_count: int = 0) -> None:
+    """明細を書き込み、以前より減った分の明細を削除する"""
+    with _lines_table().batch_writer(overwrite_by_pkeys=['po_id', 'line_no']) as batch:
+        for row in line_rows(po_id, items):
+            batch.put_item(Item=row)
+        for line_no in range(len(items) + 1, previous_count + 1):
+            batch.delete_item(Key={'po_id': po_id, 'line_no': line_no})
+
+
+def delete_lines(line_counts: Iterable[Tuple[str, int]]) -> None:
+    """(po_id, 明細数) ごとに発注書の明細をすべて削除する"""
+    with _lines_table().batch_writer(overwrite_by_pkeys=['po_id', 'line_no']) as batch:
+        for po_id, count in line_counts:
+            for line_no in range(1, count + 1):
+                batch.delete_item(Key={'po_id': po_id, 'line_no': line_no})
+
+
+def _to_line(row: Dict[str, Any]) -> Dict[str, Any]:
+    line = {k: v for k, v in row.items() if k != 'po_id'}
+    line['line_no'] = int(row['line_no'])
+    return line
+
+
+def _query_lines(po_id: str, first: int, last: int) -> List[Dict[str, Any]]:
+    """line_no が first〜last の明細を Query で読み込む"""
+    if last < first:
+        return []
+    table = _lines_table()
+    params: Dict[str, Any] = {
+        'KeyConditionExpression': 'po_id = :po_id AND line_no BETWEEN :first AND :last',
+        'ExpressionAttributeValues': {':po_id': po_id, ':first': first, ':last': last}
+    }
+    lines: List[Dict[str, Any]] = []
+    while True:
+        response = table.query(**params)
+        lines.extend(_to_line(row) for row in response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return lines
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def load_items_page(item: Dict[str, Any], start: int = 1,
+                    limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """line_no が start 以降の明細を最大 limit 件返す。(明細, 次のページの line_no または None)"""
+    count = line_count(item)
+    last = min(start + limit - 1, count)
+    items = _inline_items(item)
+    if items is not None:
+        lines = [dict(line, line_no=line_no) for line_no, line in enumerate(items[start - 1:last], start)]
+    else:
+        lines = _query_lines(item['po_id'], start, last)
+    return lines, (last + 1 if last < count else None)
+
+
+def load_all_items(item: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """発注書の明細をすべて返す"""
+    items = _inline_items(item)
+    if items is not None:
+        return items
+    return _query_lines(item['po_id'], 1, line_count(item))
+
+
+def with_items(items: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """ヘッダーに明細を読み込んで items を付けて返す（エクスポートやアーカイブなど明細全体が必要な処理用）
+
+    明細の Query は発注書ごとに並行して行い、結果は items の順に返します。
+    """
+    workers = max(1, int_env('LINE_LOAD_WORKERS', DEFAULT_LOAD_WORKERS))
+    with TracedThreadPoolExecutor(max_workers=workers) as executor:
+        pending: deque = deque()
+        for item in items:
+            pending.append((item, executor.submit(load_all_items, item)))
+            if len(pending) >= workers * LOAD_AHEAD_PER_WORKER:
+                head, future = pending.popleft()
+                yield dict(head, items=future.result())
+        while pending:
+            head, future = pending.popleft()
+            yield dict(head, items=future.result())
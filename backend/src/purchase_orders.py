@@ -2,10 +2,11 @@
 購買発注書管理関連のLambda関数
 
 購買発注書のCRUD操作を提供します。
+明細は PurchaseOrderLines に別に保存し（po_lines を参照）、一覧はヘッダーだけを返します。
 """
 import json
 import os
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 import boto3
 from botocore.exceptions import ClientError
@@ -17,11 +18,47 @@ from utils import (
     get_path_parameter,
     get_query_parameter,
     validate_required_fields,
-    handle_dynamodb_error
+    handle_dynamodb_error,
+    to_dynamodb_item,
+    encode_cursor,
+    decode_cursor,
+    prime_dynamodb
 )
-from models import PurchaseOrder, PurchaseOrderStatus, UserRole, generate_id
+from instrumentation import traced_handler
+from warmup import register_primer
+from idempotency import idempotent
+from item_cache import get_item_cache
+from archival import load_archived
+from search_index import DOC_PURCHASE_ORDER, index_documents, remove_document
+from change_log import record_changes, record_deletions
+from po_lines import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    delete_lines,
+    header_item,
+    line_count,
+    load_all_items,
+    load_items_page,
+    with_items,
+    write_lines
+)
+from repository import PURCHASE_ORDER, get_repository
+from models import (
+    PurchaseOrder,
+    PurchaseOrderStatus,
+    Shipment,
+    UserRole,
+    compress_attributes,
+    decompress_attributes,
+    generate_id
+)
+
+
+register_primer('dynamodb', lambda: prime_dynamodb(get_repository().table_name(PURCHASE_ORDER)), 'purchase_orders')
+register_primer('item_cache', lambda: get_item_cache('purchase_orders'), 'purchase_orders')
 
 
+@traced_handler('purchase_orders')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """購買発注書管理のメインハンドラー"""
     http_method = event['httpMethod']
@@ -32,6 +69,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             return get_purchase_orders(event, context)
         elif path == '/purchase-orders' and http_method == 'POST':
             return create_purchase_order(event, context)
+        elif path.startswith('/purchase-orders/') and path.endswith('/items') and http_method == 'GET':
+            return get_purchase_order_items(event, context)
         elif path.startswith('/purchase-orders/') and http_method == 'GET':
             return get_purchase_order(event, context)
         elif path.startswith('/purchase-orders/') and http_method == 'PUT':
@@ -48,39 +87,35 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 
 @require_auth
 def get_purchase_orders(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    """購買発注書の一覧を取得"""
+    """購買発注書の一覧を取得（ヘッダーのみ。include=items を指定すると明細も返す）"""
     try:
+        include_items = get_query_parameter(event, 'include') == 'items'
+        
         user = event.get('user', {})
         user_role = user.get('custom:role', 'user')
         user_id = user.get('sub')
         
-        dynamodb = get_dynamodb_resource()
-        po_table = dynamodb.Table(os.environ['PURCHASE_ORDERS_TABLE'])
+        repository = get_repository()
+        po_table = repository.table(PURCHASE_ORDER)
         
         # 管理者はすべての発注書を閲覧可能、一般ユーザーは自分が作成したもののみ
         if user_role == UserRole.ADMIN.value:
-            response = po_table.scan()
+            response = po_table.scan(**repository.scan_params(PURCHASE_ORDER))
         else:
             # 一般ユーザーの場合、created_byでフィルタリング
-            response = po_table.scan(
-                FilterExpression='created_by = :user_id',
-                ExpressionAttributeValues={':user_id': user_id}
-            )
+            response = po_table.scan(**repository.scan_params(PURCHASE_ORDER, {
+                'FilterExpression': 'created_by = :user_id',
+                'ExpressionAttributeValues': {':user_id': user_id}
+            }))
         
         purchase_orders = []
-        for item in response['Items']:
+        items = with_items(response['Items']) if include_items else response['Items']
+        for item in items:
             po = PurchaseOrder.from_dict(item)
-            purchase_orders.append({
-                'po_id': po.po_id,
-                'supplier': po.supplier,
-                'items': po.items,
-                'total_amount': po.total_amount,
-                'status': po.status.value,
-                'created_by': po.created_by,
-                'created_at': po.created_at,
-                'updated_at': po.updated_at,
-                'notes': po.notes
-            })
+            summary = po.summary()
+            if include_items:
+                summary['items'] = po.items
+            purchase_orders.append(summary)
         
         # 作成日時で降順ソート
         purchase_orders.sort(key=lambda x: x['created_at'], reverse=True)
@@ -92,6 +127,7 @@ def get_purchase_orders(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 
 
 @require_auth
+@idempotent
 def create_purchase_order(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """新しい購買発注書を作成"""
     try:
@@ -142,10 +178,16 @@ def create_purchase_order(event: Dict[str, Any], context: Any) -> Dict[str, Any]
         )
         
         # DynamoDBに保存
-        dynamodb = get_dynamodb_resource()
-        po_table = dynamodb.Table(os.environ['PURCHASE_ORDERS_TABLE'])
+        repository = get_repository()
         
-        po_table.put_item(Item=purchase_order.to_dict())
+        # 明細を書き込んでからヘッダーを書き込む（ヘッダーがない明細は読まれない）
+        item = to_dynamodb_item(purchase_order.to_dict())
+        write_lines(po_id, item['items'])
+        repository.table(PURCHASE_ORDER).put_item(
+            Item=repository.to_storage(PURCHASE_ORDER, compress_attributes(header_item(item)))
+        )
+        index_documents(DOC_PURCHASE_ORDER, [item])
+        record_changes(PURCHASE_ORDER, [item])
         
         return create_response(201, {
             'message': 'Purchase order created successfully',
@@ -153,6 +195,7 @@ def create_purchase_order(event: Dict[str, Any], context: Any) -> Dict[str, Any]
                 'po_id': purchase_order.po_id,
                 'supplier': purchase_order.supplier,
                 'items': purchase_order.items,
+                'line_count': purchase_order.line_count,
                 'total_amount': purchase_order.total_amount,
                 'status': purchase_order.status.value,
                 'created_by': purchase_order.created_by,
@@ -169,7 +212,7 @@ def create_purchase_order(event: Dict[str, Any], context: Any) -> Dict[str, Any]
 
 @require_auth
 def get_purchase_order(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    """特定の購買発注書を取得"""
+    """特定の購買発注書を取得（include=shipments を指定すると出荷も返す）"""
     try:
         po_id = get_path_parameter(event, 'po_id')
         if not po_id:
@@ -179,32 +222,59 @@ def get_purchase_order(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         user_role = user.get('custom:role', 'user')
         user_id = user.get('sub')
         
-        dynamodb = get_dynamodb_resource()
-        po_table = dynamodb.Table(os.environ['PURCHASE_ORDERS_TABLE'])
-        
-        response = po_table.get_item(Key={'po_id': po_id})
-        if 'Item' not in response:
+        shipments = None
+        if get_query_parameter(event, 'include') == 'shipments':
+            # 出荷は頻繁に変わるのでキャッシュを使わない（single_table では発注書と出荷を1回の Query で読み込む）
+            item, shipments = _load_with_shipments(po_id)
+        else:
+            # ウォームコンテナではキャッシュから返し、DynamoDBの読み込みを省略する
+            item = get_item_cache('purchase_orders').get_or_load(po_id, lambda: _load_with_first_page(po_id))
+        if item is None:
             return create_error_response(404, 'Purchase order not found')
         
-        purchase_order = PurchaseOrder.from_dict(response['Item'])
+        purchase_order = PurchaseOrder.from_dict(item)
         
         # 権限チェック：管理者または作成者のみアクセス可能
         if user_role != UserRole.ADMIN.value and purchase_order.created_by != user_id:
             return create_error_response(403, 'Access denied')
         
-        return create_response(200, {
+        # 明細は最初のページだけを返し、続きは GET /purchase-orders/{po_id}/items で取得する
+        next_line = len(item['items']) + 1 if item['line_count'] > len(item['items']) else None
+        body: Dict[str, Any] = {
             'purchase_order': {
                 'po_id': purchase_order.po_id,
                 'supplier': purchase_order.supplier,
-                'items': purchase_order.items,
+                'items': item['items'],
+                'line_count': item['line_count'],
+                'items_next_cursor': encode_cursor({'line_no': next_line}) if next_line else None,
                 'total_amount': purchase_order.total_amount,
                 'status': purchase_order.status.value,
                 'created_by': purchase_order.created_by,
                 'created_at': purchase_order.created_at,
                 'updated_at': purchase_order.updated_at,
-                'notes': purchase_order.notes
+                'notes': purchase_order.notes,
+                'archived_at': item.get('archived_at')
             }
-        })
+        }
+        if shipments is not None:
+            body['shipments'] = []
+            for shipment_item in shipments:
+                shipment = Shipment.from_dict(shipment_item)
+                body['shipments'].append({
+                    'shipment_id': shipment.shipment_id,
+                    'po_id': shipment.po_id,
+                    'tracking_number': shipment.tracking_number,
+                    'carrier': shipment.carrier,
+                    'status': shipment.status.value,
+                    'created_by': shipment.created_by,
+                    'estimated_delivery': shipment.estimated_delivery,
+                    'actual_delivery': shipment.actual_delivery,
+                    'created_at': shipment.created_at,
+                    'updated_at': shipment.updated_at,
+                    'notes': shipment.notes
+                })
+            body['shipments'].sort(key=lambda x: x['created_at'], reverse=True)
+        return create_response(200, body)
         
     except ClientError as e:
         return handle_dynamodb_error(e)
@@ -224,15 +294,15 @@ def update_purchase_order(event: Dict[str, Any], context: Any) -> Dict[str, Any]
         
         body = json.loads(event['body'])
         
-        dynamodb = get_dynamodb_resource()
-        po_table = dynamodb.Table(os.environ['PURCHASE_ORDERS_TABLE'])
+        repository = get_repository()
         
         # 既存の発注書を取得
-        response = po_table.get_item(Key={'po_id': po_id})
-        if 'Item' not in response:
+        previous = repository.get(PURCHASE_ORDER, po_id)
+        if previous is None:
             return create_error_response(404, 'Purchase order not found')
         
-        purchase_order = PurchaseOrder.from_dict(response['Item'])
+        previous = decompress_attributes(previous)
+        purchase_order = PurchaseOrder.from_dict(previous)
         
         # 権限チェック：管理者または作成者のみ更新可能
         if user_role != UserRole.ADMIN.value and purchase_order.created_by != user_id:
@@ -273,22 +343,43 @@ def update_purchase_order(event: Dict[str, Any], context: Any) -> Dict[str, Any]
         # 更新日時を設定
         purchase_order.updated_at = datetime.utcnow().isoformat()
         
-        # DynamoDBを更新
-        po_table.put_item(Item=purchase_order.to_dict())
+        # 明細が変わった場合（または分割前の行の場合）は明細を書き直してからヘッダーを更新する。
+        # それ以外はヘッダーだけを書き込み、明細は読み込まない
+        items_changed = 'items' in update_data or isinstance(previous.get('items'), list)
+        item = to_dynamodb_item(purchase_order.to_dict())
+        if items_changed:
+            write_lines(po_id, item['items'], int(previous.get('line_count') or 0))
+        repository.table(PURCHASE_ORDER).put_item(
+            Item=repository.to_storage(PURCHASE_ORDER, compress_attributes(header_item(item)))
+        )
         
-        return create_response(200, {
-            'message': 'Purchase order updated successfully',
-            'purchase_order': {
-                'po_id': purchase_order.po_id,
-                'supplier': purchase_order.supplier,
-                'items': purchase_order.items,
-                'total_amount': purchase_order.total_amount,
-                'status': purchase_order.status.value,
-                'created_by': purchase_order.created_by,
-                'updated_at': purchase_order.updated_at,
-                'notes': purchase_order.notes
-            }
-        })
+        cache = get_item_cache('purchase_orders')
+        if items_changed:
+            # キャッシュには詳細の取得と同じく最初のページだけを書き込む
+            cache.put(po_id, _with_first_page(header_item(item), item['items']))
+            index_documents(DOC_PURCHASE_ORDER, [item])
+        else:
+            cache.invalidate(po_id)
+            if 'supplier' in update_data or 'notes' in update_data:
+                # 検索の文書には明細の品名も含まれるため、検索対象の項目が変わった場合だけ明細を読み込む
+                index_documents(DOC_PURCHASE_ORDER, [dict(item, items=load_all_items(previous))])
+        record_changes(PURCHASE_ORDER, [item])
+        
+        result = {
+            'po_id': purchase_order.po_id,
+            'supplier': purchase_order.supplier,
+            'items': purchase_order.items,
+            'line_count': item['line_count'],
+            'total_amount': purchase_order.total_amount,
+            'status': purchase_order.status.value,
+            'created_by': purchase_order.created_by,
+            'updated_at': purchase_order.updated_at,
+            'notes': purchase_order.notes
+        }
+        if not items_changed:
+            # 明細は読み込んでいないので返さない（GET /purchase-orders/{po_id}/items で取得する）
+            del result['items']
+        return create_response(200, {'message': 'Purchase order updated successfully', 'purchase_order': result})
         
     except json.JSONDecodeError:
         return create_error_response(400, 'Invalid JSON in request body')
@@ -308,22 +399,26 @@ def delete_purchase_order(event: Dict[str, Any], context: Any) -> Dict[str, Any]
         user_role = user.get('custom:role', 'user')
         user_id = user.get('sub')
         
-        dynamodb = get_dynamodb_resource()
-        po_table = dynamodb.Table(os.environ['PURCHASE_ORDERS_TABLE'])
+        repository = get_repository()
         
         # 既存の発注書を取得
-        response = po_table.get_item(Key={'po_id': po_id})
-        if 'Item' not in response:
+        previous = repository.get(PURCHASE_ORDER, po_id)
+        if previous is None:
             return create_error_response(404, 'Purchase order not found')
         
-        purchase_order = PurchaseOrder.from_dict(response['Item'])
+        purchase_order = PurchaseOrder.from_dict(previous)
         
         # 権限チェック：管理者または作成者のみ削除可能
         if user_role != UserRole.ADMIN.value and purchase_order.created_by != user_id:
             return create_error_response(403, 'Access denied')
         
-        # 発注書を削除
-        po_table.delete_item(Key={'po_id': po_id})
+        # 発注書を削除してから明細を削除する
+        repository.table(PURCHASE_ORDER).delete_item(Key=repository.key(PURCHASE_ORDER, previous))
+        if 'items' not in previous:
+            delete_lines([(po_id, line_count(previous))])
+        get_item_cache('purchase_orders').invalidate(po_id)
+        remove_document(DOC_PURCHASE_ORDER, po_id)
+        record_deletions(PURCHASE_ORDER, [previous])
         
         return create_response(200, {'message': 'Purchase order deleted successfully'})
         
@@ -331,6 +426,75 @@ def delete_purchase_order(event: Dict[str, Any], context: Any) -> Dict[str, Any]
         return handle_dynamodb_error(e)
 
 
+@require_auth
+def get_purchase_order_items(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """購買発注書の明細をページ単位で取得（limit はデフォルト100、最大500）"""
+    try:
+        po_id = get_path_parameter(event, 'po_id')
+        if not po_id:
+            return create_error_response(400, 'Purchase order ID is required')
+        
+        user = event.get('user', {})
+        user_role = user.get('custom:role', 'user')
+        user_id = user.get('sub')
+        
+        try:
+            limit = int(get_query_parameter(event, 'limit', DEFAULT_PAGE_SIZE))
+            cursor = decode_cursor(get_query_parameter(event, 'cursor'), keys=('line_no',))
+            start = int(cursor['line_no']) if cursor else 1
+        except ValueError:
+            return create_error_response(400, 'Invalid limit or cursor')
+        if limit < 1 or limit > MAX_PAGE_SIZE or start < 1:
+            return create_error_response(400, f'limit must be between 1 and {MAX_PAGE_SIZE}')
+        
+        item = get_repository().get(PURCHASE_ORDER, po_id) or load_archived('purchase_orders', po_id)
+        if item is None:
+            return create_error_response(404, 'Purchase order not found')
+        item = decompress_attributes(item)
+        
+        # 権限チェック：管理者または作成者のみアクセス可能
+        if user_role != UserRole.ADMIN.value and item.get('created_by') != user_id:
+            return create_error_response(403, 'Access denied')
+        
+        lines, next_line = load_items_page(item, start, limit)
+        return create_response(200, {
+            'items': lines,
+            'line_count': line_count(item),
+            'next_cursor': encode_cursor({'line_no': next_line}) if next_line else None
+        })
+        
+    except ClientError as e:
+        return handle_dynamodb_error(e)
+
+
+def _with_first_page(header: Dict[str, Any], items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """ヘッダーに明細の最初のページを付ける（詳細の取得とキャッシュ用）"""
+    first_page = [dict(line, line_no=line_no) for line_no, line in enumerate(items[:DEFAULT_PAGE_SIZE], 1)]
+    return dict(header, items=first_page, line_count=len(items))
+
+
+def _load_with_first_page(po_id: str, item: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """ヘッダーと明細の最初のページを読み込む（テーブルにない場合はアーカイブ済みのデータを探す）"""
+    item = item or get_repository().get(PURCHASE_ORDER, po_id) or load_archived('purchase_orders', po_id)
+    if item is None:
+        return None
+    # キャッシュには展開した値を保存する
+    item = decompress_attributes(item)
+    lines, _ = load_items_page(item, 1, DEFAULT_PAGE_SIZE)
+    return dict(item, items=lines, line_count=line_count(item))
+
+
+def _load_with_shipments(po_id: str) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+    """ヘッダー・明細の最初のページと出荷を読み込む"""
+    repository = get_repository()
+    item, shipments = repository.get_purchase_order_with_shipments(po_id)
+    if item is None:
+        # アーカイブ済みの発注書には、まだテーブルにある出荷を付ける
+        item = load_archived('purchase_orders', po_id)
+        shipments = repository.query_shipments(po_id) if item is not None else []
+    return _load_with_first_page(po_id, item), shipments
+
+
 def _check_user_permission(user_id: str, permission: str) -> bool:
     """ユーザーが特定の権限を持っているかチェック"""
     try:
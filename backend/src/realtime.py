@@ -0,0 +1,360 @@
+"""
+発注書・出荷の変更のリアルタイム配信（WebSocket）
+
+API Gateway の WebSocket API に接続したクライアントへ、変更履歴（change_log）と同じ形式の変更を送ります。
+一覧を定期的に読み直さなくても、出荷のステータス変更などがすぐに画面に反映されます。
+
+- $connect で ?token=<アクセストークン>（または Authorization ヘッダー）を確認し、接続を Connections テーブルに保存します。
+  管理者はすべての変更、一般ユーザーは自分が作成したものの変更だけを受け取ります（GET /changes と同じ範囲）
+- {"action": "subscribe", "types": ["shipment"]} で受け取る種類を絞り込めます（接続時はすべて）
+- 配信は ChangeLog テーブルの DynamoDB Streams（change_log.stream_handler）から呼ばれ、ストリームのバッチごとにまとめて行います。
+  受信者ごとに1通（MAX_MESSAGE_BYTES を超える場合は分割）にまとめ、PUSH_WORKERS 並列で送信します
+- 送信時に切断済み（GoneException）だった接続は削除します。$disconnect が届かなかった接続も TTL で削除されます
+
+送信先は WEBSOCKET_BACKEND で切り替えます。
+- apigateway: API Gateway Management API（エンドポイントは WEBSOCKET_ENDPOINT、応答はリクエストの接続先）
+- local: プロセス内のスタンドイン（テスト・ローカル開発用）。DynamoDB Streams の代わりに変更履歴の書き込み時に配信します
+
+切断中の変更は届かないので、クライアントは再接続したら GET /changes で差分を取得してください。
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from botocore.exceptions import ClientError
+from utils import (
+    create_response,
+    create_error_response,
+    get_apigateway_management_client,
+    get_dynamodb_resource,
+    get_user_from_token,
+    json_default,
+    int_env,
+    prime_dynamodb
+)
+from instrumentation import TracedThreadPoolExecutor, traced_handler
+from warmup import register_primer
+from models import UserRole, generate_id
+
+
+CHANGE_TYPES = ('purchase_order', 'shipment')
+# 管理者の接続の audience（ユーザー ID と重ならない値）
+ADMIN_AUDIENCE = '#admin'
+# API Gateway の接続の最大時間（2時間）より長く残し、$disconnect が届かなかった接続を TTL で削除する
+CONNECTION_TTL_SECONDS = 3 * 60 * 60
+# API Gateway の WebSocket のメッセージの上限（128KB）より小さくする
+MAX_MESSAGE_BYTES = 120 * 1024
+DEFAULT_PUSH_WORKERS = 16
+
+
+class GoneConnection(Exception):
+    """切断済みの接続に送信しようとした"""
+
+
+def _table() -> Any:
+    return get_dynamodb_resource().Table(os.environ['CONNECTIONS_TABLE'])
+
+
+class ApiGatewayConnections:
+    """API Gateway Management API で接続にメッセージを送る"""
+
+    inline = False
+
+    def __init__(self):
+        self._clients: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _client(self, endpoint: str) -> Any:
+        with self._lock:
+            if endpoint not in self._clients:
+                self._clients[endpoint] = get_apigateway_management_client(endpoint)
+            return self._clients[endpoint]
+
+    def send(self, connection_id: str, data: bytes, endpoint: Optional[str] = None) -> None:
+        client = self._client(endpoint or os.environ['WEBSOCKET_ENDPOINT'])
+        try:
+            client.post_to_connection(ConnectionId=connection_id, Data=data)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'GoneException':
+                raise GoneConnection(connection_id)
+            raise
+
+
+class LocalConnections:
+    """API Gateway の WebSocket API のスタンドイン（テスト・ローカル開発用）
+
+    connect / send_message / disconnect は API Gateway と同じ形式のイベントで handler を呼び出します。
+    クライアントに送られたメッセージは接続ごとに messages に保存されます。
+    """
+
+    inline = True
+
+    def __init__(self):
+        self.messages: Dict[str, List[Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def _event(self, route_key: str, connection_id: str, **fields: Any) -> Dict[str, Any]:
+        event_types = {'$connect': 'CONNECT', '$disconnect': 'DISCONNECT'}
+        event = {
+            'requestContext': {
+                'routeKey': route_key,
+                'eventType': event_types.get(route_key, 'MESSAGE'),
+                'connectionId': connection_id,
+                'domainName': 'localhost',
+                'stage': 'local'
+            },
+            'isBase64Encoded': False
+        }
+        event.update(fields)
+        return event
+
+    def connect(self, query: Optional[Dict[str, str]] = None,
+                headers: Optional[Dict[str, str]] = None) -> Tuple[Optional[str], Dict[str, Any]]:
+        """接続して (接続 ID, $connect の応答) を返す（拒否された場合の接続 ID は None）"""
+        connection_id = generate_id()
+        with self._lock:
+            self.messages[connection_id] = []
+        response = handler(self._event(
+            '$connect', connection_id, queryStringParameters=query, headers=headers or {}
+        ), None)
+        if response['statusCode'] != 200:
+            with self._lock:
+                del self.messages[connection_id]
+            return None, response
+        return connection_id, response
+
+    def send_message(self, connection_id: str, body: Any) -> Dict[str, Any]:
+        """クライアントからメッセージを送る（ルートは action で選ぶ。$request.body.action と同じ）"""
+        action = body.get('action') if isinstance(body, dict) else None
+        route_key = action if action in ROUTES else '$default'
+        return handler(self._event(route_key, connection_id, body=json.dumps(body)), None)
+
+    def disconnect(self, connection_id: str) -> None:
+        handler(self._event('$disconnect', connection_id), None)
+        self.drop(connection_id)
+
+    def drop(self, connection_id: str) -> None:
+        """$disconnect を送らずに接続を失う（ネットワークの切断など）"""
+        with self._lock:
+            self.messages.pop(connection_id, None)
+
+    def send(self, connection_id: str, data: bytes, endpoint: Optional[str] = None) -> None:
+        with self._lock:
+            if connection_id not in self.messages:
+                raise GoneConnection(connection_id)
+            self.messages[connection_id].append(json.loads(data))
+
+
+_connections: Optional[Any] = None
+
+
+def get_connections():
+    """コンテナ内で共有する送信先を取得"""
+    global _connections
+    if _connections is None:
+        if os.environ.get('WEBSOCKET_BACKEND', 'local') == 'apigateway':
+            _connections = ApiGatewayConnections()
+        else:
+            _connections = LocalConnections()
+    return _connections
+
+
+def reset_connections() -> None:
+    """送信先の選択を破棄（テスト用）"""
+    global _connections
+    _connections = None
+
+
+def prime_connections() -> None:
+    """ウォームアップ用：送信先と API Gateway Management API のクライアントを作成しておく"""
+    connections = get_connections()
+    if isinstance(connections, ApiGatewayConnections) and os.environ.get('WEBSOCKET_ENDPOINT'):
+        connections._client(os.environ['WEBSOCKET_ENDPOINT'])
+
+
+def publishes_inline() -> bool:
+    """変更履歴の書き込み時に配信するか（DynamoDB Streams のない local の場合）"""
+    return bool(os.environ.get('CONNECTIONS_TABLE')) and get_connections().inline
+
+
+def _encode_messages(changes: List[Dict[str, Any]]) -> List[bytes]:
+    """変更を MAX_MESSAGE_BYTES 以下のメッセージに分ける"""
+    messages = []
+    batch: List[str] = []
+    size = 0
+    for change in changes:
+        encoded = json.dumps(change, ensure_ascii=False, default=json_default)
+        length = len(encoded.encode('utf-8')) + 1
+        if batch and size + length > MAX_MESSAGE_BYTES:
+            messages.append(batch)
+            batch, size = [], 0
+        batch.append(encoded)
+        size += length
+    if batch:
+        messages.append(batch)
+    return [f'{{"type":"changes","changes":[{",".join(batch)}]}}'.encode('utf-8') for batch in messages]
+
+
+def _query_audience(audience: str) -> List[Dict[str, Any]]:
+    params: Dict[str, Any] = {
+        'IndexName': 'audience-index',
+        'KeyConditionExpression': 'audience = :audience',
+        'ExpressionAttributeValues': {':audience': audience}
+    }
+    table = _table()
+    connections = []
+    while True:
+        response = table.query(**params)
+        connections.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return connections
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def _deliver(connection_id: str, messages: List[bytes]) -> bool:
+    """1つの接続にメッセージを送り、切断済みだった場合は False を返す"""
+    try:
+        for data in messages:
+            get_connections().send(connection_id, data)
+    except GoneConnection:
+        return False
+    except ClientError as e:
+        # 1つの接続の失敗でバッチ全体を再試行すると他の接続に重複して届くため、記録して続ける
+        print(f"Error pushing to connection {connection_id}: {str(e)}")
+    return True
+
+
+def publish_changes(changes: Iterable[Tuple[str, Dict[str, Any]]]) -> Dict[str, int]:
+    """(作成者, 変更) を受信できる接続にまとめて送り、件数を返す"""
+    by_owner: Dict[str, List[Dict[str, Any]]] = {}
+    for created_by, change in changes:
+        by_owner.setdefault(created_by, []).append(change)
+    if not by_owner or not os.environ.get('CONNECTIONS_TABLE'):
+        return {'connections': 0, 'messages': 0, 'gone': 0}
+
+    all_changes = [change for owned in by_owner.values() for change in owned]
+    audiences = [(ADMIN_AUDIENCE, all_changes)] + list(by_owner.items())
+    deliveries: List[Tuple[str, List[bytes]]] = []
+    with TracedThreadPoolExecutor(max_workers=int_env('PUSH_WORKERS', DEFAULT_PUSH_WORKERS)) as executor:
+        found = executor.map(_query_audience, [audience for audience, _ in audiences])
+        # 受信者ごとに送る変更を1通にまとめる（受け取る種類で絞り込む）
+        for (_, audience_changes), connections in zip(audiences, found):
+            for connection in connections:
+                types = set(connection.get('types') or CHANGE_TYPES)
+                selected = [change for change in audience_changes if change['type'] in types]
+                if selected:
+                    deliveries.append((connection['connection_id'], _encode_messages(selected)))
+        alive = list(executor.map(lambda delivery: _deliver(*delivery), deliveries))
+
+    gone = [connection_id for (connection_id, _), ok in zip(deliveries, alive) if not ok]
+    if gone:
+        with _table().batch_writer(overwrite_by_pkeys=['connection_id']) as batch:
+            for connection_id in gone:
+                batch.delete_item(Key={'connection_id': connection_id})
+    return {
+        'connections': len(deliveries),
+        'messages': sum(len(messages) for _, messages in deliveries),
+        'gone': len(gone)
+    }
+
+
+def _reply(event: Dict[str, Any], message: Dict[str, Any]) -> None:
+    """リクエストを送ってきた接続にメッセージを送る"""
+    request_context = event['requestContext']
+    endpoint = f"https://{request_context['domainName']}/{request_context['stage']}"
+    try:
+        get_connections().send(
+            request_context['connectionId'], json.dumps(message).encode('utf-8'), endpoint=endpoint
+        )
+    except GoneConnection:
+        pass
+
+
+def connect(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """接続を認証して保存（ブラウザの WebSocket はヘッダーを付けられないため token パラメータも受け付ける）"""
+    headers = event.get('headers') or {}
+    auth_header = headers.get('Authorization') or headers.get('authorization') or ''
+    token = (event.get('queryStringParameters') or {}).get('token')
+    if not token and auth_header.startswith('Bearer '):
+        token = auth_header.replace('Bearer ', '')
+    user = get_user_from_token(token) if token else None
+    if not user or not user.get('sub'):
+        return create_error_response(401, 'Invalid token')
+
+    is_admin = user.get('custom:role', 'user') == UserRole.ADMIN.value
+    _table().put_item(Item={
+        'connection_id': event['requestContext']['connectionId'],
+        'user_id': user['sub'],
+        'audience': ADMIN_AUDIENCE if is_admin else user['sub'],
+        'types': list(CHANGE_TYPES),
+        'connected_at': datetime.utcnow().isoformat(),
+        'expires_at': int(time.time()) + CONNECTION_TTL_SECONDS
+    })
+    return create_response(200, {'message': 'Connected'})
+
+
+def disconnect(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    _table().delete_item(Key={'connection_id': event['requestContext']['connectionId']})
+    return create_response(200, {'message': 'Disconnected'})
+
+
+def subscribe(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """受け取る変更の種類を設定"""
+    try:
+        body = json.loads(event.get('body') or '{}')
+    except json.JSONDecodeError:
+        body = None
+    types = body.get('types') if isinstance(body, dict) else None
+    if not isinstance(types, list) or not types or not all(t in CHANGE_TYPES for t in types):
+        _reply(event, {'type': 'error', 'error': f"types must be a list of {', '.join(CHANGE_TYPES)}"})
+        return create_error_response(400, 'Invalid types')
+
+    try:
+        _table().update_item(
+            Key={'connection_id': event['requestContext']['connectionId']},
+            UpdateExpression='SET #types = :types',
+            ConditionExpression='attribute_exists(connection_id)',
+            ExpressionAttributeNames={'#types': 'types'},
+            ExpressionAttributeValues={':types': sorted(set(types))}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return create_error_response(410, 'Connection not found')
+    _reply(event, {'type': 'subscribed', 'types': sorted(set(types))})
+    return create_response(200, {'message': 'Subscribed'})
+
+
+def default(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    _reply(event, {'type': 'error', 'error': 'Unknown action'})
+    return create_error_response(400, 'Unknown action')
+
+
+ROUTES = {
+    '$connect': connect,
+    '$disconnect': disconnect,
+    'subscribe': subscribe,
+    '$default': default
+}
+
+
+register_primer('dynamodb', lambda: prime_dynamodb(os.environ.get('CONNECTIONS_TABLE')), 'realtime')
+register_primer('connections', prime_connections, 'realtime')
+
+
+@traced_handler('realtime')
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """WebSocket API のメインハンドラー（ルートは requestContext.routeKey）"""
+    route_key = event.get('requestContext', {}).get('routeKey')
+
+    try:
+        if route_key in ROUTES:
+            return ROUTES[route_key](event, context)
+        else:
+            return create_error_response(404, 'Route not found')
+
+    except Exception as e:
+        print(f"Error in realtime handler: {str(e)}")
+        return create_error_response(500, 'Internal server error')
@@ -0,0 +1,143 @@
+"""
+NDJSON / CSV のレコード入出力
+
+一括インポート・エクスポートで使うため、入出力を1行ずつ処理するジェネレーターとして実装しています。
+全体をリストに展開しないので、メモリ使用量は行数に比例しません。
+"""
+import base64
+import codecs
+import csv
+import io
+import json
+import zlib
+from typing import Dict, Any, Callable, Iterator, Iterable, List, Optional, Tuple
+from utils import json_default
+
+
+FORMAT_CSV = 'csv'
+FORMAT_NDJSON = 'ndjson'
+SUPPORTED_FORMATS = (FORMAT_CSV, FORMAT_NDJSON)
+
+CONTENT_TYPES = {
+    'text/csv': FORMAT_CSV,
+    'application/csv': FORMAT_CSV,
+    'application/x-ndjson': FORMAT_NDJSON,
+    'application/ndjson': FORMAT_NDJSON,
+    'application/jsonl': FORMAT_NDJSON
+}
+
+
+def detect_format(content_type: Optional[str], requested: Optional[str] = None) -> Optional[str]:
+    """明示的な指定または Content-Type から形式を判定"""
+    if requested:
+        return requested.lower() if requested.lower() in SUPPORTED_FORMATS else None
+    if not content_type:
+        return None
+    return CONTENT_TYPES.get(content_type.split(';')[0].strip().lower())
+
+
+def event_body_stream(event: Dict[str, Any]) -> io.StringIO:
+    """API Gateway イベントの本文をテキストストリームとして取得（Base64 エンコードにも対応）"""
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body).decode('utf-8')
+    return io.StringIO(body)
+
+
+def iter_records(stream: Iterable[str], fmt: str) -> Iterator[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]:
+    """レコードを1件ずつ返す: (行番号, レコード, エラー)
+
+    行番号は1始まり（CSV はヘッダー行を除いたデータ行の番号）。解析できない行はレコードが None になります。
+    """
+    if fmt == FORMAT_CSV:
+        reader = csv.DictReader(stream)
+        for row_number, row in enumerate(reader, start=1):
+            if None in row:
+                yield row_number, None, 'Too many columns'
+                continue
+            yield row_number, {k.strip(): (v.strip() if isinstance(v, str) else v) for k, v in row.items() if k}, None
+    elif fmt == FORMAT_NDJSON:
+        row_number = 0
+        for line in stream:
+            if not line.strip():
+                continue
+            row_number += 1
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                yield row_number, None, 'Invalid JSON'
+                continue
+            if not isinstance(record, dict):
+                yield row_number, None, 'Each line must be a JSON object'
+                continue
+            yield row_number, record, None
+    else:
+        raise ValueError(f'Unsupported format: {fmt}')
+
+
+def _csv_value(value: Any) -> Any:
+    # リストや辞書（発注書の明細等）は JSON 文字列として1セルに入れる
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False, default=json_default)
+    return '' if value is None else value
+
+
+def encode_records(records: Iterable[Dict[str, Any]], fmt: str,
+                   fieldnames: Optional[List[str]] = None) -> Iterator[str]:
+    """レコードを1行ずつテキストに変換（CSV の場合は最初にヘッダー行を返す）"""
+    if fmt == FORMAT_NDJSON:
+        for record in records:
+            yield json.dumps(record, ensure_ascii=False, default=json_default) + '\n'
+    elif fmt == FORMAT_CSV:
+        if not fieldnames:
+            raise ValueError('CSV output requires fieldnames')
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(fieldnames)
+        yield buffer.getvalue()
+        for record in records:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow([_csv_value(record.get(name)) for name in fieldnames])
+            yield buffer.getvalue()
+    else:
+        raise ValueError(f'Unsupported format: {fmt}')
+
+
+def gzip_chunks(lines: Iterable[str], chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+    """テキスト行を gzip で圧縮し、おおよそ chunk_size バイトごとに返す"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    pending: List[bytes] = []
+    pending_size = 0
+    for line in lines:
+        data = compressor.compress(line.encode('utf-8'))
+        if data:
+            pending.append(data)
+            pending_size += len(data)
+            if pending_size >= chunk_size:
+                yield b''.join(pending)
+                pending, pending_size = [], 0
+    pending.append(compressor.flush())
+    yield b''.join(pending)
+
+
+def iter_text_lines(read: Callable[[int], bytes], compressed: bool = False,
+                    chunk_size: int = 256 * 1024) -> Iterator[str]:
+    """バイナリストリームを少しずつ読み、改行を保ったままテキスト行を返す（gzip にも対応）"""
+    decompressor = zlib.decompressobj(47) if compressed else None
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    remainder = ''
+    while True:
+        data = read(chunk_size)
+        final = not data
+        if decompressor is not None:
+            data = decompressor.decompress(data) if data else decompressor.flush()
+        # JSON 文字列には U+2028 等が含まれ得るため、splitlines ではなく '\n' だけで区切る
+        lines = (remainder + decoder.decode(data, final=final)).split('\n')
+        remainder = lines.pop()
+        for line in lines:
+            yield line + '\n'
+        if final:
+            if remainder:
+                yield remainder
+            return
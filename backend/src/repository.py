@@ -0,0 +1,210 @@
+"""
+発注書・出荷の保存先（リポジトリ）
+
+STORAGE_LAYOUT で保存方法を切り替えます。ハンドラーやジョブはテーブルを直接扱わず、
+get_repository() が返すリポジトリからテーブル・キー・スキャン条件を取得します。
+
+- tables（デフォルト）: PurchaseOrders / Shipments の2テーブルに保存します
+- single_table: PROCUREMENT_TABLE の1テーブルに隣接リストで保存します
+  - 発注書: pk = PO#<po_id>, sk = META
+  - 出荷: pk = PO#<po_id>, sk = SHIP#<shipment_id>
+
+  発注書とその出荷は同じパーティションにあるので1回の Query で読み込めます。
+  出荷 ID だけで読み込む場合は shipment-id-index（KEYS_ONLY の GSI）でキーを調べてから GetItem します。
+  tracking-number-index は出荷だけが持つ属性の GSI なので、同じ名前・同じキーで使えます。
+
+明細（PurchaseOrderLines）と追跡番号の予約（ShipmentTrackingNumbers）はどちらの場合も別テーブルです。
+tools/migrate_to_single_table.py で既存の2テーブルを single_table にコピーできます。
+"""
+import os
+from typing import Any, Dict, List, Optional, Tuple
+from utils import get_dynamodb_resource
+
+
+LAYOUT_TABLES = 'tables'
+LAYOUT_SINGLE_TABLE = 'single_table'
+
+PURCHASE_ORDER = 'purchase_order'
+SHIPMENT = 'shipment'
+
+ID_NAMES = {PURCHASE_ORDER: 'po_id', SHIPMENT: 'shipment_id'}
+
+PO_PREFIX = 'PO#'
+META_SORT_KEY = 'META'
+SHIPMENT_PREFIX = 'SHIP#'
+
+
+def _query_all(table: Any, **params: Any) -> List[Dict[str, Any]]:
+    items: List[Dict[str, Any]] = []
+    while True:
+        response = table.query(**params)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return items
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+class TablesRepository:
+    """PurchaseOrders / Shipments の2テーブルに保存する"""
+
+    layout = LAYOUT_TABLES
+    TABLE_ENVS = {PURCHASE_ORDER: 'PURCHASE_ORDERS_TABLE', SHIPMENT: 'SHIPMENTS_TABLE'}
+
+    def table_name(self, entity: str) -> str:
+        return os.environ[self.TABLE_ENVS[entity]]
+
+    def table(self, entity: str) -> Any:
+        return get_dynamodb_resource().Table(self.table_name(entity))
+
+    def key(self, entity: str, item: Dict[str, Any]) -> Dict[str, Any]:
+        """アイテム（出荷の場合は po_id も必要）のプライマリキー"""
+        return {ID_NAMES[entity]: item[ID_NAMES[entity]]}
+
+    def key_names(self, entity: str) -> Tuple[str, ...]:
+        """プライマリキーの属性名"""
+        return (ID_NAMES[entity],)
+
+    def to_storage(self, entity: str, item: Dict[str, Any]) -> Dict[str, Any]:
+        """書き込むアイテムにキー属性を付ける"""
+        return item
+
+    def from_storage(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """読み込んだアイテムからキー属性を除く"""
+        return item
+
+    def scan_params(self, entity: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Scan のパラメーターにエンティティを絞り込む条件を加える"""
+        return dict(params or {})
+
+    def get(self, entity: str, item_id: str, consistent: bool = False) -> Optional[Dict[str, Any]]:
+        response = self.table(entity).get_item(Key={ID_NAMES[entity]: item_id}, ConsistentRead=consistent)
+        return response.get('Item')
+
+    def query_shipments(self, po_id: str) -> List[Dict[str, Any]]:
+        """発注書の出荷をすべて読み込む"""
+        return _query_all(
+            self.table(SHIPMENT),
+            IndexName='po-id-index',
+            KeyConditionExpression='po_id = :po_id',
+            ExpressionAttributeValues={':po_id': po_id}
+        )
+
+    def get_purchase_order_with_shipments(self, po_id: str) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """発注書とその出荷を読み込む（GetItem と GSI の Query の2回）"""
+        purchase_order = self.get(PURCHASE_ORDER, po_id)
+        if purchase_order is None:
+            return None, []
+        return purchase_order, self.query_shipments(po_id)
+
+    def put_request(self, entity: str, item: Dict[str, Any],
+                    condition: Optional[str] = None) -> Dict[str, Any]:
+        """TransactWriteItems の Put（condition は ID 属性の存在などを表す条件式）"""
+        request: Dict[str, Any] = {'TableName': self.table_name(entity), 'Item': self.to_storage(entity, item)}
+        if condition:
+            request['ConditionExpression'] = condition
+        return {'Put': request}
+
+    def delete_request(self, entity: str, item: Dict[str, Any]) -> Dict[str, Any]:
+        return {'Delete': {'TableName': self.table_name(entity), 'Key': self.key(entity, item)}}
+
+    def exists_request(self, entity: str, item: Dict[str, Any]) -> Dict[str, Any]:
+        """アイテムが存在することを確認する TransactWriteItems の ConditionCheck"""
+        return {'ConditionCheck': {
+            'TableName': self.table_name(entity),
+            'Key': self.key(entity, item),
+            'ConditionExpression': f'attribute_exists({next(iter(self.key(entity, item)))})'
+        }}
+
+
+class SingleTableRepository(TablesRepository):
+    """PROCUREMENT_TABLE の1テーブルに隣接リストで保存する"""
+
+    layout = LAYOUT_SINGLE_TABLE
+
+    def table_name(self, entity: str) -> str:
+        return os.environ['PROCUREMENT_TABLE']
+
+    def key(self, entity: str, item: Dict[str, Any]) -> Dict[str, Any]:
+        sort_key = META_SORT_KEY if entity == PURCHASE_ORDER else SHIPMENT_PREFIX + item['shipment_id']
+        return {'pk': PO_PREFIX + item['po_id'], 'sk': sort_key}
+
+    def key_names(self, entity: str) -> Tuple[str, ...]:
+        return ('pk', 'sk')
+
+    def to_storage(self, entity: str, item: Dict[str, Any]) -> Dict[str, Any]:
+        return dict(item, **self.key(entity, item))
+
+    def from_storage(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v for k, v in item.items() if k not in ('pk', 'sk')}
+
+    def scan_params(self, entity: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        params = dict(params or {})
+        if entity == PURCHASE_ORDER:
+            condition, value = '#sk = :entity_sk', META_SORT_KEY
+        else:
+            condition, value = 'begins_with(#sk, :entity_sk)', SHIPMENT_PREFIX
+        if params.get('FilterExpression'):
+            condition = f"({params['FilterExpression']}) AND {condition}"
+        params['FilterExpression'] = condition
+        params['ExpressionAttributeNames'] = dict(params.get('ExpressionAttributeNames') or {}, **{'#sk': 'sk'})
+        params['ExpressionAttributeValues'] = dict(
+            params.get('ExpressionAttributeValues') or {}, **{':entity_sk': value}
+        )
+        return params
+
+    def get(self, entity: str, item_id: str, consistent: bool = False) -> Optional[Dict[str, Any]]:
+        table = self.table(entity)
+        if entity == PURCHASE_ORDER:
+            key = self.key(entity, {'po_id': item_id})
+        else:
+            # 出荷 ID だけではパーティションキーが分からないので、GSI でキーを調べる
+            keys = table.query(
+                IndexName='shipment-id-index',
+                KeyConditionExpression='shipment_id = :shipment_id',
+                ExpressionAttributeValues={':shipment_id': item_id}
+            )['Items']
+            if not keys:
+                return None
+            key = {'pk': keys[0]['pk'], 'sk': keys[0]['sk']}
+        item = table.get_item(Key=key, ConsistentRead=consistent).get('Item')
+        return self.from_storage(item) if item is not None else None
+
+    def query_shipments(self, po_id: str) -> List[Dict[str, Any]]:
+        items = _query_all(
+            self.table(SHIPMENT),
+            KeyConditionExpression='pk = :pk AND begins_with(sk, :prefix)',
+            ExpressionAttributeValues={':pk': PO_PREFIX + po_id, ':prefix': SHIPMENT_PREFIX}
+        )
+        return [self.from_storage(item) for item in items]
+
+    def get_purchase_order_with_shipments(self, po_id: str) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """発注書とその出荷を1回の Query で読み込む"""
+        items = _query_all(
+            self.table(PURCHASE_ORDER),
+            KeyConditionExpression='pk = :pk',
+            ExpressionAttributeValues={':pk': PO_PREFIX + po_id}
+        )
+        purchase_order = None
+        shipments = []
+        for item in items:
+            if item['sk'] == META_SORT_KEY:
+                purchase_order = self.from_storage(item)
+            else:
+                shipments.append(self.from_storage(item))
+        if purchase_order is None:
+            return None, []
+        return purchase_order, shipments
+
+
+_REPOSITORIES = {
+    LAYOUT_TABLES: TablesRepository(),
+    LAYOUT_SINGLE_TABLE: SingleTableRepository()
+}
+
+
+def get_repository() -> TablesRepository:
+    """STORAGE_LAYOUT に対応するリポジトリを取得"""
+    layout = os.environ.get('STORAGE_LAYOUT') or LAYOUT_TABLES
+    if layout not in _REPOSITORIES:
+        raise ValueError(f'Unknown STORAGE_LAYOUT: {layout}')
+    return _REPOSITORIES[layout]
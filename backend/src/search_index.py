@@ -0,0 +1,450 @@
+"""
+発注書・出荷の全文検索
+
+GET /search?q= で発注書（ID・仕入先・明細の品名・備考）と出荷（ID・発注書 ID・追跡番号・運送会社・備考）を検索します。
+
+- 転置インデックス（語 → {文書: 出現回数}）をコンテナのメモリに保持し、BM25 でランキングします
+- 英数字は単語単位、日本語などは文字の bigram に分割し、ソート済みの語の一覧を二分探索して前方一致で展開します
+- 永続化は2層です。オブジェクトストレージの gzip スナップショット（search/latest.json が最新を指す）と、
+  文書ごとの最新の内容を記録する SearchIndex テーブル（差分）
+- 作成・更新・削除の各ハンドラーが SearchIndex に差分を書き込み、同じコンテナのインデックスにも即時に反映します
+- インデックスは最初の検索時にスナップショットと以降の差分から読み込み、その後は SEARCH_REFRESH_SECONDS ごとに
+  indexed-day-index から新しい差分だけを読み込んで反映します
+- 'search_snapshot' ジョブ（1時間ごと）がスナップショットを作り直します。payload に rebuild を指定するとテーブルから再構築します
+"""
+import bisect
+import gzip
+import heapq
+import json
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+from botocore.exceptions import ClientError
+from utils import (
+    create_response,
+    create_error_response,
+    require_auth,
+    get_dynamodb_resource,
+    get_query_parameter,
+    scan_all,
+    int_env,
+    prime_dynamodb
+)
+from instrumentation import traced_handler
+from warmup import register_primer
+from jobs import enqueue_job, register_job
+from object_storage import get_object_storage
+from po_lines import with_items
+from repository import PURCHASE_ORDER, SHIPMENT, get_repository
+from models import UserRole, decode_attribute
+
+
+DOC_PURCHASE_ORDER = 'purchase_order'
+DOC_SHIPMENT = 'shipment'
+DOC_ENTITIES = {
+    DOC_PURCHASE_ORDER: PURCHASE_ORDER,
+    DOC_SHIPMENT: SHIPMENT
+}
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+# 前方一致で展開する語の上限（短すぎる入力で検索が遅くならないようにする）
+MAX_PREFIX_EXPANSIONS = 50
+# 前方一致で展開した語のスコアの重み（完全一致は 1.0）
+PREFIX_WEIGHT = 0.5
+# 1文書あたりの語の上限（SearchIndex のアイテムサイズを 400KB 以内に収める）
+MAX_DOC_TERMS = 2000
+BM25_K1 = 1.2
+BM25_B = 0.75
+DEFAULT_REFRESH_SECONDS = 10
+DELTA_TTL_SECONDS = 7 * 24 * 60 * 60
+# コンテナ間の時計のずれで差分を取りこぼさないよう、前回の位置より少し前から読み直す
+REFRESH_OVERLAP_SECONDS = 5
+LATEST_KEY = 'search/latest.json'
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+|[^\W\x00-\x7f]+')
+
+
+def tokenize(text: Any) -> List[str]:
+    """テキストを検索用の語に分割（英数字は単語、それ以外は bigram）"""
+    tokens: List[str] = []
+    for run in _TOKEN_RE.findall(unicodedata.normalize('NFKC', str(text)).lower()):
+        if run.isascii() or len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def build_document(doc_type: str, item: Dict[str, Any]) -> Dict[str, Any]:
+    """テーブルのアイテムからインデックスに登録する文書を作成"""
+    if doc_type == DOC_PURCHASE_ORDER:
+        doc_id = item['po_id']
+        title = str(item.get('supplier') or '')
+        texts = [doc_id, item.get('supplier'), decode_attribute(item.get('notes'))]
+        texts.extend(line.get('name') for line in item.get('items') or [] if isinstance(line, dict))
+    else:
+        doc_id = item['shipment_id']
+        title = f"{item.get('carrier') or ''} {item.get('tracking_number') or ''}".strip()
+        texts = [
+            doc_id, item.get('po_id'), item.get('tracking_number'), item.get('carrier'), decode_attribute(item.get('notes'))
+        ]
+
+    terms: Counter = Counter()
+    for text in texts:
+        if text:
+            terms.update(tokenize(text))
+    return {
+        'doc_key': f'{doc_type}#{doc_id}',
+        'doc_type': doc_type,
+        'doc_id': doc_id,
+        'title': title,
+        'owner': item.get('created_by'),
+        'terms': dict(terms.most_common(MAX_DOC_TERMS))
+    }
+
+
+class InvertedIndex:
+    """メモリ上の転置インデックス"""
+
+    def __init__(self):
+        # doc_key -> (doc_type, doc_id, title, owner, 語数, 語の一覧)
+        self.docs: Dict[str, Tuple[str, str, str, Optional[str], int, Tuple[str, ...]]] = {}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.total_length = 0
+        # 前方一致用のソート済みの語（削除された語が残っていてもよい）
+        self._terms: List[str] = []
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def put(self, doc: Dict[str, Any]) -> None:
+        """文書を登録（同じ doc_key の文書は置き換える）"""
+        with self._lock:
+            self.remove(doc['doc_key'])
+            terms = {term: int(tf) for term, tf in doc['terms'].items()}
+            length = sum(terms.values())
+            for term, tf in terms.items():
+                postings = self.postings.get(term)
+                if postings is None:
+                    postings = self.postings[term] = {}
+                    position = bisect.bisect_left(self._terms, term)
+                    if position == len(self._terms) or self._terms[position] != term:
+                        self._terms.insert(position, term)
+                postings[doc['doc_key']] = tf
+            self.docs[doc['doc_key']] = (
+                doc['doc_type'], doc['doc_id'], doc['title'], doc.get('owner'), length, tuple(terms)
+            )
+            self.total_length += length
+
+    def remove(self, doc_key: str) -> None:
+        with self._lock:
+            doc = self.docs.pop(doc_key, None)
+            if doc is None:
+                return
+            self.total_length -= doc[4]
+            for term in doc[5]:
+                postings = self.postings.get(term)
+                if postings is not None:
+                    postings.pop(doc_key, None)
+                    if not postings:
+                        del self.postings[term]
+
+    def _expand(self, token: str) -> List[Tuple[str, float]]:
+        """語を前方一致で展開し、(語, 重み) の一覧を返す"""
+        expanded = []
+        position = bisect.bisect_left(self._terms, token)
+        while position < len(self._terms) and len(expanded) < MAX_PREFIX_EXPANSIONS:
+            term = self._terms[position]
+            if not term.startswith(token):
+                break
+            if term in self.postings:
+                expanded.append((term, 1.0 if term == token else PREFIX_WEIGHT))
+            position += 1
+        return expanded
+
+    def search(self, query: str, owner: Optional[str] = None, doc_type: Optional[str] = None,
+               limit: int = DEFAULT_LIMIT) -> List[Dict[str, Any]]:
+        """すべての語（前方一致を含む）を含む文書を BM25 のスコア順に返す"""
+        tokens = list(dict.fromkeys(tokenize(query)))
+        with self._lock:
+            if not tokens or not self.docs:
+                return []
+            expansions = [self._expand(token) for token in tokens]
+            if not all(expansions):
+                return []
+            doc_count = len(self.docs)
+            average_length = self.total_length / doc_count or 1
+
+            # 候補の少ない語から順に処理し、以降の語は残った候補だけを採点する
+            expansions.sort(key=lambda terms: sum(len(self.postings[term]) for term, _ in terms))
+            scores: Optional[Dict[str, float]] = None
+            for terms in expansions:
+                token_scores: Dict[str, float] = {}
+                for term, weight in terms:
+                    postings = self.postings[term]
+                    idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                    candidates = postings if scores is None else [k for k in scores if k in postings]
+                    for doc_key in candidates:
+                        doc = self.docs[doc_key]
+                        if scores is None and ((owner and doc[3] != owner) or (doc_type and doc[0] != doc_type)):
+                            continue
+                        tf = postings[doc_key]
+                        score = weight * idf * tf * (BM25_K1 + 1) / (
+                            tf + BM25_K1 * (1 - BM25_B + BM25_B * doc[4] / average_length)
+                        )
+                        # 1つの語が複数の語に展開された場合は最も高いスコアを使う
+                        if score > token_scores.get(doc_key, 0.0):
+                            token_scores[doc_key] = score
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {doc_key: scores[doc_key] + score for doc_key, score in token_scores.items()}
+                if not scores:
+                    return []
+
+            results = []
+            for doc_key, score in heapq.nlargest(limit, scores.items(), key=lambda entry: entry[1]):
+                doc = self.docs[doc_key]
+                results.append({'type': doc[0], 'id': doc[1], 'title': doc[2], 'score': round(score, 4)})
+            return results
+
+    def to_snapshot(self) -> bytes:
+        """スナップショット（文書は番号で参照する gzip 圧縮 JSON）を作成"""
+        with self._lock:
+            doc_keys = list(self.docs)
+            numbers = {doc_key: number for number, doc_key in enumerate(doc_keys)}
+            data = {
+                'version': 1,
+                'docs': [[doc_key, *self.docs[doc_key][:4]] for doc_key in doc_keys],
+                'postings': {
+                    term: [value for doc_key, tf in postings.items() for value in (numbers[doc_key], tf)]
+                    for term, postings in self.postings.items()
+                }
+            }
+        return gzip.compress(json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+    @classmethod
+    def from_snapshot(cls, data: bytes) -> 'InvertedIndex':
+        snapshot = json.loads(gzip.decompress(data))
+        index = cls()
+        doc_keys = [entry[0] for entry in snapshot['docs']]
+        doc_terms: List[List[str]] = [[] for _ in doc_keys]
+        lengths = [0] * len(doc_keys)
+        for term, values in snapshot['postings'].items():
+            postings = {}
+            for number, tf in zip(values[::2], values[1::2]):
+                postings[doc_keys[number]] = tf
+                doc_terms[number].append(term)
+                lengths[number] += tf
+            index.postings[term] = postings
+        for number, (doc_key, doc_type, doc_id, title, owner) in enumerate(snapshot['docs']):
+            index.docs[doc_key] = (doc_type, doc_id, title, owner, lengths[number], tuple(doc_terms[number]))
+        index.total_length = sum(lengths)
+        index._terms = sorted(index.postings)
+        return index
+
+
+def _delta_table():
+    return get_dynamodb_resource().Table(os.environ['SEARCH_INDEX_TABLE'])
+
+
+def _apply_delta(index: InvertedIndex, item: Dict[str, Any]) -> None:
+    if item.get('deleted'):
+        index.remove(item['doc_key'])
+    else:
+        index.put(item)
+
+
+def _apply_deltas(index: InvertedIndex, since: str) -> str:
+    """since 以降の差分をインデックスに反映し、反映した最新の indexed_at を返す"""
+    start = datetime.fromisoformat(since) - timedelta(seconds=REFRESH_OVERLAP_SECONDS)
+    table = _delta_table()
+    latest = since
+    day = start.date()
+    while day <= datetime.utcnow().date():
+        params: Dict[str, Any] = {
+            'IndexName': 'indexed-day-index',
+            'KeyConditionExpression': 'indexed_day = :day AND indexed_at > :since',
+            'ExpressionAttributeValues': {':day': day.isoformat(), ':since': start.isoformat()}
+        }
+        while True:
+            response = table.query(**params)
+            for item in response['Items']:
+                _apply_delta(index, item)
+                latest = max(latest, item['indexed_at'])
+            if 'LastEvaluatedKey' not in response:
+                break
+            params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        day += timedelta(days=1)
+    return latest
+
+
+def _load_index() -> Tuple[InvertedIndex, str]:
+    """最新のスナップショットとそれ以降の差分からインデックスを読み込む"""
+    storage = get_object_storage()
+    pointer = storage.get_bytes(LATEST_KEY)
+    snapshot = None
+    if pointer:
+        latest = json.loads(pointer)
+        snapshot = storage.get_bytes(latest['key'])
+    if snapshot:
+        index, since = InvertedIndex.from_snapshot(snapshot), latest['built_at']
+    else:
+        # スナップショットがない場合は保存されているすべての差分から作る
+        index = InvertedIndex()
+        since = (datetime.utcnow() - timedelta(seconds=DELTA_TTL_SECONDS)).isoformat()
+    return index, _apply_deltas(index, since)
+
+
+_index: Optional[InvertedIndex] = None
+_cursor: Optional[str] = None
+_refreshed_at = 0.0
+_load_lock = threading.Lock()
+
+
+def get_search_index() -> InvertedIndex:
+    """コンテナ内で共有するインデックスを取得（初回に読み込み、以降は定期的に差分を反映）"""
+    global _index, _cursor, _refreshed_at
+    with _load_lock:
+        if _index is None:
+            _index, _cursor = _load_index()
+            _refreshed_at = time.monotonic()
+        elif time.monotonic() - _refreshed_at >= int_env('SEARCH_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS):
+            _cursor = _apply_deltas(_index, _cursor)
+            _refreshed_at = time.monotonic()
+        return _index
+
+
+def reset_search_index() -> None:
+    """読み込み済みのインデックスを破棄（テスト用）"""
+    global _index, _cursor, _refreshed_at
+    with _load_lock:
+        _index = None
+        _cursor = None
+        _refreshed_at = 0.0
+
+
+def _write_deltas(deltas: List[Dict[str, Any]]) -> None:
+    """差分を SearchIndex に保存し、読み込み済みのインデックスにも反映"""
+    if not os.environ.get('SEARCH_INDEX_TABLE'):
+        # 検索を使わない環境
+        return
+    now = datetime.utcnow()
+    expires_at = int(time.time()) + DELTA_TTL_SECONDS
+    for delta in deltas:
+        delta.update({'indexed_at': now.isoformat(), 'indexed_day': now.date().isoformat(), 'expires_at': expires_at})
+    try:
+        with _delta_table().batch_writer(overwrite_by_pkeys=['doc_key']) as batch:
+            for delta in deltas:
+                batch.put_item(Item=delta)
+    except ClientError as e:
+        # 検索は補助的な機能なので、本体の書き込みは失敗させない（rebuild で復旧できる）
+        print(f"Failed to update search index: {str(e)}")
+        return
+    # インポートでは複数のスレッドから呼ばれるため、読み込み済みのインデックスはロックを取って更新する
+    with _load_lock:
+        if _index is not None:
+            for delta in deltas:
+                _apply_delta(_index, delta)
+
+
+def index_documents(doc_type: str, items: Iterable[Dict[str, Any]]) -> None:
+    """作成・更新されたアイテムをインデックスに登録"""
+    deltas = [dict(build_document(doc_type, item), deleted=False) for item in items]
+    if deltas:
+        _write_deltas(deltas)
+
+
+def remove_document(doc_type: str, doc_id: str) -> None:
+    """削除されたアイテムをインデックスから除く"""
+    _write_deltas([{
+        'doc_key': f'{doc_type}#{doc_id}', 'doc_type': doc_type, 'doc_id': doc_id, 'deleted': True
+    }])
+
+
+register_primer('dynamodb', lambda: prime_dynamodb(os.environ.get('SEARCH_INDEX_TABLE')), 'search')
+# インデックスの読み込み（スナップショットと差分）が最も時間のかかる初期化
+register_primer('search_index', get_search_index, 'search')
+
+
+@traced_handler('search')
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """検索のメインハンドラー（API Gateway とスケジュール実行の両方から呼ばれる）"""
+    if 'httpMethod' not in event:
+        # EventBridge のスケジュールから呼ばれた場合はスナップショットの作成ジョブを登録するだけ
+        job = enqueue_job('search_snapshot', {})
+        return {'statusCode': 202, 'job_id': job['job_id']}
+
+    http_method = event['httpMethod']
+    path = event['path']
+
+    try:
+        if path == '/search' and http_method == 'GET':
+            return search(event, context)
+        else:
+            return create_error_response(404, 'Endpoint not found')
+
+    except Exception as e:
+        print(f"Error in search handler: {str(e)}")
+        return create_error_response(500, 'Internal server error')
+
+
+@require_auth
+def search(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """発注書・出荷を検索（一般ユーザーは自分が作成したもののみ）
+
+    クエリパラメータ:
+    - q: 検索語（空白区切りの語をすべて含む文書を返す。各語は前方一致）
+    - type: purchase_order または shipment に絞り込む
+    - limit: 件数（デフォルト20、最大100）
+    """
+    query = (get_query_parameter(event, 'q') or '').strip()
+    if not query:
+        return create_error_response(400, 'q is required')
+    doc_type = get_query_parameter(event, 'type')
+    if doc_type and doc_type not in DOC_ENTITIES:
+        return create_error_response(400, f"type must be one of: {', '.join(DOC_ENTITIES)}")
+    try:
+        limit = min(max(int(get_query_parameter(event, 'limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+    except ValueError:
+        return create_error_response(400, 'Invalid limit')
+
+    user = event.get('user', {})
+    owner = None if user.get('custom:role') == UserRole.ADMIN.value else user.get('sub')
+    results = get_search_index().search(query, owner=owner, doc_type=doc_type, limit=limit)
+    return create_response(200, {'results': results})
+
+
+@register_job('search_snapshot')
+def run_search_snapshot(payload: Dict[str, Any], job: Dict[str, Any]) -> Dict[str, Any]:
+    """スナップショットを作り直すジョブ（rebuild の場合はテーブルをスキャンして再構築）"""
+    # 作成中の変更は次回の読み込み時に差分として反映されるよう、開始時刻を built_at とする
+    built_at = datetime.utcnow().isoformat()
+    if payload.get('rebuild'):
+        index = InvertedIndex()
+        repository = get_repository()
+        for doc_type, entity in DOC_ENTITIES.items():
+            items = scan_all(
+                repository.table(entity), segments=int_env('SEARCH_SCAN_SEGMENTS', 4), **repository.scan_params(entity)
+            )
+            if doc_type == DOC_PURCHASE_ORDER:
+                # 明細の品名も索引に含めるため、発注書ごとに明細を読み込む
+                items = with_items(items)
+            for item in items:
+                index.put(build_document(doc_type, item))
+    else:
+        index, _ = _load_index()
+
+    storage = get_object_storage()
+    key = f"search/snapshots/{job['job_id']}.json.gz"
+    data = index.to_snapshot()
+    storage.put_bytes(key, data, 'application/gzip')
+    storage.put_bytes(LATEST_KEY, json.dumps({'key': key, 'built_at': built_at}).encode('utf-8'), 'application/json')
+    return {'key': key, 'documents': len(index), 'terms': len(index.postings), 'bytes': len(data)}
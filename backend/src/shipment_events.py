@@ -0,0 +1,253 @@
+"""
+運送会社から届く出荷ステータスイベントの一括適用
+
+POST /shipments/status-events で受け取ったイベント（追跡番号・運送会社・ステータス・発生日時）を
+出荷ごとにまとめて重複を除き、発生日時順に有効な遷移（SHIPMENT_STATUS_TRANSITIONS）だけを適用します。
+
+- 追跡番号から出荷 ID への変換と現在のステータスの取得は BatchGetItem でまとめて行います
+  （single_table の場合は予約に保存した po_id から出荷のキーを組み立てます）。
+- 書き込みは出荷ごとに1回の条件付き UpdateItem で、並列数を STATUS_EVENT_WORKERS で制限します。
+  手動更新など他の書き込みと競合した場合（updated_at が変わった場合）は読み直して再適用します。
+- 出荷ごとに最後に適用した発生日時（status_updated_at）を保存し、それ以前のイベントは
+  stale として無視します。運送会社の再送や順序の入れ替わりはこれで吸収されます。
+- 配送完了になった出荷は、リクエストごとにまとめて配送実績（carrier_analytics）に加算します。
+- 更新した出荷は、リクエストごとにまとめて変更履歴（change_log）に記録します。
+"""
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from botocore.exceptions import ClientError
+from utils import get_dynamodb_resource, int_env
+from instrumentation import TracedThreadPoolExecutor
+from item_cache import get_item_cache
+from carrier_analytics import record_deliveries
+from change_log import record_changes
+from repository import SHIPMENT, get_repository
+from models import SHIPMENT_STATUS_TRANSITIONS, ShipmentStatus, activity_bucket, tracking_key
+
+
+MAX_EVENTS_PER_REQUEST = 1000
+DEFAULT_WORKERS = 8
+# 競合時に読み直して再適用する回数
+MAX_APPLY_ATTEMPTS = 3
+BATCH_GET_SIZE = 100
+
+RESULT_APPLIED = 'applied'
+RESULT_UNCHANGED = 'unchanged'
+RESULT_DUPLICATE = 'duplicate'
+RESULT_STALE = 'stale'
+RESULT_INVALID_TRANSITION = 'invalid_transition'
+RESULT_NOT_FOUND = 'not_found'
+RESULT_INVALID = 'invalid'
+RESULT_CONFLICT = 'conflict'
+RESULTS = (
+    RESULT_APPLIED, RESULT_UNCHANGED, RESULT_DUPLICATE, RESULT_STALE,
+    RESULT_INVALID_TRANSITION, RESULT_NOT_FOUND, RESULT_INVALID, RESULT_CONFLICT
+)
+
+
+def _normalize_occurred_at(value: Any) -> Optional[str]:
+    """発生日時を UTC（タイムゾーンなし）の ISO 形式に揃える"""
+    if not isinstance(value, str):
+        return None
+    try:
+        occurred_at = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if occurred_at.tzinfo is not None:
+        occurred_at = occurred_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return occurred_at.isoformat()
+
+
+def _parse_event(raw: Any) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """イベントを検証し、(イベント, エラー) を返す"""
+    if not isinstance(raw, dict):
+        return None, 'Event must be an object'
+    for field in ('tracking_number', 'carrier', 'status', 'occurred_at'):
+        if not isinstance(raw.get(field), str) or not raw[field].strip():
+            return None, f'Missing required field: {field}'
+    try:
+        status = ShipmentStatus(raw['status'])
+    except ValueError:
+        return None, 'Invalid status'
+    occurred_at = _normalize_occurred_at(raw['occurred_at'])
+    if occurred_at is None:
+        return None, 'Invalid occurred_at'
+    event_id = raw.get('event_id')
+    if event_id is not None and not isinstance(event_id, str):
+        return None, 'Invalid event_id'
+    return {
+        'tracking_key': tracking_key(raw['tracking_number'], raw['carrier']),
+        'status': status,
+        'occurred_at': occurred_at,
+        'event_id': event_id
+    }, None
+
+
+def _batch_get(dynamodb: Any, table_name: str, id_name: str, keys: List[Dict[str, Any]],
+               projection: str, names: Optional[Dict[str, str]] = None) -> Dict[str, Dict[str, Any]]:
+    """BatchGetItem で読み込み、id_name の値ごとの項目を返す"""
+    found: Dict[str, Dict[str, Any]] = {}
+    for i in range(0, len(keys), BATCH_GET_SIZE):
+        request_for_table: Dict[str, Any] = {
+            'Keys': keys[i:i + BATCH_GET_SIZE],
+            'ProjectionExpression': projection,
+            'ConsistentRead': True
+        }
+        if names:
+            request_for_table['ExpressionAttributeNames'] = names
+        request = {table_name: request_for_table}
+        while request:
+            response = dynamodb.batch_get_item(RequestItems=request)
+            for item in response['Responses'].get(table_name, []):
+                found[item[id_name]] = item
+            request = response.get('UnprocessedKeys')
+    return found
+
+
+_SHIPMENT_PROJECTION = (
+    'shipment_id, po_id, #status, status_updated_at, actual_delivery, updated_at, carrier, created_at, '
+    'estimated_delivery'
+)
+_SHIPMENT_NAMES = {'#status': 'status'}
+
+
+def _fold(shipment: Dict[str, Any], events: List[Dict[str, Any]]) -> Tuple[ShipmentStatus, Optional[str], List[str]]:
+    """現在のステータスにイベントを順に当てはめ、(最終ステータス, 最後に適用した発生日時, イベントごとの結果) を返す"""
+    status = ShipmentStatus(shipment['status'])
+    last_applied = shipment.get('status_updated_at')
+    applied_at = None
+    outcomes = []
+    for event in events:
+        if last_applied and event['occurred_at'] <= last_applied:
+            outcomes.append(RESULT_STALE)
+        elif event['status'] == status:
+            outcomes.append(RESULT_UNCHANGED)
+        elif event['status'] not in SHIPMENT_STATUS_TRANSITIONS[status]:
+            outcomes.append(RESULT_INVALID_TRANSITION)
+        else:
+            status = event['status']
+            last_applied = applied_at = event['occurred_at']
+            outcomes.append(RESULT_APPLIED)
+    return status, applied_at, outcomes
+
+
+def _apply_to_shipment(table: Any, shipment: Dict[str, Any],
+                       events: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """1件の出荷にイベントを適用し、(イベントごとの結果, 更新した場合は更新後の出荷) を返す"""
+    shipment_id = shipment['shipment_id']
+    key = get_repository().key(SHIPMENT, shipment)
+    for _ in range(MAX_APPLY_ATTEMPTS):
+        status, applied_at, outcomes = _fold(shipment, events)
+        results = [
+            {'index': event['index'], 'result': outcome, 'shipment_id': shipment_id}
+            for event, outcome in zip(events, outcomes)
+        ]
+        if applied_at is None:
+            return results, None
+
+        now = datetime.utcnow().isoformat()
+        update_expression = ('SET #status = :status, status_updated_at = :applied_at, updated_at = :now, '
+                             'activity_bucket = :activity_bucket')
+        values = {
+            ':status': status.value,
+            ':applied_at': applied_at,
+            ':now': now,
+            ':activity_bucket': activity_bucket(shipment_id, now),
+            ':expected_updated_at': shipment['updated_at']
+        }
+        # update_shipment と同じく、配送完了になった時点で実際の配送日を設定する
+        if status == ShipmentStatus.DELIVERED and not shipment.get('actual_delivery'):
+            update_expression += ', actual_delivery = :now'
+        try:
+            response = table.update_item(
+                Key=key,
+                UpdateExpression=update_expression,
+                ConditionExpression='attribute_exists(shipment_id) AND updated_at = :expected_updated_at',
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues=values,
+                ReturnValues='ALL_NEW'
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            # 他の書き込みと競合したので読み直して再適用する
+            response = table.get_item(
+                Key=key,
+                ProjectionExpression=_SHIPMENT_PROJECTION,
+                ExpressionAttributeNames=_SHIPMENT_NAMES,
+                ConsistentRead=True
+            )
+            if 'Item' not in response:
+                return [{'index': event['index'], 'result': RESULT_NOT_FOUND} for event in events], None
+            shipment = response['Item']
+            continue
+        get_item_cache('shipments').invalidate(shipment_id)
+        return results, get_repository().from_storage(response['Attributes'])
+    return [{'index': event['index'], 'result': RESULT_CONFLICT, 'shipment_id': shipment_id} for event in events], None
+
+
+def apply_status_events(raw_events: List[Any]) -> List[Dict[str, Any]]:
+    """イベントを出荷ごとに適用し、入力と同じ順序でイベントごとの結果を返す"""
+    results: List[Optional[Dict[str, Any]]] = [None] * len(raw_events)
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    seen = set()
+    for index, raw in enumerate(raw_events):
+        event, error = _parse_event(raw)
+        if error:
+            results[index] = {'index': index, 'result': RESULT_INVALID, 'error': error}
+            continue
+        # event_id がなければ同じ出荷・ステータス・発生日時のイベントを重複とみなす
+        dedupe_key = ('id', event['event_id']) if event['event_id'] else (
+            event['tracking_key'], event['status'], event['occurred_at']
+        )
+        if dedupe_key in seen:
+            results[index] = {'index': index, 'result': RESULT_DUPLICATE}
+            continue
+        seen.add(dedupe_key)
+        event['index'] = index
+        groups.setdefault(event['tracking_key'], []).append(event)
+
+    dynamodb = get_dynamodb_resource()
+    repository = get_repository()
+    reservations = _batch_get(
+        dynamodb, os.environ['TRACKING_NUMBERS_TABLE'], 'tracking_key',
+        [{'tracking_key': key} for key in groups], 'tracking_key, shipment_id, po_id'
+    )
+    shipments_table_name = repository.table_name(SHIPMENT)
+    shipment_keys = {
+        reservation['shipment_id']: repository.key(SHIPMENT, reservation)
+        for reservation in reservations.values()
+    }
+    shipments = _batch_get(
+        dynamodb, shipments_table_name, 'shipment_id',
+        [shipment_keys[shipment_id] for shipment_id in sorted(shipment_keys)],
+        _SHIPMENT_PROJECTION, _SHIPMENT_NAMES
+    )
+
+    work = []
+    for key, events in groups.items():
+        reservation = reservations.get(key)
+        shipment = shipments.get(reservation['shipment_id']) if reservation else None
+        if shipment is None:
+            for event in events:
+                results[event['index']] = {'index': event['index'], 'result': RESULT_NOT_FOUND}
+            continue
+        events.sort(key=lambda event: (event['occurred_at'], event['index']))
+        work.append((shipment, events))
+
+    if work:
+        table = dynamodb.Table(shipments_table_name)
+        workers = max(1, min(int_env('STATUS_EVENT_WORKERS', DEFAULT_WORKERS), len(work)))
+        updated = []
+        with TracedThreadPoolExecutor(max_workers=workers) as executor:
+            outcomes = executor.map(lambda args: _apply_to_shipment(table, *args), work)
+            for shipment_results, updated_shipment in outcomes:
+                for result in shipment_results:
+                    results[result['index']] = result
+                if updated_shipment is not None:
+                    updated.append(updated_shipment)
+        # 終了状態からは遷移しないので、配送完了の出荷はこのリクエストで配送完了になったもの
+        record_deliveries([s for s in updated if s['status'] == ShipmentStatus.DELIVERED.value])
+        record_changes(SHIPMENT, updated)
+    return results
@@ -17,11 +17,43 @@ from utils import (
     get_path_parameter,
     get_query_parameter,
     validate_required_fields,
-    handle_dynamodb_error
+    handle_dynamodb_error,
+    encode_cursor,
+    decode_cursor,
+    prime_dynamodb
 )
-from models import Shipment, ShipmentStatus, UserRole, generate_id
+from instrumentation import traced_handler
+from warmup import register_primer
+from idempotency import idempotent
+from item_cache import get_item_cache
+from archival import load_archived
+from search_index import DOC_SHIPMENT, index_documents, remove_document
+from change_log import record_changes, record_deletions
+from carrier_analytics import record_deliveries
+from shipment_events import MAX_EVENTS_PER_REQUEST, RESULTS, apply_status_events
+from repository import PURCHASE_ORDER, SHIPMENT, get_repository
+from models import (
+    Shipment,
+    ShipmentStatus,
+    UserRole,
+    TRACKING_PREFIX_LENGTH,
+    compress_attributes,
+    decompress_attributes,
+    generate_id,
+    normalize_tracking_number,
+    tracking_key
+)
+
+
+DEFAULT_TRACKING_LOOKUP_LIMIT = 50
+MAX_TRACKING_LOOKUP_LIMIT = 200
+
 
+register_primer('dynamodb', lambda: prime_dynamodb(get_repository().table_name(SHIPMENT)), 'shipments')
+register_primer('item_cache', lambda: get_item_cache('shipments'), 'shipments')
 
+
+@traced_handler('shipments')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """出荷管理のメインハンドラー"""
     http_method = event['httpMethod']
@@ -32,6 +64,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             return get_shipments(event, context)
         elif path == '/shipments' and http_method == 'POST':
             return create_shipment(event, context)
+        elif path == '/shipments/status-events' and http_method == 'POST':
+            return ingest_status_events(event, context)
         elif path.startswith('/shipments/') and http_method == 'GET':
             return get_shipment(event, context)
         elif path.startswith('/shipments/') and http_method == 'PUT':
@@ -54,46 +88,34 @@ def get_shipments(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         user_role = user.get('custom:role', 'user')
         user_id = user.get('sub')
         
-        dynamodb = get_dynamodb_resource()
-        shipments_table = dynamodb.Table(os.environ['SHIPMENTS_TABLE'])
+        repository = get_repository()
+        shipments_table = repository.table(SHIPMENT)
+        
+        # 追跡番号による検索は tracking-number-index で行う
+        tracking_number = get_query_parameter(event, 'tracking_number')
+        if tracking_number:
+            return _find_shipments_by_tracking_number(event, shipments_table, tracking_number, user_role, user_id)
         
         # クエリパラメータで購買発注書IDによるフィルタリングをサポート
         po_id = get_query_parameter(event, 'po_id')
         
         if po_id:
             # 特定の購買発注書に関連する出荷を取得
-            response = shipments_table.query(
-                IndexName='po-id-index',
-                KeyConditionExpression='po_id = :po_id',
-                ExpressionAttributeValues={':po_id': po_id}
-            )
+            items = repository.query_shipments(po_id)
         else:
             # 管理者はすべての出荷を閲覧可能、一般ユーザーは自分が作成したもののみ
             if user_role == UserRole.ADMIN.value:
-                response = shipments_table.scan()
+                items = shipments_table.scan(**repository.scan_params(SHIPMENT))['Items']
             else:
                 # 一般ユーザーの場合、created_byでフィルタリング
-                response = shipments_table.scan(
-                    FilterExpression='created_by = :user_id',
-                    ExpressionAttributeValues={':user_id': user_id}
-                )
+                items = shipments_table.scan(**repository.scan_params(SHIPMENT, {
+                    'FilterExpression': 'created_by = :user_id',
+                    'ExpressionAttributeValues': {':user_id': user_id}
+                }))['Items']
         
         shipments = []
-        for item in response['Items']:
-            shipment = Shipment.from_dict(item)
-            shipments.append({
-                'shipment_id': shipment.shipment_id,
-                'po_id': shipment.po_id,
-                'tracking_number': shipment.tracking_number,
-                'carrier': shipment.carrier,
-                'status': shipment.status.value,
-                'created_by': shipment.created_by,
-                'estimated_delivery': shipment.estimated_delivery,
-                'actual_delivery': shipment.actual_delivery,
-                'created_at': shipment.created_at,
-                'updated_at': shipment.updated_at,
-                'notes': shipment.notes
-            })
+        for item in items:
+            shipments.append(Shipment.from_dict(item).summary())
         
         # 作成日時で降順ソート
         shipments.sort(key=lambda x: x['created_at'], reverse=True)
@@ -105,6 +127,7 @@ def get_shipments(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 
 
 @require_auth
+@idempotent
 def create_shipment(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """新しい出荷を作成"""
     try:
@@ -131,10 +154,6 @@ def create_shipment(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         estimated_delivery = body.get('estimated_delivery')
         notes = body.get('notes')
         
-        # 購買発注書の存在確認
-        if not _verify_purchase_order_exists(po_id):
-            return create_error_response(400, 'Purchase order not found')
-        
         # 出荷を作成
         shipment_id = generate_id()
         shipment = Shipment(
@@ -148,11 +167,24 @@ def create_shipment(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             notes=notes
         )
         
-        # DynamoDBに保存
-        dynamodb = get_dynamodb_resource()
-        shipments_table = dynamodb.Table(os.environ['SHIPMENTS_TABLE'])
-        
-        shipments_table.put_item(Item=shipment.to_dict())
+        # 追跡番号の予約と出荷の保存を1つのトランザクションで行い、同じ運送会社の追跡番号の重複を防ぐ
+        # 購買発注書の存在確認も同じトランザクションの ConditionCheck で行う（事前の読み込みは不要）
+        repository = get_repository()
+        item = shipment.to_dict()
+        try:
+            get_dynamodb_resource().meta.client.transact_write_items(TransactItems=[
+                repository.put_request(SHIPMENT, compress_attributes(item), 'attribute_not_exists(shipment_id)'),
+                _reserve_tracking_number(item),
+                repository.exists_request(PURCHASE_ORDER, {'po_id': po_id})
+            ])
+        except ClientError as e:
+            if _condition_failed(e, 1):
+                return create_error_response(409, 'Tracking number already exists for this carrier')
+            if _condition_failed(e, 2):
+                return create_error_response(400, 'Purchase order not found')
+            raise
+        index_documents(DOC_SHIPMENT, [item])
+        record_changes(SHIPMENT, [item])
         
         return create_response(201, {
             'message': 'Shipment created successfully',
@@ -187,14 +219,12 @@ def get_shipment(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         user_role = user.get('custom:role', 'user')
         user_id = user.get('sub')
         
-        dynamodb = get_dynamodb_resource()
-        shipments_table = dynamodb.Table(os.environ['SHIPMENTS_TABLE'])
-        
-        response = shipments_table.get_item(Key={'shipment_id': shipment_id})
-        if 'Item' not in response:
+        # ウォームコンテナではキャッシュから返し、DynamoDBの読み込みを省略する
+        item = get_item_cache('shipments').get_or_load(shipment_id, lambda: _load_shipment(shipment_id))
+        if item is None:
             return create_error_response(404, 'Shipment not found')
         
-        shipment = Shipment.from_dict(response['Item'])
+        shipment = Shipment.from_dict(item)
         
         # 権限チェック：管理者または作成者のみアクセス可能
         if user_role != UserRole.ADMIN.value and shipment.created_by != user_id:
@@ -212,7 +242,8 @@ def get_shipment(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'actual_delivery': shipment.actual_delivery,
                 'created_at': shipment.created_at,
                 'updated_at': shipment.updated_at,
-                'notes': shipment.notes
+                'notes': shipment.notes,
+                'archived_at': item.get('archived_at')
             }
         })
         
@@ -234,15 +265,14 @@ def update_shipment(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
         body = json.loads(event['body'])
         
-        dynamodb = get_dynamodb_resource()
-        shipments_table = dynamodb.Table(os.environ['SHIPMENTS_TABLE'])
+        repository = get_repository()
         
         # 既存の出荷を取得
-        response = shipments_table.get_item(Key={'shipment_id': shipment_id})
-        if 'Item' not in response:
+        previous = repository.get(SHIPMENT, shipment_id)
+        if previous is None:
             return create_error_response(404, 'Shipment not found')
         
-        shipment = Shipment.from_dict(response['Item'])
+        shipment = Shipment.from_dict(previous)
         
         # 権限チェック：管理者または作成者のみ更新可能
         if user_role != UserRole.ADMIN.value and shipment.created_by != user_id:
@@ -265,6 +295,8 @@ def update_shipment(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         if 'status' in update_data:
             try:
                 new_status = ShipmentStatus(update_data['status'])
+                if new_status != shipment.status:
+                    shipment.status_updated_at = datetime.utcnow().isoformat()
                 shipment.status = new_status
                 
                 # ステータスが配送完了になった場合は実際の配送日を設定
@@ -286,8 +318,31 @@ def update_shipment(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         # 更新日時を設定
         shipment.updated_at = datetime.utcnow().isoformat()
         
-        # DynamoDBを更新
-        shipments_table.put_item(Item=shipment.to_dict())
+        # DynamoDBを更新し、キャッシュにも書き込む
+        item = shipment.to_dict()
+        previous_key = previous.get('tracking_key')
+        if item['tracking_key'] == previous_key:
+            repository.table(SHIPMENT).put_item(Item=repository.to_storage(SHIPMENT, compress_attributes(item)))
+        else:
+            # 追跡番号・運送会社が変わった場合は予約も付け替える
+            transact_items = [
+                repository.put_request(SHIPMENT, compress_attributes(item)),
+                _reserve_tracking_number(item)
+            ]
+            if previous_key:
+                transact_items.append(_release_tracking_number(previous_key))
+            try:
+                get_dynamodb_resource().meta.client.transact_write_items(TransactItems=transact_items)
+            except ClientError as e:
+                if _condition_failed(e, 1):
+                    return create_error_response(409, 'Tracking number already exists for this carrier')
+                raise
+        get_item_cache('shipments').put(shipment_id, item)
+        index_documents(DOC_SHIPMENT, [item])
+        record_changes(SHIPMENT, [item])
+        # 配送完了になった出荷を配送実績に加算
+        if shipment.status == ShipmentStatus.DELIVERED and previous['status'] != ShipmentStatus.DELIVERED.value:
+            record_deliveries([item])
         
         return create_response(200, {
             'message': 'Shipment updated successfully',
@@ -323,22 +378,27 @@ def delete_shipment(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         user_role = user.get('custom:role', 'user')
         user_id = user.get('sub')
         
-        dynamodb = get_dynamodb_resource()
-        shipments_table = dynamodb.Table(os.environ['SHIPMENTS_TABLE'])
+        repository = get_repository()
         
         # 既存の出荷を取得
-        response = shipments_table.get_item(Key={'shipment_id': shipment_id})
-        if 'Item' not in response:
+        previous = repository.get(SHIPMENT, shipment_id)
+        if previous is None:
             return create_error_response(404, 'Shipment not found')
         
-        shipment = Shipment.from_dict(response['Item'])
+        shipment = Shipment.from_dict(previous)
         
         # 権限チェック：管理者または作成者のみ削除可能
         if user_role != UserRole.ADMIN.value and shipment.created_by != user_id:
             return create_error_response(403, 'Access denied')
         
-        # 出荷を削除
-        shipments_table.delete_item(Key={'shipment_id': shipment_id})
+        # 出荷を削除し、追跡番号の予約も解除する
+        transact_items = [repository.delete_request(SHIPMENT, previous)]
+        if previous.get('tracking_key'):
+            transact_items.append(_release_tracking_number(previous['tracking_key']))
+        get_dynamodb_resource().meta.client.transact_write_items(TransactItems=transact_items)
+        get_item_cache('shipments').invalidate(shipment_id)
+        remove_document(DOC_SHIPMENT, shipment_id)
+        record_deletions(SHIPMENT, [previous])
         
         return create_response(200, {'message': 'Shipment deleted successfully'})
         
@@ -346,6 +406,34 @@ def delete_shipment(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         return handle_dynamodb_error(e)
 
 
+@require_auth
+def ingest_status_events(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """運送会社のステータスイベントをまとめて適用（管理者または shipment_status_update 権限）"""
+    try:
+        user = event.get('user', {})
+        if user.get('custom:role', 'user') != UserRole.ADMIN.value:
+            if not _check_user_permission(user.get('sub'), 'shipment_status_update'):
+                return create_error_response(403, 'Insufficient permissions to update shipment status')
+        
+        body = json.loads(event['body'] or '{}')
+        events = body.get('events') if isinstance(body, dict) else None
+        if not isinstance(events, list) or not events:
+            return create_error_response(400, 'events must be a non-empty list')
+        if len(events) > MAX_EVENTS_PER_REQUEST:
+            return create_error_response(400, f'At most {MAX_EVENTS_PER_REQUEST} events are allowed per request')
+        
+        results = apply_status_events(events)
+        return create_response(200, {
+            'summary': {name: sum(1 for r in results if r['result'] == name) for name in RESULTS},
+            'results': results
+        })
+        
+    except json.JSONDecodeError:
+        return create_error_response(400, 'Invalid JSON in request body')
+    except ClientError as e:
+        return handle_dynamodb_error(e)
+
+
 def _check_user_permission(user_id: str, permission: str) -> bool:
     """ユーザーが特定の権限を持っているかチェック"""
     try:
@@ -363,14 +451,106 @@ def _check_user_permission(user_id: str, permission: str) -> bool:
         return False
 
 
-def _verify_purchase_order_exists(po_id: str) -> bool:
-    """購買発注書が存在するかチェック"""
+def _find_shipments_by_tracking_number(event: Dict[str, Any], shipments_table: Any, tracking_number: str,
+                                       user_role: str, user_id: str) -> Dict[str, Any]:
+    """追跡番号で出荷を検索（1回のインデックスの読み込みで済む）
+
+    クエリパラメータ:
+    - tracking_number: 追跡番号（空白・ハイフン・大文字小文字の違いは無視）
+    - match: exact（デフォルト）または prefix（先頭3文字以上の前方一致）
+    - carrier: 運送会社で絞り込む
+    - limit / cursor: prefix の場合のページング（デフォルト50、最大200）
+    """
+    match = get_query_parameter(event, 'match', 'exact')
+    carrier = get_query_parameter(event, 'carrier')
+    normalized = normalize_tracking_number(tracking_number)
+    if match not in ('exact', 'prefix'):
+        return create_error_response(400, 'match must be exact or prefix')
+    if match == 'prefix' and len(normalized) < TRACKING_PREFIX_LENGTH:
+        return create_error_response(
+            400, f'tracking_number prefix must be at least {TRACKING_PREFIX_LENGTH} characters'
+        )
     try:
-        dynamodb = get_dynamodb_resource()
-        po_table = dynamodb.Table(os.environ['PURCHASE_ORDERS_TABLE'])
-        
-        response = po_table.get_item(Key={'po_id': po_id})
-        return 'Item' in response
-        
-    except ClientError:
-        return False
\ No newline at end of file
+        limit = min(max(int(get_query_parameter(event, 'limit', DEFAULT_TRACKING_LOOKUP_LIMIT)), 1),
+                    MAX_TRACKING_LOOKUP_LIMIT)
+        start_key = decode_cursor(
+            get_query_parameter(event, 'cursor'),
+            keys=('tracking_prefix', 'tracking_key') + get_repository().key_names(SHIPMENT)
+        )
+        if start_key and start_key['tracking_prefix'] != normalized[:TRACKING_PREFIX_LENGTH]:
+            raise ValueError('Invalid cursor')
+    except ValueError:
+        return create_error_response(400, 'Invalid limit or cursor')
+
+    params: Dict[str, Any] = {
+        'IndexName': 'tracking-number-index',
+        'ExpressionAttributeValues': {':prefix': normalized[:TRACKING_PREFIX_LENGTH]},
+        'Limit': limit
+    }
+    if match == 'exact' and carrier:
+        params['KeyConditionExpression'] = 'tracking_prefix = :prefix AND tracking_key = :key'
+        params['ExpressionAttributeValues'][':key'] = tracking_key(tracking_number, carrier)
+    else:
+        params['KeyConditionExpression'] = 'tracking_prefix = :prefix AND begins_with(tracking_key, :key)'
+        params['ExpressionAttributeValues'][':key'] = normalized + '#' if match == 'exact' else normalized
+        if carrier:
+            params['FilterExpression'] = 'carrier = :carrier'
+            params['ExpressionAttributeValues'][':carrier'] = carrier
+    if user_role != UserRole.ADMIN.value:
+        # 一般ユーザーは自分が作成した出荷のみ
+        conditions = [params['FilterExpression']] if 'FilterExpression' in params else []
+        params['FilterExpression'] = ' AND '.join(conditions + ['created_by = :user_id'])
+        params['ExpressionAttributeValues'][':user_id'] = user_id
+    if start_key:
+        params['ExclusiveStartKey'] = start_key
+
+    response = shipments_table.query(**params)
+    shipments = []
+    for item in response['Items']:
+        shipment = Shipment.from_dict(item)
+        shipments.append({
+            'shipment_id': shipment.shipment_id,
+            'po_id': shipment.po_id,
+            'tracking_number': shipment.tracking_number,
+            'carrier': shipment.carrier,
+            'status': shipment.status.value,
+            'created_by': shipment.created_by,
+            'estimated_delivery': shipment.estimated_delivery,
+            'actual_delivery': shipment.actual_delivery,
+            'created_at': shipment.created_at,
+            'updated_at': shipment.updated_at,
+            'notes': shipment.notes
+        })
+    return create_response(200, {
+        'shipments': shipments,
+        'next_cursor': encode_cursor(response.get('LastEvaluatedKey'))
+    })
+
+
+def _load_shipment(shipment_id: str) -> Optional[Dict[str, Any]]:
+    """出荷を読み込み、圧縮された属性を展開して返す（テーブルにない場合はアーカイブ済みのデータを探す）"""
+    item = get_repository().get(SHIPMENT, shipment_id) or load_archived('shipments', shipment_id)
+    return decompress_attributes(item) if item is not None else None
+
+
+def _reserve_tracking_number(item: Dict[str, Any]) -> Dict[str, Any]:
+    """追跡番号を予約する TransactWriteItems の要素（既に予約されていれば失敗する）"""
+    return {'Put': {
+        'TableName': os.environ['TRACKING_NUMBERS_TABLE'],
+        # single_table ではステータスイベントの適用時に po_id から出荷のキーを組み立てる
+        'Item': {'tracking_key': item['tracking_key'], 'shipment_id': item['shipment_id'], 'po_id': item['po_id']},
+        'ConditionExpression': 'attribute_not_exists(tracking_key)'
+    }}
+
+
+def _release_tracking_number(key: str) -> Dict[str, Any]:
+    return {'Delete': {'TableName': os.environ['TRACKING_NUMBERS_TABLE'], 'Key': {'tracking_key': key}}}
+
+
+def _condition_failed(error: ClientError, position: int) -> bool:
+    """トランザクションが position 番目（追跡番号の予約・発注書の存在確認など）の条件で失敗したか"""
+    if error.response['Error']['Code'] != 'TransactionCanceledException':
+        return False
+    reasons = error.response.get('CancellationReasons') or []
+    return len(reasons) > position and reasons[position].get('Code') == 'ConditionalCheckFailed'
+
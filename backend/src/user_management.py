@@ -5,7 +5,8 @@
 """
 import json
 import os
-from typing import Dict, Any
+import time
+from typing import Dict, Any, List, Optional, Tuple
 import boto3
 from botocore.exceptions import ClientError
 from utils import (
@@ -13,15 +14,45 @@ from utils import (
     create_error_response,
     require_auth,
     require_admin,
-    get_cognito_client,
+    handle_cognito_error,
     get_dynamodb_resource,
     get_path_parameter,
+    get_query_parameter,
+    encode_cursor,
+    decode_cursor,
     validate_email,
-    validate_required_fields
+    validate_required_fields,
+    prime_dynamodb
 )
+from instrumentation import TracedThreadPoolExecutor, traced_handler
+from warmup import register_primer
+from cognito_gateway import get_cognito_gateway, CognitoThrottledError
+from idempotency import idempotent
+from jobs import enqueue_job, register_job
+from record_io import detect_format, event_body_stream, iter_records
 from models import User, UserRole, generate_id
 
 
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_PAGES_PER_REQUEST = 10
+
+DEFAULT_BULK_CONCURRENCY = 8
+# 1チャンク分の Cognito 登録が終わるごとに Users テーブルへ書き込み、再開位置を進める
+BULK_CHUNK_SIZE = 50
+# API Gateway の統合タイムアウト（Lambda の実行時間が残っていても、これを過ぎると 504 になる）
+API_GATEWAY_TIMEOUT_MS = 29000
+# Users テーブルへの書き込みとレスポンスのために残しておく時間
+BULK_TIME_MARGIN_MS = 3000
+# 1行あたりの Cognito 呼び出し（最も遅いカテゴリのレートで1チャンクに入れる行数を決める）
+BULK_ROW_OPERATIONS = ('admin_create_user', 'admin_set_user_password')
+
+
+register_primer('dynamodb', lambda: prime_dynamodb(os.environ.get('USERS_TABLE')), 'user_management')
+register_primer('cognito', get_cognito_gateway, 'user_management')
+
+
+@traced_handler('user_management')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """ユーザー管理のメインハンドラー"""
     http_method = event['httpMethod']
@@ -32,6 +63,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             return get_users(event, context)
         elif path == '/users' and http_method == 'POST':
             return create_user(event, context)
+        elif path == '/users/bulk' and http_method == 'POST':
+            return bulk_create_users(event, context)
         elif path.startswith('/users/') and http_method == 'PUT':
             return update_user(event, context)
         elif path.startswith('/users/') and http_method == 'DELETE':
@@ -39,6 +72,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         else:
             return create_error_response(404, 'Endpoint not found')
     
+    except CognitoThrottledError as e:
+        return e.to_response()
     except Exception as e:
         print(f"Error in user management handler: {str(e)}")
         return create_error_response(500, 'Internal server error')
@@ -47,15 +82,65 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 @require_auth
 @require_admin
 def get_users(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    """すべてのユーザーを取得（管理者のみ）"""
+    """ユーザー一覧を取得（管理者のみ）
+
+    クエリパラメータ:
+    - q: メールアドレスの前方一致検索（email-index を begins_with で検索）
+    - role: 役割で絞り込み
+    - limit: 1ページの件数（デフォルト50、最大200）
+    - cursor: 前のレスポンスの next_cursor
+    """
     try:
+        search = (get_query_parameter(event, 'q') or '').strip().lower()
+        role = get_query_parameter(event, 'role')
+        if role:
+            try:
+                UserRole(role)
+            except ValueError:
+                return create_error_response(400, 'Invalid role')
+        try:
+            limit = min(max(int(get_query_parameter(event, 'limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+            # 検索の有無で読み込むインデックスが異なり、カーソルのキーも異なる
+            keys = ('user_id', 'email_initial', 'email_key') if search else ('user_id',)
+            start_key = decode_cursor(get_query_parameter(event, 'cursor'), keys=keys)
+            if start_key and search and not str(start_key['email_key']).startswith(search):
+                raise ValueError('Invalid cursor')
+        except ValueError:
+            return create_error_response(400, 'Invalid limit or cursor')
+        
         dynamodb = get_dynamodb_resource()
         users_table = dynamodb.Table(os.environ['USERS_TABLE'])
         
-        response = users_table.scan()
-        users = []
+        params: Dict[str, Any] = {}
+        values: Dict[str, Any] = {}
+        if role:
+            # role は DynamoDB の予約語
+            params['FilterExpression'] = '#role = :role'
+            params['ExpressionAttributeNames'] = {'#role': 'role'}
+            values[':role'] = role
+        if search:
+            params['IndexName'] = 'email-index'
+            params['KeyConditionExpression'] = 'email_initial = :initial AND begins_with(email_key, :prefix)'
+            values.update({':initial': search[0], ':prefix': search})
+            read_page = users_table.query
+        else:
+            read_page = users_table.scan
+        if values:
+            params['ExpressionAttributeValues'] = values
+        
+        # フィルター適用後に limit 件集まるまで読み進める（読み込み量はページ数で制限）
+        items: List[Dict[str, Any]] = []
+        for _ in range(MAX_PAGES_PER_REQUEST):
+            if start_key:
+                params['ExclusiveStartKey'] = start_key
+            response = read_page(Limit=limit - len(items), **params)
+            items.extend(response['Items'])
+            start_key = response.get('LastEvaluatedKey')
+            if not start_key or len(items) >= limit:
+                break
         
-        for item in response['Items']:
+        users = []
+        for item in items:
             user = User.from_dict(item)
             users.append({
                 'user_id': user.user_id,
@@ -66,15 +151,28 @@ def get_users(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'updated_at': user.updated_at
             })
         
-        return create_response(200, {'users': users})
+        return create_response(200, {'users': users, 'next_cursor': encode_cursor(start_key)})
         
     except ClientError as e:
         print(f"DynamoDB error: {str(e)}")
         return create_error_response(500, 'Failed to retrieve users')
 
 
+def _find_user_by_email(users_table: Any, email: str) -> Optional[Dict[str, Any]]:
+    """email-index からメールアドレスが一致するユーザーを検索（大文字・小文字は区別しない）"""
+    email_key = email.lower()
+    response = users_table.query(
+        IndexName='email-index',
+        KeyConditionExpression='email_initial = :initial AND email_key = :email_key',
+        ExpressionAttributeValues={':initial': email_key[:1], ':email_key': email_key},
+        Limit=1
+    )
+    return response['Items'][0] if response['Items'] else None
+
+
 @require_auth
 @require_admin
+@idempotent
 def create_user(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """新しいユーザーを作成（管理者のみ）"""
     try:
@@ -100,37 +198,22 @@ def create_user(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         except ValueError:
             return create_error_response(400, 'Invalid role')
         
+        # 重複は Cognito を呼ぶ前に email-index で確認する
+        dynamodb = get_dynamodb_resource()
+        users_table = dynamodb.Table(os.environ['USERS_TABLE'])
+        if _find_user_by_email(users_table, email):
+            return create_error_response(409, 'User already exists')
+        
         # Cognitoでユーザーを作成
-        cognito_client = get_cognito_client()
+        cognito_client = get_cognito_gateway()
         user_pool_id = os.environ['COGNITO_USER_POOL_ID']
         
         try:
-            response = cognito_client.admin_create_user(
-                UserPoolId=user_pool_id,
-                Username=email,
-                UserAttributes=[
-                    {'Name': 'email', 'Value': email},
-                    {'Name': 'email_verified', 'Value': 'true'},
-                    {'Name': 'custom:role', 'Value': role}
-                ],
-                TemporaryPassword=password,
-                MessageAction='SUPPRESS'
-            )
-            
-            # 一時パスワードを恒久パスワードに設定
-            cognito_client.admin_set_user_password(
-                UserPoolId=user_pool_id,
-                Username=email,
-                Password=password,
-                Permanent=True
-            )
+            username = _provision_cognito_user(cognito_client, user_pool_id, email, password, role)
             
             # DynamoDBにユーザー情報を保存
-            dynamodb = get_dynamodb_resource()
-            users_table = dynamodb.Table(os.environ['USERS_TABLE'])
-            
             user = User(
-                user_id=response['User']['Username'],
+                user_id=username,
                 email=email,
                 role=user_role,
                 permissions=permissions
@@ -154,12 +237,213 @@ def create_user(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             if error_code == 'UsernameExistsException':
                 return create_error_response(409, 'User already exists')
             else:
-                return create_error_response(500, 'User creation failed')
+                return handle_cognito_error(e, 'User creation failed')
                 
     except json.JSONDecodeError:
         return create_error_response(400, 'Invalid JSON in request body')
 
 
+@require_auth
+@require_admin
+def bulk_create_users(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """CSV / NDJSON からユーザーを一括作成（管理者のみ）
+
+    各行は email, password, role, permissions（CSV はセミコロン区切り）を持ちます。
+    API Gateway のタイムアウトと Lambda の実行時間内に処理しきれない場合は next_row を返すので、
+    同じ本文を ?start_row=<next_row> で再送すると続きから処理します。
+    既に Cognito に存在するユーザーは skipped とし、Users テーブルに行がなければ補完します。
+    パスワードの設定前に失敗したユーザー（FORCE_CHANGE_PASSWORD）は、再送時にパスワードの設定から続けます。
+    """
+    started = time.monotonic()
+    headers = event.get('headers') or {}
+    content_type = headers.get('Content-Type') or headers.get('content-type')
+    fmt = detect_format(content_type, get_query_parameter(event, 'format'))
+    if not fmt:
+        return create_error_response(400, 'Body must be CSV (text/csv) or NDJSON (application/x-ndjson)')
+    
+    try:
+        start_row = int(get_query_parameter(event, 'start_row', '1'))
+        concurrency = int(os.environ.get('BULK_IMPORT_CONCURRENCY', DEFAULT_BULK_CONCURRENCY))
+    except ValueError:
+        return create_error_response(400, 'start_row must be an integer')
+    
+    cognito_client = get_cognito_gateway()
+    user_pool_id = os.environ['COGNITO_USER_POOL_ID']
+    dynamodb = get_dynamodb_resource()
+    users_table = dynamodb.Table(os.environ['USERS_TABLE'])
+    
+    results: List[Dict[str, Any]] = []
+    next_row: Optional[int] = None
+    chunk: List[Tuple[int, Optional[Dict[str, Any]], Optional[str]]] = []
+    
+    def flush(rows) -> None:
+        # 行の検証と Cognito への登録を並列に実行し、結果をまとめて Users テーブルに書き込む
+        with TracedThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            outcomes = list(executor.map(
+                lambda row: _provision_bulk_row(cognito_client, user_pool_id, *row), rows
+            ))
+        _store_bulk_users(dynamodb, users_table, outcomes)
+        results.extend(result for result, _ in outcomes)
+    
+    chunk_size = 0
+    for row in iter_records(event_body_stream(event), fmt):
+        if row[0] < start_row:
+            continue
+        if not chunk:
+            # 残り時間に現在のレートで処理できる行数だけをチャンクに入れる
+            chunk_size = min(
+                BULK_CHUNK_SIZE,
+                int(_remaining_seconds(context, started) * cognito_client.rate(*BULK_ROW_OPERATIONS))
+            )
+            if chunk_size < 1:
+                next_row = row[0]
+                break
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+    
+    summary = {status: sum(1 for r in results if r['status'] == status) for status in ('created', 'skipped', 'failed')}
+    return create_response(200, {
+        'message': 'Bulk user import finished' if next_row is None else 'Bulk user import partially finished',
+        'processed': len(results),
+        'created': summary['created'],
+        'skipped': summary['skipped'],
+        'failed': summary['failed'],
+        'next_row': next_row,
+        'results': results
+    })
+
+
+def _remaining_seconds(context: Any, started: float) -> float:
+    """新しい行の処理に使える残り秒数（API Gateway のタイムアウトと Lambda の残り実行時間の短い方から余裕を引く）"""
+    remaining_ms = API_GATEWAY_TIMEOUT_MS - (time.monotonic() - started) * 1000
+    if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        remaining_ms = min(remaining_ms, context.get_remaining_time_in_millis())
+    return (remaining_ms - BULK_TIME_MARGIN_MS) / 1000
+
+
+def _provision_cognito_user(cognito_client: Any, user_pool_id: str, email: str, password: str, role: str) -> str:
+    """Cognitoにユーザーを作成し、恒久パスワードを設定してユーザー名を返す"""
+    response = cognito_client.admin_create_user(
+        UserPoolId=user_pool_id,
+        Username=email,
+        UserAttributes=[
+            {'Name': 'email', 'Value': email},
+            {'Name': 'email_verified', 'Value': 'true'},
+            {'Name': 'custom:role', 'Value': role}
+        ],
+        TemporaryPassword=password,
+        MessageAction='SUPPRESS'
+    )
+    
+    # 一時パスワードを恒久パスワードに設定
+    cognito_client.admin_set_user_password(
+        UserPoolId=user_pool_id,
+        Username=email,
+        Password=password,
+        Permanent=True
+    )
+    return response['User']['Username']
+
+
+def _provision_bulk_row(
+    cognito_client: Any,
+    user_pool_id: str,
+    row_number: int,
+    record: Optional[Dict[str, Any]],
+    error: Optional[str]
+) -> Tuple[Dict[str, Any], Optional[User]]:
+    """一括作成の1行を処理し、(結果, 保存するユーザー) を返す"""
+    result: Dict[str, Any] = {'row': row_number, 'email': (record or {}).get('email')}
+    if error:
+        return dict(result, status='failed', error=error), None
+    
+    is_valid, error_msg = validate_required_fields(record, ['email', 'password', 'role'])
+    if not is_valid:
+        return dict(result, status='failed', error=error_msg), None
+    if not validate_email(record['email']):
+        return dict(result, status='failed', error='Invalid email format'), None
+    try:
+        user_role = UserRole(record['role'])
+    except ValueError:
+        return dict(result, status='failed', error='Invalid role'), None
+    
+    permissions = record.get('permissions') or []
+    if isinstance(permissions, str):
+        permissions = [p.strip() for p in permissions.split(';') if p.strip()]
+    
+    try:
+        username = _provision_cognito_user(
+            cognito_client, user_pool_id, record['email'], record['password'], user_role.value
+        )
+    except CognitoThrottledError as e:
+        return dict(result, status='failed', error=str(e)), None
+    except ClientError as e:
+        error_code = e.response['Error']['Code']
+        if error_code == 'UsernameExistsException':
+            # 再開時など既に作成済みの場合（Users テーブルの行は _store_bulk_users で補完する）
+            return _resume_existing_user(cognito_client, user_pool_id, record, user_role, permissions, result)
+        return dict(result, status='failed', error=e.response['Error'].get('Message', error_code)), None
+    
+    user = User(user_id=username, email=record['email'], role=user_role, permissions=permissions)
+    return dict(result, status='created', user_id=username), user
+
+
+def _resume_existing_user(
+    cognito_client: Any,
+    user_pool_id: str,
+    record: Dict[str, Any],
+    user_role: UserRole,
+    permissions: List[str],
+    result: Dict[str, Any]
+) -> Tuple[Dict[str, Any], Optional[User]]:
+    """Cognito に既に存在する行を処理（前回パスワードの設定前に失敗していれば設定して created とする）"""
+    try:
+        cognito_user = cognito_client.admin_get_user(UserPoolId=user_pool_id, Username=record['email'])
+        if cognito_user.get('UserStatus') != 'FORCE_CHANGE_PASSWORD':
+            user = User(user_id=record['email'], email=record['email'], role=user_role, permissions=permissions)
+            return dict(result, status='skipped', reason='User already exists'), user
+        cognito_client.admin_set_user_password(
+            UserPoolId=user_pool_id,
+            Username=record['email'],
+            Password=record['password'],
+            Permanent=True
+        )
+    except CognitoThrottledError as e:
+        return dict(result, status='failed', error=str(e)), None
+    except ClientError as e:
+        error_code = e.response['Error']['Code']
+        return dict(result, status='failed', error=e.response['Error'].get('Message', error_code)), None
+    username = cognito_user['Username']
+    user = User(user_id=username, email=record['email'], role=user_role, permissions=permissions)
+    return dict(result, status='created', user_id=username), user
+
+
+def _store_bulk_users(dynamodb: Any, users_table: Any, outcomes: List[Tuple[Dict[str, Any], Optional[User]]]) -> None:
+    """作成したユーザーを BatchWriteItem で保存（既存ユーザーは行がない場合のみ補完）"""
+    created = [user for result, user in outcomes if user and result['status'] == 'created']
+    existing = [user for result, user in outcomes if user and result['status'] == 'skipped']
+    
+    if existing:
+        table_name = os.environ['USERS_TABLE']
+        found = set()
+        for i in range(0, len(existing), 100):
+            keys = [{'user_id': user.user_id} for user in existing[i:i + 100]]
+            request = {table_name: {'Keys': keys, 'ProjectionExpression': 'user_id'}}
+            while request:
+                response = dynamodb.batch_get_item(RequestItems=request)
+                found.update(item['user_id'] for item in response['Responses'].get(table_name, []))
+                request = response.get('UnprocessedKeys')
+        created.extend(user for user in existing if user.user_id not in found)
+    
+    with users_table.batch_writer(overwrite_by_pkeys=['user_id']) as batch:
+        for user in created:
+            batch.put_item(Item=user.to_dict())
+
+
 @require_auth
 @require_admin
 def update_user(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
@@ -196,7 +480,7 @@ def update_user(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     user.role = new_role
                     
                     # Cognitoの属性も更新
-                    cognito_client = get_cognito_client()
+                    cognito_client = get_cognito_gateway()
                     user_pool_id = os.environ['COGNITO_USER_POOL_ID']
                     
                     cognito_client.admin_update_user_attributes(
@@ -234,7 +518,7 @@ def update_user(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
         except ClientError as e:
             print(f"Error updating user: {str(e)}")
-            return create_error_response(500, 'Failed to update user')
+            return handle_cognito_error(e, 'Failed to update user')
             
     except json.JSONDecodeError:
         return create_error_response(400, 'Invalid JSON in request body')
@@ -264,30 +548,34 @@ def delete_user(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         if current_user.get('sub') == user_id:
             return create_error_response(400, 'Cannot delete your own account')
         
-        # Cognitoからユーザーを削除
-        cognito_client = get_cognito_client()
-        user_pool_id = os.environ['COGNITO_USER_POOL_ID']
+        # Cognitoの削除はジョブとして実行する（登録に失敗した場合は DynamoDB の行を残す）
+        job = enqueue_job(
+            'delete_cognito_user',
+            {'user_id': user_id, 'username': user.email},
+            created_by=current_user.get('sub')
+        )
+        users_table.delete_item(Key={'user_id': user_id})
         
-        try:
-            cognito_client.admin_delete_user(
-                UserPoolId=user_pool_id,
-                Username=user.email
-            )
-            
-            # DynamoDBからユーザーを削除
-            users_table.delete_item(Key={'user_id': user_id})
-            
-            return create_response(200, {'message': 'User deleted successfully'})
-            
-        except ClientError as e:
-            error_code = e.response['Error']['Code']
-            if error_code == 'UserNotFoundException':
-                # Cognitoにユーザーが存在しない場合でもDynamoDBからは削除
-                users_table.delete_item(Key={'user_id': user_id})
-                return create_response(200, {'message': 'User deleted successfully'})
-            else:
-                return create_error_response(500, 'Failed to delete user')
+        return create_response(202, {'message': 'User deletion accepted', 'job_id': job['job_id']})
                 
     except ClientError as e:
         print(f"Error deleting user: {str(e)}")
-        return create_error_response(500, 'Failed to delete user')
\ No newline at end of file
+        return create_error_response(500, 'Failed to delete user')
+
+
+@register_job('delete_cognito_user')
+def run_delete_cognito_user(payload: Dict[str, Any], job: Dict[str, Any]) -> Dict[str, Any]:
+    """Cognitoからユーザーを削除するジョブ（既に存在しない場合も成功とする）"""
+    cognito_client = get_cognito_gateway()
+    user_pool_id = os.environ['COGNITO_USER_POOL_ID']
+    
+    try:
+        cognito_client.admin_delete_user(
+            UserPoolId=user_pool_id,
+            Username=payload['username']
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'UserNotFoundException':
+            return {'user_id': payload['user_id'], 'deleted': False}
+        raise
+    return {'user_id': payload['user_id'], 'deleted': True}
@@ -3,14 +3,34 @@
 
 認証、レスポンス生成、バリデーション等の共通機能を提供します。
 """
+import base64
+import binascii
+import contextvars
 import json
 import jwt
 import os
-from typing import Dict, Any, Optional, Tuple
+import queue
+import threading
+from decimal import Decimal
+from typing import Dict, Any, Iterable, Iterator, Optional, Tuple
 from functools import wraps
 import boto3
 from botocore.exceptions import ClientError
 from models import UserRole
+from instrumentation import span, InstrumentedClient, InstrumentedResource
+import local_dynamodb
+
+
+def json_default(value: Any) -> Any:
+    """DynamoDBから取得したDecimalをJSONの数値に変換"""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def to_dynamodb_item(data: Dict[str, Any]) -> Dict[str, Any]:
+    """floatをDecimalに変換（boto3はfloat型の書き込みを受け付けないため）"""
+    return json.loads(json.dumps(data, default=json_default), parse_float=Decimal)
 
 
 def create_response(
@@ -22,23 +42,30 @@ def create_response(
     default_headers = {
         'Content-Type': 'application/json',
         'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
+        'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,Idempotency-Key',
         'Access-Control-Allow-Methods': 'GET,POST,PUT,DELETE,OPTIONS'
     }
     
     if headers:
         default_headers.update(headers)
     
+    with span('serialize', 'serialize'):
+        serialized = json.dumps(body, ensure_ascii=False, default=json_default)
+    
     return {
         'statusCode': status_code,
         'headers': default_headers,
-        'body': json.dumps(body, ensure_ascii=False)
+        'body': serialized
     }
 
 
-def create_error_response(status_code: int, message: str) -> Dict[str, Any]:
+def create_error_response(
+    status_code: int,
+    message: str,
+    headers: Optional[Dict[str, str]] = None
+) -> Dict[str, Any]:
     """エラーレスポンスを生成"""
-    return create_response(status_code, {'error': message})
+    return create_response(status_code, {'error': message}, headers)
 
 
 def get_user_from_token(token: str) -> Optional[Dict[str, Any]]:
@@ -64,7 +91,8 @@ def require_auth(func):
             return create_error_response(401, 'Authorization header missing or invalid')
         
         token = auth_header.replace('Bearer ', '')
-        user_info = get_user_from_token(token)
+        with span('decode_token', 'auth'):
+            user_info = get_user_from_token(token)
         
         if not user_info:
             return create_error_response(401, 'Invalid token')
@@ -94,40 +122,101 @@ def require_admin(func):
     return wrapper
 
 
+# boto3 の DynamoDB クライアント / リソースはコンテナ内で再利用する（接続プールと TLS セッションを使い回す）
+# クライアントはスレッドセーフだが、リソースはそうではないためスレッドごとに保持する
+_dynamodb_client: Optional[Any] = None
+_dynamodb_resources = threading.local()
+
+
 def get_dynamodb_client():
     """DynamoDBクライアントを取得"""
+    global _dynamodb_client
+    # インメモリエンジン（DYNAMODB_BACKEND=memory）の場合はコンテナ不要
+    if os.environ.get('DYNAMODB_BACKEND') == 'memory':
+        return InstrumentedClient(local_dynamodb.get_memory_client(), 'dynamodb')
+    if _dynamodb_client is None:
+        # LocalStackの場合はエンドポイントを設定
+        if os.environ.get('AWS_SAM_LOCAL'):
+            _dynamodb_client = InstrumentedClient(boto3.client(
+                'dynamodb',
+                endpoint_url='http://host.docker.internal:4566',
+                region_name='us-east-1'
+            ), 'dynamodb')
+        else:
+            _dynamodb_client = InstrumentedClient(boto3.client('dynamodb'), 'dynamodb')
+    return _dynamodb_client
+
+
+def get_dynamodb_resource():
+    """DynamoDBリソースを取得"""
+    # インメモリエンジン（DYNAMODB_BACKEND=memory）の場合はコンテナ不要
+    if os.environ.get('DYNAMODB_BACKEND') == 'memory':
+        return InstrumentedResource(local_dynamodb.get_memory_resource())
+    resource = getattr(_dynamodb_resources, 'resource', None)
+    if resource is None:
+        # LocalStackの場合はエンドポイントを設定
+        if os.environ.get('AWS_SAM_LOCAL'):
+            resource = InstrumentedResource(boto3.resource(
+                'dynamodb',
+                endpoint_url='http://host.docker.internal:4566',
+                region_name='us-east-1'
+            ))
+        else:
+            resource = InstrumentedResource(boto3.resource('dynamodb'))
+        _dynamodb_resources.resource = resource
+    return resource
+
+
+def prime_dynamodb(*table_names: str) -> None:
+    """ウォームアップ用：DynamoDB のクライアントを作成し、DescribeTable で接続を確立しておく"""
+    get_dynamodb_client()
+    client = get_dynamodb_resource().meta.client
+    for table_name in table_names:
+        if table_name:
+            client.describe_table(TableName=table_name)
+
+
+def get_cognito_client():
+    """Cognito クライアントを取得"""
     # LocalStackの場合はエンドポイントを設定
     if os.environ.get('AWS_SAM_LOCAL'):
-        return boto3.client(
-            'dynamodb',
+        return InstrumentedClient(boto3.client(
+            'cognito-idp',
             endpoint_url='http://host.docker.internal:4566',
             region_name='us-east-1'
-        )
-    return boto3.client('dynamodb')
+        ), 'cognito-idp')
+    return InstrumentedClient(boto3.client('cognito-idp'), 'cognito-idp')
 
 
-def get_dynamodb_resource():
-    """DynamoDBリソースを取得"""
+def get_sqs_client():
+    """SQS クライアントを取得"""
     # LocalStackの場合はエンドポイントを設定
     if os.environ.get('AWS_SAM_LOCAL'):
-        return boto3.resource(
-            'dynamodb',
+        return InstrumentedClient(boto3.client(
+            'sqs',
             endpoint_url='http://host.docker.internal:4566',
             region_name='us-east-1'
-        )
-    return boto3.resource('dynamodb')
+        ), 'sqs')
+    return InstrumentedClient(boto3.client('sqs'), 'sqs')
 
 
-def get_cognito_client():
-    """Cognito クライアントを取得"""
+def get_s3_client():
+    """S3 クライアントを取得"""
     # LocalStackの場合はエンドポイントを設定
     if os.environ.get('AWS_SAM_LOCAL'):
-        return boto3.client(
-            'cognito-idp',
+        return InstrumentedClient(boto3.client(
+            's3',
             endpoint_url='http://host.docker.internal:4566',
             region_name='us-east-1'
-        )
-    return boto3.client('cognito-idp')
+        ), 's3')
+    return InstrumentedClient(boto3.client('s3'), 's3')
+
+
+def get_apigateway_management_client(endpoint_url: str):
+    """API Gateway Management API クライアントを取得（WebSocket の接続にメッセージを送る）"""
+    return InstrumentedClient(
+        boto3.client('apigatewaymanagementapi', endpoint_url=endpoint_url), 'apigatewaymanagementapi'
+    )
 
 
 def validate_email(email: str) -> bool:
@@ -159,6 +248,25 @@ def handle_dynamodb_error(error: ClientError) -> Dict[str, Any]:
         return create_error_response(500, 'Internal server error')
 
 
+def handle_cognito_error(error: ClientError, default_message: str) -> Dict[str, Any]:
+    """Cognitoエラーを処理（入力エラー等は4xx、それ以外は default_message の500）"""
+    error_code = error.response['Error']['Code']
+    
+    if error_code in ('InvalidPasswordException', 'InvalidParameterException'):
+        return create_error_response(400, error.response['Error'].get('Message', 'Invalid input data'))
+    elif error_code == 'NotAuthorizedException':
+        return create_error_response(401, 'Not authorized')
+    elif error_code == 'UserNotFoundException':
+        return create_error_response(404, 'User not found')
+    elif error_code in ('UsernameExistsException', 'AliasExistsException'):
+        return create_error_response(409, 'User already exists')
+    elif error_code in ('TooManyRequestsException', 'LimitExceededException'):
+        return create_error_response(429, 'Too many requests, please retry later', headers={'Retry-After': '1'})
+    else:
+        print(f"Cognito error: {str(error)}")
+        return create_error_response(500, default_message)
+
+
 def get_path_parameter(event: Dict[str, Any], param_name: str) -> Optional[str]:
     """パスパラメータを取得"""
     path_params = event.get('pathParameters', {})
@@ -170,4 +278,105 @@ def get_query_parameter(event: Dict[str, Any], param_name: str, default: Optiona
     query_params = event.get('queryStringParameters', {})
     if not query_params:
         return default
-    return query_params.get(param_name, default)
\ No newline at end of file
+    return query_params.get(param_name, default)
+
+
+def int_env(name: str, default: int) -> int:
+    """環境変数を整数として取得（未設定・整数でない場合は default）"""
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def encode_cursor(last_evaluated_key: Optional[Dict[str, Any]]) -> Optional[str]:
+    """LastEvaluatedKey をクライアントに返すページングカーソルに変換"""
+    if not last_evaluated_key:
+        return None
+    data = json.dumps(last_evaluated_key, default=json_default, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: Optional[str], keys: Optional[Iterable[str]] = None) -> Optional[Dict[str, Any]]:
+    """ページングカーソルを ExclusiveStartKey に戻す（不正な場合は ValueError）
+
+    keys を指定すると、属性がちょうど keys のカーソルだけを受け付けます。
+    別の一覧や検索方法のカーソルを渡された場合に、読み込み時のエラーではなく 400 にするためです。
+    """
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')), parse_float=Decimal)
+    except (binascii.Error, UnicodeError, json.JSONDecodeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(key, dict) or not all(isinstance(v, (str, int, Decimal)) for v in key.values()):
+        raise ValueError('Invalid cursor')
+    if keys is not None and set(key) != set(keys):
+        raise ValueError('Invalid cursor')
+    return key
+
+
+def scan_all(table: Any, segments: int = 1, **scan_kwargs: Any) -> Iterator[Dict[str, Any]]:
+    """テーブル全体をページ単位でスキャンし、アイテムを1件ずつ返す
+
+    segments > 1 の場合はセグメントごとのスレッドで並列スキャンします（順序は保証しません）。
+    読み込んだページは上限付きのキューで受け渡すため、呼び出し側の処理が遅くても
+    メモリに溜まるのは高々 segments * 2 ページ分です。
+    """
+    if segments <= 1:
+        params = dict(scan_kwargs)
+        while True:
+            response = table.scan(**params)
+            yield from response['Items']
+            if 'LastEvaluatedKey' not in response:
+                return
+            params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    pages: queue.Queue = queue.Queue(maxsize=segments * 2)
+    stop = threading.Event()
+    done = object()
+
+    def put(value: Any) -> bool:
+        while not stop.is_set():
+            try:
+                pages.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def scan_segment(segment: int) -> None:
+        params = dict(scan_kwargs, Segment=segment, TotalSegments=segments)
+        try:
+            while not stop.is_set():
+                response = table.scan(**params)
+                if not put(response['Items']):
+                    return
+                if 'LastEvaluatedKey' not in response:
+                    break
+                params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        except Exception as e:
+            put(e)
+        finally:
+            put(done)
+
+    # セグメントのスレッドも呼び出し元のトレースに計上する（コンテキストはスレッドごとにコピー）
+    workers = [
+        threading.Thread(target=contextvars.copy_context().run, args=(scan_segment, segment), daemon=True)
+        for segment in range(segments)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        remaining = segments
+        while remaining:
+            page = pages.get()
+            if page is done:
+                remaining -= 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield from page
+    finally:
+        # 途中で打ち切られた場合もスレッドを止める
+        stop.set()
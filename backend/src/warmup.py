@@ -0,0 +1,57 @@
+"""
+ウォームアップ呼び出し
+
+スケジュール（template.yaml の WarmupSchedule）から {"warmup": true} を受け取ったハンドラーは、
+本来の処理を行わずにクライアント・接続・キャッシュを初期化して返します（traced_handler が判定）。
+スケールアウトで増えたコンテナでも、最初のリクエストが初期化の時間を負担しないようにするためのものです。
+
+- 各モジュールは register_primer で初期化処理を登録する（service を省略すると全ハンドラーで実行）
+- 初期化したオブジェクトはモジュール変数に保持されるため、以降のリクエストでそのまま再利用される
+- 初期化の失敗は記録するだけで、通常のリクエストの時点で改めて作成される
+"""
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+
+WARMUP_KEY = 'warmup'
+ALL_SERVICES = '*'
+
+# (service, 名前, 初期化処理) の登録順のリスト
+_primers: List[Tuple[str, str, Callable[[], Any]]] = []
+
+
+def register_primer(name: str, primer: Callable[[], Any], service: str = ALL_SERVICES) -> None:
+    """ウォームアップ時に実行する初期化処理を登録（同じ service と名前の再登録は置き換える）"""
+    for index, (registered_service, registered_name, _) in enumerate(_primers):
+        if (registered_service, registered_name) == (service, name):
+            _primers[index] = (service, name, primer)
+            return
+    _primers.append((service, name, primer))
+
+
+def is_warmup_event(event: Any) -> bool:
+    """スケジュールから送られたウォームアップのイベントか"""
+    return isinstance(event, dict) and event.get(WARMUP_KEY) is True
+
+
+def prime(service: str) -> Dict[str, Any]:
+    """service の初期化処理を実行し、合計と処理ごとの所要時間（ミリ秒）を返す"""
+    started = time.perf_counter()
+    steps: Dict[str, float] = {}
+    errors: Dict[str, str] = {}
+    for registered_service, name, primer in list(_primers):
+        if registered_service not in (ALL_SERVICES, service):
+            continue
+        step_started = time.perf_counter()
+        try:
+            primer()
+        except Exception as e:
+            errors[name] = str(e)
+        steps[name] = round((time.perf_counter() - step_started) * 1000, 3)
+    result: Dict[str, Any] = {
+        'priming_ms': round((time.perf_counter() - started) * 1000, 3),
+        'steps': steps
+    }
+    if errors:
+        result['errors'] = errors
+    return result
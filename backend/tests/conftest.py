@@ -0,0 +1,80 @@
+"""
+テスト共通設定
+
+Lambda の実行環境と同じく、src/ 直下のモジュールをトップレベルでインポートできるようにします。
+unittest のテストクラスでは @pytest.mark.usefixtures('memory_dynamodb', 'auth_headers') で共通のフィクスチャを使います。
+発注書が必要なテストは 'create_purchase_order' も指定し、self.create_purchase_order() で作成します。
+"""
+import json
+import os
+import sys
+from unittest import mock
+import jwt
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import local_dynamodb  # noqa: E402
+import purchase_orders  # noqa: E402
+
+
+TEST_JWT_SECRET = 'test-secret'
+
+
+def make_token(sub: str = 'admin-user', role: str = 'admin') -> str:
+    """sub と custom:role を持つ JWT（署名は検証されない）"""
+    return jwt.encode({'sub': sub, 'custom:role': role}, TEST_JWT_SECRET, algorithm='HS256')
+
+
+def make_auth_headers(sub: str = 'admin-user', role: str = 'admin') -> dict:
+    """make_token の JWT を持つ Authorization ヘッダー"""
+    return {'Authorization': f'Bearer {make_token(sub, role)}'}
+
+
+def purchase_order_body(**fields) -> dict:
+    """商品A を1行持つ発注書の POST /purchase-orders の本文（fields で上書き）"""
+    body = {
+        'supplier': 'テスト供給者', 'total_amount': 100,
+        'items': [{'name': '商品A', 'quantity': 1, 'unit_price': 100}]
+    }
+    body.update(fields)
+    return body
+
+
+def make_purchase_order(supplier: str = 'テスト供給者', headers: dict = None, **fields) -> str:
+    """POST /purchase-orders で発注書を作成して po_id を返す"""
+    response = purchase_orders.handler({
+        'httpMethod': 'POST', 'path': '/purchase-orders', 'headers': headers or make_auth_headers(),
+        'body': json.dumps(purchase_order_body(supplier=supplier, **fields))
+    }, None)
+    assert response['statusCode'] == 201, response['body']
+    return json.loads(response['body'])['purchase_order']['po_id']
+
+
+@pytest.fixture
+def memory_dynamodb():
+    """メモリ版 DynamoDB を使い、local_dynamodb.TABLE_DEFINITIONS の全テーブル名を環境変数に設定して空の状態から始める"""
+    environment = {env_var: definition['TableName'] for env_var, definition in local_dynamodb.TABLE_DEFINITIONS.items()}
+    environment['DYNAMODB_BACKEND'] = 'memory'
+    with mock.patch.dict(os.environ, environment):
+        local_dynamodb.reset_memory_backend()
+        yield
+
+
+@pytest.fixture
+def auth_headers(request):
+    """テストクラスから self.auth_headers(sub, role) で認証ヘッダー、self.auth_token(sub, role) で JWT を作れるようにする"""
+    if request.cls is not None:
+        request.cls.auth_headers = staticmethod(make_auth_headers)
+        request.cls.auth_token = staticmethod(make_token)
+    return make_auth_headers
+
+
+@pytest.fixture
+def create_purchase_order(request):
+    """テストクラスから self.create_purchase_order(supplier, headers, **fields) で発注書を作り、
+    self.purchase_order_body(**fields) で POST の本文を作れるようにする"""
+    if request.cls is not None:
+        request.cls.create_purchase_order = staticmethod(make_purchase_order)
+        request.cls.purchase_order_body = staticmethod(purchase_order_body)
+    return make_purchase_order
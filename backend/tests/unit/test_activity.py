@@ -0,0 +1,142 @@
+"""
+アクティビティフィード（GET /activity と activity-index）のテスト
+"""
+import json
+import os
+import sys
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+import pytest
+import activity
+import local_dynamodb
+import models
+import purchase_orders
+import shipments
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'tools'))
+import backfill_activity_buckets  # noqa: E402
+
+
+@pytest.mark.usefixtures('memory_dynamodb', 'auth_headers', 'create_purchase_order')
+class TestActivityFeed(unittest.TestCase):
+    """書き込みを分散した activity-index から最新の更新を読み込むテスト"""
+
+    layout = 'tables'
+
+    def setUp(self):
+        patcher = mock.patch.dict(os.environ, {
+            'STORAGE_LAYOUT': self.layout,
+            'ITEM_CACHE_BACKEND': 'none'
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.resource = local_dynamodb.get_memory_resource()
+
+    def _create_shipment(self, po_id, tracking_number):
+        response = shipments.handler({
+            'httpMethod': 'POST', 'path': '/shipments', 'headers': self.auth_headers(),
+            'body': json.dumps({'po_id': po_id, 'tracking_number': tracking_number, 'carrier': 'ヤマト運輸'})
+        }, None)
+        return json.loads(response['body'])['shipment']['shipment_id']
+
+    def _activity(self, params=None, headers=None):
+        event = {'httpMethod': 'GET', 'path': '/activity', 'headers': headers or self.auth_headers()}
+        if params:
+            event['queryStringParameters'] = params
+        response = activity.handler(event, None)
+        return response['statusCode'], json.loads(response['body'])
+
+    def test_returns_latest_updates_across_shards(self):
+        ids = []
+        for i in range(12):
+            po_id = self.create_purchase_order(f'供給者{i}')
+            ids.append(po_id)
+            ids.append(self._create_shipment(po_id, f'TRK-{i:03d}'))
+        # 12件の ID は複数のシャードに分かれる
+        self.assertGreater(len({models.activity_bucket(item_id, '2026-01-01') for item_id in ids}), 1)
+
+        status, body = self._activity({'limit': '5'})
+        self.assertEqual(status, 200)
+        self.assertEqual([entry['id'] for entry in body['activity']], ids[::-1][:5])
+        self.assertEqual(body['activity'][0]['type'], 'shipment')
+        self.assertEqual(body['activity'][0]['tracking_number'], 'TRK-011')
+        self.assertEqual(body['activity'][1]['supplier'], '供給者11')
+
+        # カーソルで重複・欠落なく続きを読める
+        seen = [entry['id'] for entry in body['activity']]
+        while body['next_cursor']:
+            _, body = self._activity({'limit': '5', 'cursor': body['next_cursor']})
+            seen.extend(entry['id'] for entry in body['activity'])
+        self.assertEqual(seen, ids[::-1])
+
+    def test_update_moves_item_to_the_top(self):
+        po_id = self.create_purchase_order('古い供給者')
+        self.create_purchase_order('新しい供給者')
+        purchase_orders.handler({
+            'httpMethod': 'PUT', 'path': f'/purchase-orders/{po_id}', 'headers': self.auth_headers(),
+            'pathParameters': {'po_id': po_id}, 'body': json.dumps({'notes': 'メモ'})
+        }, None)
+        _, body = self._activity()
+        self.assertEqual([entry['id'] for entry in body['activity']][0], po_id)
+        self.assertEqual(len(body['activity']), 2)
+
+    def test_reads_previous_days_and_backfills_old_rows(self):
+        today = datetime.utcnow()
+        po_id = self.create_purchase_order('今日の供給者')
+        old = models.PurchaseOrder(
+            po_id='old-po', supplier='3日前の供給者', items=None, total_amount=10,
+            status=models.PurchaseOrderStatus.DRAFT, created_by='admin-user',
+            updated_at=(today - timedelta(days=3)).isoformat()
+        ).to_dict()
+        old.pop('items')
+        old.pop('activity_bucket')
+        table = self.resource.Table('Procurement' if self.layout == 'single_table' else 'PurchaseOrders')
+        if self.layout == 'single_table':
+            old.update(pk='PO#old-po', sk='META')
+        table.put_item(Item=old)
+
+        # activity_bucket を持たない行は表示されない
+        _, body = self._activity()
+        self.assertEqual([entry['id'] for entry in body['activity']], [po_id])
+
+        self.assertEqual(backfill_activity_buckets.backfill(), {'purchase_order': 1, 'shipment': 0})
+        _, body = self._activity()
+        self.assertEqual([entry['id'] for entry in body['activity']], [po_id, 'old-po'])
+
+        # さかのぼる日数を超えた更新は次のページで読む
+        with mock.patch.object(activity, 'LOOKBACK_DAYS', 2):
+            _, body = self._activity()
+            self.assertEqual([entry['id'] for entry in body['activity']], [po_id])
+            _, body = self._activity({'cursor': body['next_cursor']})
+            self.assertEqual([entry['id'] for entry in body['activity']], ['old-po'])
+
+    def test_status_events_update_the_bucket(self):
+        po_id = self.create_purchase_order('供給者')
+        shipment_id = self._create_shipment(po_id, 'TRK-001')
+        self.create_purchase_order('後の供給者')
+        shipments.handler({
+            'httpMethod': 'POST', 'path': '/shipments/status-events', 'headers': self.auth_headers(),
+            'body': json.dumps({'events': [{
+                'tracking_number': 'TRK-001', 'carrier': 'ヤマト運輸', 'status': 'in_transit',
+                'occurred_at': '2099-01-01T00:00:00'
+            }]})
+        }, None)
+        _, body = self._activity({'limit': '1'})
+        self.assertEqual((body['activity'][0]['id'], body['activity'][0]['status']), (shipment_id, 'in_transit'))
+
+    def test_requires_admin_and_valid_parameters(self):
+        self.assertEqual(self._activity(headers=self.auth_headers('user-1', 'user'))[0], 403)
+        self.assertEqual(self._activity({'limit': '0'})[0], 400)
+        self.assertEqual(self._activity({'limit': '201'})[0], 400)
+        self.assertEqual(self._activity({'cursor': 'invalid'})[0], 400)
+
+
+class TestActivityFeedSingleTable(TestActivityFeed):
+    """STORAGE_LAYOUT=single_table の場合も同じように読み込めるテスト"""
+
+    layout = 'single_table'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+"""
+アーカイブのテスト
+"""
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock
+import pytest
+import archival
+import jobs
+import local_dynamodb
+import object_storage
+import purchase_orders
+import shipments
+
+
+def _days_ago(days):
+    return (datetime.utcnow() - timedelta(days=days)).isoformat()
+
+
+@pytest.mark.usefixtures('memory_dynamodb', 'auth_headers')
+class TestArchival(unittest.TestCase):
+    """アーカイブジョブと詳細取得のフォールバックのテスト"""
+
+    def setUp(self):
+        self.storage_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.storage_dir, True)
+        patcher = mock.patch.dict(os.environ, {
+            'JOB_QUEUE_BACKEND': 'local',
+            'OBJECT_STORAGE_BACKEND': 'local',
+            'LOCAL_STORAGE_DIR': self.storage_dir,
+            'ITEM_CACHE_BACKEND': 'none',
+            'ARCHIVE_BLOCK_BYTES': '600',
+            'ARCHIVE_CHUNK_ROWS': '30'
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        jobs.reset_job_queue()
+        object_storage.reset_object_storage()
+        self.addCleanup(jobs.reset_job_queue)
+        self.addCleanup(object_storage.reset_object_storage)
+
+        resource = local_dynamodb.get_memory_resource()
+        self.po_table = resource.Table('PurchaseOrders')
+        self.shipments_table = resource.Table('Shipments')
+        with self.po_table.batch_writer() as batch:
+            for i in range(100):
+                # 0-59: 古いキャンセル済み、60-79: 最近のキャンセル済み、80-99: 古い承認済み
+                status = 'approved' if i >= 80 else 'cancelled'
+                updated_at = _days_ago(10 if 60 <= i < 80 else 400)
+                batch.put_item(Item={
+                    'po_id': f'po-{i:03d}',
+                    'supplier': f'供給者{i}',
+                    'items': [{'name': '商品', 'quantity': 1, 'unit_price': Decimal('10.5')}],
+                    'total_amount': Decimal('10.5'),
+                    'status': status,
+                    'created_by': 'user-1',
+                    'created_at': f'2025-{i % 12 + 1:02d}-01T00:00:00',
+                    'updated_at': updated_at,
+                    'notes': ''
+                })
+        with self.shipments_table.batch_writer() as batch:
+            for i in range(20):
+                batch.put_item(Item={
+                    'shipment_id': f'sh-{i:03d}',
+                    'po_id': f'po-{i:03d}',
+                    'tracking_number': f'TRK{i:05d}',
+                    'carrier': 'ヤマト運輸',
+                    'status': 'delivered' if i < 15 else 'in_transit',
+                    'created_by': 'user-1',
+                    'created_at': '2025-03-01T00:00:00',
+                    'updated_at': _days_ago(400),
+                    'notes': ''
+                })
+
+    def _start_archive(self, body=None, headers=None):
+        response = archival.handler({
+            'httpMethod': 'POST', 'path': '/archives',
+            'headers': headers or self.auth_headers(), 'body': json.dumps(body or {})
+        }, None)
+        return response['statusCode'], json.loads(response['body'])
+
+    def test_archives_old_closed_records(self):
+        status, body = self._start_archive()
+        self.assertEqual(status, 202)
+        jobs.get_job_queue().drain()
+
+        job = jobs.get_job(body['job']['job_id'])
+        self.assertEqual(job['status'], jobs.STATUS_SUCCEEDED)
+        self.assertEqual(job['result']['archived'], {'purchase_orders': 60, 'shipments': 15})
+        remaining = sorted(item['po_id'] for item in self.po_table.scan()['Items'])
+        self.assertEqual(remaining, [f'po-{i:03d}' for i in range(60, 100)])
+        self.assertEqual(self.shipments_table.scan(Select='COUNT')['Count'], 5)
+
+        # 作成月ごとに分割され、各ファイルは通常の gzip として全件読める
+        storage = object_storage.get_object_storage()
+        keys = list(storage.list_keys('archive/purchase_orders/'))
+        self.assertTrue(all('/year=2025/month=' in key for key in keys))
+        archived = []
+        for key in keys:
+            archived.extend(json.loads(line) for line in gzip.decompress(storage.get_bytes(key)).splitlines())
+        self.assertEqual(sorted(r['po_id'] for r in archived), [f'po-{i:03d}' for i in range(60)])
+
+    def test_detail_reads_fall_back_to_archive(self):
+        self._start_archive()
+        jobs.get_job_queue().drain()
+
+        response = purchase_orders.handler({
+            'httpMethod': 'GET', 'path': '/purchase-orders/po-042',
+            'pathParameters': {'po_id': 'po-042'}, 'headers': self.auth_headers('user-1', 'user')
+        }, None)
+        self.assertEqual(response['statusCode'], 200)
+        purchase_order = json.loads(response['body'])['purchase_order']
+        self.assertEqual((purchase_order['supplier'], purchase_order['status']), ('供給者42', 'cancelled'))
+        self.assertEqual(purchase_order['total_amount'], 10.5)
+        self.assertIsNotNone(purchase_order['archived_at'])
+
+        response = shipments.handler({
+            'httpMethod': 'GET', 'path': '/shipments/sh-003',
+            'pathParameters': {'shipment_id': 'sh-003'}, 'headers': self.auth_headers('user-2', 'user')
+        }, None)
+        self.assertEqual(response['statusCode'], 403)
+
+        response = purchase_orders.handler({
+            'httpMethod': 'GET', 'path': '/purchase-orders/po-999',
+            'pathParameters': {'po_id': 'po-999'}, 'headers': self.auth_headers()
+        }, None)
+        self.assertEqual(response['statusCode'], 404)
+
+    def test_continues_when_time_budget_is_exceeded(self):
+        with mock.patch.dict(os.environ, {'ARCHIVE_TIME_BUDGET_SECONDS': '-1'}):
+            _, body = self._start_archive({'resources': ['purchase_orders'], 'older_than_days': 5})
+            queue = jobs.get_job_queue()
+            queue.drain(max_jobs=1)
+            job = jobs.get_job(body['job']['job_id'])
+            self.assertEqual(job['status'], jobs.STATUS_QUEUED)
+            self.assertEqual(job['progress']['archived'], {'purchase_orders': 30})
+            queue.drain()
+
+        job = jobs.get_job(body['job']['job_id'])
+        self.assertEqual(job['result']['archived'], {'purchase_orders': 80})
+        self.assertEqual(self.po_table.scan(Select='COUNT')['Count'], 20)
+        self.assertEqual(self.shipments_table.scan(Select='COUNT')['Count'], 20)
+
+    def test_requires_admin(self):
+        status, _ = self._start_archive(headers=self.auth_headers('user-1', 'user'))
+        self.assertEqual(status, 403)
+        status, _ = self._start_archive({'resources': ['users']})
+        self.assertEqual(status, 400)
+
+    def test_scheduled_invocation_enqueues_job(self):
+        response = archival.handler({'source': 'aws.events', 'detail-type': 'Scheduled Event'}, None)
+        self.assertEqual(response['statusCode'], 202)
+        self.assertEqual(jobs.get_job(response['job_id'])['job_type'], 'archive')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+"""
+大きな属性の圧縮（models の compress_attributes / CompressedAttribute）のテスト
+"""
+import json
+import os
+import unittest
+from decimal import Decimal
+from unittest import mock
+import pytest
+from boto3.dynamodb.types import Binary
+import local_dynamodb
+import models
+import purchase_orders
+import search_index
+import shipments
+
+
+LONG_NOTES = '納品時に検品書を同梱してください。' * 100
+
+
+class TestAttributeCodec(unittest.TestCase):
+    """encode_attribute / decode_attribute のテスト"""
+
+    def test_round_trip_and_threshold(self):
+        self.assertEqual(models.encode_attribute('短いメモ'), '短いメモ')
+        self.assertIsNone(models.encode_attribute(None))
+
+        encoded = models.encode_attribute(LONG_NOTES)
+        self.assertIsInstance(encoded, bytes)
+        self.assertEqual(encoded[0], models.CODEC_ZLIB_JSON)
+        self.assertLess(len(encoded), len(LONG_NOTES.encode('utf-8')))
+        self.assertEqual(models.decode_attribute(Binary(encoded)), LONG_NOTES)
+
+        items = [{'name': f'商品{i}', 'quantity': Decimal(i), 'unit_price': Decimal('10.5')} for i in range(100)]
+        self.assertEqual(models.decode_attribute(models.encode_attribute(items)), items)
+
+    def test_unknown_version_is_rejected(self):
+        with self.assertRaises(ValueError):
+            models.decode_attribute(b'\x09data')
+
+    def test_model_decodes_lazily(self):
+        item = models.compress_attributes({'notes': LONG_NOTES})
+        shipment = models.Shipment(
+            shipment_id='s1', po_id='p1', tracking_number='TRK1', carrier='テスト運送',
+            status=models.ShipmentStatus.PENDING, created_by='u1', notes=Binary(item['notes'])
+        )
+        self.assertIsInstance(shipment.__dict__['_notes'], Binary)
+        self.assertEqual(shipment.notes, LONG_NOTES)
+        self.assertEqual(shipment.to_dict()['notes'], LONG_NOTES)
+
+
+@pytest.mark.usefixtures('memory_dynamodb', 'auth_headers', 'create_purchase_order')
+class TestCompressedRows(unittest.TestCase):
+    """圧縮して保存した行を API から読み込むテスト"""
+
+    def setUp(self):
+        patcher = mock.patch.dict(os.environ, {
+            'ITEM_CACHE_BACKEND': 'none'
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.resource = local_dynamodb.get_memory_resource()
+
+    def test_long_notes_are_stored_compressed(self):
+        po_id = self.create_purchase_order(notes=LONG_NOTES)
+        stored = self.resource.Table('PurchaseOrders').get_item(Key={'po_id': po_id})['Item']
+        self.assertIsInstance(stored['notes'], Binary)
+
+        response = purchase_orders.handler({
+            'httpMethod': 'GET', 'path': f'/purchase-orders/{po_id}', 'headers': self.auth_headers(),
+            'pathParameters': {'po_id': po_id}
+        }, None)
+        self.assertEqual(json.loads(response['body'])['purchase_order']['notes'], LONG_NOTES)
+
+        response = shipments.handler({
+            'httpMethod': 'POST', 'path': '/shipments', 'headers': self.auth_headers(),
+            'body': json.dumps({'po_id': po_id, 'tracking_number': 'TRK1', 'carrier': 'テスト運送', 'notes': LONG_NOTES})
+        }, None)
+        shipment_id = json.loads(response['body'])['shipment']['shipment_id']
+        stored = self.resource.Table('Shipments').get_item(Key={'shipment_id': shipment_id})['Item']
+        self.assertIsInstance(stored['notes'], Binary)
+        response = shipments.handler({'httpMethod': 'GET', 'path': '/shipments', 'headers': self.auth_headers()}, None)
+        self.assertEqual(json.loads(response['body'])['shipments'][0]['notes'], LONG_NOTES)
+
+        # 検索索引の再構築でも展開したメモを使う
+        document = search_index.build_document(search_index.DOC_SHIPMENT, stored)
+        self.assertIn(search_index.tokenize('検品書')[0], document['terms'])
+
+    def test_uncompressed_rows_are_still_readable(self):
+        po_id = self.create_purchase_order(notes='短いメモ')
+        stored = self.resource.Table('PurchaseOrders').get_item(Key={'po_id': po_id})['Item']
+        self.assertEqual(stored['notes'], '短いメモ')
+        response = purchase_orders.handler({
+            'httpMethod': 'GET', 'path': '/purchase-orders', 'headers': self.auth_headers()
+        }, None)
+        self.assertEqual(json.loads(response['body'])['purchase_orders'][0]['notes'], '短いメモ')
+
+
+if __name__ == '__main__':
+    unittest.main()
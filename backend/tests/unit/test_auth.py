@@ -0,0 +1,86 @@
+"""
+認証ハンドラーのテスト
+"""
+import json
+import os
+import unittest
+from unittest import mock
+import jwt
+from botocore.exceptions import ClientError
+import auth
+from cognito_gateway import CognitoGateway
+
+
+def _id_token(**overrides):
+    claims = {
+        'sub': 'user-123',
+        'email': 'user@example.com',
+        'custom:role': 'admin',
+        'token_use': 'id',
+        'aud': 'client-id',
+        'iss': 'https://cognito-idp.us-east-1.amazonaws.com/pool-id'
+    }
+    claims.update(overrides)
+    return jwt.encode(claims, 'test-secret', algorithm='HS256')
+
+
+@mock.patch.dict(os.environ, {
+    'COGNITO_USER_POOL_ID': 'pool-id',
+    'COGNITO_USER_POOL_CLIENT_ID': 'client-id'
+})
+class TestAuth(unittest.TestCase):
+    """ログインとトークン更新のテスト"""
+
+    def _invoke(self, path, body, cognito_client):
+        gateway = CognitoGateway(cognito_client, sleep=lambda seconds: None)
+        with mock.patch.object(auth, 'get_cognito_gateway', return_value=gateway):
+            return auth.handler({'httpMethod': 'POST', 'path': path, 'body': json.dumps(body)}, None)
+
+    def test_login_uses_id_token_claims(self):
+        """ログインは IDトークンからユーザー情報を取得し、get_user を呼ばないこと"""
+        cognito_client = mock.Mock()
+        cognito_client.admin_initiate_auth.return_value = {'AuthenticationResult': {
+            'AccessToken': 'access', 'IdToken': _id_token(), 'RefreshToken': 'refresh'
+        }}
+        response = self._invoke('/auth/login', {'email': 'user@example.com', 'password': 'Passw0rd'}, cognito_client)
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(json.loads(response['body'])['user'], {
+            'email': 'user@example.com', 'role': 'admin', 'user_id': 'user-123'
+        })
+        cognito_client.get_user.assert_not_called()
+
+    def test_login_rejects_token_for_other_client(self):
+        """別のクライアント向けの IDトークンは受け付けないこと"""
+        cognito_client = mock.Mock()
+        cognito_client.admin_initiate_auth.return_value = {'AuthenticationResult': {
+            'AccessToken': 'access', 'IdToken': _id_token(aud='other-client'), 'RefreshToken': 'refresh'
+        }}
+        response = self._invoke('/auth/login', {'email': 'user@example.com', 'password': 'Passw0rd'}, cognito_client)
+        self.assertEqual(response['statusCode'], 500)
+
+    def test_refresh(self):
+        """リフレッシュトークンで新しいトークンを取得できること"""
+        cognito_client = mock.Mock()
+        cognito_client.admin_initiate_auth.return_value = {'AuthenticationResult': {
+            'AccessToken': 'new-access', 'IdToken': _id_token()
+        }}
+        response = self._invoke('/auth/refresh', {'refresh_token': 'refresh'}, cognito_client)
+        self.assertEqual(response['statusCode'], 200)
+        body = json.loads(response['body'])
+        self.assertEqual(body['tokens']['access_token'], 'new-access')
+        self.assertEqual(body['tokens']['refresh_token'], 'refresh')
+        kwargs = cognito_client.admin_initiate_auth.call_args.kwargs
+        self.assertEqual(kwargs['AuthFlow'], 'REFRESH_TOKEN_AUTH')
+
+    def test_refresh_with_invalid_token(self):
+        """無効なリフレッシュトークンは 401 を返すこと"""
+        cognito_client = mock.Mock()
+        cognito_client.admin_initiate_auth.side_effect = ClientError(
+            {'Error': {'Code': 'NotAuthorizedException', 'Message': 'Invalid Refresh Token'}}, 'AdminInitiateAuth'
+        )
+        response = self._invoke('/auth/refresh', {'refresh_token': 'expired'}, cognito_client)
+        self.assertEqual(response['statusCode'], 401)
+
+
+if __name__ == '__main__':
+    unittest.main()
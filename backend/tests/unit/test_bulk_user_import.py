@@ -0,0 +1,139 @@
+"""
+ユーザー一括作成のテスト
+"""
+import json
+import os
+import unittest
+from unittest import mock
+import pytest
+from botocore.exceptions import ClientError
+import local_dynamodb
+import user_management
+from cognito_gateway import CognitoGateway
+from record_io import FORMAT_CSV, FORMAT_NDJSON, detect_format, iter_records
+
+
+class TestRecordIO(unittest.TestCase):
+    """CSV / NDJSON の読み込みのテスト"""
+
+    def test_detect_format(self):
+        self.assertEqual(detect_format('text/csv; charset=utf-8'), FORMAT_CSV)
+        self.assertEqual(detect_format('application/json', 'ndjson'), FORMAT_NDJSON)
+        self.assertIsNone(detect_format('application/json'))
+
+    def test_iter_records_reports_bad_rows(self):
+        """解析できない行はエラーとして返し、後続の行の処理を続けること"""
+        rows = list(iter_records(['{"email": "a@example.com"}\n', 'oops\n', '\n', '[1]\n'], FORMAT_NDJSON))
+        self.assertEqual([row[0] for row in rows], [1, 2, 3])
+        self.assertEqual(rows[0][1], {'email': 'a@example.com'})
+        self.assertEqual(rows[1][2], 'Invalid JSON')
+        self.assertEqual(rows[2][2], 'Each line must be a JSON object')
+
+
+@pytest.mark.usefixtures('memory_dynamodb', 'auth_headers')
+class TestBulkCreateUsers(unittest.TestCase):
+    """POST /users/bulk のテスト"""
+
+    def setUp(self):
+        patcher = mock.patch.dict(os.environ, {
+            'COGNITO_USER_POOL_ID': 'pool-id'
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.headers = {**self.auth_headers(), 'Content-Type': 'text/csv'}
+
+        self.cognito_client = mock.Mock()
+        self.cognito_client.admin_create_user.side_effect = self._create_user
+        gateway = CognitoGateway(self.cognito_client, quota_share=100, sleep=lambda seconds: None)
+        patcher = mock.patch.object(user_management, 'get_cognito_gateway', return_value=gateway)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def _create_user(**kwargs):
+        if kwargs['Username'] == 'exists@example.com':
+            raise ClientError({'Error': {'Code': 'UsernameExistsException', 'Message': 'exists'}}, 'AdminCreateUser')
+        return {'User': {'Username': 'id-' + kwargs['Username']}}
+
+    def _invoke(self, body, query=None, context=None):
+        return user_management.handler({
+            'httpMethod': 'POST',
+            'path': '/users/bulk',
+            'headers': self.headers,
+            'queryStringParameters': query,
+            'body': body
+        }, context)
+
+    def _users(self):
+        table = local_dynamodb.get_memory_resource().Table('Users')
+        return {item['user_id']: item for item in table.scan()['Items']}
+
+    def test_bulk_create(self):
+        """行ごとの結果を返し、作成したユーザーと既存ユーザーの欠けた行を保存すること"""
+        body = '\n'.join([
+            'email,password,role,permissions',
+            'a@example.com,Passw0rd!,user,read;write',
+            'invalid,Passw0rd!,user,',
+            'b@example.com,Passw0rd!,superuser,',
+            'exists@example.com,Passw0rd!,admin,'
+        ])
+        response = self._invoke(body)
+        self.assertEqual(response['statusCode'], 200)
+        result = json.loads(response['body'])
+        self.assertEqual((result['created'], result['skipped'], result['failed']), (1, 1, 2))
+        self.assertIsNone(result['next_row'])
+        self.assertEqual([r['status'] for r in result['results']], ['created', 'failed', 'failed', 'skipped'])
+
+        users = self._users()
+        self.assertEqual(users['id-a@example.com']['permissions'], ['read', 'write'])
+        self.assertEqual(users['exists@example.com']['role'], 'admin')
+        self.assertEqual(len(users), 2)
+
+    def test_resume_when_out_of_time(self):
+        """残り時間が足りない場合は next_row を返し、start_row で再開できること"""
+        body = '\n'.join(['email,password,role'] + [f'u{i}@example.com,Passw0rd!,user' for i in range(3)])
+        context = mock.Mock()
+        context.get_remaining_time_in_millis.return_value = 1000
+        with mock.patch.object(user_management, 'BULK_CHUNK_SIZE', 2):
+            result = json.loads(self._invoke(body, context=context)['body'])
+        self.assertEqual(result['processed'], 0)
+        self.assertEqual(result['next_row'], 1)
+
+        result = json.loads(self._invoke(body, query={'start_row': '3'})['body'])
+        self.assertEqual(result['created'], 1)
+        self.assertEqual(list(self._users()), ['id-u2@example.com'])
+
+    def test_chunks_shrink_to_remaining_time(self):
+        """残り時間に現在のレートで処理できる行数だけを送り、残りは next_row で返すこと"""
+        now = [0.0]
+        gateway = CognitoGateway(self.cognito_client, quota_share=0.2, clock=lambda: now[0],
+                                 sleep=lambda seconds: now.__setitem__(0, now[0] + seconds))
+        body = '\n'.join(['email,password,role'] + [f'u{i}@example.com,Passw0rd!,user' for i in range(15)])
+        context = mock.Mock()
+        # UserAccountUpdate は 25 * 0.2 = 5 件/秒なので、余裕を除いた 2 秒で 10 行、0.4 秒で 2 行
+        context.get_remaining_time_in_millis.side_effect = [5000, 3400, 3000]
+        with mock.patch.object(user_management, 'get_cognito_gateway', return_value=gateway), \
+                mock.patch.dict(os.environ, {'BULK_IMPORT_CONCURRENCY': '1'}):
+            result = json.loads(self._invoke(body, context=context)['body'])
+        self.assertEqual((result['created'], result['next_row']), (12, 13))
+        self.assertEqual(len(self._users()), 12)
+
+    def test_resume_finishes_password_step(self):
+        """前回パスワードの設定前に失敗したユーザーは、再送時にパスワードを設定して作成済みとすること"""
+        self.cognito_client.admin_get_user.return_value = {
+            'Username': 'id-exists@example.com', 'UserStatus': 'FORCE_CHANGE_PASSWORD'
+        }
+        result = json.loads(self._invoke('email,password,role\nexists@example.com,Passw0rd!,user')['body'])
+        self.assertEqual(result['results'][0]['status'], 'created')
+        self.cognito_client.admin_set_user_password.assert_called_once_with(
+            UserPoolId='pool-id', Username='exists@example.com', Password='Passw0rd!', Permanent=True
+        )
+        self.assertEqual(self._users()['id-exists@example.com']['email'], 'exists@example.com')
+
+    def test_rejects_unknown_format(self):
+        self.headers['Content-Type'] = 'application/json'
+        self.assertEqual(self._invoke('[]')['statusCode'], 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+"""
+運送会社の配送実績の集計のテスト
+"""
+import json
+import os
+import random
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+import pytest
+import carrier_analytics
+import local_dynamodb
+import shipments
+from carrier_analytics import CarrierSketch, bucket_index, bucket_value
+
+
+class TestCarrierSketch(unittest.TestCase):
+    """スケッチ本体のテスト"""
+
+    def test_quantiles_within_relative_accuracy(self):
+        rng = random.Random(7)
+        values = sorted(rng.lognormvariate(8, 1) for _ in range(5000))
+        sketch = CarrierSketch('ヤマト運輸', '2026-03')
+        for value in values:
+            sketch.add(value, None)
+        for q in (0.5, 0.9, 0.99):
+            expected = values[int(q * (len(values) - 1))]
+            self.assertAlmostEqual(sketch.quantile(q) / expected, 1, delta=0.021)
+        self.assertEqual(bucket_value(bucket_index(0.5)), 0.0)
+
+    def test_merge_and_item_round_trip(self):
+        first, second, combined = (CarrierSketch('ヤマト運輸', '2026-03') for _ in range(3))
+        for i in range(1, 200):
+            (first if i % 2 else second).add(i * 60, i % 3 == 0)
+            combined.add(i * 60, i % 3 == 0)
+        first.merge(CarrierSketch.from_item(second.to_item()))
+        self.assertEqual(first.summary(), combined.summary())
+        self.assertEqual(first.buckets, combined.buckets)
+
+    def test_update_sketches_fit_in_one_update(self):
+        """バケットが多い場合も出荷単位でスケッチを分け、1回の UpdateItem で加算できること"""
+        deliveries = [
+            {'carrier': 'ヤマト運輸', 'created_at': '2026-03-01T00:00:00',
+             'actual_delivery': (datetime(2026, 3, 1) + timedelta(minutes=1.05 ** i)).isoformat()}
+            for i in range(2, 300)
+        ]
+        with mock.patch.object(carrier_analytics, 'MAX_BUCKETS_PER_UPDATE', 40):
+            sketches = carrier_analytics.update_sketches(deliveries)
+            requests = [sketch.update_request() for sketch in sketches]
+            self.assertGreater(len(sketches), 1)
+            self.assertTrue(all(len(sketch.buckets) <= 40 for sketch in sketches))
+            with self.assertRaises(ValueError):
+                carrier_analytics.build_sketches(deliveries)[sketches[0].sketch_key].update_request()
+        self.assertEqual(sum(sketch.delivered for sketch in sketches), len(deliveries))
+        self.assertTrue(all(request['UpdateExpression'].startswith('SET carrier') for request in requests))
+
+
+@pytest.mark.usefixtures('memory_dynamodb', 'auth_headers')
+class TestCarrierAnalyticsEndpoint(unittest.TestCase):
+    """配送完了の加算と GET /analytics/carriers のテスト"""
+
+    def setUp(self):
+        patcher = mock.patch.dict(os.environ, {
+            'ITEM_CACHE_BACKEND': 'none'
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.shipments_table = local_dynamodb.get_memory_resource().Table('Shipments')
+
+    def _put_shipment(self, shipment_id, carrier, created_hours_ago, estimated_delivery=None):
+        created_at = (datetime.utcnow() - timedelta(hours=created_hours_ago)).isoformat()
+        self.shipments_table.put_item(Item={
+            'shipment_id': shipment_id, 'po_id': 'po-1', 'tracking_number': shipment_id, 'carrier': carrier,
+            'status': 'in_transit', 'created_by': 'admin-user', 'created_at': created_at, 'updated_at': created_at,
+            'estimated_delivery': estimated_delivery, 'notes': ''
+        })
+
+    def _deliver(self, shipment_id):
+        response = shipments.handler({
+            'httpMethod': 'PUT', 'path': f'/shipments/{shipment_id}', 'headers': self.auth_headers(),
+            'pathParameters': {'shipment_id': shipment_id}, 'body': json.dumps({'status': 'delivered'})
+        }, None)
+        self.assertEqual(response['statusCode'], 200)
+
+    def _analytics(self, params=None, headers=None):
+        response = carrier_analytics.handler({
+            'httpMethod': 'GET', 'path': '/analytics/carriers', 'headers': headers or self.auth_headers(),
+            'queryStringParameters': params
+        }, None)
+        return response['statusCode'], json.loads(response['body'])
+
+    def test_deliveries_are_folded_into_sketches(self):
+        today = datetime.utcnow().date()
+        for i in range(10):
+            estimated = (today + timedelta(days=1 if i < 7 else -1)).isoformat()
+            self._put_shipment(f'sh-{i}', 'ヤマト運輸', 24 * (i + 1), estimated)
+            self._deliver(f'sh-{i}')
+        self._put_shipment('sh-sagawa', '佐川急便', 10)
+        self._deliver('sh-sagawa')
+        # 配送完了のまま更新しても二重に数えない
+        self._deliver('sh-0')
+
+        status, body = self._analytics()
+        self.assertEqual(status, 200)
+        yamato, sagawa = body['carriers']
+        self.assertEqual((yamato['carrier'], yamato['delivered'], yamato['on_time_rate']), ('ヤマト運輸', 10, 0.7))
+        self.assertAlmostEqual(yamato['lead_time_hours']['p50'], 120, delta=120 * 0.021)
+        self.assertAlmostEqual(yamato['lead_time_hours']['p90'], 216, delta=216 * 0.021)
+        self.assertEqual((sagawa['delivered'], sagawa['on_time_rate']), (1, None))
+
+        _, body = self._analytics({'carrier': 'ﾔﾏﾄ運輸', 'group_by': 'month'})
+        self.assertEqual([c['carrier'] for c in body['carriers']], ['ヤマト運輸'])
+        self.assertEqual(body['carriers'][0]['months'][0]['month'], today.strftime('%Y-%m'))
+
+        _, body = self._analytics({'from': '2000-01', 'to': '2000-12'})
+        self.assertEqual(body['carriers'], [])
+
+    def test_validation_and_permissions(self):
+        self.assertEqual(self._analytics(headers=self.auth_headers('user-1', 'user'))[0], 403)
+        self.assertEqual(self._analytics({'from': '2026-13'})[0], 400)
+        self.assertEqual(self._analytics({'from': '2026-05', 'to': '2026-04'})[0], 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+"""
+変更履歴（GET /changes と ChangeLog テーブル）のテスト
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+import pytest
+import archival
+import change_log
+import jobs
+import local_dynamodb
+import object_storage
+import purchase_orders
+import shipments
+from utils import encode_cursor
+
+
+@pytest.mark.usefixtures('memory_dynamodb', 'auth_headers', 'create_purchase_order')
+class TestChangeLog(unittest.TestCase):
+    """発注書・出荷の書き込みが変更履歴に記録され、カーソルで差分を読めるテスト"""
+
+    def setUp(self):
+        self.storage_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.storage_dir, True)
+        patcher = mock.patch.dict(os.environ, {
+            'JOB_QUEUE_BACKEND': 'local',
+            'OBJECT_STORAGE_BACKEND': 'local',
+            'LOCAL_STORAGE_DIR': self.storage_dir,
+            'ITEM_CACHE_BACKEND': 'none'
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # テストでは書き込み直後の変更も返す
+        settle = mock.patch.object(change_log, 'SETTLE_SECONDS', 0)
+        settle.start()
+        self.addCleanup(settle.stop)
+        jobs.reset_job_queue()
+        object_storage.reset_object_storage()
+        self.addCleanup(jobs.reset_job_queue)
+        self.addCleanup(object_storage.reset_object_storage)
+        self.resource = local_dynamodb.get_memory_resource()
+
+    def _request(self, module, method, path, body=None, path_parameters=None, headers=None):
+        event = {'httpMethod': method, 'path': path, 'headers': headers or self.auth_headers()}
+        if body is not None:
+            event['body'] = json.dumps(body)
+        if path_parameters:
+            event['pathParameters'] = path_parameters
+        response = module.handler(event, None)
+        return response['statusCode'], json.loads(response['body'])
+
+    def _changes(self, cursor=None, limit=None, headers=None):
+        event = {'httpMethod': 'GET', 'path': '/changes', 'headers': headers or self.auth_headers()}
+        params = {}
+        if cursor:
+            params['since'] = cursor
+        if limit:
+            params['limit'] = str(limit)
+        if params:
+            event['queryStringParameters'] = params
+        response = change_log.handler(event, None)
+        return response['statusCode'], json.loads(response['body'])
+
+    def test_returns_creates_updates_and_deletes_since_cursor(self):
+        removed = self.create_purchase_order('削除する供給者')
+        _, body = self._changes()
+        self.assertEqual(body['changes'], [])
+        cursor = body['cursor']
+
+        po_id = self.create_purchase_order('供給者')
+        self._request(purchase_orders, 'PUT', f'/purchase-orders/{po_id}', {'notes': 'メモ'},
+                      path_parameters={'po_id': po_id})
+        _, body = self._request(shipments, 'POST', '/shipments', {
+            'po_id': po_id, 'tracking_number': 'TRK-001', 'carrier': 'ヤマト運輸'
+        })
+        shipment_id = body['shipment']['shipment_id']
+        self._request(purchase_orders, 'DELETE', f'/purchase-orders/{removed}', path_parameters={'po_id': removed})
+
+        status, body = self._changes(cursor)
+        self.assertEqual(status, 200)
+        self.assertFalse(body['has_more'])
+        # 作成と更新は1件にまとまり、最新の内容を一覧と同じ形式で返す
+        self.assertEqual(
+            [(change['type'], change['id'], change['deleted']) for change in body['changes']],
+            [('purchase_order', po_id, False), ('shipment', shipment_id, False), ('purchase_order', removed, True)]
+        )
+        self.assertEqual(body['changes'][0]['purchase_order']['notes'], 'メモ')
+        self.assertEqual(body['changes'][0]['purchase_order']['line_count'], 1)
+        self.assertNotIn('items', body['changes'][0]['purchase_order'])
+        self.assertEqual(body['changes'][1]['shipment']['tracking_number'], 'TRK-001')
+        self.assertNotIn('purchase_order', body['changes'][2])
+
+        # 返したカーソル以降に変更がなければ空
+        _, body = self._changes(body['cursor'])
+        self.assertEqual(body['changes'], [])
+
+    def test_pages_in_change_order(self):
+        cursor = self._changes()[1]['cursor']
+        ids = [self.create_purchase_order(f'供給者{i}') for i in range(5)]
+
+        seen = []
+        pages = 0
+        while True:
+            _, body = self._changes(cursor, limit=2)
+            seen.extend(change['id'] for change in body['changes'])
+            cursor = body['cursor']
+            pages += 1
+            if not body['has_more']:
+                break
+        self.assertEqual((seen, pages), (ids, 3))
+
+    def test_recent_changes_wait_for_the_settle_window(self):
+        since = (datetime.utcnow().isoformat(), None)
+        po_id = self.create_purchase_order('供給者')
+        with mock.patch.object(change_log, 'SETTLE_SECONDS', 60):
+            rows, position, has_more = change_log.load_changes(since, 10)
+            self.assertEqual((rows, position, has_more), ([], since, False))
+            rows, _, _ = change_log.load_changes(since, 10, now=datetime.utcnow() + timedelta(seconds=61))
+        self.assertEqual([row['item_id'] for row in rows], [po_id])
+
+    def test_users_receive_only_their_own_changes(self):
+        self.resource.Table('Users').put_item(Item={
+            'user_id': 'user-1', 'permissions': ['purchase_order_create']
+        })
+        cursor = self._changes()[1]['cursor']
+        self.create_purchase_order('管理者の供給者')
+        own = self.create_purchase_order('ユーザーの供給者', headers=self.auth_headers('user-1', 'user'))
+
+        _, body = self._changes(cursor, headers=self.auth_headers('user-1', 'user'))
+        self.assertEqual([change['id'] for change in body['changes']], [own])
+        _, body = self._changes(cursor)
+        self.assertEqual(len(body['changes']), 2)
+
+    def test_status_events_and_archival_are_recorded(self):
+        po_id = self.create_purchase_order('供給者')
+        _, body = self._request(shipments, 'POST', '/shipments', {
+            'po_id': po_id, 'tracking_number': 'TRK-001', 'carrier': 'ヤマト運輸'
+        })
+        shipment_id = body['shipment']['shipment_id']
+        cursor = self._changes()[1]['cursor']
+
+        self._request(shipments, 'POST', '/shipments/status-events', {'events': [{
+            'tracking_number': 'TRK-001', 'carrier': 'ヤマト運輸', 'status': 'in_transit',
+            'occurred_at': '2099-01-01T00:00:00'
+        }]})
+        _, body = self._changes(cursor)
+        self.assertEqual(
+            [(change['id'], change['shipment']['status']) for change in body['changes']],
+            [(shipment_id, 'in_transit')]
+        )
+
+        # アーカイブで削除した行は tombstone になる
+        old = (datetime.utcnow() - timedelta(days=400)).isoformat()
+        self.resource.Table('PurchaseOrders').update_item(
+            Key={'po_id': po_id},
+            UpdateExpression='SET #status = :status, updated_at = :old',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={':status': 'cancelled', ':old': old}
+        )
+        cursor = body['cursor']
+        self._request(archival, 'POST', '/archives', {'resources': ['purchase_orders']})
+        jobs.get_job_queue().drain()
+        _, body = self._changes(cursor)
+        self.assertEqual([(change['id'], change['deleted']) for change in body['changes']], [(po_id, True)])
+
+    def test_rejects_invalid_and_expired_cursors(self):
+        self.assertEqual(self._changes('invalid')[0], 400)
+        self.assertEqual(self._changes(self._changes()[1]['cursor'], limit=1001)[0], 400)
+        expired = encode_cursor({'changed_at': (datetime.utcnow() - timedelta(days=8)).isoformat()})
+        self.assertEqual(self._changes(expired)[0], 410)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+"""
+Cognito ゲートウェイのテスト
+"""
+import unittest
+from unittest import mock
+from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError
+from cognito_gateway import CognitoGateway, CognitoThrottledError, TokenBucket, CircuitBreaker
+
+
+def _client_error(code):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, 'AdminInitiateAuth')
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestTokenBucket(unittest.TestCase):
+    """トークンバケットのテスト"""
+
+    def test_reserve_and_refill(self):
+        """バースト分を使い切ると待ち時間が発生し、上限を超えると拒否されること"""
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, burst=2, clock=clock)
+        self.assertEqual(bucket.reserve(max_wait=1), 0)
+        self.assertEqual(bucket.reserve(max_wait=1), 0)
+        self.assertAlmostEqual(bucket.reserve(max_wait=1), 0.5)
+        self.assertIsNone(bucket.reserve(max_wait=0.5))
+        clock.now += 2
+        self.assertEqual(bucket.reserve(max_wait=0), 0)
+
+    def test_adaptive_rate(self):
+        """スロットリングでレートが下がり、成功で回復すること"""
+        bucket = TokenBucket(rate=10)
+        bucket.throttled()
+        self.assertEqual(bucket.rate, 5)
+        bucket.succeeded()
+        self.assertEqual(bucket.rate, 5.5)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """サーキットブレーカーのテスト"""
+
+    def test_open_and_half_open(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=2, open_seconds=10, clock=clock)
+        breaker.record_failure()
+        self.assertIsNone(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.allow(), 10)
+        clock.now += 10
+        self.assertIsNone(breaker.allow())
+        # 試行中は他の呼び出しを拒否する
+        self.assertIsNotNone(breaker.allow())
+        breaker.record_success()
+        self.assertIsNone(breaker.allow())
+
+
+class TestCognitoGateway(unittest.TestCase):
+    """ゲートウェイのテスト"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.client = mock.Mock()
+        self.gateway = CognitoGateway(self.client, quota_share=1.0, clock=self.clock, sleep=self.clock.sleep)
+
+    def test_retries_throttling(self):
+        """TooManyRequestsException は再試行されること"""
+        self.client.admin_initiate_auth.side_effect = [_client_error('TooManyRequestsException'), {'ok': True}]
+        self.assertEqual(self.gateway.admin_initiate_auth(UserPoolId='p'), {'ok': True})
+        self.assertEqual(self.client.admin_initiate_auth.call_count, 2)
+        self.assertLess(self.gateway.buckets['UserAuthentication'].rate, 120)
+
+    def test_client_errors_are_not_retried(self):
+        """入力エラーは再試行せずにそのまま送出されること"""
+        self.client.admin_initiate_auth.side_effect = _client_error('NotAuthorizedException')
+        with self.assertRaises(ClientError):
+            self.gateway.admin_initiate_auth(UserPoolId='p')
+        self.assertEqual(self.client.admin_initiate_auth.call_count, 1)
+
+    def test_breaker_fails_fast(self):
+        """再試行を使い切る失敗が続くとブレーカーが開き、呼び出さずに 429 になること"""
+        self.client.admin_create_user.side_effect = _client_error('TooManyRequestsException')
+        for _ in range(5):
+            with self.assertRaises(CognitoThrottledError):
+                self.gateway.admin_create_user(Username='u')
+        calls = self.client.admin_create_user.call_count
+        with self.assertRaises(CognitoThrottledError) as ctx:
+            self.gateway.admin_create_user(Username='u')
+        self.assertEqual(self.client.admin_create_user.call_count, calls)
+        response = ctx.exception.to_response()
+        self.assertEqual(response['statusCode'], 429)
+        self.assertIn('Retry-After', response['headers'])
+
+
+    def _open_breaker(self):
+        self.client.admin_create_user.side_effect = _client_error('TooManyRequestsException')
+        for _ in range(5):
+            with self.assertRaises(CognitoThrottledError):
+                self.gateway.admin_create_user(Username='u')
+        self.clock.now += 60
+
+    def test_timeouts_are_retried_and_counted(self):
+        """タイムアウト・接続エラーは再試行し、使い切った場合は 429 としてブレーカーに数えること"""
+        timeout = ReadTimeoutError(endpoint_url='https://cognito-idp')
+        self.client.admin_initiate_auth.side_effect = [timeout, {'ok': True}]
+        self.assertEqual(self.gateway.admin_initiate_auth(UserPoolId='p'), {'ok': True})
+
+        self.client.admin_initiate_auth.side_effect = EndpointConnectionError(endpoint_url='https://cognito-idp')
+        with self.assertRaises(CognitoThrottledError):
+            self.gateway.admin_initiate_auth(UserPoolId='p')
+        self.assertEqual(self.client.admin_initiate_auth.call_count, 2 + 4)
+        self.assertEqual(self.gateway.breakers['UserAuthentication'].failures, 1)
+
+    def test_trial_ending_in_timeout_releases_breaker(self):
+        """半開状態の試行が通信エラーで終わっても、次の試行が許可されること"""
+        self._open_breaker()
+        self.client.admin_create_user.side_effect = ReadTimeoutError(endpoint_url='https://cognito-idp')
+        with self.assertRaises(CognitoThrottledError):
+            self.gateway.admin_create_user(Username='u')
+        self.assertFalse(self.gateway.breakers['UserCreation'].trial_in_flight)
+
+        self.clock.now += 100
+        self.client.admin_create_user.side_effect = None
+        self.client.admin_create_user.return_value = {'ok': True}
+        self.assertEqual(self.gateway.admin_create_user(Username='u'), {'ok': True})
+
+    def test_trial_rejected_by_bucket_releases_breaker(self):
+        """半開状態の試行がバケットで拒否されても、次の試行が許可されること"""
+        self._open_breaker()
+        with mock.patch.object(self.gateway.buckets['UserCreation'], 'reserve', return_value=None):
+            with self.assertRaises(CognitoThrottledError):
+                self.gateway.admin_create_user(Username='u')
+        breaker = self.gateway.breakers['UserCreation']
+        self.assertFalse(breaker.trial_in_flight)
+
+        self.client.admin_create_user.side_effect = None
+        self.client.admin_create_user.return_value = {'ok': True}
+        self.assertEqual(self.gateway.admin_create_user(Username='u'), {'ok': True})
+        self.assertIsNone(breaker.opened_at)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+"""
+エクスポートのテスト
+"""
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from decimal import Decimal
+from unittest import mock
+import pytest
+import exports
+import jobs
+import local_dynamodb
+import object_storage
+from object_storage import S3MultipartWriter
+from utils import scan_all
+
+
+@pytest.mark.usefixtures('memory_dynamodb', 'auth_headers')
+class TestExports(unittest.TestCase):
+    """POST /exports からダウンロードまでのテスト"""
+
+    def setUp(self):
+        self.storage_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.storage_dir, True)
+        patcher = mock.patch.dict(os.environ, {
+            'JOB_QUEUE_BACKEND': 'local',
+            'OBJECT_STORAGE_BACKEND': 'local',
+            'LOCAL_STORAGE_DIR': self.storage_dir,
+            'EXPORT_SCAN_SEGMENTS': '3'
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        jobs.reset_job_queue()
+        object_storage.reset_object_storage()
+        self.addCleanup(jobs.reset_job_queue)
+        self.addCleanup(object_storage.reset_object_storage)
+
+        self.table = local_dynamodb.get_memory_resource().Table('PurchaseOrders')
+        with self.table.batch_writer() as batch:
+            for i in range(250):
+                batch.put_item(Item={
+                    'po_id': f'po-{i:03d}',
+                    'supplier': f'供給者{i}',
+                    'items': [{'name': '商品', 'quantity': 1, 'unit_price': Decimal('10.5')}],
+                    'total_amount': Decimal('10.5'),
+                    'status': 'draft',
+                    'created_by': 'user-1' if i < 10 else 'user-2',
+                    'created_at': f'2026-01-01T00:00:{i % 60:02d}',
+                    'updated_at': f'2026-01-01T00:00:{i % 60:02d}',
+                    'notes': ''
+                })
+
+    def _export(self, headers, body):
+        response = exports.handler({
+            'httpMethod': 'POST', 'path': '/exports', 'headers': headers, 'body': json.dumps(body)
+        }, None)
+        self.assertEqual(response['statusCode'], 202)
+        job_id = json.loads(response['body'])['job']['job_id']
+        jobs.get_job_queue().drain()
+        response = exports.handler({
+            'httpMethod': 'GET', 'path': f'/exports/{job_id}',
+            'pathParameters': {'job_id': job_id}, 'headers': headers
+        }, None)
+        self.assertEqual(response['statusCode'], 200)
+        body = json.loads(response['body'])
+        self.assertEqual(body['job']['status'], jobs.STATUS_SUCCEEDED)
+        with open(body['download_url'][len('file://'):], 'rb') as f:
+            return body, gzip.decompress(f.read()).decode('utf-8')
+
+    def test_ndjson_export_by_admin(self):
+        body, content = self._export(self.auth_headers('admin', 'admin'), {'resource': 'purchase_orders'})
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(len(rows), 250)
+        self.assertEqual(body['job']['result']['rows'], 250)
+        self.assertEqual(sorted(r['po_id'] for r in rows), [f'po-{i:03d}' for i in range(250)])
+        self.assertEqual(rows[0]['total_amount'], 10.5)
+
+    def test_csv_export_is_limited_to_own_records(self):
+        _, content = self._export(self.auth_headers('user-1', 'user'), {'resource': 'purchase_orders', 'format': 'csv'})
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(json.loads(rows[0]['items'])[0]['unit_price'], 10.5)
+
+    def test_other_users_cannot_see_export(self):
+        response = exports.handler({
+            'httpMethod': 'POST', 'path': '/exports', 'headers': self.auth_headers('user-1', 'user'),
+            'body': json.dumps({'resource': 'purchase_orders'})
+        }, None)
+        job_id = json.loads(response['body'])['job']['job_id']
+        response = exports.handler({
+            'httpMethod': 'GET', 'path': f'/exports/{job_id}',
+            'pathParameters': {'job_id': job_id}, 'headers': self.auth_headers('user-2', 'user')
+        }, None)
+        self.assertEqual(response['statusCode'], 404)
+
+    def test_rejects_unknown_resource(self):
+        response = exports.handler({
+            'httpMethod': 'POST', 'path': '/exports', 'headers': self.auth_headers('admin', 'admin'),
+            'body': json.dumps({'resource': 'users'})
+        }, None)
+        self.assertEqual(response['statusCode'], 400)
+
+    def test_parallel_scan_stops_early(self):
+        """途中で打ち切っても問題なく終了すること"""
+        items = scan_all(self.table, segments=4, Limit=10)
+        self.assertEqual(len([next(items) for _ in range(5)]), 5)
+        items.close()
+        self.assertEqual(len(list(scan_all(self.table, segments=4, Limit=10))), 250)
+
+
+class TestS3MultipartWriter(unittest.TestCase):
+    """マルチパートアップロードのテスト"""
+
+    def test_parts_and_small_objects(self):
+        client = mock.Mock()
+        client.create_multipart_upload.return_value = {'UploadId': 'upload-1'}
+        client.upload_part.side_effect = lambda **kwargs: {'ETag': f"etag-{kwargs['PartNumber']}"}
+        with mock.patch.object(object_storage, 'PART_SIZE', 4):
+            with S3MultipartWriter(client, 'bucket', 'key', 'text/plain') as writer:
+                writer.write(b'abcde')
+                writer.write(b'fg')
+        self.assertEqual([c.kwargs['Body'] for c in client.upload_part.call_args_list], [b'abcde', b'fg'])
+        client.complete_multipart_upload.assert_called_once_with(
+            Bucket='bucket', Key='key', UploadId='upload-1',
+            MultipartUpload={'Parts': [{'ETag': 'etag-1', 'PartNumber': 1}, {'ETag': 'etag-2', 'PartNumber': 2}]}
+        )
+
+        client = mock.Mock()
+        with S3MultipartWriter(client, 'bucket', 'key', 'text/plain') as writer:
+            writer.write(b'small')
+        client.put_object.assert_called_once_with(Bucket='bucket', Key='key', Body=b'small', ContentType='text/plain')
+        client.create_multipart_upload.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
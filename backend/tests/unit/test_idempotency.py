@@ -0,0 +1,73 @@
+"""
+冪等性キーのテスト
+"""
+import json
+import unittest
+from unittest import mock
+import pytest
+import purchase_orders
+from utils import get_dynamodb_resource
+
+
+@pytest.mark.usefixtures('memory_dynamodb', 'auth_headers', 'create_purchase_order')
+class TestIdempotency(unittest.TestCase):
+    """Idempotency-Key ヘッダーのテスト"""
+
+    def setUp(self):
+        self.headers = {**self.auth_headers(), 'Idempotency-Key': 'key-1'}
+        self.body = self.purchase_order_body()
+
+    def _create(self, body=None, headers=None):
+        return purchase_orders.handler({
+            'httpMethod': 'POST',
+            'path': '/purchase-orders',
+            'headers': headers or self.headers,
+            'body': json.dumps(body or self.body)
+        }, None)
+
+    def _po_count(self):
+        table = get_dynamodb_resource().Table('PurchaseOrders')
+        return table.scan(Select='COUNT')['Count']
+
+    def test_replay_returns_stored_response(self):
+        """同じキーの再送は保存済みのレスポンスを返し、重複作成しないこと"""
+        first = self._create()
+        second = self._create()
+        self.assertEqual(first['statusCode'], 201)
+        self.assertEqual(second['statusCode'], 201)
+        self.assertEqual(json.loads(first['body']), json.loads(second['body']))
+        self.assertEqual(second['headers']['Idempotent-Replayed'], 'true')
+        self.assertEqual(self._po_count(), 1)
+
+    def test_key_reused_with_different_body(self):
+        """同じキーで異なる本文の場合は 422 を返すこと"""
+        self._create()
+        response = self._create(body=dict(self.body, supplier='別の供給者'))
+        self.assertEqual(response['statusCode'], 422)
+        self.assertEqual(self._po_count(), 1)
+
+    def test_in_flight_duplicate(self):
+        """処理中の重複リクエストは 409 を返すこと"""
+        results = []
+
+        original = purchase_orders.PurchaseOrder
+
+        def nested_request(*args, **kwargs):
+            results.append(self._create())
+            return original(*args, **kwargs)
+
+        with mock.patch.object(purchase_orders, 'PurchaseOrder', side_effect=nested_request):
+            first = self._create()
+        self.assertEqual(first['statusCode'], 201)
+        self.assertEqual(results[0]['statusCode'], 409)
+
+    def test_failed_request_can_be_retried(self):
+        """失敗したリクエストは同じキーで再試行できること"""
+        response = self._create(body=dict(self.body, total_amount=-1))
+        self.assertEqual(response['statusCode'], 400)
+        response = self._create()
+        self.assertEqual(response['statusCode'], 201)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+"""
+トレースとEMFメトリクスのテスト
+"""
+import io
+import json
+import os
+import threading
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+import pytest
+import instrumentation
+import purchase_orders
+import shipments
+from utils import get_dynamodb_resource
+
+
+@pytest.mark.usefixtures('memory_dynamodb', 'auth_headers')
+@mock.patch.dict(os.environ, {'TRACE_SAMPLE_RATE': '1'})
+class TestInstrumentation(unittest.TestCase):
+    """traced_handler のテスト"""
+
+    def setUp(self):
+        # 見つからない出荷をアーカイブから探す読み込みを計測に含めない
+        del os.environ['ARCHIVE_INDEX_TABLE']
+
+    def _invoke(self, event):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            response = shipments.handler(event, None)
+        records = [json.loads(line) for line in output.getvalue().splitlines() if line.startswith('{')]
+        return response, records[-1]
+
+    def test_emf_record(self):
+        """EMF レコードにレイテンシと AWS 呼び出しが記録されること"""
+        response, record = self._invoke({
+            'httpMethod': 'GET',
+            'path': '/shipments',
+            'resource': '/shipments',
+            'headers': self.auth_headers()
+        })
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(record['Endpoint'], 'GET /shipments')
+        self.assertEqual(record['Service'], 'shipments')
+        self.assertEqual(record['AwsCallCount'], 1)
+        metric_names = {m['Name'] for m in record['_aws']['CloudWatchMetrics'][0]['Metrics']}
+        self.assertTrue({'Latency', 'ColdStart', 'DynamoDBLatency', 'AuthLatency'} <= metric_names)
+        self.assertEqual([s['name'] for s in record['Spans'] if s['category'] == 'dynamodb'], ['dynamodb.scan'])
+        self.assertEqual(record['Spans'][-1]['category'], 'serialize')
+
+    @mock.patch.dict(os.environ, {'CAPACITY_DEBUG_HEADER': 'true'})
+    def test_consumed_capacity(self):
+        """消費キャパシティがテーブル別に集計され、ヘッダーとメトリクスに出力されること"""
+        response, record = self._invoke({
+            'httpMethod': 'GET',
+            'path': '/shipments/missing',
+            'resource': '/shipments/{shipment_id}',
+            'pathParameters': {'shipment_id': 'missing'},
+            'headers': self.auth_headers()
+        })
+        self.assertEqual(response['statusCode'], 404)
+        self.assertEqual(response['headers']['X-Consumed-Capacity'], 'rcu=0.5; wcu=0; Shipments=0.5/0')
+        self.assertEqual(record['ReadCapacityUnits'], 0.5)
+        self.assertEqual(record['WriteCapacityUnits'], 0)
+        self.assertEqual(record['ConsumedCapacity'], {'Shipments': {'read': 0.5, 'write': 0.0}})
+
+    @mock.patch.dict(os.environ, {'CAPACITY_DEBUG_HEADER': 'true'})
+    def test_batch_writer_capacity(self):
+        """batch_writer でフラッシュした書き込みも消費キャパシティに計上されること"""
+        output = io.StringIO()
+        with redirect_stdout(output):
+            response = purchase_orders.handler({
+                'httpMethod': 'POST', 'path': '/purchase-orders', 'resource': '/purchase-orders',
+                'headers': self.auth_headers(),
+                'body': json.dumps({
+                    'supplier': 'テスト供給者', 'total_amount': 300,
+                    'items': [{'name': f'商品{i}', 'quantity': 1, 'unit_price': 1} for i in range(300)]
+                })
+            }, None)
+        self.assertEqual(response['statusCode'], 201)
+        record = json.loads(output.getvalue().splitlines()[-1])
+        self.assertEqual(record['ConsumedCapacity']['PurchaseOrderLines']['write'], 300)
+        self.assertIn('PurchaseOrderLines=0/300', response['headers']['X-Consumed-Capacity'])
+
+    def test_cold_start_only_once(self):
+        """コールドスタートは最初のリクエストのみ記録されること"""
+        instrumentation._cold_start = True
+        event = {'httpMethod': 'GET', 'path': '/unknown'}
+        _, first = self._invoke(event)
+        _, second = self._invoke(event)
+        self.assertEqual(first['ColdStart'], 1)
+        self.assertEqual(second['ColdStart'], 0)
+
+    def test_span_outside_request(self):
+        """ハンドラー外ではスパンを記録しないこと"""
+        with instrumentation.span('noop'):
+            pass
+        self.assertIsNone(instrumentation.current_trace())
+
+
+    def test_executor_threads_record_into_request_trace(self):
+        """TracedThreadPoolExecutor のタスクの呼び出しはリクエストに計上し、無関係なスレッドには引き継がないこと"""
+        other_thread = []
+
+        @instrumentation.traced_handler('instrumentation_test')
+        def handler(event, context):
+            table = get_dynamodb_resource().Table('Shipments')
+            with instrumentation.TracedThreadPoolExecutor(max_workers=4) as executor:
+                list(executor.map(lambda i: table.get_item(Key={'shipment_id': f'sh-{i}'}), range(8)))
+            thread = threading.Thread(target=lambda: other_thread.append(instrumentation.current_trace()))
+            thread.start()
+            thread.join()
+            return {'statusCode': 200, 'body': '{}'}
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            handler({'httpMethod': 'GET', 'path': '/parallel'}, None)
+        record = json.loads(output.getvalue().splitlines()[-1])
+        self.assertEqual(record['AwsCallCount'], 8)
+        self.assertEqual(record['ConsumedCapacity'], {'Shipments': {'read': 4.0, 'write': 0.0}})
+        self.assertEqual(len(record['Spans']), 8)
+        self.assertEqual(other_thread, [None])
+
+
+if __name__ == '__main__':
+    unittest.main()
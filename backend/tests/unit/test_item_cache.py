@@ -0,0 +1,91 @@
+"""
+アイテムキャッシュのテスト
+"""
+import json
+import unittest
+from decimal import Decimal
+from unittest import mock
+import pytest
+import item_cache
+import local_dynamodb
+import purchase_orders
+from item_cache import ItemCache, LRUCacheBackend, SharedCacheBackend, LocalSharedStore
+
+
+class TestCacheBackends(unittest.TestCase):
+    """キャッシュバックエンドのテスト"""
+
+    def test_lru_eviction_and_ttl(self):
+        """エントリ数の上限と TTL のテスト"""
+        backend = LRUCacheBackend(max_entries=2)
+        backend.set('a', {'v': 1}, ttl=60)
+        backend.set('b', {'v': 2}, ttl=60)
+        backend.get('a')
+        backend.set('c', {'v': 3}, ttl=60)
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual(backend.get('a'), {'v': 1})
+
+        backend.set('d', {'v': 4}, ttl=0)
+        self.assertIsNone(backend.get('d'))
+
+    def test_lru_returns_copies(self):
+        """キャッシュ済みの値が呼び出し側の変更の影響を受けないこと"""
+        backend = LRUCacheBackend()
+        value = {'items': [1]}
+        backend.set('a', value, ttl=60)
+        backend.get('a')['items'].append(2)
+        self.assertEqual(backend.get('a'), {'items': [1]})
+
+    def test_shared_backend_keeps_decimal(self):
+        """共有キャッシュで Decimal が保持されること"""
+        backend = SharedCacheBackend(LocalSharedStore())
+        backend.set('a', {'amount': Decimal('10.5'), 'items': [{'q': Decimal('2')}]}, ttl=60)
+        self.assertEqual(backend.get('a'), {'amount': Decimal('10.5'), 'items': [{'q': Decimal('2')}]})
+        backend.delete('a')
+        self.assertIsNone(backend.get('a'))
+
+    def test_read_through(self):
+        """存在しないアイテムはキャッシュしないこと"""
+        cache = ItemCache('test', LRUCacheBackend())
+        loader = mock.Mock(return_value=None)
+        cache.get_or_load('x', loader)
+        cache.get_or_load('x', loader)
+        self.assertEqual(loader.call_count, 2)
+
+
+@pytest.mark.usefixtures('memory_dynamodb', 'auth_headers', 'create_purchase_order')
+class TestPurchaseOrderCache(unittest.TestCase):
+    """発注書詳細のキャッシュのテスト"""
+
+    def setUp(self):
+        item_cache.reset_item_caches()
+        self.headers = self.auth_headers()
+        self.po_id = self.create_purchase_order()
+
+    def _request(self, method, body=None):
+        return purchase_orders.handler({
+            'httpMethod': method,
+            'path': f'/purchase-orders/{self.po_id}',
+            'pathParameters': {'po_id': self.po_id},
+            'headers': self.headers,
+            'body': json.dumps(body) if body else None
+        }, None)
+
+    def test_cached_read_and_write_through(self):
+        """2回目の詳細取得はキャッシュから返り、更新・削除が反映されること"""
+        engine = local_dynamodb._engine
+        with mock.patch.object(engine, 'get_item', wraps=engine.get_item) as get_item:
+            self._request('GET')
+            self._request('GET')
+            self.assertEqual(get_item.call_count, 1)
+
+        self._request('PUT', {'supplier': '更新後の供給者'})
+        body = json.loads(self._request('GET')['body'])
+        self.assertEqual(body['purchase_order']['supplier'], '更新後の供給者')
+
+        self._request('DELETE')
+        self.assertEqual(self._request('GET')['statusCode'], 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+"""
+バックグラウンドジョブのテスト
+"""
+import json
+import os
+import unittest
+from unittest import mock
+import pytest
+from botocore.exceptions import ClientError
+import jobs
+import local_dynamodb
+import user_management
+from models import User, UserRole
+
+
+@pytest.mark.usefixtures('memory_dynamodb', 'auth_headers')
+class JobTestCase(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.dict(os.environ, {
+            'JOB_QUEUE_BACKEND': 'local',
+            'COGNITO_USER_POOL_ID': 'pool-id'
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        jobs.reset_job_queue()
+        self.addCleanup(jobs.reset_job_queue)
+
+
+class TestJobQueue(JobTestCase):
+    """ジョブの実行・再試行・デッドレターのテスト"""
+
+    def setUp(self):
+        super().setUp()
+        self.calls = []
+        patcher = mock.patch.dict(jobs._job_handlers, {'test_job': self._handler})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _handler(self, payload, job):
+        self.calls.append(job['attempts'])
+        if payload.get('fail_times', 0) >= job['attempts']:
+            raise RuntimeError('temporary failure')
+        if payload.get('permanent'):
+            raise jobs.PermanentJobError('bad payload')
+        return {'value': payload['value']}
+
+    def test_success(self):
+        job = jobs.enqueue_job('test_job', {'value': 1.5}, created_by='user-1')
+        self.assertEqual(jobs.get_job(job['job_id'])['status'], jobs.STATUS_QUEUED)
+        jobs.get_job_queue().drain()
+        stored = jobs.get_job(job['job_id'])
+        self.assertEqual(stored['status'], jobs.STATUS_SUCCEEDED)
+        self.assertEqual(float(stored['result']['value']), 1.5)
+        self.assertNotIn('lease_expires_at', stored)
+
+    def test_retry_then_success(self):
+        job = jobs.enqueue_job('test_job', {'value': 1, 'fail_times': 2})
+        jobs.get_job_queue().drain()
+        self.assertEqual(self.calls, [1, 2, 3])
+        self.assertEqual(jobs.get_job(job['job_id'])['status'], jobs.STATUS_SUCCEEDED)
+
+    def test_dead_letter_after_max_attempts(self):
+        job = jobs.enqueue_job('test_job', {'value': 1, 'fail_times': 5}, max_attempts=2)
+        queue = jobs.get_job_queue()
+        queue.drain()
+        stored = jobs.get_job(job['job_id'])
+        self.assertEqual(stored['status'], jobs.STATUS_FAILED)
+        self.assertEqual(stored['error'], 'temporary failure')
+        self.assertEqual(queue.dead_letters, [job['job_id']])
+
+    def test_permanent_error_is_not_retried(self):
+        job = jobs.enqueue_job('test_job', {'value': 1, 'permanent': True})
+        jobs.get_job_queue().drain()
+        self.assertEqual(self.calls, [1])
+        self.assertEqual(jobs.get_job(job['job_id'])['status'], jobs.STATUS_FAILED)
+
+    def test_finished_job_is_not_run_again(self):
+        """SQS の重複配信で終了済みのジョブが再実行されないこと"""
+        job = jobs.enqueue_job('test_job', {'value': 1})
+        jobs.get_job_queue().drain()
+        self.assertFalse(jobs.run_job(job['job_id']))
+        self.assertEqual(self.calls, [1])
+
+    def test_worker_reports_retries_as_batch_failures(self):
+        job = jobs.enqueue_job('test_job', {'value': 1, 'fail_times': 1})
+        response = jobs.worker_handler({'Records': [
+            {'messageId': 'm1', 'body': json.dumps({'job_id': job['job_id']})}
+        ]}, None)
+        self.assertEqual(response, {'batchItemFailures': [{'itemIdentifier': 'm1'}]})
+
+    def test_status_endpoint(self):
+        job = jobs.enqueue_job('test_job', {'value': 1}, created_by='user-1')
+
+        def get_status(headers):
+            return jobs.handler({
+                'httpMethod': 'GET',
+                'path': f"/jobs/{job['job_id']}",
+                'pathParameters': {'job_id': job['job_id']},
+                'headers': headers
+            }, None)
+
+        response = get_status(self.auth_headers('user-1', 'user'))
+        self.assertEqual(response['statusCode'], 200)
+        body = json.loads(response['body'])['job']
+        self.assertEqual(body['status'], jobs.STATUS_QUEUED)
+        self.assertNotIn('payload', body)
+        self.assertEqual(get_status(self.auth_headers('user-2', 'user'))['statusCode'], 404)
+        self.assertEqual(get_status(self.auth_headers('admin', 'admin'))['statusCode'], 200)
+
+
+class TestDeferredUserDeletion(JobTestCase):
+    """ユーザー削除時の Cognito 削除がジョブで実行されることのテスト"""
+
+    def test_delete_user(self):
+        table = local_dynamodb.get_memory_resource().Table('Users')
+        table.put_item(Item=User('user-1', 'user1@example.com', UserRole.USER).to_dict())
+        gateway = mock.Mock()
+        gateway.admin_delete_user.side_effect = [
+            ClientError({'Error': {'Code': 'InternalErrorException', 'Message': 'error'}}, 'AdminDeleteUser'),
+            {}
+        ]
+
+        with mock.patch.object(user_management, 'get_cognito_gateway', return_value=gateway):
+            response = user_management.handler({
+                'httpMethod': 'DELETE',
+                'path': '/users/user-1',
+                'pathParameters': {'user_id': 'user-1'},
+                'headers': self.auth_headers('admin', 'admin')
+            }, None)
+            self.assertEqual(response['statusCode'], 202)
+            self.assertNotIn('Item', table.get_item(Key={'user_id': 'user-1'}))
+            gateway.admin_delete_user.assert_not_called()
+
+            jobs.get_job_queue().drain()
+
+        job = jobs.get_job(json.loads(response['body'])['job_id'])
+        self.assertEqual(job['status'], jobs.STATUS_SUCCEEDED)
+        self.assertEqual(job['attempts'], 2)
+        gateway.admin_delete_user.assert_called_with(UserPoolId='pool-id', Username='user1@example.com')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+"""
+インメモリDynamoDBエンジンのテスト
+"""
+import json
+import unittest
+from decimal import Decimal
+import pytest
+from boto3.dynamodb.conditions import Key, Attr
+from botocore.exceptions import ClientError
+import local_dynamodb
+import purchase_orders
+import shipments
+
+
+class TestLocalDynamoDB(unittest.TestCase):
+    """インメモリエンジンのテスト"""
+
+    def setUp(self):
+        local_dynamodb.reset_memory_backend()
+        self.resource = local_dynamodb.get_memory_resource()
+        self.resource.create_table(
+            TableName='Orders',
+            KeySchema=[
+                {'AttributeName': 'pk', 'KeyType': 'HASH'},
+                {'AttributeName': 'sk', 'KeyType': 'RANGE'}
+            ],
+            GlobalSecondaryIndexes=[{
+                'IndexName': 'status-index',
+                'KeySchema': [
+                    {'AttributeName': 'status', 'KeyType': 'HASH'},
+                    {'AttributeName': 'sk', 'KeyType': 'RANGE'}
+                ],
+                'Projection': {'ProjectionType': 'KEYS_ONLY'}
+            }]
+        )
+        self.table = self.resource.Table('Orders')
+
+    def test_put_get_and_condition(self):
+        """書き込み・読み込み・条件付き書き込みのテスト"""
+        self.table.put_item(Item={'pk': 'a', 'sk': 1, 'name': 'first'})
+        item = self.table.get_item(Key={'pk': 'a', 'sk': 1})['Item']
+        self.assertEqual(item['name'], 'first')
+        self.assertIsInstance(item['sk'], Decimal)
+
+        with self.assertRaises(ClientError) as ctx:
+            self.table.put_item(
+                Item={'pk': 'a', 'sk': 1, 'name': 'second'},
+                ConditionExpression='attribute_not_exists(pk)'
+            )
+        self.assertEqual(ctx.exception.response['Error']['Code'], 'ConditionalCheckFailedException')
+
+        # boto3 と同様に float は受け付けない
+        with self.assertRaises(TypeError):
+            self.table.put_item(Item={'pk': 'a', 'sk': 2, 'price': 1.5})
+
+    def test_update_item(self):
+        """更新式のテスト"""
+        self.table.put_item(Item={'pk': 'a', 'sk': 1, 'count': 1, 'tags': ['x']})
+        response = self.table.update_item(
+            Key={'pk': 'a', 'sk': 1},
+            UpdateExpression='SET #c = #c + :one, tags = list_append(tags, :more), note = if_not_exists(note, :n) '
+                             'REMOVE missing ADD visits :one',
+            ExpressionAttributeNames={'#c': 'count'},
+            ExpressionAttributeValues={':one': 1, ':more': ['y'], ':n': 'hello'},
+            ReturnValues='ALL_NEW'
+        )
+        attributes = response['Attributes']
+        self.assertEqual(attributes['count'], 2)
+        self.assertEqual(attributes['tags'], ['x', 'y'])
+        self.assertEqual(attributes['note'], 'hello')
+        self.assertEqual(attributes['visits'], 1)
+
+    def test_query_gsi_and_pagination(self):
+        """GSI のクエリとページネーションのテスト"""
+        for i in range(5):
+            self.table.put_item(Item={'pk': 'a', 'sk': i, 'status': 'open' if i % 2 == 0 else 'closed'})
+
+        response = self.table.query(KeyConditionExpression=Key('pk').eq('a') & Key('sk').gte(1), Limit=2)
+        self.assertEqual([item['sk'] for item in response['Items']], [1, 2])
+        response = self.table.query(
+            KeyConditionExpression=Key('pk').eq('a') & Key('sk').gte(1),
+            ExclusiveStartKey=response['LastEvaluatedKey']
+        )
+        self.assertEqual([item['sk'] for item in response['Items']], [3, 4])
+        self.assertNotIn('LastEvaluatedKey', response)
+
+        response = self.table.query(
+            IndexName='status-index',
+            KeyConditionExpression='#s = :s',
+            ExpressionAttributeNames={'#s': 'status'},
+            ExpressionAttributeValues={':s': 'open'},
+            ScanIndexForward=False
+        )
+        self.assertEqual([item['sk'] for item in response['Items']], [4, 2, 0])
+
+    def test_scan_segments_and_filter(self):
+        """並列スキャンとフィルターのテスト"""
+        for i in range(20):
+            self.table.put_item(Item={'pk': f'p{i}', 'sk': 0, 'n': i})
+        seen = []
+        for segment in range(3):
+            response = self.table.scan(Segment=segment, TotalSegments=3, FilterExpression=Attr('n').gte(10))
+            seen.extend(item['n'] for item in response['Items'])
+        self.assertEqual(sorted(seen), list(range(10, 20)))
+
+    def test_batch_and_transactions(self):
+        """バッチ操作とトランザクションのテスト"""
+        with self.table.batch_writer() as batch:
+            for i in range(30):
+                batch.put_item(Item={'pk': 'b', 'sk': i})
+        self.assertEqual(self.table.query(KeyConditionExpression=Key('pk').eq('b'))['Count'], 30)
+
+        client = self.resource.meta.client
+        with self.assertRaises(ClientError) as ctx:
+            client.transact_write_items(TransactItems=[
+                {'Put': {'TableName': 'Orders', 'Item': {'pk': 't', 'sk': 1}}},
+                {'ConditionCheck': {'TableName': 'Orders', 'Key': {'pk': 'b', 'sk': 0},
+                                    'ConditionExpression': 'attribute_not_exists(pk)'}}
+            ])
+        self.assertEqual(ctx.exception.response['Error']['Code'], 'TransactionCanceledException')
+        self.assertNotIn('Item', self.table.get_item(Key={'pk': 't', 'sk': 1}))
+
+    def test_consumed_capacity(self):
+        """消費キャパシティの概算のテスト"""
+        response = self.table.put_item(
+            Item={'pk': 'c', 'sk': 1, 'status': 'open', 'body': 'x' * 3000},
+            ReturnConsumedCapacity='INDEXES'
+        )
+        capacity = response['ConsumedCapacity']
+        self.assertEqual(capacity['Table']['CapacityUnits'], 3.0)
+        self.assertEqual(capacity['GlobalSecondaryIndexes']['status-index']['CapacityUnits'], 1.0)
+
+        response = self.table.get_item(Key={'pk': 'c', 'sk': 1}, ReturnConsumedCapacity='TOTAL')
+        self.assertEqual(response['ConsumedCapacity']['CapacityUnits'], 0.5)
+
+    def test_typed_client(self):
+        """低レベルクライアント形式のテスト"""
+        client = local_dynamodb.get_memory_client()
+        client.put_item(TableName='Orders', Item={'pk': {'S': 'd'}, 'sk': {'N': '1'}})
+        response = client.get_item(TableName='Orders', Key={'pk': {'S': 'd'}, 'sk': {'N': '1'}})
+        self.assertEqual(response['Item'], {'pk': {'S': 'd'}, 'sk': {'N': '1'}})
+
+
+@pytest.mark.usefixtures('memory_dynamodb', 'auth_headers')
+class TestHandlersWithMemoryBackend(unittest.TestCase):
+    """インメモリエンジンを使ったハンドラーの結合テスト"""
+
+    def test_purchase_order_and_shipment_flow(self):
+        """発注書と出荷の作成・取得のテスト"""
+        response = purchase_orders.handler({
+            'httpMethod': 'POST',
+            'path': '/purchase-orders',
+            'headers': self.auth_headers(),
+            'body': json.dumps({
+                'supplier': 'テスト供給者',
+                'items': [{'name': '商品A', 'quantity': 2, 'unit_price': 100.5}],
+                'total_amount': 201.0
+            })
+        }, None)
+        self.assertEqual(response['statusCode'], 201)
+        po_id = json.loads(response['body'])['purchase_order']['po_id']
+
+        response = shipments.handler({
+            'httpMethod': 'POST',
+            'path': '/shipments',
+            'headers': self.auth_headers(),
+            'body': json.dumps({'po_id': po_id, 'tracking_number': 'TRK1', 'carrier': 'テスト運送'})
+        }, None)
+        self.assertEqual(response['statusCode'], 201)
+
+        response = purchase_orders.handler({
+            'httpMethod': 'GET',
+            'path': '/purchase-orders',
+            'headers': self.auth_headers(),
+            'queryStringParameters': {'include': 'items'}
+        }, None)
+        self.assertEqual(response['statusCode'], 200)
+        body = json.loads(response['body'])
+        self.assertEqual(body['purchase_orders'][0]['total_amount'], 201)
+        self.assertEqual(body['purchase_orders'][0]['items'][0]['unit_price'], 100.5)
+
+        response = shipments.handler({
+            'httpMethod': 'GET',
+            'path': '/shipments',
+            'headers': self.auth_headers(),
+            'queryStringParameters': {'po_id': po_id}
+        }, None)
+        self.assertEqual(len(json.loads(response['body'])['shipments']), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+"""
+tools/local_server.py（Lambda ハンドラーのローカル HTTP サーバー）のテスト
+"""
+import base64
+import http.client
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+import pytest
+import jobs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'tools'))
+
+import local_server  # noqa: E402
+
+
+class TestRoutes(unittest.TestCase):
+    """template.yaml からのルーティングとイベントの変換のテスト"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.routes = local_server.load_routes()
+
+    def test_routes_are_derived_from_template(self):
+        handlers = {(route.method, route.path): route.handler for route in self.routes}
+        self.assertEqual(handlers[('POST', '/auth/login')], 'auth.handler')
+        self.assertEqual(handlers[('GET', '/purchase-orders/{po_id}')], 'purchase_orders.handler')
+        self.assertEqual(handlers[('GET', '/changes')], 'change_log.handler')
+        # スケジュールや SQS / DynamoDB Streams のイベントはルートにならない
+        self.assertNotIn('change_log.stream_handler', {route.handler for route in self.routes})
+        self.assertNotIn('jobs.worker_handler', {route.handler for route in self.routes})
+
+    def test_static_segments_take_precedence(self):
+        route, params = local_server.match_route(self.routes, 'POST', '/shipments/status-events')
+        self.assertEqual((route.path, params), ('/shipments/status-events', {}))
+        route, params = local_server.match_route(self.routes, 'GET', '/shipments/sh-1')
+        self.assertEqual((route.path, params), ('/shipments/{shipment_id}', {'shipment_id': 'sh-1'}))
+        self.assertEqual(local_server.match_route(self.routes, 'PATCH', '/shipments/sh-1'), (None, None))
+
+    def test_builds_proxy_event(self):
+        route, params = local_server.match_route(self.routes, 'GET', '/purchase-orders/po-1/items')
+        event = local_server.build_event(
+            route, 'GET', '/purchase-orders/po-1/items?limit=10&tag=a&tag=b',
+            [('Authorization', 'Bearer x'), ('X-Forwarded-For', '1.1.1.1'), ('X-Forwarded-For', '2.2.2.2')],
+            b'', params
+        )
+        self.assertEqual(event['resource'], '/purchase-orders/{po_id}/items')
+        self.assertEqual(event['path'], '/purchase-orders/po-1/items')
+        self.assertEqual(event['pathParameters'], {'po_id': 'po-1'})
+        self.assertEqual(event['queryStringParameters'], {'limit': '10', 'tag': 'b'})
+        self.assertEqual(event['multiValueQueryStringParameters']['tag'], ['a', 'b'])
+        self.assertEqual(event['headers']['X-Forwarded-For'], '2.2.2.2')
+        self.assertEqual(event['multiValueHeaders']['X-Forwarded-For'], ['1.1.1.1', '2.2.2.2'])
+        self.assertIsNone(event['body'])
+
+        event = local_server.build_event(route, 'POST', '/imports/purchase-orders', [], b'\xff\x00', {})
+        self.assertTrue(event['isBase64Encoded'])
+        self.assertEqual(base64.b64decode(event['body']), b'\xff\x00')
+        self.assertIsNone(event['queryStringParameters'])
+
+    def test_memory_backend_runs_a_single_worker(self):
+        """インメモリエンジンではワーカーを1つにし、複数を指定するとエラーにすること"""
+        with mock.patch.dict(os.environ, {'DYNAMODB_BACKEND': 'memory', 'LOCAL_SERVER_WORKERS': ''}):
+            self.assertEqual(local_server.worker_count(), 1)
+            os.environ['LOCAL_SERVER_WORKERS'] = '4'
+            with self.assertRaises(SystemExit):
+                local_server.worker_count()
+        with mock.patch.dict(os.environ, {'DYNAMODB_BACKEND': 'aws', 'LOCAL_SERVER_WORKERS': '4'}):
+            self.assertEqual(local_server.worker_count(), 4)
+
+
+@pytest.mark.usefixtures('memory_dynamodb', 'auth_headers', 'create_purchase_order')
+class TestLocalServer(unittest.TestCase):
+    """HTTP リクエストがハンドラーに届き、レスポンスが返るテスト"""
+
+    def setUp(self):
+        self.storage_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.storage_dir, True)
+        patcher = mock.patch.dict(os.environ, {
+            'OBJECT_STORAGE_BACKEND': 'local',
+            'LOCAL_STORAGE_DIR': self.storage_dir,
+            'JOB_QUEUE_BACKEND': 'local',
+            'WEBSOCKET_BACKEND': 'local'
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        local_server.configure_environment()
+        jobs.reset_job_queue()
+        self.addCleanup(jobs.reset_job_queue)
+
+        self.server = local_server.make_server(local_server.load_routes(), port=0)
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        # 接続を再利用する（HTTP/1.1 の keep-alive）
+        self.connection = http.client.HTTPConnection('127.0.0.1', self.server.server_address[1], timeout=10)
+        self.addCleanup(self.connection.close)
+
+    def _request(self, method, path, body=None, headers=None):
+        with redirect_stdout(io.StringIO()):
+            self.connection.request(method, path, body=json.dumps(body) if body is not None else None,
+                                    headers=headers if headers is not None else self.auth_headers())
+            response = self.connection.getresponse()
+            data = response.read()
+        return response.status, response, json.loads(data) if data else None
+
+    def test_dispatches_to_handlers(self):
+        status, _, body = self._request('POST', '/purchase-orders', self.purchase_order_body(supplier='供給者'))
+        self.assertEqual(status, 201)
+        po_id = body['purchase_order']['po_id']
+
+        status, response, body = self._request('GET', f'/purchase-orders/{po_id}')
+        self.assertEqual(status, 200)
+        self.assertEqual(body['purchase_order']['supplier'], '供給者')
+        self.assertEqual(response.getheader('Access-Control-Allow-Origin'), '*')
+
+        status, _, body = self._request('GET', '/purchase-orders?limit=1')
+        self.assertEqual([po['po_id'] for po in body['purchase_orders']], [po_id])
+
+        status, _, _ = self._request('GET', '/purchase-orders', headers={})
+        self.assertEqual(status, 401)
+
+    def test_unknown_routes_and_preflight(self):
+        status, _, body = self._request('GET', '/unknown')
+        self.assertEqual((status, body), (403, {'message': 'Missing Authentication Token'}))
+
+        status, response, _ = self._request('OPTIONS', '/purchase-orders/po-1', headers={})
+        self.assertEqual(status, 200)
+        self.assertIn('Authorization', response.getheader('Access-Control-Allow-Headers'))
+
+    def test_jobs_run_under_the_invoke_lock(self):
+        """ハンドラーが積んだジョブは、ハンドラーと同じロックを持って別のスレッドで実行されること"""
+        self.assertEqual(os.environ['JOB_LOCAL_AUTORUN'], 'false')
+        ran = threading.Event()
+        locked = []
+
+        def run_job(job_id):
+            locked.append(local_server._invoke_lock.locked())
+            ran.set()
+            return False
+
+        with mock.patch.object(jobs, 'run_job', side_effect=run_job):
+            status, _, _ = self._request('POST', '/exports', {'resource': 'purchase_orders'})
+            self.assertEqual(status, 202)
+            self.assertTrue(ran.wait(5))
+        self.assertEqual(locked, [True])
+        self.assertFalse(jobs.get_job_queue().pending)
+
+    def test_warm_up_primes_each_handler(self):
+        handlers = []
+        with mock.patch.object(local_server, 'get_handler', side_effect=lambda handler: (
+            lambda event, context: handlers.append((handler, event))
+        )):
+            local_server.warm_up(local_server.load_routes())
+        self.assertIn(('purchase_orders.handler', {'warmup': True}), handlers)
+        self.assertEqual(len(handlers), len({handler for handler, _ in handlers}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,204 @@
+"""
+発注書インポートのテスト
+"""
+import codecs
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from decimal import Decimal
+from unittest import mock
+import pytest
+import jobs
+import local_dynamodb
+import object_storage
+import po_import
+
+
+def _row(i, **overrides):
+    row = {
+        'po_id': f'po-{i:04d}',
+        'supplier': f'供給者{i}',
+        'items': [{'name': '商品', 'quantity': 2, 'unit_price': 10.5}],
+        'total_amount': 21.0
+    }
+    row.update(overrides)
+    return row
+
+
+@pytest.mark.usefixtures('memory_dynamodb', 'auth_headers')
+class TestPurchaseOrderImport(unittest.TestCase):
+    """POST /imports/purchase-orders のテスト"""
+
+    def setUp(self):
+        self.storage_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.storage_dir, True)
+        patcher = mock.patch.dict(os.environ, {
+            'JOB_QUEUE_BACKEND': 'local',
+            'OBJECT_STORAGE_BACKEND': 'local',
+            'LOCAL_STORAGE_DIR': self.storage_dir,
+            'IMPORT_WINDOW_ROWS': '40'
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        jobs.reset_job_queue()
+        object_storage.reset_object_storage()
+        self.addCleanup(jobs.reset_job_queue)
+        self.addCleanup(object_storage.reset_object_storage)
+        self.table = local_dynamodb.get_memory_resource().Table('PurchaseOrders')
+
+    def _request(self, method, path, body=None):
+        event = {
+            'httpMethod': method, 'path': path, 'headers': self.auth_headers(),
+            'body': json.dumps(body) if body else None
+        }
+        if path.startswith('/imports/') and method == 'GET':
+            event['pathParameters'] = {'job_id': path.rsplit('/', 1)[1]}
+        response = po_import.handler(event, None)
+        return response['statusCode'], json.loads(response['body'])
+
+    def _upload(self, data):
+        status, body = self._request('POST', '/imports/purchase-orders/uploads')
+        self.assertEqual(status, 201)
+        with open(body['upload_url'][len('file://'):], 'wb') as f:
+            f.write(data)
+        return body['key']
+
+    def test_ndjson_import_with_rejects(self):
+        lines = [json.dumps(_row(i)) for i in range(100)]
+        lines[10] = json.dumps(_row(10, total_amount=-1))
+        lines[20] = 'not json'
+        lines[30] = json.dumps(_row(29))
+        key = self._upload(gzip.compress(('\n'.join(lines) + '\n').encode('utf-8')))
+
+        status, body = self._request('POST', '/imports/purchase-orders', {'key': key, 'compressed': True})
+        self.assertEqual(status, 202)
+        job_id = body['job']['job_id']
+        jobs.get_job_queue().drain()
+
+        status, body = self._request('GET', f'/imports/{job_id}')
+        result = body['job']['result']
+        self.assertEqual((result['rows'], result['imported'], result['rejected']), (100, 97, 3))
+        self.assertEqual(self.table.scan(Select='COUNT')['Count'], 97)
+        self.assertEqual(self.table.get_item(Key={'po_id': 'po-0001'})['Item']['total_amount'], Decimal('21.0'))
+
+        with open(body['rejects_url'][len('file://'):]) as f:
+            rejects = [json.loads(line) for line in f]
+        self.assertEqual([r['row'] for r in rejects], [11, 21, 31])
+        self.assertEqual(rejects[2]['error'], 'Duplicate po_id in file')
+
+    def test_csv_rows_without_id(self):
+        data = 'supplier,total_amount,items\n' + ''.join(
+            f'供給者{i},100,"[{{""name"": ""A"", ""quantity"": 1, ""unit_price"": 100}}]"\n' for i in range(5)
+        )
+        key = self._upload(data.encode('utf-8'))
+        self._request('POST', '/imports/purchase-orders', {'key': key, 'format': 'csv'})
+        jobs.get_job_queue().drain()
+        items = self.table.scan()['Items']
+        self.assertEqual(len(items), 5)
+        self.assertEqual(items[0]['created_by'], 'admin-user')
+
+    def test_resume_from_checkpoint(self):
+        """途中で失敗しても、再試行で保存済みの行の続きから取り込むこと"""
+        lines = [json.dumps(_row(i)) + '\n' for i in range(100)]
+        key = self._upload(''.join(lines).encode('utf-8'))
+        original = po_import._write_batch
+        calls = {'count': 0}
+
+        def flaky_write(dynamodb, table_name, items):
+            # ヘッダーの書き込みだけを数える（明細はヘッダーより先に書き込まれる）
+            if table_name != 'PurchaseOrders':
+                return original(dynamodb, table_name, items)
+            calls['count'] += 1
+            if calls['count'] == 4:
+                raise RuntimeError('throttled')
+            original(dynamodb, table_name, items)
+
+        with mock.patch.object(po_import, '_write_batch', side_effect=flaky_write), \
+                mock.patch.dict(os.environ, {'IMPORT_WRITE_WORKERS': '1'}):
+            _, body = self._request('POST', '/imports/purchase-orders', {'key': key})
+            queue = jobs.get_job_queue()
+            queue.drain(max_jobs=1)
+            job = jobs.get_job(body['job']['job_id'])
+            self.assertEqual(job['status'], jobs.STATUS_QUEUED)
+            self.assertEqual(job['progress']['row'], 40)
+            self.assertEqual(job['progress']['offset'], len(''.join(lines[:40]).encode('utf-8')))
+            # 再試行は保存した位置からファイルを読む
+            storage = object_storage.get_object_storage()
+            with mock.patch.object(storage, 'open_reader', wraps=storage.open_reader) as open_reader:
+                queue.drain()
+            self.assertEqual(open_reader.call_args.args, (key, job['progress']['offset']))
+
+        job = jobs.get_job(body['job']['job_id'])
+        self.assertEqual(job['status'], jobs.STATUS_SUCCEEDED)
+        self.assertEqual(job['result']['imported'], 100)
+        self.assertEqual(self.table.scan(Select='COUNT')['Count'], 100)
+        # 1回目で2バッチ（40行）書き込み、2回目は41行目から（60行 = 3バッチ）
+        self.assertEqual(calls['count'], 2 + 2 + 3)
+
+    def test_continues_when_time_budget_is_exceeded(self):
+        key = self._upload(''.join(json.dumps(_row(i)) + '\n' for i in range(100)).encode('utf-8'))
+        with mock.patch.dict(os.environ, {'IMPORT_TIME_BUDGET_SECONDS': '-1'}):
+            _, body = self._request('POST', '/imports/purchase-orders', {'key': key})
+            queue = jobs.get_job_queue()
+            queue.drain(max_jobs=1)
+            job = jobs.get_job(body['job']['job_id'])
+            self.assertEqual((job['status'], job['attempts'], job['progress']['row']), (jobs.STATUS_QUEUED, 0, 40))
+            queue.drain()
+        self.assertEqual(jobs.get_job(body['job']['job_id'])['result']['imported'], 100)
+
+    def test_index_and_change_log_are_written_by_workers(self):
+        """検索インデックスと変更履歴もヘッダーと同じスレッドで分割して書き込むこと"""
+        key = self._upload(''.join(json.dumps(_row(i)) + '\n' for i in range(30)).encode('utf-8'))
+        with mock.patch.object(po_import, 'SIDE_WRITE_ROWS', 10), \
+                mock.patch.object(po_import, 'index_documents', wraps=po_import.index_documents) as index_documents:
+            self._request('POST', '/imports/purchase-orders', {'key': key})
+            jobs.get_job_queue().drain()
+        self.assertEqual([len(call.args[1]) for call in index_documents.call_args_list], [10, 10, 10])
+        resource = local_dynamodb.get_memory_resource()
+        self.assertEqual(resource.Table('SearchIndex').scan(Select='COUNT')['Count'], 30)
+        self.assertEqual(resource.Table('ChangeLog').scan(Select='COUNT')['Count'], 30)
+
+    def test_rejects_rows_for_existing_purchase_orders(self):
+        """既存の発注書と同じ po_id の行は上書きせずに rejects に入れること"""
+        self.table.put_item(Item={
+            'po_id': 'po-0001', 'supplier': '既存の供給者', 'line_count': 0, 'total_amount': 1,
+            'status': 'approved', 'created_by': 'user-1'
+        })
+        key = self._upload(''.join(json.dumps(_row(i)) + '\n' for i in range(3)).encode('utf-8'))
+        _, body = self._request('POST', '/imports/purchase-orders', {'key': key})
+        jobs.get_job_queue().drain()
+
+        _, body = self._request('GET', f"/imports/{body['job']['job_id']}")
+        self.assertEqual((body['job']['result']['imported'], body['job']['result']['rejected']), (2, 1))
+        self.assertEqual(self.table.get_item(Key={'po_id': 'po-0001'})['Item']['supplier'], '既存の供給者')
+        with open(body['rejects_url'][len('file://'):]) as f:
+            self.assertEqual([json.loads(line)['error'] for line in f], ['Purchase order already exists'])
+
+    def test_csv_with_bom_resumes_from_offset(self):
+        """BOM 付きの CSV も途中の位置から再開し、ヘッダーと行番号を引き継ぐこと"""
+        items = '"[{""name"": ""A"", ""quantity"": 1, ""unit_price"": 100}]"'
+        data = 'po_id,supplier,total_amount,items\n' + ''.join(
+            f'po-{i:04d},供給者{i},{-1 if i == 50 else 100},{items}\n' for i in range(100)
+        )
+        key = self._upload(codecs.BOM_UTF8 + data.encode('utf-8'))
+        with mock.patch.dict(os.environ, {'IMPORT_TIME_BUDGET_SECONDS': '-1'}):
+            _, body = self._request('POST', '/imports/purchase-orders', {'key': key, 'format': 'csv'})
+            jobs.get_job_queue().drain()
+
+        _, body = self._request('GET', f"/imports/{body['job']['job_id']}")
+        result = body['job']['result']
+        self.assertEqual((result['rows'], result['imported'], result['rejected']), (100, 99, 1))
+        self.assertEqual(self.table.get_item(Key={'po_id': 'po-0099'})['Item']['supplier'], '供給者99')
+        with open(body['rejects_url'][len('file://'):]) as f:
+            self.assertEqual([json.loads(line)['row'] for line in f], [51])
+
+    def test_rejects_unknown_key(self):
+        status, _ = self._request('POST', '/imports/purchase-orders', {'key': 'imports/uploads/missing'})
+        self.assertEqual(status, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+"""
+購買発注書の明細（PurchaseOrderLines）のテスト
+"""
+import json
+import os
+import unittest
+from unittest import mock
+import pytest
+import local_dynamodb
+import po_lines
+import purchase_orders
+from utils import encode_cursor
+
+
+def _lines(count):
+    return [{'name': f'商品{i}', 'quantity': 1, 'unit_price': 10} for i in range(1, count + 1)]
+
+
+@pytest.mark.usefixtures('memory_dynamodb', 'auth_headers')
+class TestPurchaseOrderLines(unittest.TestCase):
+    """明細を別テーブルに保存する購買発注書 API のテスト"""
+
+    def setUp(self):
+        patcher = mock.patch.dict(os.environ, {
+            'ITEM_CACHE_BACKEND': 'none'
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        resource = local_dynamodb.get_memory_resource()
+        self.po_table = resource.Table('PurchaseOrders')
+        self.lines_table = resource.Table('PurchaseOrderLines')
+
+    def _request(self, method, path, body=None, params=None, headers=None):
+        event = {'httpMethod': method, 'path': path, 'headers': headers or self.auth_headers()}
+        if body is not None:
+            event['body'] = json.dumps(body)
+        if params:
+            event['queryStringParameters'] = params
+        if path.count('/') >= 2:
+            event['pathParameters'] = {'po_id': path.split('/')[2]}
+        response = purchase_orders.handler(event, None)
+        return response['statusCode'], json.loads(response['body'])
+
+    def _create(self, count):
+        status, body = self._request('POST', '/purchase-orders', {
+            'supplier': 'テスト供給者', 'total_amount': 10 * count, 'items': _lines(count)
+        })
+        self.assertEqual(status, 201)
+        return body['purchase_order']['po_id']
+
+    def _line_numbers(self, po_id):
+        rows = self.lines_table.query(
+            KeyConditionExpression='po_id = :po_id', ExpressionAttributeValues={':po_id': po_id}
+        )['Items']
+        return sorted(int(row['line_no']) for row in rows)
+
+    def test_create_stores_header_and_lines_separately(self):
+        po_id = self._create(3)
+        header = self.po_table.get_item(Key={'po_id': po_id})['Item']
+        self.assertNotIn('items', header)
+        self.assertEqual(header['line_count'], 3)
+        self.assertEqual(self._line_numbers(po_id), [1, 2, 3])
+
+        # 一覧はヘッダーのみ、include=items で明細も返す
+        _, body = self._request('GET', '/purchase-orders')
+        self.assertNotIn('items', body['purchase_orders'][0])
+        self.assertEqual(body['purchase_orders'][0]['line_count'], 3)
+        _, body = self._request('GET', '/purchase-orders', params={'include': 'items'})
+        self.assertEqual([line['name'] for line in body['purchase_orders'][0]['items']], ['商品1', '商品2', '商品3'])
+
+    def test_detail_returns_first_page_and_items_are_paged(self):
+        po_id = self._create(250)
+        _, body = self._request('GET', f'/purchase-orders/{po_id}')
+        purchase_order = body['purchase_order']
+        self.assertEqual((len(purchase_order['items']), purchase_order['line_count']), (100, 250))
+        self.assertIsNotNone(purchase_order['items_next_cursor'])
+
+        names = []
+        cursor = None
+        while True:
+            params = {'limit': '120'}
+            if cursor:
+                params['cursor'] = cursor
+            status, body = self._request('GET', f'/purchase-orders/{po_id}/items', params=params)
+            self.assertEqual(status, 200)
+            names.extend(line['name'] for line in body['items'])
+            cursor = body['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(names, [f'商品{i}' for i in range(1, 251)])
+
+        status, _ = self._request('GET', f'/purchase-orders/{po_id}/items', params={'limit': '501'})
+        self.assertEqual(status, 400)
+        # 明細以外のカーソルは 400
+        cursor = encode_cursor({'user_id': 'user-1'})
+        status, _ = self._request('GET', f'/purchase-orders/{po_id}/items', params={'cursor': cursor})
+        self.assertEqual(status, 400)
+        status, _ = self._request('GET', f'/purchase-orders/{po_id}/items', headers=self.auth_headers('user-1', 'user'))
+        self.assertEqual(status, 403)
+
+    def test_update_and_delete_rewrite_lines(self):
+        po_id = self._create(5)
+        status, body = self._request('PUT', f'/purchase-orders/{po_id}', {'items': _lines(2)})
+        self.assertEqual((status, body['purchase_order']['line_count']), (200, 2))
+        self.assertEqual(self._line_numbers(po_id), [1, 2])
+
+        # 明細を含まない更新では明細を読み込まず、書き直さない
+        with mock.patch.object(po_lines, '_query_lines', wraps=po_lines._query_lines) as query_lines:
+            status, body = self._request('PUT', f'/purchase-orders/{po_id}', {'status': 'approved'})
+        self.assertEqual((status, body['purchase_order']['line_count']), (200, 2))
+        self.assertNotIn('items', body['purchase_order'])
+        self.assertEqual(query_lines.call_count, 0)
+        self.assertEqual(self._line_numbers(po_id), [1, 2])
+
+        # 検索対象の項目が変わった場合は品名を含めて索引し直すため明細を読み込む
+        with mock.patch.object(po_lines, '_query_lines', wraps=po_lines._query_lines) as query_lines:
+            status, _ = self._request('PUT', f'/purchase-orders/{po_id}', {'notes': 'メモ'})
+        self.assertEqual((status, query_lines.call_count), (200, 1))
+        self.assertEqual(self._line_numbers(po_id), [1, 2])
+
+        status, _ = self._request('DELETE', f'/purchase-orders/{po_id}')
+        self.assertEqual(status, 200)
+        self.assertEqual(self._line_numbers(po_id), [])
+
+    def test_reads_and_splits_legacy_rows_with_inline_items(self):
+        self.po_table.put_item(Item={
+            'po_id': 'legacy-po', 'supplier': '旧供給者', 'items': _lines(3), 'total_amount': 30,
+            'status': 'draft', 'created_by': 'admin-user',
+            'created_at': '2025-01-01T00:00:00', 'updated_at': '2025-01-01T00:00:00'
+        })
+        _, body = self._request('GET', '/purchase-orders/legacy-po/items', params={'limit': '2'})
+        self.assertEqual([line['line_no'] for line in body['items']], [1, 2])
+        self.assertEqual(body['line_count'], 3)
+
+        # 明細の更新で分割される
+        self._request('PUT', '/purchase-orders/legacy-po', {'notes': 'メモ'})
+        header = self.po_table.get_item(Key={'po_id': 'legacy-po'})['Item']
+        self.assertNotIn('items', header)
+        self.assertEqual(self._line_numbers('legacy-po'), [1, 2, 3])
+
+
+    def test_with_items_loads_lines_in_parallel_in_order(self):
+        """明細を並行して読み込み、読み込み中の発注書を上限までに抑えて元の順に返すこと"""
+        po_ids = [self._create(count) for count in (3, 1, 5, 1, 2, 4, 3, 1, 2, 5)]
+        headers = [self.po_table.get_item(Key={'po_id': po_id})['Item'] for po_id in po_ids]
+        headers.insert(3, {'po_id': 'legacy-po', 'items': _lines(2)})
+        pulled = []
+
+        def source():
+            for header in headers:
+                pulled.append(header['po_id'])
+                yield header
+
+        with mock.patch.dict(os.environ, {'LINE_LOAD_WORKERS': '2'}):
+            loaded = po_lines.with_items(source())
+            first = next(loaded)
+            self.assertEqual(len(pulled), 2 * po_lines.LOAD_AHEAD_PER_WORKER)
+            results = [first] + list(loaded)
+        self.assertEqual([item['po_id'] for item in results], [header['po_id'] for header in headers])
+        self.assertEqual([len(item['items']) for item in results], [3, 1, 5, 2, 1, 2, 4, 3, 1, 2, 5])
+        self.assertEqual([line['line_no'] for line in results[2]['items']], [1, 2, 3, 4, 5])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+"""
+WebSocket による変更のリアルタイム配信のテスト
+"""
+import json
+import os
+import unittest
+from unittest import mock
+import pytest
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
+import change_log
+import local_dynamodb
+import realtime
+import shipments
+
+
+@pytest.mark.usefixtures('memory_dynamodb', 'auth_headers', 'create_purchase_order')
+class TestRealtime(unittest.TestCase):
+    """接続の管理と、変更を受信者ごとにまとめて送るテスト"""
+
+    def setUp(self):
+        patcher = mock.patch.dict(os.environ, {
+            'WEBSOCKET_BACKEND': 'local',
+            'ITEM_CACHE_BACKEND': 'none'
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        realtime.reset_connections()
+        self.addCleanup(realtime.reset_connections)
+        self.resource = local_dynamodb.get_memory_resource()
+        self.connections = realtime.get_connections()
+
+    def _connect(self, sub='admin-user', role='admin'):
+        connection_id, response = self.connections.connect({'token': self.auth_token(sub, role)})
+        self.assertEqual(response['statusCode'], 200)
+        return connection_id
+
+    def _pushed(self, connection_id):
+        return [
+            (change['type'], change['id'])
+            for message in self.connections.messages[connection_id] if message['type'] == 'changes'
+            for change in message['changes']
+        ]
+
+    def test_connect_requires_token(self):
+        connection_id, response = self.connections.connect()
+        self.assertIsNone(connection_id)
+        self.assertEqual(response['statusCode'], 401)
+
+        connection_id = self._connect('user-1', 'user')
+        row = self.resource.Table('WebSocketConnections').get_item(Key={'connection_id': connection_id})['Item']
+        self.assertEqual((row['user_id'], row['audience']), ('user-1', 'user-1'))
+
+        self.connections.disconnect(connection_id)
+        self.assertEqual(self.resource.Table('WebSocketConnections').scan()['Items'], [])
+
+    def test_pushes_to_admins_and_owners(self):
+        self.resource.Table('Users').put_item(Item={'user_id': 'user-1', 'permissions': ['purchase_order_create']})
+        admin = self._connect()
+        owner = self._connect('user-1', 'user')
+        other = self._connect('user-2', 'user')
+
+        admin_po = self.create_purchase_order('管理者の供給者')
+        own_po = self.create_purchase_order('ユーザーの供給者', headers=self.auth_headers('user-1', 'user'))
+
+        self.assertEqual(self._pushed(admin), [('purchase_order', admin_po), ('purchase_order', own_po)])
+        self.assertEqual(self._pushed(owner), [('purchase_order', own_po)])
+        self.assertEqual(self._pushed(other), [])
+        change = self.connections.messages[owner][0]['changes'][0]
+        self.assertEqual(change['purchase_order']['supplier'], 'ユーザーの供給者')
+        self.assertFalse(change['deleted'])
+
+    def test_subscribe_filters_types(self):
+        connection_id = self._connect()
+        self.connections.send_message(connection_id, {'action': 'subscribe', 'types': ['shipment']})
+        self.assertEqual(self.connections.messages[connection_id][-1], {'type': 'subscribed', 'types': ['shipment']})
+
+        po_id = self.create_purchase_order('供給者')
+        response = shipments.handler({
+            'httpMethod': 'POST', 'path': '/shipments', 'headers': self.auth_headers(),
+            'body': json.dumps({'po_id': po_id, 'tracking_number': 'TRK-001', 'carrier': 'ヤマト運輸'})
+        }, None)
+        shipment_id = json.loads(response['body'])['shipment']['shipment_id']
+        self.assertEqual(self._pushed(connection_id), [('shipment', shipment_id)])
+
+        response = self.connections.send_message(connection_id, {'action': 'subscribe', 'types': ['invoice']})
+        self.assertEqual(response['statusCode'], 400)
+        self.connections.send_message(connection_id, {'action': 'unknown'})
+        self.assertEqual(self.connections.messages[connection_id][-1], {'type': 'error', 'error': 'Unknown action'})
+
+    def test_stream_batch_is_sent_as_one_message_per_connection(self):
+        connection_id = self._connect()
+        gone = self._connect()
+        # $disconnect が届かなかった接続
+        self.connections.drop(gone)
+
+        serializer = TypeSerializer()
+        records = []
+        for i in range(3):
+            row = {
+                'change_key': f'shipment#sh-{i}', 'entity': 'shipment', 'item_id': f'sh-{i}',
+                'created_by': 'user-1', 'deleted': True, 'changed_at': f'2026-01-01T00:00:0{i}'
+            }
+            records.append({
+                'eventSource': 'aws:dynamodb', 'eventName': 'MODIFY',
+                'dynamodb': {'NewImage': {name: serializer.serialize(value) for name, value in row.items()}}
+            })
+        records.append({'eventSource': 'aws:dynamodb', 'eventName': 'REMOVE', 'dynamodb': {}})
+
+        result = change_log.stream_handler({'Records': records}, None)
+        self.assertEqual(result, {'connections': 2, 'messages': 2, 'gone': 1})
+        self.assertEqual(len(self.connections.messages[connection_id]), 1)
+        self.assertEqual([item_id for _, item_id in self._pushed(connection_id)], ['sh-0', 'sh-1', 'sh-2'])
+        rows = self.resource.Table('WebSocketConnections').scan()['Items']
+        self.assertEqual([row['connection_id'] for row in rows], [connection_id])
+
+        # 上限を超える場合はメッセージを分ける
+        with mock.patch.object(realtime, 'MAX_MESSAGE_BYTES', 100):
+            change_log.stream_handler({'Records': records}, None)
+        self.assertEqual(len(self.connections.messages[connection_id]), 4)
+        self.assertEqual(len(self._pushed(connection_id)), 6)
+
+
+class TestApiGatewayConnections(unittest.TestCase):
+    """API Gateway Management API の送信のテスト"""
+
+    def test_gone_connection(self):
+        client = mock.Mock()
+        client.post_to_connection.side_effect = ClientError(
+            {'Error': {'Code': 'GoneException', 'Message': 'Gone'}}, 'PostToConnection'
+        )
+        with mock.patch.object(realtime, 'get_apigateway_management_client', return_value=client) as factory:
+            connections = realtime.ApiGatewayConnections()
+            with self.assertRaises(realtime.GoneConnection):
+                connections.send('conn-1', b'{}', endpoint='https://example.com/prod')
+        factory.assert_called_once_with('https://example.com/prod')
+        client.post_to_connection.assert_called_once_with(ConnectionId='conn-1', Data=b'{}')
+
+
+if __name__ == '__main__':
+    unittest.main()
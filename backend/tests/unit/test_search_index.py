@@ -0,0 +1,192 @@
+"""
+全文検索のテスト
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from decimal import Decimal
+from unittest import mock
+import pytest
+import jobs
+import local_dynamodb
+import object_storage
+import purchase_orders
+import search_index
+from search_index import DOC_PURCHASE_ORDER, DOC_SHIPMENT, InvertedIndex, build_document, tokenize
+
+
+def _po(po_id, supplier, item_names, notes='', created_by='user-1'):
+    return {
+        'po_id': po_id,
+        'supplier': supplier,
+        'items': [{'name': name, 'quantity': 1, 'unit_price': Decimal('10')} for name in item_names],
+        'total_amount': Decimal('10'),
+        'status': 'draft',
+        'created_by': created_by,
+        'created_at': '2026-01-01T00:00:00',
+        'updated_at': '2026-01-01T00:00:00',
+        'notes': notes
+    }
+
+
+class TestTokenize(unittest.TestCase):
+    """語の分割のテスト"""
+
+    def test_words_and_bigrams(self):
+        self.assertEqual(tokenize('ACME 株式会社 Widget-42'), ['acme', '株式', '式会', '会社', 'widget', '42'])
+        self.assertEqual(tokenize('ＡＢＣ　ボ'), ['abc', 'ボ'])
+
+
+class TestInvertedIndex(unittest.TestCase):
+    """インデックス本体のテスト"""
+
+    def setUp(self):
+        self.index = InvertedIndex()
+        self.index.put(build_document(DOC_PURCHASE_ORDER, _po('po-1', 'Acme Tools', ['ステンレスボルト', 'ナット'])))
+        self.index.put(build_document(DOC_PURCHASE_ORDER, _po('po-2', 'Acme Foods', ['小麦粉'], notes='acme acme')))
+        self.index.put(build_document(DOC_SHIPMENT, {
+            'shipment_id': 'sh-1', 'po_id': 'po-1', 'tracking_number': 'TRK12345',
+            'carrier': 'ヤマト運輸', 'created_by': 'user-2'
+        }))
+
+    def _ids(self, query, **kwargs):
+        return [result['id'] for result in self.index.search(query, **kwargs)]
+
+    def test_ranking_and_prefix(self):
+        self.assertEqual(self._ids('acme'), ['po-2', 'po-1'])
+        self.assertEqual(self._ids('acm'), ['po-2', 'po-1'])
+        self.assertEqual(self._ids('acme tool'), ['po-1'])
+        self.assertEqual(self._ids('ボルト'), ['po-1'])
+        self.assertEqual(self._ids('trk123'), ['sh-1'])
+        self.assertCountEqual(self._ids('po-1'), ['po-1', 'sh-1'])
+        self.assertEqual(self._ids('acme 存在しない'), [])
+
+    def test_filters(self):
+        self.assertEqual(self._ids('po', owner='user-2'), ['sh-1'])
+        self.assertEqual(self._ids('po', doc_type=DOC_SHIPMENT), ['sh-1'])
+        self.assertEqual(len(self._ids('po', limit=1)), 1)
+
+    def test_replace_and_remove(self):
+        self.index.put(build_document(DOC_PURCHASE_ORDER, _po('po-1', 'Globex', ['ボルト'])))
+        self.assertEqual(self._ids('acme'), ['po-2'])
+        self.index.remove('purchase_order#po-2')
+        self.assertEqual(self._ids('acme'), [])
+        self.assertEqual(self._ids('globex'), ['po-1'])
+
+    def test_snapshot_round_trip(self):
+        restored = InvertedIndex.from_snapshot(self.index.to_snapshot())
+        for query in ('acme', 'ボルト', 'trk'):
+            self.assertEqual(restored.search(query), self.index.search(query))
+        restored.remove('purchase_order#po-1')
+        self.assertEqual([r['id'] for r in restored.search('acme')], ['po-2'])
+
+
+@pytest.mark.usefixtures('memory_dynamodb', 'auth_headers')
+class TestSearchEndpoint(unittest.TestCase):
+    """GET /search と差分・スナップショットによる永続化のテスト"""
+
+    def setUp(self):
+        self.storage_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.storage_dir, True)
+        patcher = mock.patch.dict(os.environ, {
+            'JOB_QUEUE_BACKEND': 'local',
+            'OBJECT_STORAGE_BACKEND': 'local',
+            'LOCAL_STORAGE_DIR': self.storage_dir,
+            'ITEM_CACHE_BACKEND': 'none',
+            'SEARCH_REFRESH_SECONDS': '0'
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        jobs.reset_job_queue()
+        object_storage.reset_object_storage()
+        search_index.reset_search_index()
+        self.addCleanup(jobs.reset_job_queue)
+        self.addCleanup(object_storage.reset_object_storage)
+        self.addCleanup(search_index.reset_search_index)
+        self.deltas = local_dynamodb.get_memory_resource().Table('SearchIndex')
+
+    def _search(self, query, headers=None):
+        response = search_index.handler({
+            'httpMethod': 'GET', 'path': '/search', 'headers': headers or self.auth_headers(),
+            'queryStringParameters': {'q': query} if query is not None else None
+        }, None)
+        body = json.loads(response['body'])
+        if response['statusCode'] != 200:
+            return response['statusCode'], body
+        return response['statusCode'], [result['id'] for result in body['results']]
+
+    def _po_request(self, method, path, body=None):
+        event = {
+            'httpMethod': method, 'path': path, 'headers': self.auth_headers(),
+            'body': json.dumps(body) if body else None
+        }
+        if path.count('/') == 2:
+            event['pathParameters'] = {'po_id': path.rsplit('/', 1)[1]}
+        response = purchase_orders.handler(event, None)
+        return json.loads(response['body'])
+
+    def test_write_paths_update_index(self):
+        created = self._po_request('POST', '/purchase-orders', {
+            'supplier': 'Initech', 'total_amount': 100,
+            'items': [{'name': 'ホチキス', 'quantity': 1, 'unit_price': 100}]
+        })
+        po_id = created['purchase_order']['po_id']
+        self.assertEqual(self._search('ホチキス'), (200, [po_id]))
+
+        self._po_request('PUT', f'/purchase-orders/{po_id}', {'notes': 'urgent'})
+        self.assertEqual(self._search('urg'), (200, [po_id]))
+
+        self._po_request('DELETE', f'/purchase-orders/{po_id}')
+        self.assertEqual(self._search('initech'), (200, []))
+
+    def test_non_admin_only_sees_own_documents(self):
+        search_index.index_documents(DOC_PURCHASE_ORDER, [
+            _po('po-1', 'Acme', ['ボルト'], created_by='user-1'),
+            _po('po-2', 'Acme', ['ボルト'], created_by='user-2')
+        ])
+        self.assertEqual(self._search('acme', self.auth_headers('user-1', 'user')), (200, ['po-1']))
+        self.assertEqual(self._search(None)[0], 400)
+
+    def test_other_containers_pick_up_deltas(self):
+        search_index.index_documents(DOC_PURCHASE_ORDER, [_po('po-1', 'Acme', ['ボルト'])])
+        # 新しいコンテナでは差分から読み込む
+        search_index.reset_search_index()
+        self.assertEqual(self._search('acme'), (200, ['po-1']))
+
+        # 他のコンテナが書き込んだ差分は次の検索で反映される
+        loaded = search_index.get_search_index()
+        with mock.patch.object(search_index, '_index', None):
+            search_index.index_documents(DOC_PURCHASE_ORDER, [_po('po-2', 'Acme', ['ナット'])])
+            search_index.remove_document(DOC_PURCHASE_ORDER, 'po-1')
+        self.assertIs(search_index.get_search_index(), loaded)
+        self.assertEqual(self._search('acme'), (200, ['po-2']))
+
+    def test_snapshot_job(self):
+        search_index.index_documents(DOC_PURCHASE_ORDER, [_po(f'po-{i}', f'Supplier{i}', ['ボルト']) for i in range(30)])
+        job = jobs.enqueue_job('search_snapshot', {})
+        jobs.get_job_queue().drain()
+        self.assertEqual(jobs.get_job(job['job_id'])['result']['documents'], 30)
+
+        # 差分が TTL で消えてもスナップショットから読み込める
+        for item in self.deltas.scan()['Items']:
+            self.deltas.delete_item(Key={'doc_key': item['doc_key']})
+        search_index.reset_search_index()
+        self.assertEqual(self._search('supplier7'), (200, ['po-7']))
+
+    def test_rebuild_from_tables(self):
+        table = local_dynamodb.get_memory_resource().Table('PurchaseOrders')
+        table.put_item(Item=_po('po-legacy', 'Umbrella', ['傘']))
+        jobs.enqueue_job('search_snapshot', {'rebuild': True})
+        jobs.get_job_queue().drain()
+        search_index.reset_search_index()
+        self.assertEqual(self._search('umbrella'), (200, ['po-legacy']))
+
+    def test_scheduled_invocation_enqueues_snapshot(self):
+        response = search_index.handler({'source': 'aws.events'}, None)
+        self.assertEqual(jobs.get_job(response['job_id'])['job_type'], 'search_snapshot')
+
+
+if __name__ == '__main__':
+    unittest.main()
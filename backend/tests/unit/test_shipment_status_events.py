@@ -0,0 +1,122 @@
+"""
+運送会社のステータスイベント一括取り込みのテスト
+"""
+import json
+import os
+import unittest
+from unittest import mock
+import pytest
+import local_dynamodb
+import shipment_events
+import shipments
+
+
+def _event(tracking_number, status, occurred_at, event_id=None, carrier='ヤマト運輸'):
+    event = {'tracking_number': tracking_number, 'carrier': carrier, 'status': status, 'occurred_at': occurred_at}
+    if event_id:
+        event['event_id'] = event_id
+    return event
+
+
+@pytest.mark.usefixtures('memory_dynamodb', 'auth_headers', 'create_purchase_order')
+class TestShipmentStatusEvents(unittest.TestCase):
+    """POST /shipments/status-events のテスト"""
+
+    def setUp(self):
+        patcher = mock.patch.dict(os.environ, {
+            'ITEM_CACHE_BACKEND': 'none',
+            'STATUS_EVENT_WORKERS': '4'
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.shipments_table = local_dynamodb.get_memory_resource().Table('Shipments')
+
+        self.po_id = self.create_purchase_order()
+
+    def _create(self, tracking_number):
+        response = shipments.handler({
+            'httpMethod': 'POST', 'path': '/shipments', 'headers': self.auth_headers(),
+            'body': json.dumps({'po_id': self.po_id, 'tracking_number': tracking_number, 'carrier': 'ヤマト運輸'})
+        }, None)
+        return json.loads(response['body'])['shipment']['shipment_id']
+
+    def _ingest(self, events, headers=None):
+        response = shipments.handler({
+            'httpMethod': 'POST', 'path': '/shipments/status-events', 'headers': headers or self.auth_headers(),
+            'body': json.dumps({'events': events})
+        }, None)
+        return response['statusCode'], json.loads(response['body'])
+
+    def _shipment(self, shipment_id):
+        return self.shipments_table.get_item(Key={'shipment_id': shipment_id})['Item']
+
+    def test_applies_events_in_order_per_shipment(self):
+        first = self._create('TRK-001')
+        second = self._create('TRK-002')
+        status, body = self._ingest([
+            _event('TRK-001', 'delivered', '2026-03-02T10:00:00+09:00', 'e3'),
+            _event('trk 001', 'in_transit', '2026-03-01T10:00:00+09:00', 'e1'),
+            _event('TRK-001', 'in_transit', '2026-03-01T12:00:00+09:00', 'e2'),
+            _event('TRK-002', 'in_transit', '2026-03-01T00:00:00Z', 'e4'),
+            _event('TRK-002', 'in_transit', '2026-03-01T00:00:00Z', 'e4'),
+            _event('TRK-999', 'in_transit', '2026-03-01T00:00:00Z'),
+            _event('TRK-002', 'lost', '2026-03-01T00:00:00Z'),
+        ])
+        self.assertEqual(status, 200)
+        self.assertEqual([r['result'] for r in body['results']], [
+            'applied', 'applied', 'unchanged', 'applied', 'duplicate', 'not_found', 'invalid'
+        ])
+        self.assertEqual(body['summary']['applied'], 3)
+
+        item = self._shipment(first)
+        self.assertEqual((item['status'], item['status_updated_at']), ('delivered', '2026-03-02T01:00:00'))
+        self.assertIsNotNone(item['actual_delivery'])
+        self.assertEqual(self._shipment(second)['status'], 'in_transit')
+
+    def test_stale_and_invalid_transitions_are_ignored(self):
+        shipment_id = self._create('TRK-001')
+        self._ingest([_event('TRK-001', 'delivered', '2026-03-02T00:00:00')])
+        actual_delivery = self._shipment(shipment_id)['actual_delivery']
+
+        # 再送・順序の入れ替わり・終端からの遷移は適用しない
+        _, body = self._ingest([
+            _event('TRK-001', 'in_transit', '2026-03-01T00:00:00'),
+            _event('TRK-001', 'cancelled', '2026-03-03T00:00:00'),
+        ])
+        self.assertEqual([r['result'] for r in body['results']], ['stale', 'invalid_transition'])
+        item = self._shipment(shipment_id)
+        self.assertEqual((item['status'], item['actual_delivery']), ('delivered', actual_delivery))
+
+    def test_retries_after_concurrent_update(self):
+        shipment_id = self._create('TRK-001')
+        original = shipment_events._fold
+
+        def fold_with_concurrent_update(shipment, events):
+            # 最初の書き込みの直前に他の更新が入った状況を再現する
+            if shipment['status'] == 'pending':
+                shipments.handler({
+                    'httpMethod': 'PUT', 'path': f'/shipments/{shipment_id}', 'headers': self.auth_headers(),
+                    'pathParameters': {'shipment_id': shipment_id},
+                    'body': json.dumps({'status': 'in_transit'})
+                }, None)
+            return original(shipment, events)
+
+        with mock.patch.object(shipment_events, '_fold', side_effect=fold_with_concurrent_update):
+            _, body = self._ingest([_event('TRK-001', 'delivered', '2099-01-01T00:00:00')])
+        self.assertEqual(body['results'][0]['result'], 'applied')
+        self.assertEqual(self._shipment(shipment_id)['status'], 'delivered')
+
+    def test_requires_permission_and_valid_body(self):
+        self._create('TRK-001')
+        status, _ = self._ingest(
+            [_event('TRK-001', 'in_transit', '2026-03-01T00:00:00')], self.auth_headers('user-1', 'user')
+        )
+        self.assertEqual(status, 403)
+        self.assertEqual(self._ingest([])[0], 400)
+        with mock.patch.object(shipments, 'MAX_EVENTS_PER_REQUEST', 1):
+            events = [_event('TRK-001', 'in_transit', f'2026-03-0{i}T00:00:00') for i in (1, 2)]
+            self.assertEqual(self._ingest(events)[0], 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+"""
+single_table（STORAGE_LAYOUT=single_table）の保存方法のテスト
+"""
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+import pytest
+import local_dynamodb
+import purchase_orders
+import repository
+import shipments
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'tools'))
+import backfill_carrier_analytics  # noqa: E402
+import migrate_to_single_table  # noqa: E402
+import split_purchase_order_lines  # noqa: E402
+
+
+@pytest.mark.usefixtures('memory_dynamodb', 'auth_headers', 'create_purchase_order')
+class TestSingleTableLayout(unittest.TestCase):
+    """発注書と出荷を PROCUREMENT_TABLE に保存する API のテスト"""
+
+    def setUp(self):
+        patcher = mock.patch.dict(os.environ, {
+            'STORAGE_LAYOUT': 'single_table',
+            'ITEM_CACHE_BACKEND': 'none'
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.resource = local_dynamodb.get_memory_resource()
+        self.table = self.resource.Table('Procurement')
+
+    def _request(self, module, method, path, body=None, path_parameters=None, params=None):
+        event = {'httpMethod': method, 'path': path, 'headers': self.auth_headers()}
+        if body is not None:
+            event['body'] = json.dumps(body)
+        if path_parameters:
+            event['pathParameters'] = path_parameters
+        if params:
+            event['queryStringParameters'] = params
+        response = module.handler(event, None)
+        return response['statusCode'], json.loads(response['body'])
+
+    def _create_shipment(self, po_id, tracking_number):
+        return self._request(shipments, 'POST', '/shipments', {
+            'po_id': po_id, 'tracking_number': tracking_number, 'carrier': 'ヤマト運輸'
+        })
+
+    def test_items_share_the_purchase_order_partition(self):
+        po_id = self.create_purchase_order()
+        _, body = self._create_shipment(po_id, 'TRK-001')
+        shipment_id = body['shipment']['shipment_id']
+
+        rows = self.table.scan()['Items']
+        self.assertEqual(sorted(row['sk'] for row in rows), ['META', f'SHIP#{shipment_id}'])
+        self.assertEqual({row['pk'] for row in rows}, {f'PO#{po_id}'})
+        self.assertEqual(self.resource.Table('PurchaseOrders').scan()['Items'], [])
+        self.assertEqual(self.resource.Table('Shipments').scan()['Items'], [])
+
+        # 一覧は各エンティティの行だけを返し、キー属性は含まない
+        _, body = self._request(purchase_orders, 'GET', '/purchase-orders')
+        self.assertEqual([po['po_id'] for po in body['purchase_orders']], [po_id])
+        self.assertNotIn('pk', body['purchase_orders'][0])
+        _, body = self._request(shipments, 'GET', '/shipments')
+        self.assertEqual([s['shipment_id'] for s in body['shipments']], [shipment_id])
+        _, body = self._request(shipments, 'GET', '/shipments', params={'po_id': po_id})
+        self.assertEqual([s['shipment_id'] for s in body['shipments']], [shipment_id])
+
+    def test_detail_includes_shipments_in_one_query(self):
+        po_id = self.create_purchase_order()
+        self._create_shipment(po_id, 'TRK-001')
+        self._create_shipment(po_id, 'TRK-002')
+
+        with mock.patch.object(repository, '_query_all', wraps=repository._query_all) as query_all:
+            status, body = self._request(
+                purchase_orders, 'GET', f'/purchase-orders/{po_id}',
+                path_parameters={'po_id': po_id}, params={'include': 'shipments'}
+            )
+        self.assertEqual(status, 200)
+        self.assertEqual(query_all.call_count, 1)
+        self.assertEqual(
+            sorted(s['tracking_number'] for s in body['shipments']), ['TRK-001', 'TRK-002']
+        )
+        self.assertEqual(body['purchase_order']['items'][0]['name'], '商品A')
+
+    def test_shipment_crud_by_id(self):
+        po_id = self.create_purchase_order()
+        status, _ = self._create_shipment('missing-po', 'TRK-001')
+        self.assertEqual(status, 400)
+
+        _, body = self._create_shipment(po_id, 'TRK-001')
+        shipment_id = body['shipment']['shipment_id']
+        path = f'/shipments/{shipment_id}'
+        status, body = self._request(shipments, 'GET', path, path_parameters={'shipment_id': shipment_id})
+        self.assertEqual((status, body['shipment']['po_id']), (200, po_id))
+
+        status, body = self._request(
+            shipments, 'PUT', path, {'status': 'in_transit'}, path_parameters={'shipment_id': shipment_id}
+        )
+        self.assertEqual((status, body['shipment']['status']), (200, 'in_transit'))
+
+        # ステータスイベントも同じパーティションの出荷に適用される
+        status, body = self._request(shipments, 'POST', '/shipments/status-events', {'events': [{
+            'tracking_number': 'TRK-001', 'carrier': 'ヤマト運輸', 'status': 'delivered',
+            'occurred_at': '2099-01-01T00:00:00'
+        }]})
+        self.assertEqual(body['results'][0]['result'], 'applied')
+        stored = self.table.get_item(Key={'pk': f'PO#{po_id}', 'sk': f'SHIP#{shipment_id}'})['Item']
+        self.assertEqual(stored['status'], 'delivered')
+
+        status, _ = self._request(shipments, 'DELETE', path, path_parameters={'shipment_id': shipment_id})
+        self.assertEqual(status, 200)
+        status, _ = self._request(shipments, 'GET', path, path_parameters={'shipment_id': shipment_id})
+        self.assertEqual(status, 404)
+
+    def test_split_legacy_rows_in_procurement_table(self):
+        self.table.put_item(Item={
+            'pk': 'PO#legacy-po', 'sk': 'META', 'po_id': 'legacy-po', 'supplier': '旧供給者',
+            'items': [{'name': f'商品{i}', 'quantity': 1, 'unit_price': 10} for i in range(1, 4)],
+            'total_amount': 30, 'status': 'draft', 'created_by': 'admin-user',
+            'created_at': '2025-01-01T00:00:00', 'updated_at': '2025-01-01T00:00:00'
+        })
+        self.assertEqual(split_purchase_order_lines.split(), (1, []))
+
+        header = self.table.get_item(Key={'pk': 'PO#legacy-po', 'sk': 'META'})['Item']
+        self.assertNotIn('items', header)
+        self.assertEqual(header['line_count'], 3)
+        lines = self.resource.Table('PurchaseOrderLines').scan()['Items']
+        self.assertEqual(sorted(int(row['line_no']) for row in lines), [1, 2, 3])
+
+    def test_backfill_carrier_analytics_from_procurement_table(self):
+        po_id = self.create_purchase_order()
+        for i, status in enumerate(('delivered', 'delivered', 'in_transit')):
+            self.table.put_item(Item={
+                'pk': f'PO#{po_id}', 'sk': f'SHIP#sh-{i}', 'shipment_id': f'sh-{i}', 'po_id': po_id,
+                'tracking_number': f'TRK-{i}', 'carrier': 'ヤマト運輸', 'status': status,
+                'created_at': '2026-03-01T00:00:00', 'actual_delivery': '2026-03-03T00:00:00'
+            })
+        sketches = backfill_carrier_analytics.backfill()
+        self.assertEqual([sketch.delivered for sketch in sketches.values()], [2])
+        rows = self.resource.Table('CarrierAnalytics').scan()['Items']
+        self.assertEqual([(row['delivery_month'], row['delivered_count']) for row in rows], [('2026-03', 2)])
+
+
+@pytest.mark.usefixtures('memory_dynamodb', 'auth_headers', 'create_purchase_order')
+class TestMigrateToSingleTable(unittest.TestCase):
+    """tools/migrate_to_single_table.py のテスト"""
+
+    def setUp(self):
+        patcher = mock.patch.dict(os.environ, {
+            'ITEM_CACHE_BACKEND': 'none'
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_copies_existing_rows(self):
+        po_id = self.create_purchase_order()
+        response = shipments.handler({
+            'httpMethod': 'POST', 'path': '/shipments', 'headers': self.auth_headers(),
+            'body': json.dumps({'po_id': po_id, 'tracking_number': 'TRK-001', 'carrier': 'ヤマト運輸'})
+        }, None)
+        shipment_id = json.loads(response['body'])['shipment']['shipment_id']
+
+        self.assertEqual(migrate_to_single_table.migrate(segments=2), {'purchase_order': 1, 'shipment': 1})
+        # 2回実行しても同じ結果になる
+        migrate_to_single_table.migrate(segments=2)
+
+        with mock.patch.dict(os.environ, {'STORAGE_LAYOUT': 'single_table'}):
+            purchase_order, shipment_rows = repository.get_repository().get_purchase_order_with_shipments(po_id)
+            self.assertEqual(purchase_order['supplier'], 'テスト供給者')
+            self.assertEqual([row['shipment_id'] for row in shipment_rows], [shipment_id])
+        reservations = local_dynamodb.get_memory_resource().Table('ShipmentTrackingNumbers').scan()['Items']
+        self.assertEqual([row['po_id'] for row in reservations], [po_id])
+
+
+if __name__ == '__main__':
+    unittest.main()
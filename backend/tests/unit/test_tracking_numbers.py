@@ -0,0 +1,110 @@
+"""
+追跡番号による出荷検索と重複防止のテスト
+"""
+import json
+import os
+import unittest
+from unittest import mock
+import pytest
+import shipments
+from utils import encode_cursor
+
+
+@pytest.mark.usefixtures('memory_dynamodb', 'auth_headers', 'create_purchase_order')
+class TestTrackingNumbers(unittest.TestCase):
+    """GET /shipments?tracking_number= と POST /shipments の重複チェックのテスト"""
+
+    def setUp(self):
+        patcher = mock.patch.dict(os.environ, {
+            'ITEM_CACHE_BACKEND': 'none'
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.po_id = self.create_purchase_order()
+
+    def _create(self, tracking_number, carrier='ヤマト運輸'):
+        response = shipments.handler({
+            'httpMethod': 'POST', 'path': '/shipments', 'headers': self.auth_headers(),
+            'body': json.dumps({'po_id': self.po_id, 'tracking_number': tracking_number, 'carrier': carrier})
+        }, None)
+        return response['statusCode'], json.loads(response['body'])
+
+    def _lookup(self, params, headers=None):
+        response = shipments.handler({
+            'httpMethod': 'GET', 'path': '/shipments', 'headers': headers or self.auth_headers(),
+            'queryStringParameters': params
+        }, None)
+        return response['statusCode'], json.loads(response['body'])
+
+    def _numbers(self, params, headers=None):
+        status, body = self._lookup(params, headers)
+        self.assertEqual(status, 200)
+        return [(s['tracking_number'], s['carrier']) for s in body['shipments']]
+
+    def test_exact_and_prefix_lookup(self):
+        self._create('1234-5678-9012')
+        self._create('1234-5678-9999')
+        self._create('1234-5678-9012', carrier='佐川急便')
+        self._create('9999-0000-0000')
+
+        self.assertCountEqual(self._numbers({'tracking_number': '123456789012'}),
+                              [('1234-5678-9012', 'ヤマト運輸'), ('1234-5678-9012', '佐川急便')])
+        self.assertEqual(self._numbers({'tracking_number': '1234 5678 9012', 'carrier': '佐川急便'}),
+                         [('1234-5678-9012', '佐川急便')])
+        self.assertEqual(len(self._numbers({'tracking_number': '1234-5678', 'match': 'prefix'})), 3)
+        self.assertEqual(self._numbers({'tracking_number': '12345678', 'match': 'prefix', 'carrier': '佐川急便'}),
+                         [('1234-5678-9012', '佐川急便')])
+        self.assertEqual(self._numbers({'tracking_number': '1234'}), [])
+
+        status, body = self._lookup({'tracking_number': '1234', 'match': 'prefix', 'limit': '2'})
+        self.assertEqual(len(body['shipments']), 2)
+        cursor = body['next_cursor']
+        status, body = self._lookup({'tracking_number': '1234', 'match': 'prefix', 'cursor': cursor})
+        self.assertEqual(len(body['shipments']), 1)
+        # 別の追跡番号や別の一覧のカーソルは 400
+        self.assertEqual(self._lookup({'tracking_number': '9999', 'match': 'prefix', 'cursor': cursor})[0], 400)
+        self.assertEqual(self._lookup({'tracking_number': '1234', 'cursor': encode_cursor({'line_no': 2})})[0], 400)
+
+        self.assertEqual(self._lookup({'tracking_number': '12', 'match': 'prefix'})[0], 400)
+        self.assertEqual(self._lookup({'tracking_number': '1234', 'match': 'fuzzy'})[0], 400)
+
+    def test_non_admin_only_sees_own_shipments(self):
+        self._create('ABC-001')
+        self.assertEqual(self._numbers({'tracking_number': 'abc001'}, self.auth_headers('user-1', 'user')), [])
+
+    def test_duplicate_tracking_number_is_rejected(self):
+        status, _ = self._create('ABC-001')
+        self.assertEqual(status, 201)
+        status, body = self._create('abc 001')
+        self.assertEqual((status, body['error']), (409, 'Tracking number already exists for this carrier'))
+        self.assertEqual(self._create('ABC-001', carrier='佐川急便')[0], 201)
+        self.assertEqual(len(self._numbers({'tracking_number': 'ABC001'})), 2)
+
+    def test_update_and_delete_release_reservation(self):
+        _, body = self._create('ABC-001')
+        shipment_id = body['shipment']['shipment_id']
+        self._create('ABC-002')
+
+        def update(tracking_number):
+            return shipments.handler({
+                'httpMethod': 'PUT', 'path': f'/shipments/{shipment_id}', 'headers': self.auth_headers(),
+                'pathParameters': {'shipment_id': shipment_id},
+                'body': json.dumps({'tracking_number': tracking_number})
+            }, None)['statusCode']
+
+        self.assertEqual(update('ABC-002'), 409)
+        self.assertEqual(update('ABC-003'), 200)
+        self.assertEqual(self._numbers({'tracking_number': 'ABC003'}), [('ABC-003', 'ヤマト運輸')])
+        self.assertEqual(self._create('ABC-001')[0], 201)
+
+        response = shipments.handler({
+            'httpMethod': 'DELETE', 'path': f'/shipments/{shipment_id}', 'headers': self.auth_headers(),
+            'pathParameters': {'shipment_id': shipment_id}
+        }, None)
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(self._create('ABC-003')[0], 201)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+ユーザー一覧（検索・ページング）のテスト
+"""
+import json
+import os
+import unittest
+from unittest import mock
+import pytest
+import local_dynamodb
+import user_management
+from models import User, UserRole
+from utils import decode_cursor, encode_cursor
+
+
+@pytest.mark.usefixtures('memory_dynamodb', 'auth_headers')
+class TestUserDirectory(unittest.TestCase):
+    """GET /users と重複チェックのテスト"""
+
+    def setUp(self):
+        patcher = mock.patch.dict(os.environ, {
+            'COGNITO_USER_POOL_ID': 'pool-id'
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.headers = self.auth_headers()
+
+        table = local_dynamodb.get_memory_resource().Table('Users')
+        for i in range(5):
+            table.put_item(Item=User(f'alice-{i}', f'Alice{i}@example.com', UserRole.USER).to_dict())
+        table.put_item(Item=User('alan', 'alan@example.com', UserRole.ADMIN).to_dict())
+        table.put_item(Item=User('bob', 'bob@example.com', UserRole.USER).to_dict())
+
+    def _get_users(self, **query):
+        response = user_management.handler({
+            'httpMethod': 'GET',
+            'path': '/users',
+            'headers': self.headers,
+            'queryStringParameters': query or None
+        }, None)
+        return response['statusCode'], json.loads(response['body'])
+
+    def test_prefix_search_is_case_insensitive(self):
+        status, body = self._get_users(q='ALI')
+        self.assertEqual(status, 200)
+        self.assertEqual([u['email'] for u in body['users']], [f'Alice{i}@example.com' for i in range(5)])
+        self.assertIsNone(body['next_cursor'])
+
+    def test_role_filter(self):
+        _, body = self._get_users(q='a', role='admin')
+        self.assertEqual([u['user_id'] for u in body['users']], ['alan'])
+        self.assertEqual(self._get_users(role='owner')[0], 400)
+
+    def test_cursor_pagination(self):
+        """カーソルで全件を重複なく取得できること"""
+        seen = []
+        cursor = None
+        while True:
+            query = {'limit': '3'}
+            if cursor:
+                query['cursor'] = cursor
+            _, body = self._get_users(**query)
+            self.assertLessEqual(len(body['users']), 3)
+            seen.extend(u['user_id'] for u in body['users'])
+            cursor = body['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(sorted(seen), sorted(['alan', 'bob'] + [f'alice-{i}' for i in range(5)]))
+        self.assertEqual(self._get_users(cursor='not-a-cursor')[0], 400)
+
+    def test_cursor_from_another_listing_is_rejected(self):
+        """一覧のカーソルを検索に、別の検索のカーソルを検索に渡すと 400 を返すこと"""
+        _, body = self._get_users(limit='2')
+        self.assertEqual(self._get_users(q='ali', cursor=body['next_cursor'])[0], 400)
+        status, body = self._get_users(q='ali', limit='2')
+        self.assertEqual(status, 200)
+        self.assertEqual(self._get_users(q='ali', cursor=body['next_cursor'])[0], 200)
+        self.assertEqual(self._get_users(q='bob', cursor=body['next_cursor'])[0], 400)
+        self.assertEqual(self._get_users(cursor=body['next_cursor'])[0], 400)
+
+    def test_cursor_round_trip(self):
+        key = {'user_id': 'u1', 'email_initial': 'a', 'email_key': 'a@example.com'}
+        self.assertEqual(decode_cursor(encode_cursor(key)), key)
+
+    def test_create_rejects_duplicate_email_before_cognito(self):
+        """既存のメールアドレスは Cognito を呼ばずに 409 を返すこと"""
+        with mock.patch.object(user_management, 'get_cognito_gateway') as get_gateway:
+            response = user_management.handler({
+                'httpMethod': 'POST',
+                'path': '/users',
+                'headers': self.headers,
+                'body': json.dumps({'email': 'BOB@example.com', 'password': 'Passw0rd!', 'role': 'user'})
+            }, None)
+        self.assertEqual(response['statusCode'], 409)
+        get_gateway.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+"""
+ウォームアップ呼び出しのテスト
+"""
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+import pytest
+import item_cache
+import jobs
+import object_storage
+import search_index
+import shipments
+import warmup
+from instrumentation import traced_handler
+
+WARMUP_EVENT = {'warmup': True}
+
+
+@pytest.mark.usefixtures('memory_dynamodb')
+class TestWarmup(unittest.TestCase):
+    """ウォームアップのイベントで本来の処理を行わずに初期化だけ行うテスト"""
+
+    def setUp(self):
+        self.storage_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.storage_dir, True)
+        patcher = mock.patch.dict(os.environ, {
+            'JOB_QUEUE_BACKEND': 'local',
+            'OBJECT_STORAGE_BACKEND': 'local',
+            'LOCAL_STORAGE_DIR': self.storage_dir,
+            'TRACE_SAMPLE_RATE': '1'
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        item_cache.reset_item_caches()
+        jobs.reset_job_queue()
+        object_storage.reset_object_storage()
+        search_index.reset_search_index()
+        self.addCleanup(item_cache.reset_item_caches)
+        self.addCleanup(jobs.reset_job_queue)
+        self.addCleanup(object_storage.reset_object_storage)
+        self.addCleanup(search_index.reset_search_index)
+
+    def _invoke(self, handler, event):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            response = handler(event, None)
+        records = [json.loads(line) for line in output.getvalue().splitlines() if line.startswith('{')]
+        return response, records[-1]
+
+    def test_primes_clients_and_caches_without_routing(self):
+        response, record = self._invoke(shipments.handler, WARMUP_EVENT)
+        self.assertEqual(response['statusCode'], 200)
+        body = json.loads(response['body'])
+        self.assertTrue(body['warmup'])
+        self.assertEqual(body['service'], 'shipments')
+        self.assertEqual(set(body['steps']), {'dynamodb', 'item_cache'})
+        self.assertNotIn('errors', body)
+        self.assertIn('shipments', item_cache._caches)
+
+        self.assertEqual(record['Endpoint'], 'warmup')
+        self.assertEqual(record['PrimingLatency'], body['priming_ms'])
+        self.assertIn('PrimingLatency', {m['Name'] for m in record['_aws']['CloudWatchMetrics'][0]['Metrics']})
+        self.assertEqual([s['name'] for s in record['Spans']], ['dynamodb.describe_table'])
+
+    def test_loads_search_index(self):
+        response, _ = self._invoke(search_index.handler, WARMUP_EVENT)
+        self.assertEqual(set(json.loads(response['body'])['steps']), {'dynamodb', 'search_index'})
+        self.assertIsNotNone(search_index._index)
+
+    def test_failed_primer_is_reported(self):
+        calls = []
+
+        def failing():
+            raise RuntimeError('unavailable')
+
+        self.addCleanup(warmup._primers.remove, ('warmup_test', 'failing', failing))
+        warmup.register_primer('failing', failing, 'warmup_test')
+
+        @traced_handler('warmup_test')
+        def handler(event, context):
+            calls.append(event)
+            return {'statusCode': 200, 'body': '{}'}
+
+        response, record = self._invoke(handler, WARMUP_EVENT)
+        self.assertEqual(json.loads(response['body'])['errors'], {'failing': 'unavailable'})
+        self.assertEqual(record['PrimingErrors'], {'failing': 'unavailable'})
+        self.assertEqual(calls, [])
+
+        # スケジュールされたジョブ等のイベントはそのまま処理する
+        scheduled = {'source': 'aws.events', 'detail-type': 'Scheduled Event'}
+        self.assertFalse(warmup.is_warmup_event(scheduled))
+        self.assertFalse(warmup.is_warmup_event({'warmup': 'true'}))
+        with redirect_stdout(io.StringIO()):
+            handler(scheduled, None)
+        self.assertEqual(calls, [scheduled])
+
+    def test_primes_at_init_with_provisioned_concurrency(self):
+        primed = []
+
+        def primer():
+            primed.append('primed')
+
+        self.addCleanup(warmup._primers.remove, ('warmup_init_test', 'marker', primer))
+        warmup.register_primer('marker', primer, 'warmup_init_test')
+
+        def handler(event, context):
+            return {'statusCode': 200, 'body': '{}'}
+
+        # オンデマンドのコンテナでは読み込み時に初期化しない
+        traced_handler('warmup_init_test')(handler)
+        self.assertEqual(primed, [])
+
+        output = io.StringIO()
+        with mock.patch.dict(os.environ, {
+            'AWS_LAMBDA_INITIALIZATION_TYPE': 'provisioned-concurrency',
+            '_HANDLER': f'{__name__}.handler'
+        }), redirect_stdout(output):
+            traced_handler('warmup_init_test')(handler)
+        self.assertEqual(primed, ['primed'])
+        record = json.loads(output.getvalue())
+        self.assertEqual((record['Service'], record['Endpoint']), ('warmup_init_test', 'warmup'))
+        self.assertIn('marker', record['PrimingSteps'])
+
+
+if __name__ == '__main__':
+    unittest.main()
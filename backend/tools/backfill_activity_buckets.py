@@ -0,0 +1,55 @@
+"""
+発注書・出荷の既存データに activity-index 用のキー（activity_bucket）を追加する
+
+activity-index の追加前に最後に更新された行はインデックスに含まれず、GET /activity に表示されないため、
+デプロイ後に一度だけ実行してください。STORAGE_LAYOUT に対応するテーブルを更新します。
+updated_at が変わっていない場合だけ書き込むので、実行中に更新された行（キーは更新時に設定済み）は上書きしません。
+
+    PURCHASE_ORDERS_TABLE=PurchaseOrders SHIPMENTS_TABLE=Shipments python tools/backfill_activity_buckets.py
+"""
+import os
+import sys
+from typing import Dict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from botocore.exceptions import ClientError  # noqa: E402
+from models import activity_bucket  # noqa: E402
+from repository import ID_NAMES, PURCHASE_ORDER, SHIPMENT, get_repository  # noqa: E402
+
+
+def backfill() -> Dict[str, int]:
+    """キーが欠けている行を更新し、エンティティごとの更新件数を返す"""
+    repository = get_repository()
+    counts = {PURCHASE_ORDER: 0, SHIPMENT: 0}
+    for entity in (PURCHASE_ORDER, SHIPMENT):
+        table = repository.table(entity)
+        params = repository.scan_params(entity, {'FilterExpression': 'attribute_not_exists(activity_bucket)'})
+        while True:
+            response = table.scan(**params)
+            for item in response['Items']:
+                item = repository.from_storage(item)
+                try:
+                    table.update_item(
+                        Key=repository.key(entity, item),
+                        UpdateExpression='SET activity_bucket = :bucket',
+                        ConditionExpression='updated_at = :updated_at',
+                        ExpressionAttributeValues={
+                            ':bucket': activity_bucket(item[ID_NAMES[entity]], item['updated_at']),
+                            ':updated_at': item['updated_at']
+                        }
+                    )
+                except ClientError as e:
+                    if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                        raise
+                    continue
+                counts[entity] += 1
+            if 'LastEvaluatedKey' not in response:
+                break
+            params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return counts
+
+
+if __name__ == '__main__':
+    result = backfill()
+    print(f"Updated {result[PURCHASE_ORDER]} purchase orders and {result[SHIPMENT]} shipments")
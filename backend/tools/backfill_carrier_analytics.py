@@ -0,0 +1,42 @@
+"""
+配送完了した出荷から CarrierAnalytics のスケッチを計算し直す
+
+配送実績の集計の追加前に配送完了した出荷を含めるため、デプロイ後に一度だけ実行してください。
+STORAGE_LAYOUT に対応するテーブルから出荷を読み込みます。加算に失敗したスケッチを作り直す場合にも実行できます。
+スケッチは計算結果で上書きするので、何度実行しても二重に加算されることはありません。
+アーカイブ済みの出荷はテーブルに残っていないため含まれません。
+
+    SHIPMENTS_TABLE=Shipments CARRIER_ANALYTICS_TABLE=CarrierAnalytics \\
+        python tools/backfill_carrier_analytics.py
+"""
+import os
+import sys
+from typing import Dict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from carrier_analytics import CarrierSketch, build_sketches  # noqa: E402
+from repository import SHIPMENT, get_repository  # noqa: E402
+from utils import get_dynamodb_resource, scan_all  # noqa: E402
+
+
+def backfill() -> Dict[str, CarrierSketch]:
+    """スケッチを計算して書き込み、書き込んだスケッチを返す"""
+    repository = get_repository()
+    shipments = scan_all(repository.table(SHIPMENT), 1, **repository.scan_params(SHIPMENT, {
+        'FilterExpression': '#status = :delivered AND attribute_exists(actual_delivery)',
+        'ProjectionExpression': 'carrier, created_at, estimated_delivery, actual_delivery',
+        'ExpressionAttributeNames': {'#status': 'status'},
+        'ExpressionAttributeValues': {':delivered': 'delivered'}
+    }))
+    sketches = build_sketches(shipments)
+    analytics_table = get_dynamodb_resource().Table(os.environ['CARRIER_ANALYTICS_TABLE'])
+    with analytics_table.batch_writer(overwrite_by_pkeys=['sketch_key']) as batch:
+        for sketch in sketches.values():
+            batch.put_item(Item=sketch.to_item())
+    return sketches
+
+
+if __name__ == '__main__':
+    result = backfill()
+    print(f"Wrote {len(result)} sketches from {sum(s.delivered for s in result.values())} shipments")
@@ -0,0 +1,69 @@
+"""
+Shipments テーブルの既存データに tracking-number-index 用のキー（tracking_prefix / tracking_key）を追加し、
+追跡番号を ShipmentTrackingNumbers に予約する
+
+tracking-number-index の追加前に作成された出荷はインデックスに含まれず、重複チェックの対象にもならないため、
+デプロイ後に一度だけ実行してください。同じ運送会社の追跡番号が既に重複している出荷は予約できないので、
+出荷 ID を表示します（インデックスには含まれます）。
+
+    SHIPMENTS_TABLE=Shipments TRACKING_NUMBERS_TABLE=ShipmentTrackingNumbers \\
+        python tools/backfill_shipment_tracking_keys.py
+"""
+import os
+import sys
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from botocore.exceptions import ClientError  # noqa: E402
+from models import TRACKING_PREFIX_LENGTH, normalize_tracking_number, tracking_key  # noqa: E402
+from utils import get_dynamodb_resource  # noqa: E402
+
+
+def backfill(shipments_table_name: str, tracking_table_name: str) -> Tuple[int, List[str]]:
+    """キーが欠けている行を更新し、(更新件数, 予約できなかった出荷 ID) を返す"""
+    dynamodb = get_dynamodb_resource()
+    table = dynamodb.Table(shipments_table_name)
+    reservations = dynamodb.Table(tracking_table_name)
+    params = {
+        'FilterExpression': 'attribute_not_exists(tracking_key)',
+        'ProjectionExpression': 'shipment_id, tracking_number, carrier'
+    }
+    updated = 0
+    duplicates: List[str] = []
+    while True:
+        response = table.scan(**params)
+        for item in response['Items']:
+            key = tracking_key(item['tracking_number'], item['carrier'])
+            try:
+                reservations.put_item(
+                    Item={'tracking_key': key, 'shipment_id': item['shipment_id']},
+                    ConditionExpression='attribute_not_exists(tracking_key) OR shipment_id = :shipment_id',
+                    ExpressionAttributeValues={':shipment_id': item['shipment_id']}
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                duplicates.append(item['shipment_id'])
+            table.update_item(
+                Key={'shipment_id': item['shipment_id']},
+                UpdateExpression='SET tracking_prefix = :prefix, tracking_key = :key',
+                ExpressionAttributeValues={
+                    ':prefix': normalize_tracking_number(item['tracking_number'])[:TRACKING_PREFIX_LENGTH],
+                    ':key': key
+                }
+            )
+            updated += 1
+        if 'LastEvaluatedKey' not in response:
+            return updated, duplicates
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+if __name__ == '__main__':
+    count, duplicate_ids = backfill(
+        os.environ.get('SHIPMENTS_TABLE', 'Shipments'),
+        os.environ.get('TRACKING_NUMBERS_TABLE', 'ShipmentTrackingNumbers')
+    )
+    print(f"Updated {count} shipments")
+    for shipment_id in duplicate_ids:
+        print(f"Duplicate tracking number: {shipment_id}")
@@ -0,0 +1,41 @@
+"""
+Users テーブルの既存データに email-index 用のキー（email_initial / email_key）を追加する
+
+email-index の追加前に作成されたユーザーはインデックスに含まれないため、
+デプロイ後に一度だけ実行してください。
+
+    USERS_TABLE=Users python tools/backfill_user_email_keys.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from utils import get_dynamodb_resource  # noqa: E402
+
+
+def backfill(table_name: str) -> int:
+    """キーが欠けている行を更新し、更新件数を返す"""
+    table = get_dynamodb_resource().Table(table_name)
+    params = {
+        'FilterExpression': 'attribute_not_exists(email_key)',
+        'ProjectionExpression': 'user_id, email'
+    }
+    updated = 0
+    while True:
+        response = table.scan(**params)
+        for item in response['Items']:
+            email_key = item['email'].lower()
+            table.update_item(
+                Key={'user_id': item['user_id']},
+                UpdateExpression='SET email_initial = :initial, email_key = :email_key',
+                ExpressionAttributeValues={':initial': email_key[:1], ':email_key': email_key}
+            )
+            updated += 1
+        if 'LastEvaluatedKey' not in response:
+            return updated
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+if __name__ == '__main__':
+    print(f"Updated {backfill(os.environ.get('USERS_TABLE', 'Users'))} users")
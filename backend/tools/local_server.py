@@ -0,0 +1,378 @@
+"""
+Lambda ハンドラーをローカルの HTTP サーバーで動かす（負荷試験・フロントエンド開発用）
+
+template.yaml の AWS::Serverless::Function の Api イベント（Path / Method）からルーティングを作り、
+HTTP リクエストを API Gateway（REST API）のプロキシ統合と同じ形式のイベントに変換して、
+auth.handler や purchase_orders.handler などを同じプロセス内で呼び出します。SAM CLI のように呼び出しごとにコンテナを起動しません。
+
+- LOCAL_SERVER_WORKERS 個のワーカープロセス（既定は CPU 数。インメモリエンジンの場合は1）が同じソケットで待ち受ける
+- 接続はワーカー内のスレッドで受けるが、Lambda のコンテナと同じくハンドラーは同時に1リクエストずつ呼び出す
+  （instrumentation やモジュール変数のキャッシュはこれを前提にしている）
+- ハンドラーのモジュールは fork 前に読み込み、各ワーカーは起動時にウォームアップのイベントで初期化を済ませる
+- DYNAMODB_BACKEND を指定しない場合はインメモリエンジンを使う。データはワーカーごとに別になるため、ワーカーは1つだけにする
+  （2つ以上を指定するとエラー）。複数のワーカーで試験する場合は DYNAMODB_BACKEND を memory 以外（例: aws）にして
+  AWS_ENDPOINT_URL_DYNAMODB で DynamoDB Local / LocalStack を指定する
+- テーブル名の環境変数は local_dynamodb.TABLE_DEFINITIONS の名前を既定値にする
+- キュー・ストレージ・WebSocket は各モジュールの local 実装を使う。ジョブはワーカー内のスレッドで、
+  ハンドラーと同じロックを持って1件ずつ実行する（リクエストのトレースやメトリクスにジョブの処理が混ざらない）
+
+    LOCAL_SERVER_PORT=3001 LOCAL_SERVER_QUIET=true python tools/local_server.py
+    DYNAMODB_BACKEND=aws AWS_ENDPOINT_URL_DYNAMODB=http://localhost:8000 LOCAL_SERVER_WORKERS=8 \\
+        python tools/local_server.py
+"""
+import base64
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from importlib import import_module
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'template.yaml')
+sys.path.insert(0, SRC_DIR)
+
+import local_dynamodb  # noqa: E402
+from jobs import LocalJobQueue, get_job_queue  # noqa: E402
+from utils import create_response  # noqa: E402
+
+FUNCTION_TYPE = 'AWS::Serverless::Function'
+STAGE = 'local'
+# API Gateway がルートに一致しないリクエストに返すレスポンス
+MISSING_ROUTE = (403, b'{"message":"Missing Authentication Token"}')
+HANDLER_ERROR = (502, b'{"message":"Internal server error"}')
+
+
+class Route:
+    """Api イベント1件分のルート（path はテンプレートの Path のまま）"""
+
+    def __init__(self, function: str, handler: str, method: str, path: str):
+        self.function = function
+        self.handler = handler
+        self.method = method.upper()
+        self.path = path
+        pattern = ''
+        for segment in path.strip('/').split('/'):
+            if segment.startswith('{') and segment.endswith('+}'):
+                pattern += f'/(?P<{segment[1:-2]}>.+)'
+            elif segment.startswith('{') and segment.endswith('}'):
+                pattern += f'/(?P<{segment[1:-1]}>[^/]+)'
+            elif segment:
+                pattern += '/' + re.escape(segment)
+        self.pattern = re.compile(f'^{pattern or "/"}$')
+
+    def priority(self) -> Tuple[int, int]:
+        """API Gateway と同じく、固定のセグメントが多いルートを優先する"""
+        segments = [s for s in self.path.strip('/').split('/') if s]
+        return (-sum(1 for s in segments if not s.startswith('{')), -len(segments))
+
+    def __repr__(self) -> str:
+        return f'Route({self.method} {self.path} -> {self.handler})'
+
+
+def _parse_template(text: str) -> Dict[str, Any]:
+    """template.yaml をキーと値の入れ子の辞書として読む
+
+    SAM のテンプレートは !Ref などのタグを含み、PyYAML も依存関係にないため、
+    ルーティングに必要なマッピングだけを字下げで読み取る（リストとブロック文字列は読み飛ばす）。
+    """
+    root: Dict[str, Any] = {}
+    stack: List[Tuple[int, Dict[str, Any]]] = [(-1, root)]
+    skip_indent: Optional[int] = None
+    for line in text.splitlines():
+        content = line.strip()
+        if not content or content.startswith('#'):
+            continue
+        indent = len(line) - len(line.lstrip(' '))
+        if skip_indent is not None:
+            if indent > skip_indent:
+                continue
+            skip_indent = None
+        while stack[-1][0] >= indent:
+            stack.pop()
+        key, separator, value = content.partition(':')
+        if content.startswith('-') or not separator:
+            skip_indent = indent
+            continue
+        value = re.sub(r'\s+#.*$', '', value).strip()
+        if not value:
+            child: Dict[str, Any] = {}
+            stack[-1][1][key.strip()] = child
+            stack.append((indent, child))
+        elif value[0] in '|>':
+            stack[-1][1][key.strip()] = None
+            skip_indent = indent
+        else:
+            stack[-1][1][key.strip()] = value.strip('\'"')
+    return root
+
+
+def load_routes(template_path: str = TEMPLATE_PATH) -> List[Route]:
+    """template.yaml の関数の Api イベントからルートを作る（優先順に並べる）"""
+    with open(template_path, encoding='utf-8') as f:
+        template = _parse_template(f.read())
+    routes = []
+    for name, resource in (template.get('Resources') or {}).items():
+        if not isinstance(resource, dict) or resource.get('Type') != FUNCTION_TYPE:
+            continue
+        properties = resource.get('Properties') or {}
+        handler = properties.get('Handler')
+        for event in (properties.get('Events') or {}).values():
+            if not isinstance(event, dict) or event.get('Type') != 'Api':
+                continue
+            event_properties = event.get('Properties') or {}
+            routes.append(Route(name, handler, event_properties['Method'], event_properties['Path']))
+    return sorted(routes, key=Route.priority)
+
+
+def match_route(routes: List[Route], method: str,
+                path: str) -> Tuple[Optional[Route], Optional[Dict[str, str]]]:
+    """メソッドとパスに一致するルートとパスパラメータを返す（一致しなければ None）"""
+    for route in routes:
+        if route.method not in (method, 'ANY'):
+            continue
+        match = route.pattern.match(path)
+        if match:
+            return route, match.groupdict()
+    return None, None
+
+
+def _decode_body(body: bytes) -> Tuple[Optional[str], bool]:
+    if not body:
+        return None, False
+    try:
+        return body.decode('utf-8'), False
+    except UnicodeDecodeError:
+        return base64.b64encode(body).decode('ascii'), True
+
+
+def build_event(route: Route, method: str, raw_path: str, headers: List[Tuple[str, str]], body: bytes,
+                path_parameters: Dict[str, str], source_ip: str = '127.0.0.1') -> Dict[str, Any]:
+    """HTTP リクエストを API Gateway（REST API）のプロキシ統合のイベントに変換"""
+    url = urlsplit(raw_path)
+    query = parse_qs(url.query, keep_blank_values=True)
+    multi_headers: Dict[str, List[str]] = {}
+    for name, value in headers:
+        multi_headers.setdefault(name, []).append(value)
+    event_body, is_base64 = _decode_body(body)
+    return {
+        'resource': route.path,
+        'path': url.path,
+        'httpMethod': method,
+        'headers': {name: values[-1] for name, values in multi_headers.items()},
+        'multiValueHeaders': multi_headers,
+        'queryStringParameters': {name: values[-1] for name, values in query.items()} or None,
+        'multiValueQueryStringParameters': query or None,
+        'pathParameters': path_parameters or None,
+        'stageVariables': None,
+        'requestContext': {
+            'resourcePath': route.path,
+            'httpMethod': method,
+            'path': f'/{STAGE}{url.path}',
+            'stage': STAGE,
+            'requestId': str(uuid.uuid4()),
+            'requestTimeEpoch': int(time.time() * 1000),
+            'identity': {'sourceIp': source_ip, 'userAgent': multi_headers.get('User-Agent', [None])[-1]}
+        },
+        'body': event_body,
+        'isBase64Encoded': is_base64
+    }
+
+
+class LambdaContext:
+    """ハンドラーに渡す Lambda のコンテキスト（使われている属性のみ）"""
+
+    def __init__(self, function_name: str, timeout_seconds: int = 30):
+        self.function_name = function_name
+        self.aws_request_id = str(uuid.uuid4())
+        self.memory_limit_in_mb = 128
+        self._deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
+
+
+_handlers: Dict[str, Callable[[Dict[str, Any], Any], Dict[str, Any]]] = {}
+# ワーカー内でハンドラーを同時に呼び出さないためのロック（ジョブの実行も同じロックを持つ）
+_invoke_lock = threading.Lock()
+# ジョブを実行するスレッドが動いているか（_invoke_lock を持って読み書きする）
+_job_runner_active = False
+
+
+def get_handler(handler: str) -> Callable[[Dict[str, Any], Any], Dict[str, Any]]:
+    """Handler（module.function）の関数を取得（モジュールはプロセス内で一度だけ読み込む）"""
+    if handler not in _handlers:
+        module_name, _, function_name = handler.rpartition('.')
+        _handlers[handler] = getattr(import_module(module_name), function_name)
+    return _handlers[handler]
+
+
+def _start_job_runner() -> None:
+    """ハンドラーがローカルのキューにジョブを積んでいれば、実行するスレッドを起動する（_invoke_lock を持って呼ぶ）"""
+    global _job_runner_active
+    queue = get_job_queue()
+    if _job_runner_active or not isinstance(queue, LocalJobQueue) or not queue.pending:
+        return
+    _job_runner_active = True
+    threading.Thread(target=_run_jobs, args=(queue,), daemon=True).start()
+
+
+def _run_jobs(queue: LocalJobQueue) -> None:
+    """キューが空になるまで、ハンドラーの呼び出しの合間にジョブを1件ずつ実行する"""
+    global _job_runner_active
+    while True:
+        with _invoke_lock:
+            if not queue.drain(max_jobs=1):
+                _job_runner_active = False
+                return
+
+
+def invoke(route: Route, event: Dict[str, Any]) -> Tuple[int, List[Tuple[str, str]], bytes]:
+    """ハンドラーを呼び出し、レスポンスを (ステータス, ヘッダー, 本文) に変換"""
+    try:
+        with _invoke_lock:
+            try:
+                response = get_handler(route.handler)(event, LambdaContext(route.function))
+            finally:
+                _start_job_runner()
+    except Exception:
+        # Lambda の関数エラーは API Gateway では 502 になる
+        traceback.print_exc()
+        return HANDLER_ERROR[0], [('Content-Type', 'application/json')], HANDLER_ERROR[1]
+    headers = list((response.get('headers') or {}).items())
+    for name, values in (response.get('multiValueHeaders') or {}).items():
+        headers.extend((name, value) for value in values)
+    body = response.get('body') or ''
+    if response.get('isBase64Encoded'):
+        data = base64.b64decode(body)
+    else:
+        data = body.encode('utf-8')
+    return int(response.get('statusCode', 200)), headers, data
+
+
+class LocalServer(ThreadingHTTPServer):
+    """ワーカープロセスが共有する待ち受けソケット（keep-alive の接続ごとにスレッドで受ける）"""
+
+    request_queue_size = 1024
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """HTTP リクエストを対応するハンドラーに渡す"""
+
+    # 負荷試験のクライアントが接続を再利用できるようにする
+    protocol_version = 'HTTP/1.1'
+    routes: List[Route] = []
+    access_log = False
+
+    def _dispatch(self) -> None:
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        path = urlsplit(self.path).path
+        route, path_parameters = match_route(self.routes, self.command, path)
+        if route is not None:
+            event = build_event(route, self.command, self.path, list(self.headers.items()), body,
+                                path_parameters, self.client_address[0])
+            status, headers, data = invoke(route, event)
+        elif self.command == 'OPTIONS' and any(route.pattern.match(path) for route in self.routes):
+            # ブラウザのプリフライトには、ハンドラーと同じ CORS ヘッダーで答える
+            status, headers, data = 200, list(create_response(200, {})['headers'].items()), b''
+        else:
+            status, (headers, data) = MISSING_ROUTE[0], ([('Content-Type', 'application/json')], MISSING_ROUTE[1])
+        self.send_response(status)
+        for name, value in headers:
+            if name.lower() not in ('content-length', 'connection'):
+                self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_HEAD = do_OPTIONS = _dispatch
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if self.access_log:
+            super().log_message(format, *args)
+
+
+def configure_environment() -> None:
+    """ローカル実行用の環境変数の既定値を設定"""
+    os.environ.setdefault('DYNAMODB_BACKEND', 'memory')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    # エクスポート等のジョブは invoke がハンドラーと同じロックを持って実行するので、キュー自身のスレッドでは実行しない
+    os.environ['JOB_LOCAL_AUTORUN'] = 'false'
+    for env_var, definition in local_dynamodb.TABLE_DEFINITIONS.items():
+        os.environ.setdefault(env_var, definition['TableName'])
+
+
+def make_server(routes: List[Route], host: str = '127.0.0.1', port: int = 3001,
+                access_log: bool = False) -> LocalServer:
+    """ルートを持つ HTTP サーバーを作成（port=0 で空いているポートを使う）"""
+    handler_class = type('LocalRequestHandler', (RequestHandler,), {'routes': routes, 'access_log': access_log})
+    return LocalServer((host, port), handler_class)
+
+
+def warm_up(routes: List[Route]) -> None:
+    """ワーカーの起動時に、各ハンドラーをウォームアップのイベントで初期化する"""
+    for handler in sorted({route.handler for route in routes}):
+        with _invoke_lock:
+            get_handler(handler)({'warmup': True}, LambdaContext(handler))
+
+
+def worker_count() -> int:
+    """ワーカープロセスの数（インメモリエンジンはワーカーごとにデータが別になるため1つだけ）"""
+    memory = os.environ['DYNAMODB_BACKEND'] == 'memory'
+    workers = int(os.environ.get('LOCAL_SERVER_WORKERS') or (1 if memory else os.cpu_count() or 1))
+    if memory and workers > 1:
+        raise SystemExit(
+            'DYNAMODB_BACKEND=memory keeps separate data in each worker; '
+            'set LOCAL_SERVER_WORKERS=1 or use DynamoDB Local (DYNAMODB_BACKEND=aws)'
+        )
+    return workers
+
+
+def _serve(server: LocalServer, routes: List[Route], quiet: bool) -> None:
+    if quiet:
+        # ハンドラーが出力する EMF のログを捨てる
+        sys.stdout = open(os.devnull, 'w')
+    warm_up(routes)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def main() -> None:
+    configure_environment()
+    routes = load_routes()
+    host = os.environ.get('LOCAL_SERVER_HOST', '127.0.0.1')
+    port = int(os.environ.get('LOCAL_SERVER_PORT', '3001'))
+    workers = worker_count()
+    quiet = os.environ.get('LOCAL_SERVER_QUIET', '').lower() == 'true'
+    server = make_server(routes, host, port, access_log=os.environ.get('LOCAL_SERVER_ACCESS_LOG', '').lower() == 'true')
+
+    # fork 前に読み込み、ワーカーはモジュールの読み込み済みの状態から始める
+    for handler in {route.handler for route in routes}:
+        get_handler(handler)
+    print(f"Serving {len(routes)} routes on http://{host}:{server.server_address[1]} with {workers} workers")
+
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=_serve, args=(server, routes, quiet), daemon=True) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
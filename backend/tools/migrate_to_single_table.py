@@ -0,0 +1,58 @@
+"""
+PurchaseOrders / Shipments テーブルの既存データを PROCUREMENT_TABLE（single_table の隣接リスト）にコピーする
+
+STORAGE_LAYOUT=single_table に切り替える前に実行してください。アイテムはキー属性（pk / sk）を付けて
+そのまま書き込むので、何度実行しても同じ結果になります。ステータスイベントの適用で出荷のキーを組み立てられるよう、
+ShipmentTrackingNumbers の予約にも po_id を追加します。
+
+コピー中の更新は反映されないため、書き込みを止めてから実行し、完了後に STORAGE_LAYOUT を切り替えてください。
+元のテーブルは変更しないので、問題があれば STORAGE_LAYOUT=tables に戻せます。
+
+    PURCHASE_ORDERS_TABLE=PurchaseOrders SHIPMENTS_TABLE=Shipments PROCUREMENT_TABLE=Procurement \\
+        TRACKING_NUMBERS_TABLE=ShipmentTrackingNumbers python tools/migrate_to_single_table.py
+"""
+import os
+import sys
+from typing import Any, Dict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from botocore.exceptions import ClientError  # noqa: E402
+from repository import PURCHASE_ORDER, SHIPMENT, SingleTableRepository, TablesRepository  # noqa: E402
+from utils import get_dynamodb_resource, scan_all  # noqa: E402
+
+
+def migrate(segments: int = 4) -> Dict[str, int]:
+    """2テーブルのアイテムを PROCUREMENT_TABLE にコピーし、エンティティごとの件数を返す"""
+    source = TablesRepository()
+    target = SingleTableRepository()
+    dynamodb = get_dynamodb_resource()
+    reservations = dynamodb.Table(os.environ['TRACKING_NUMBERS_TABLE'])
+    counts = {PURCHASE_ORDER: 0, SHIPMENT: 0}
+    with target.table(PURCHASE_ORDER).batch_writer(overwrite_by_pkeys=['pk', 'sk']) as batch:
+        for entity in (PURCHASE_ORDER, SHIPMENT):
+            for item in scan_all(source.table(entity), segments):
+                batch.put_item(Item=target.to_storage(entity, item))
+                if entity == SHIPMENT and item.get('tracking_key'):
+                    _add_po_id(reservations, item)
+                counts[entity] += 1
+    return counts
+
+
+def _add_po_id(reservations: Any, item: Dict[str, Any]) -> None:
+    """出荷の追跡番号の予約に po_id を追加する（別の出荷が予約している重複した古い番号は書き換えない）"""
+    try:
+        reservations.update_item(
+            Key={'tracking_key': item['tracking_key']},
+            UpdateExpression='SET po_id = :po_id',
+            ConditionExpression='shipment_id = :shipment_id',
+            ExpressionAttributeValues={':po_id': item['po_id'], ':shipment_id': item['shipment_id']}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+
+if __name__ == '__main__':
+    result = migrate()
+    print(f"Copied {result[PURCHASE_ORDER]} purchase orders and {result[SHIPMENT]} shipments")
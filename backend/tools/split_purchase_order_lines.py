@@ -0,0 +1,59 @@
+"""
+既存の発注書の明細（items）を PurchaseOrderLines に移し、ヘッダーに line_count を設定する
+
+分割前に作成された発注書もそのまま読めますが、一覧のスキャンで明細の分の RCU を消費し続けるため、
+デプロイ後に一度だけ実行してください。STORAGE_LAYOUT に対応するテーブルの発注書を分割します。
+明細を書き込んでから、updated_at が変わっていない場合だけヘッダーを置き換えるので、
+実行中に更新された発注書はスキップされます（もう一度実行すると分割されます）。
+
+    PURCHASE_ORDERS_TABLE=PurchaseOrders PURCHASE_ORDER_LINES_TABLE=PurchaseOrderLines \\
+        python tools/split_purchase_order_lines.py
+"""
+import os
+import sys
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from botocore.exceptions import ClientError  # noqa: E402
+from models import compress_attributes  # noqa: E402
+from po_lines import header_item, load_all_items, write_lines  # noqa: E402
+from repository import PURCHASE_ORDER, get_repository  # noqa: E402
+
+
+def split() -> Tuple[int, List[str]]:
+    """items を持つ行を分割し、(分割件数, 実行中に更新されたためスキップした発注書 ID) を返す"""
+    repository = get_repository()
+    table = repository.table(PURCHASE_ORDER)
+    params = repository.scan_params(PURCHASE_ORDER, {
+        'FilterExpression': 'attribute_exists(#items)', 'ExpressionAttributeNames': {'#items': 'items'}
+    })
+    updated = 0
+    skipped: List[str] = []
+    while True:
+        response = table.scan(**params)
+        for item in response['Items']:
+            item = repository.from_storage(item)
+            write_lines(item['po_id'], load_all_items(item))
+            try:
+                table.put_item(
+                    Item=repository.to_storage(PURCHASE_ORDER, compress_attributes(header_item(item))),
+                    ConditionExpression='updated_at = :updated_at',
+                    ExpressionAttributeValues={':updated_at': item['updated_at']}
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                skipped.append(item['po_id'])
+                continue
+            updated += 1
+        if 'LastEvaluatedKey' not in response:
+            return updated, skipped
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+if __name__ == '__main__':
+    count, skipped_ids = split()
+    print(f"Split {count} purchase orders")
+    for po_id in skipped_ids:
+        print(f"Skipped (updated during split): {po_id}")
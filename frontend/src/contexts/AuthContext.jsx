@@ -1,5 +1,6 @@
 import React, { createContext, useContext, useState, useEffect } from 'react';
 import { authAPI } from '../services/api';
+import { clearLists } from '../services/listSync';
 
 const AuthContext = createContext();
 
@@ -21,6 +22,8 @@ export const AuthProvider = ({ children }) => {
     const storedUser = localStorage.getItem('user');
     const accessToken = localStorage.getItem('access_token');
     
+    const refreshToken = localStorage.getItem('refresh_token');
+    
     if (storedUser && accessToken) {
       try {
         const userData = JSON.parse(storedUser);
@@ -30,6 +33,17 @@ export const AuthProvider = ({ children }) => {
         console.error('Error parsing stored user data:', error);
         clearAuthData();
       }
+    } else if (storedUser && refreshToken) {
+      // 存取權杖已失效但仍有 refresh token 時，不需重新輸入密碼即可恢復登入狀態
+      authAPI
+        .refresh()
+        .then(() => {
+          setUser(JSON.parse(localStorage.getItem('user')));
+          setIsAuthenticated(true);
+        })
+        .catch(() => clearAuthData())
+        .finally(() => setLoading(false));
+      return;
     }
     
     setLoading(false);
@@ -40,6 +54,7 @@ export const AuthProvider = ({ children }) => {
     localStorage.removeItem('id_token');
     localStorage.removeItem('refresh_token');
     localStorage.removeItem('user');
+    clearLists();
     setUser(null);
     setIsAuthenticated(false);
   };
@@ -29,6 +29,7 @@ import {
   Visibility,
 } from '@mui/icons-material';
 import { purchaseOrderAPI } from '../services/api';
+import { loadList, subscribeList } from '../services/listSync';
 import { useAuth } from '../contexts/AuthContext';
 
 const PurchaseOrdersPage = () => {
@@ -49,13 +50,14 @@ const PurchaseOrdersPage = () => {
 
   useEffect(() => {
     fetchPurchaseOrders();
+    // 其他使用者的變更以 WebSocket 即時反映
+    return subscribeList('purchase_order', setPurchaseOrders);
   }, []);
 
-  const fetchPurchaseOrders = async () => {
+  const fetchPurchaseOrders = async (options = {}) => {
     try {
       setLoading(true);
-      const response = await purchaseOrderAPI.getPurchaseOrders();
-      setPurchaseOrders(response.data.purchase_orders || []);
+      setPurchaseOrders(await loadList('purchase_order', options));
     } catch (error) {
       console.error('Error fetching purchase orders:', error);
       setError('載入購買訂單時發生錯誤');
@@ -64,7 +66,7 @@ const PurchaseOrdersPage = () => {
     }
   };
 
-  const handleOpenDialog = (mode, po = null) => {
+  const handleOpenDialog = async (mode, po = null) => {
     setDialogMode(mode);
     setSelectedPO(po);
     
@@ -76,9 +78,18 @@ const PurchaseOrdersPage = () => {
         notes: '',
       });
     } else if (po) {
+      // 列表只包含表頭，明細另外取得
+      let items;
+      try {
+        items = await purchaseOrderAPI.getAllPurchaseOrderItems(po.po_id);
+      } catch (error) {
+        console.error('Error fetching purchase order items:', error);
+        setError('載入訂單明細時發生錯誤');
+        return;
+      }
       setFormData({
         supplier: po.supplier,
-        items: po.items,
+        items: items.map(({ line_no, ...item }) => item),
         total_amount: po.total_amount,
         notes: po.notes || '',
       });
@@ -102,7 +113,7 @@ const PurchaseOrdersPage = () => {
       }
       
       handleCloseDialog();
-      fetchPurchaseOrders();
+      fetchPurchaseOrders({ reload: true });
     } catch (error) {
       console.error('Error saving purchase order:', error);
       setError(error.response?.data?.error || '儲存時發生錯誤');
@@ -113,7 +124,7 @@ const PurchaseOrdersPage = () => {
     if (window.confirm('確定要刪除這個購買訂單嗎？')) {
       try {
         await purchaseOrderAPI.deletePurchaseOrder(poId);
-        fetchPurchaseOrders();
+        fetchPurchaseOrders({ reload: true });
       } catch (error) {
         console.error('Error deleting purchase order:', error);
         setError('刪除時發生錯誤');
@@ -31,7 +31,8 @@ import {
   Delete,
   Visibility,
 } from '@mui/icons-material';
-import { shipmentAPI, purchaseOrderAPI } from '../services/api';
+import { shipmentAPI } from '../services/api';
+import { loadList, subscribeList } from '../services/listSync';
 import { useAuth } from '../contexts/AuthContext';
 
 const ShipmentsPage = () => {
@@ -57,13 +58,14 @@ const ShipmentsPage = () => {
   useEffect(() => {
     fetchShipments();
     fetchPurchaseOrders();
+    // 貨運狀態等變更以 WebSocket 即時反映
+    return subscribeList('shipment', setShipments);
   }, []);
 
-  const fetchShipments = async () => {
+  const fetchShipments = async (options = {}) => {
     try {
       setLoading(true);
-      const response = await shipmentAPI.getShipments();
-      setShipments(response.data.shipments || []);
+      setShipments(await loadList('shipment', options));
     } catch (error) {
       console.error('Error fetching shipments:', error);
       setError('載入貨運資料時發生錯誤');
@@ -74,8 +76,7 @@ const ShipmentsPage = () => {
 
   const fetchPurchaseOrders = async () => {
     try {
-      const response = await purchaseOrderAPI.getPurchaseOrders();
-      setPurchaseOrders(response.data.purchase_orders || []);
+      setPurchaseOrders(await loadList('purchase_order'));
     } catch (error) {
       console.error('Error fetching purchase orders:', error);
     }
@@ -131,7 +132,7 @@ const ShipmentsPage = () => {
       }
       
       handleCloseDialog();
-      fetchShipments();
+      fetchShipments({ reload: true });
     } catch (error) {
       console.error('Error saving shipment:', error);
       setError(error.response?.data?.error || '儲存時發生錯誤');
@@ -142,7 +143,7 @@ const ShipmentsPage = () => {
     if (window.confirm('確定要刪除這個貨運記錄嗎？')) {
       try {
         await shipmentAPI.deleteShipment(shipmentId);
-        fetchShipments();
+        fetchShipments({ reload: true });
       } catch (error) {
         console.error('Error deleting shipment:', error);
         setError('刪除時發生錯誤');
@@ -39,7 +39,11 @@ import { useAuth } from '../contexts/AuthContext';
 
 const UsersPage = () => {
   const [users, setUsers] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [search, setSearch] = useState('');
+  const [roleFilter, setRoleFilter] = useState('');
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [error, setError] = useState('');
   const [dialogOpen, setDialogOpen] = useState(false);
   const [dialogMode, setDialogMode] = useState('create');
@@ -63,16 +67,28 @@ const UsersPage = () => {
   ];
 
   useEffect(() => {
-    if (isAdmin()) {
-      fetchUsers();
+    if (!isAdmin()) {
+      return undefined;
     }
-  }, []);
+    // 輸入搜尋文字時稍候再查詢，避免每個按鍵都送出請求
+    const timer = setTimeout(() => fetchUsers(), 300);
+    return () => clearTimeout(timer);
+  }, [search, roleFilter]);
+
+  const buildQuery = (cursor = null) => {
+    const params = { limit: 50 };
+    if (search.trim()) params.q = search.trim();
+    if (roleFilter) params.role = roleFilter;
+    if (cursor) params.cursor = cursor;
+    return params;
+  };
 
   const fetchUsers = async () => {
     try {
       setLoading(true);
-      const response = await userAPI.getUsers();
+      const response = await userAPI.getUsers(buildQuery());
       setUsers(response.data.users || []);
+      setNextCursor(response.data.next_cursor || null);
     } catch (error) {
       console.error('Error fetching users:', error);
       setError('載入使用者資料時發生錯誤');
@@ -81,6 +97,20 @@ const UsersPage = () => {
     }
   };
 
+  const fetchMoreUsers = async () => {
+    try {
+      setLoadingMore(true);
+      const response = await userAPI.getUsers(buildQuery(nextCursor));
+      setUsers((current) => [...current, ...(response.data.users || [])]);
+      setNextCursor(response.data.next_cursor || null);
+    } catch (error) {
+      console.error('Error fetching users:', error);
+      setError('載入使用者資料時發生錯誤');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleOpenDialog = (mode, user = null) => {
     setDialogMode(mode);
     setSelectedUser(user);
@@ -173,14 +203,6 @@ const UsersPage = () => {
     );
   }
 
-  if (loading) {
-    return (
-      <Box display="flex" justifyContent="center" alignItems="center" minHeight="400px">
-        <CircularProgress />
-      </Box>
-    );
-  }
-
   return (
     <Box>
       <Box display="flex" justifyContent="space-between" alignItems="center" mb={3}>
@@ -202,6 +224,34 @@ const UsersPage = () => {
         </Alert>
       )}
 
+      <Box display="flex" gap={2} mb={2}>
+        <TextField
+          size="small"
+          label="搜尋電子郵件"
+          placeholder="輸入開頭文字"
+          value={search}
+          onChange={(e) => setSearch(e.target.value)}
+          sx={{ minWidth: 280 }}
+        />
+        <FormControl size="small" sx={{ minWidth: 160 }}>
+          <InputLabel>角色</InputLabel>
+          <Select
+            value={roleFilter}
+            label="角色"
+            onChange={(e) => setRoleFilter(e.target.value)}
+          >
+            <MenuItem value="">全部</MenuItem>
+            <MenuItem value="admin">管理者</MenuItem>
+            <MenuItem value="user">一般使用者</MenuItem>
+          </Select>
+        </FormControl>
+      </Box>
+
+      {loading ? (
+        <Box display="flex" justifyContent="center" alignItems="center" minHeight="400px">
+          <CircularProgress />
+        </Box>
+      ) : (
       <TableContainer component={Paper}>
         <Table>
           <TableHead>
@@ -264,6 +314,15 @@ const UsersPage = () => {
           </TableBody>
         </Table>
       </TableContainer>
+      )}
+
+      {!loading && nextCursor && (
+        <Box display="flex" justifyContent="center" mt={2}>
+          <Button onClick={fetchMoreUsers} disabled={loadingMore}>
+            {loadingMore ? <CircularProgress size={20} /> : '載入更多'}
+          </Button>
+        </Box>
+      )}
 
       {/* 對話框 */}
       <Dialog
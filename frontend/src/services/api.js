@@ -25,19 +25,63 @@ api.interceptors.request.use(
   }
 );
 
+// 使用 refresh token 取得新的存取權杖（同時發生多個 401 時只呼叫一次）
+let refreshPromise = null;
+
+const refreshAccessToken = () => {
+  if (!refreshPromise) {
+    const refreshToken = localStorage.getItem('refresh_token');
+    refreshPromise = api
+      .post('/auth/refresh', { refresh_token: refreshToken })
+      .then((response) => {
+        const { tokens, user } = response.data;
+        localStorage.setItem('access_token', tokens.access_token);
+        localStorage.setItem('id_token', tokens.id_token);
+        localStorage.setItem('refresh_token', tokens.refresh_token);
+        if (user) {
+          const storedUser = JSON.parse(localStorage.getItem('user') || '{}');
+          localStorage.setItem('user', JSON.stringify({ ...storedUser, ...user }));
+        }
+        return tokens.access_token;
+      })
+      .finally(() => {
+        refreshPromise = null;
+      });
+  }
+  return refreshPromise;
+};
+
+const clearAuthAndRedirect = () => {
+  // 清除本地儲存的認證資訊
+  localStorage.removeItem('access_token');
+  localStorage.removeItem('id_token');
+  localStorage.removeItem('refresh_token');
+  localStorage.removeItem('user');
+
+  // 重新導向到登入頁面
+  window.location.href = '/login';
+};
+
 // 回應攔截器 - 處理認證錯誤
 api.interceptors.response.use(
   (response) => response,
-  (error) => {
+  async (error) => {
+    const originalRequest = error.config;
     if (error.response?.status === 401) {
-      // 清除本地儲存的認證資訊
-      localStorage.removeItem('access_token');
-      localStorage.removeItem('id_token');
-      localStorage.removeItem('refresh_token');
-      localStorage.removeItem('user');
-      
-      // 重新導向到登入頁面
-      window.location.href = '/login';
+      // 認證 API 以外的 401 先嘗試以 refresh token 更新權杖並重送一次，避免強制重新輸入密碼
+      const isAuthRequest = originalRequest?.url?.startsWith('/auth/');
+      if (!isAuthRequest && !originalRequest?._retry && localStorage.getItem('refresh_token')) {
+        originalRequest._retry = true;
+        try {
+          const accessToken = await refreshAccessToken();
+          originalRequest.headers.Authorization = `Bearer ${accessToken}`;
+          return api(originalRequest);
+        } catch (refreshError) {
+          clearAuthAndRedirect();
+          return Promise.reject(refreshError);
+        }
+      }
+      clearAuthAndRedirect();
     }
     return Promise.reject(error);
   }
@@ -46,14 +90,18 @@ api.interceptors.response.use(
 // 認證 API
 export const authAPI = {
   login: (email, password) => api.post('/auth/login', { email, password }),
+  refresh: () => refreshAccessToken(),
   logout: () => api.post('/auth/logout'),
   register: (userData) => api.post('/auth/register', userData),
 };
 
 // 使用者管理 API
 export const userAPI = {
-  getUsers: () => api.get('/users'),
+  getUsers: (params = {}) => api.get('/users', { params }),
   createUser: (userData) => api.post('/users', userData),
+  bulkCreateUsers: (csvText, startRow = 1) => api.post(`/users/bulk?start_row=${startRow}`, csvText, {
+    headers: { 'Content-Type': 'text/csv' },
+  }),
   updateUser: (userId, userData) => api.put(`/users/${userId}`, userData),
   deleteUser: (userId) => api.delete(`/users/${userId}`),
 };
@@ -61,7 +109,19 @@ export const userAPI = {
 // 購買訂單 API
 export const purchaseOrderAPI = {
   getPurchaseOrders: () => api.get('/purchase-orders'),
-  getPurchaseOrder: (poId) => api.get(`/purchase-orders/${poId}`),
+  getPurchaseOrder: (poId, params = {}) => api.get(`/purchase-orders/${poId}`, { params }),
+  getPurchaseOrderItems: (poId, params = {}) => api.get(`/purchase-orders/${poId}/items`, { params }),
+  // 明細をすべてのページから取得する（一覧には明細が含まれないため）
+  getAllPurchaseOrderItems: async (poId) => {
+    const items = [];
+    let cursor;
+    do {
+      const response = await api.get(`/purchase-orders/${poId}/items`, { params: { limit: 500, cursor } });
+      items.push(...response.data.items);
+      cursor = response.data.next_cursor;
+    } while (cursor);
+    return items;
+  },
   createPurchaseOrder: (poData) => api.post('/purchase-orders', poData),
   updatePurchaseOrder: (poId, poData) => api.put(`/purchase-orders/${poId}`, poData),
   deletePurchaseOrder: (poId) => api.delete(`/purchase-orders/${poId}`),
@@ -73,10 +133,56 @@ export const shipmentAPI = {
     const url = poId ? `/shipments?po_id=${poId}` : '/shipments';
     return api.get(url);
   },
+  findByTrackingNumber: (trackingNumber, params = {}) =>
+    api.get('/shipments', { params: { tracking_number: trackingNumber, ...params } }),
   getShipment: (shipmentId) => api.get(`/shipments/${shipmentId}`),
   createShipment: (shipmentData) => api.post('/shipments', shipmentData),
   updateShipment: (shipmentId, shipmentData) => api.put(`/shipments/${shipmentId}`, shipmentData),
   deleteShipment: (shipmentId) => api.delete(`/shipments/${shipmentId}`),
+  ingestStatusEvents: (events) => api.post('/shipments/status-events', { events }),
+};
+
+// 背景工作 API
+export const jobAPI = {
+  getJob: (jobId) => api.get(`/jobs/${jobId}`),
+};
+
+// 匯入 API
+export const importAPI = {
+  createUpload: () => api.post('/imports/purchase-orders/uploads'),
+  createImport: (key, format = 'csv', compressed = false) => api.post('/imports/purchase-orders', { key, format, compressed }),
+  getImport: (jobId) => api.get(`/imports/${jobId}`),
+};
+
+// 匯出 API
+export const exportAPI = {
+  createExport: (resource, format = 'csv') => api.post('/exports', { resource, format }),
+  getExport: (jobId) => api.get(`/exports/${jobId}`),
+};
+
+// 搜尋 API
+export const searchAPI = {
+  search: (q, params = {}) => api.get('/search', { params: { q, ...params } }),
+};
+
+// 封存 API
+export const archiveAPI = {
+  createArchive: (options = {}) => api.post('/archives', options),
+};
+
+// 分析 API
+export const analyticsAPI = {
+  getCarrierAnalytics: (params = {}) => api.get('/analytics/carriers', { params }),
+};
+
+// 最近の更新 API
+export const activityAPI = {
+  getActivity: (params = {}) => api.get('/activity', { params }),
+};
+
+// 差分同期 API
+export const changesAPI = {
+  getChanges: (params = {}) => api.get('/changes', { params }),
 };
 
 export default api;
\ No newline at end of file
@@ -0,0 +1,88 @@
+import { changesAPI, purchaseOrderAPI, shipmentAPI } from './api';
+import { subscribeRealtime } from './realtime';
+
+// 列表的差異同步
+// 第一次讀取整個列表並保留 cursor，之後再進入頁面時只以 GET /changes 取得變更並套用到保留的列表
+
+const LISTS = {
+  purchase_order: {
+    idKey: 'po_id',
+    fetch: async () => (await purchaseOrderAPI.getPurchaseOrders()).data.purchase_orders || [],
+  },
+  shipment: {
+    idKey: 'shipment_id',
+    fetch: async () => (await shipmentAPI.getShipments()).data.shipments || [],
+  },
+};
+
+// 依 type 保存的 { items, cursor }
+let cache = {};
+
+const reload = async (type) => {
+  // 先取得 cursor 再讀取列表，這段期間的變更會包含在下一次的差異中
+  const { cursor } = (await changesAPI.getChanges()).data;
+  const items = await LISTS[type].fetch();
+  cache[type] = { items, cursor };
+  return items;
+};
+
+const applyChanges = (items, changes, type) => {
+  const { idKey } = LISTS[type];
+  const byId = new Map(items.map((item) => [item[idKey], item]));
+  changes
+    .filter((change) => change.type === type)
+    .forEach((change) => {
+      if (change.deleted) {
+        byId.delete(change.id);
+      } else {
+        byId.set(change.id, change[type]);
+      }
+    });
+  // 與列表 API 相同，依建立時間由新到舊排列
+  return [...byId.values()].sort((a, b) => (b.created_at || '').localeCompare(a.created_at || ''));
+};
+
+// 取得列表（type: 'purchase_order' | 'shipment'）。自己新增、修改、刪除後請以 { reload: true } 重新讀取
+export const loadList = async (type, { reload: forceReload = false } = {}) => {
+  const cached = cache[type];
+  if (!cached || forceReload) {
+    return reload(type);
+  }
+  try {
+    let { items, cursor } = cached;
+    let hasMore = true;
+    while (hasMore) {
+      const response = await changesAPI.getChanges({ since: cursor });
+      items = applyChanges(items, response.data.changes, type);
+      cursor = response.data.cursor;
+      hasMore = response.data.has_more;
+    }
+    cache[type] = { items, cursor };
+    return items;
+  } catch (error) {
+    // cursor 過期（410）時重新讀取整個列表
+    if (error.response?.status === 410) {
+      return reload(type);
+    }
+    throw error;
+  }
+};
+
+// 以 WebSocket 推播的變更更新保留的列表，並以 onUpdate(items) 通知（回傳取消訂閱的函式）
+export const subscribeList = (type, onUpdate) => subscribeRealtime(async (message) => {
+  if (message.type === 'changes' && cache[type]) {
+    cache[type] = { ...cache[type], items: applyChanges(cache[type].items, message.changes, type) };
+    onUpdate(cache[type].items);
+  } else if (message.type === 'reconnected' && cache[type]) {
+    try {
+      onUpdate(await loadList(type));
+    } catch (error) {
+      console.error('Error syncing list:', error);
+    }
+  }
+});
+
+// 登出時清除保留的列表
+export const clearLists = () => {
+  cache = {};
+};
@@ -0,0 +1,67 @@
+// 購買訂單與貨運變更的即時推播（WebSocket）
+// 未設定 VITE_WS_URL 時不連線
+
+const WS_URL = import.meta.env.VITE_WS_URL;
+const MAX_RECONNECT_DELAY = 30000;
+
+const listeners = new Set();
+let socket = null;
+let reconnectDelay = 1000;
+let reconnectTimer = null;
+
+const notify = (event) => {
+  listeners.forEach((listener) => listener(event));
+};
+
+const connect = () => {
+  const token = localStorage.getItem('access_token');
+  if (!WS_URL || !token || socket) {
+    return;
+  }
+  socket = new WebSocket(`${WS_URL}?token=${encodeURIComponent(token)}`);
+  socket.onopen = () => {
+    // 斷線期間的變更不會補送，讓列表以 GET /changes 取得差異
+    if (reconnectDelay > 1000) {
+      notify({ type: 'reconnected' });
+    }
+    reconnectDelay = 1000;
+  };
+  socket.onmessage = (message) => {
+    try {
+      notify(JSON.parse(message.data));
+    } catch (error) {
+      console.error('Invalid realtime message:', error);
+    }
+  };
+  socket.onclose = () => {
+    socket = null;
+    if (listeners.size > 0) {
+      // 逐漸拉長間隔重新連線
+      reconnectTimer = setTimeout(connect, reconnectDelay);
+      reconnectDelay = Math.min(reconnectDelay * 2, MAX_RECONNECT_DELAY);
+    }
+  };
+};
+
+const disconnect = () => {
+  clearTimeout(reconnectTimer);
+  reconnectTimer = null;
+  if (socket) {
+    socket.onclose = null;
+    socket.close();
+    socket = null;
+  }
+  reconnectDelay = 1000;
+};
+
+// 訂閱推播的訊息，回傳取消訂閱的函式（沒有訂閱者時關閉連線）
+export const subscribeRealtime = (listener) => {
+  listeners.add(listener);
+  connect();
+  return () => {
+    listeners.delete(listener);
+    if (listeners.size === 0) {
+      disconnect();
+    }
+  };
+};